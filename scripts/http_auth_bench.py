@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+HTTP NTLM capture load test - measures Negotiate/Challenge/Authenticate
+handshakes per second against NTLMHTTPCaptureServer over loopback
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import binascii
+
+# Add project root to path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from src.modules.capture.http_server import NTLMHTTPCaptureServer
+from src.utils.metrics import summarize_latencies
+from src.utils.ntlm import build_authenticate_message, build_negotiate_message
+
+async def read_response(reader):
+    """Read one response head and return (status, WWW-Authenticate NTLM token)"""
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    token = None
+    for line in head.split(b'\r\n')[1:]:
+        if line.lower().startswith(b'www-authenticate: ntlm '):
+            token = binascii.a2b_base64(line[23:])
+    return status, token
+
+def request(token=None):
+    authorization = b''
+    if token is not None:
+        authorization = b'Authorization: NTLM ' + binascii.b2a_base64(token, newline=False) + b'\r\n'
+    return (b'GET / HTTP/1.1\r\nHost: bench\r\n' + authorization +
+            b'Connection: keep-alive\r\n\r\n')
+
+async def run_client(host, port, handshakes, latencies, user, password, domain):
+    """Perform handshakes NTLM exchanges on a single keep-alive connection"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(handshakes):
+            started = time.perf_counter()
+            writer.write(request())
+            status, _ = await read_response(reader)
+            assert status == 401
+            writer.write(request(build_negotiate_message()))
+            status, challenge = await read_response(reader)
+            assert status == 401 and challenge
+            writer.write(request(build_authenticate_message(challenge, user, password, domain)))
+            status, _ = await read_response(reader)
+            assert status == 200
+            latencies.append(time.perf_counter() - started)
+    finally:
+        writer.close()
+
+async def run_benchmark(args):
+    server = None
+    host, port = args.host, args.port
+    if not port:
+        server = NTLMHTTPCaptureServer('127.0.0.1', 0)
+        await server.start()
+        host, port = '127.0.0.1', server.port
+
+    latencies = []
+    started = time.perf_counter()
+    results = await asyncio.gather(*[
+        run_client(host, port, args.handshakes, latencies, args.user, args.password, args.domain)
+        for _ in range(args.clients)
+    ], return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    if server:
+        await server.stop()
+
+    errors = [str(r) for r in results if isinstance(r, Exception)]
+    return {
+        'clients': args.clients,
+        'handshakes_per_client': args.handshakes,
+        'completed': len(latencies),
+        'errors': len(errors),
+        'elapsed_s': round(elapsed, 3),
+        'handshakes_per_s': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'latency': summarize_latencies(latencies),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the HTTP NTLM capture server")
+    parser.add_argument("--host", default="127.0.0.1", help="Server to test (default: in-process server)")
+    parser.add_argument("--port", type=int, default=0, help="Server port (0 starts an in-process server)")
+    parser.add_argument("-c", "--clients", type=int, default=50, help="Concurrent keep-alive connections")
+    parser.add_argument("-n", "--handshakes", type=int, default=20, help="Handshakes per connection")
+    parser.add_argument("--user", default="bench")
+    parser.add_argument("--password", default="Passw0rd!")
+    parser.add_argument("--domain", default="LAB")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmark(args))
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Offline SMB2 relay test bed - drives SMB2StubClient authentications through
+an in-process NTLMRelayServer to an SMB2StubServer target, all on loopback
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+
+# Add project root to path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from src.modules.exploit.testbed import RelayTestBed
+
+def main():
+    parser = argparse.ArgumentParser(description="Relay SMB2 authentications to a stub target over loopback")
+    parser.add_argument("-n", "--relays", type=int, default=500, help="Total relayed authentications")
+    parser.add_argument("-c", "--concurrency", type=int, default=20, help="Relays in flight")
+    parser.add_argument("--user", default="alice")
+    parser.add_argument("--password", default="Passw0rd!")
+    parser.add_argument("--domain", default="LAB")
+    parser.add_argument("--bad-password-every", type=int, default=0,
+                        help="Send a wrong password on every Nth relay (0: never)")
+    parser.add_argument("--relay-host", default="127.0.0.1", help="Address the relay listens on")
+    parser.add_argument("--target-host", default="127.0.0.2",
+                        help="Address the stub target listens on (must differ from --relay-host)")
+    parser.add_argument("--pool-depth", type=int, default=2, help="Pre-negotiated target connections")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the relay's log")
+    args = parser.parse_args()
+
+    # The relay logs every step of every relay; keep the report readable
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    else:
+        logging.disable(logging.ERROR)
+
+    report = RelayTestBed(args.relays, args.concurrency, args.user, args.password, args.domain,
+                          args.bad_password_every, args.relay_host, args.target_host,
+                          args.pool_depth).run()
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Relay control client - shows or changes the targets and options of a relay
+started with --control-socket, without restarting its listeners
+"""
+
+import os
+import sys
+import json
+import argparse
+
+# Add project root to path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from src.modules.exploit.relay_control import send_command
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or reconfigure a running relay")
+    parser.add_argument("socket", help="Control socket of the relay (--control-socket)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for the relay")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="Show the configuration and relay statistics")
+    reconfigure = commands.add_parser("reconfigure", help="Swap the target, scope or options")
+    reconfigure.add_argument("--target", help="New relay target")
+    reconfigure.add_argument("--target-port", type=int, help="SMB port of the new target")
+    reconfigure.add_argument("--scope", dest="scope_file",
+                             help="Scope file read by the relay (a path on the relay's host)")
+    reconfigure.add_argument("--schedule", choices=["round-robin", "priority"])
+    reconfigure.add_argument("--max-per-target", type=int)
+    reconfigure.add_argument("--client-timeout", type=float, help="Seconds a relay client may stay silent")
+    reconfigure.add_argument("--post-auth", help="Comma-separated post-auth actions (empty = none)")
+    args = parser.parse_args()
+
+    options = {}
+    if args.command == "reconfigure":
+        options = {key: getattr(args, key) for key in ("target", "target_port", "scope_file", "schedule",
+                                                       "max_per_target", "client_timeout")
+                   if getattr(args, key) is not None}
+        if args.post_auth is not None:
+            options["post_auth_actions"] = [name for name in args.post_auth.split(",") if name]
+        if args.scope_file:
+            options["scope_file"] = os.path.abspath(args.scope_file)
+        if not options:
+            parser.error("reconfigure needs at least one option")
+
+    try:
+        response = send_command(args.socket, args.command, timeout=args.timeout, **options)
+    except OSError as e:
+        print(f"Cannot reach the relay on {args.socket}: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(response, indent=2))
+    sys.exit(0 if response.get("ok") else 1)
+
+if __name__ == "__main__":
+    main()
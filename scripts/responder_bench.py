@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Responder load test - sends an LLMNR/NBT-NS/MDNS query mix at a fixed rate
+and reports answer latency percentiles, answers/s and drop rate as JSON.
+
+Engines:
+  threaded  in-process LLMNR/NBT-NS/MDNS poisoners (ResponderCapture default)
+  workers   in-process ResponderWorkerPool (ResponderCapture --workers N)
+  external  an already running responder reached at --host / --*-port
+
+To test over a veth pair instead of loopback, run the responder on one end
+and point --host/--source at the addresses of the two ends.
+"""
+
+import os
+import sys
+import json
+import socket
+import logging
+import argparse
+import threading
+
+# Add project root to path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from src.modules.capture.loadgen import DEFAULT_MIX, ResponderLoadGenerator, compare_reports
+
+class BenchResponder:
+    """Stand-in for ResponderCapture that counts poisoned requests instead of storing them"""
+
+    def __init__(self, response_ip):
+        self.logger = logging.getLogger('responder_bench')
+        self.response_ip = response_ip
+        self.poisoned = 0
+        self.lock = threading.Lock()
+
+    def get_response_ip(self):
+        return self.response_ip
+
+    def handle_poisoned_request(self, request_type, source_ip, request_name):
+        with self.lock:
+            self.poisoned += 1
+
+def _free_udp_port(host):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((host, 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def start_threaded(args):
+    from src.modules.capture.responder import LLMNRPoisoner, MDNSPoisoner, NBTNSPoisoner
+    responder = BenchResponder(args.response_ip)
+    servers = {}
+    for protocol, server_class in (('llmnr', LLMNRPoisoner), ('nbt-ns', NBTNSPoisoner),
+                                   ('mdns', MDNSPoisoner)):
+        server = server_class((args.host, 0), responder)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers[protocol] = server
+
+    def stop():
+        for server in servers.values():
+            server.shutdown()
+            server.server_close()
+
+    return {protocol: server.server_address[1] for protocol, server in servers.items()}, stop
+
+def start_workers(args):
+    from src.modules.capture.workers import ResponderWorkerPool
+    ports = {protocol: _free_udp_port(args.host) for protocol in ('llmnr', 'nbt-ns', 'mdns')}
+    pool = ResponderWorkerPool(args.response_ip, ports, workers=args.workers, bind_address=args.host)
+    pool.start()
+    return ports, pool.stop
+
+def start_external(args):
+    return {'llmnr': args.llmnr_port, 'nbt-ns': args.nbtns_port, 'mdns': args.mdns_port}, lambda: None
+
+ENGINES = {
+    'threaded': start_threaded,
+    'workers': start_workers,
+    'external': start_external,
+}
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        protocol, _, weight = item.partition('=')
+        mix[protocol.strip()] = float(weight or 1)
+    return mix
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the LLMNR/NBT-NS/MDNS poisoners")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="threaded")
+    parser.add_argument("--host", default="127.0.0.1", help="Address the poisoners listen on")
+    parser.add_argument("--source", default="0.0.0.0", help="Local address to send queries from")
+    parser.add_argument("--llmnr-port", type=int, default=5355)
+    parser.add_argument("--nbtns-port", type=int, default=137)
+    parser.add_argument("--mdns-port", type=int, default=5353)
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes for --engine workers")
+    parser.add_argument("--response-ip", default="10.0.0.5", help="IP the in-process engines answer with")
+    parser.add_argument("-r", "--rate", type=float, default=2000, help="Queries per second")
+    parser.add_argument("-d", "--duration", type=float, default=5, help="Seconds of load")
+    parser.add_argument("--mix", type=parse_mix,
+                        default=DEFAULT_MIX, help="Protocol weights, e.g. llmnr=5,nbt-ns=3,mdns=2")
+    parser.add_argument("--timeout", type=float, default=1.0, help="Seconds before a query counts as dropped")
+    parser.add_argument("--sockets", type=int, default=4, help="Client sockets per protocol")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file")
+    parser.add_argument("--compare", help="Baseline report; exit 1 if this run regressed")
+    parser.add_argument("--max-latency-increase", type=float, default=0.25)
+    parser.add_argument("--max-throughput-decrease", type=float, default=0.10)
+    parser.add_argument("--max-drop-increase", type=float, default=0.01)
+    args = parser.parse_args()
+
+    ports, stop = ENGINES[args.engine](args)
+    try:
+        generator = ResponderLoadGenerator(
+            args.host, ports, rate=args.rate, duration=args.duration, mix=args.mix,
+            timeout=args.timeout, source_address=args.source, sockets_per_protocol=args.sockets,
+            response_ip=None if args.engine == 'external' else args.response_ip, seed=args.seed)
+        report = generator.run()
+    finally:
+        stop()
+    report['engine'] = args.engine
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, args.max_latency_increase,
+                                      args.max_throughput_decrease, args.max_drop_increase)
+        if regressions:
+            print("Regressions against " + args.compare + ":", file=sys.stderr)
+            for regression in regressions:
+                print("  " + regression, file=sys.stderr)
+            sys.exit(1)
+        print("No regressions against " + args.compare, file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+SMB2 capture load test - drives short-lived SMB2StubClient connections
+(NEGOTIATE + NTLMSSP SESSION_SETUP) against SMB2CaptureServer over loopback
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+# Add project root to path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from src.modules.capture.smb_server import SMB2CaptureServer
+from src.utils.metrics import summarize_latencies
+from src.utils.smb2 import STATUS_ACCESS_DENIED
+from src.utils.smb2_client import SMB2StubClient
+
+async def run_benchmark(args):
+    server = None
+    host, port = args.host, args.port
+    if not port:
+        server = SMB2CaptureServer('127.0.0.1', 0)
+        await server.start()
+        host, port = '127.0.0.1', server.port
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = []
+
+    async def one_connection(index):
+        async with semaphore:
+            client = SMB2StubClient(host, port, f"{args.user}{index}", args.password, args.domain)
+            try:
+                result = await client.authenticate()
+                if result['status'] != STATUS_ACCESS_DENIED:
+                    errors.append(f"unexpected status {result['status']:#x}")
+                    return
+                latencies.append(result['total_s'])
+            except Exception as e:
+                errors.append(str(e))
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one_connection(i) for i in range(args.connections)])
+    elapsed = time.perf_counter() - started
+    captured = server.handshakes if server else None
+    if server:
+        await server.stop()
+
+    return {
+        'connections': args.connections,
+        'concurrency': args.concurrency,
+        'completed': len(latencies),
+        'captured': captured,
+        'errors': len(errors),
+        'elapsed_s': round(elapsed, 3),
+        'handshakes_per_s': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'latency': summarize_latencies(latencies),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the SMB2 NTLM capture server")
+    parser.add_argument("--host", default="127.0.0.1", help="Server to test (default: in-process server)")
+    parser.add_argument("--port", type=int, default=0, help="Server port (0 starts an in-process server)")
+    parser.add_argument("-n", "--connections", type=int, default=2000, help="Total client connections")
+    parser.add_argument("-c", "--concurrency", type=int, default=200, help="Connections in flight")
+    parser.add_argument("--user", default="bench")
+    parser.add_argument("--password", default="Passw0rd!")
+    parser.add_argument("--domain", default="LAB")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmark(args))
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
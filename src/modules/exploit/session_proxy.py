@@ -0,0 +1,229 @@
+import os
+import time
+import socket
+import logging
+import itertools
+import selectors
+import threading
+from typing import Dict, Tuple
+
+# os.splice() moves data socket -> pipe -> socket inside the kernel (Linux, Python 3.10+)
+SPLICE_SUPPORTED = hasattr(os, 'splice')
+
+# Bytes moved per splice/recv_into call; a pipe holds 64 KB by default
+CHUNK_SIZE = 64 * 1024
+
+# How often the copy threads look at the idle timer
+POLL_INTERVAL = 1.0
+
+class ProxySession:
+    """
+    One relayed client <-> target session being proxied.
+
+    Each direction is copied by its own thread so a peer that stops reading
+    cannot stall the other direction. With splice the payload never enters
+    Python; otherwise recv_into() fills one buffer that is reused for every
+    chunk. A direction that sees EOF half-closes its destination; the session
+    is torn down when both directions are done, on an error, or once no byte
+    moved either way for idle_timeout seconds.
+    """
+
+    def __init__(self, session_id: int, client: socket.socket, target: socket.socket,
+                 client_address: Tuple[str, int], target_address: Tuple[str, int], user: str = None,
+                 idle_timeout: float = 300.0, use_splice: bool = SPLICE_SUPPORTED, on_close=None):
+        self.logger = logging.getLogger(__name__)
+        self.session_id = session_id
+        self.client = client
+        self.target = target
+        self.client_address = client_address
+        self.target_address = target_address
+        self.user = user
+        self.idle_timeout = idle_timeout
+        self.use_splice = use_splice
+        self.on_close = on_close
+        self.bytes_to_target = 0
+        self.bytes_to_client = 0
+        self.started = time.time()
+        self.last_activity = time.monotonic()
+        self.closed_reason = None
+        self.closed = threading.Event()
+        self.lock = threading.Lock()
+        self.running_directions = 0
+
+    def start(self, to_client: bytes = b'', to_target: bytes = b''):
+        """Send the bytes already in hand to each side, then start copying"""
+        for sock in (self.client, self.target):
+            sock.setblocking(True)
+        if to_client:
+            self.client.sendall(to_client)
+            self.bytes_to_client += len(to_client)
+        if to_target:
+            self.target.sendall(to_target)
+            self.bytes_to_target += len(to_target)
+        self.running_directions = 2
+        for source, destination, direction in ((self.client, self.target, 'to_target'),
+                                               (self.target, self.client, 'to_client')):
+            threading.Thread(target=self._pump, args=(source, destination, direction),
+                             name=f"proxy-{self.session_id}-{direction}", daemon=True).start()
+
+    def _pump(self, source: socket.socket, destination: socket.socket, direction: str):
+        counter = 'bytes_' + direction
+        selector = selectors.DefaultSelector()
+        selector.register(source, selectors.EVENT_READ)
+        pipe = os.pipe() if self.use_splice else None
+        view = None if pipe else memoryview(bytearray(CHUNK_SIZE))
+        try:
+            while not self.closed.is_set():
+                if not selector.select(POLL_INTERVAL):
+                    if time.monotonic() - self.last_activity > self.idle_timeout:
+                        self.close('idle')
+                        return
+                    continue
+                if pipe:
+                    count = os.splice(source.fileno(), pipe[1], CHUNK_SIZE, flags=os.SPLICE_F_MOVE)
+                    remaining = count
+                    while remaining:
+                        remaining -= os.splice(pipe[0], destination.fileno(), remaining,
+                                               flags=os.SPLICE_F_MOVE)
+                else:
+                    count = source.recv_into(view)
+                    destination.sendall(view[:count])
+                if not count:
+                    # Peer finished sending; pass the half-close on and keep the other direction
+                    try:
+                        destination.shutdown(socket.SHUT_WR)
+                    except OSError:
+                        pass
+                    return
+                setattr(self, counter, getattr(self, counter) + count)
+                self.last_activity = time.monotonic()
+        except OSError as e:
+            if not self.closed.is_set():
+                self.logger.debug(f"[*] Proxy session {self.session_id} {direction}: {e}")
+                self.close('error')
+        finally:
+            selector.close()
+            if pipe:
+                os.close(pipe[0])
+                os.close(pipe[1])
+            self._direction_done()
+
+    def _direction_done(self):
+        with self.lock:
+            self.running_directions -= 1
+            last = self.running_directions == 0
+        if not last:
+            return
+        self.close('closed')
+        for sock in (self.client, self.target):
+            sock.close()
+        self.logger.info(f"[*] Proxy session {self.session_id} ({self.user}) {self.closed_reason}: "
+                         f"{self.bytes_to_target} bytes to target, {self.bytes_to_client} bytes to client")
+        if self.on_close:
+            self.on_close(self)
+
+    def close(self, reason: str = 'stopped'):
+        """Tear the session down; the copy threads exit on their own"""
+        with self.lock:
+            if self.closed.is_set():
+                return
+            self.closed_reason = reason
+            self.closed.set()
+        # Wake both copy threads blocked on their sockets
+        for sock in (self.client, self.target):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict:
+        """Byte counters and timers of the session"""
+        return {
+            'id': self.session_id,
+            'client': f"{self.client_address[0]}:{self.client_address[1]}",
+            'target': f"{self.target_address[0]}:{self.target_address[1]}",
+            'user': self.user,
+            'bytes_to_target': self.bytes_to_target,
+            'bytes_to_client': self.bytes_to_client,
+            'duration_s': round(time.time() - self.started, 3),
+            'idle_s': round(time.monotonic() - self.last_activity, 3),
+            'open': not self.closed.is_set(),
+            'closed_reason': self.closed_reason,
+        }
+
+class SessionProxy:
+    """Keeps authenticated relay sessions open and proxies the client's traffic to the target"""
+
+    def __init__(self, idle_timeout: float = 300.0, use_splice: bool = SPLICE_SUPPORTED):
+        self.logger = logging.getLogger(__name__)
+        self.idle_timeout = idle_timeout
+        self.use_splice = use_splice
+        self.session_ids = itertools.count(1)
+        self.sessions: Dict[int, ProxySession] = {}
+        self.lock = threading.Lock()
+        self.closed_sessions = 0
+        self.closed_bytes_to_target = 0
+        self.closed_bytes_to_client = 0
+
+    def proxy(self, client: socket.socket, target: socket.socket, client_address: Tuple[str, int],
+              target_address: Tuple[str, int], user: str = None, to_client: bytes = b'',
+              to_target: bytes = b'') -> ProxySession:
+        """
+        Start proxying a relayed session.
+
+        Args:
+            client (socket.socket): Socket of the relayed client
+            target (socket.socket): Authenticated socket to the target
+            client_address (Tuple[str, int]): Client address, for logs and stats
+            target_address (Tuple[str, int]): Target address, for logs and stats
+            user (str): DOMAIN\\user the session is authenticated as
+            to_client (bytes): Frame still owed to the client (the final SESSION_SETUP response)
+            to_target (bytes): Client bytes already read by the relay
+
+        Returns:
+            ProxySession: The running session
+        """
+        session = ProxySession(next(self.session_ids), client, target, client_address, target_address,
+                               user, self.idle_timeout, self.use_splice, self._on_close)
+        with self.lock:
+            self.sessions[session.session_id] = session
+        try:
+            session.start(to_client, to_target)
+        except OSError:
+            with self.lock:
+                self.sessions.pop(session.session_id, None)
+            for sock in (client, target):
+                sock.close()
+            raise
+        self.logger.info(f"[+] Proxying {client_address[0]} -> {target_address[0]} as {user} "
+                         f"(session {session.session_id}, {'splice' if self.use_splice else 'recv_into'})")
+        return session
+
+    def _on_close(self, session: ProxySession):
+        with self.lock:
+            if self.sessions.pop(session.session_id, None):
+                self.closed_sessions += 1
+                self.closed_bytes_to_target += session.bytes_to_target
+                self.closed_bytes_to_client += session.bytes_to_client
+
+    def get_stats(self) -> Dict:
+        """Totals over all sessions plus the counters of the open ones"""
+        with self.lock:
+            sessions = list(self.sessions.values())
+            stats = {
+                'active': len(sessions),
+                'closed': self.closed_sessions,
+                'bytes_to_target': self.closed_bytes_to_target,
+                'bytes_to_client': self.closed_bytes_to_client,
+            }
+        stats['sessions'] = [session.stats() for session in sessions]
+        stats['bytes_to_target'] += sum(s['bytes_to_target'] for s in stats['sessions'])
+        stats['bytes_to_client'] += sum(s['bytes_to_client'] for s in stats['sessions'])
+        return stats
+
+    def stop(self):
+        """Close every proxied session"""
+        with self.lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            session.close()
@@ -0,0 +1,235 @@
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from impacket.smbconnection import SMBConnection
+
+SessionKey = Tuple[str, str, str]
+
+class RelayedSession:
+    """Authenticated target connection kept alive by the SessionRegistry"""
+
+    def __init__(self, key: SessionKey, connection: SMBConnection):
+        self.key = key
+        self.connection = connection
+        self.created = time.time()
+        # Jobs count as use; keep-alives only as activity
+        self.last_used = time.monotonic()
+        self.last_activity = self.last_used
+        self.jobs = 0
+        self.failed_jobs = 0
+        self.closed = False
+        # An SMBConnection is not thread safe, jobs and keep-alives take turns
+        self.lock = threading.Lock()
+
+    def stats(self) -> Dict:
+        user, domain, target = self.key
+        return {
+            'user': user,
+            'domain': domain,
+            'target': target,
+            'age_s': round(time.time() - self.created, 1),
+            'idle_s': round(time.monotonic() - self.last_used, 1),
+            'jobs': self.jobs,
+            'failed_jobs': self.failed_jobs,
+        }
+
+class SessionRegistry:
+    """
+    Live authenticated target sessions, keyed by (user, domain, target).
+
+    Each successful relay can leave its SMB session here instead of closing
+    it. Jobs - callables taking the SMBConnection - submitted for a key run on
+    that session in a small worker pool, one at a time per session; jobs for
+    a key without a session wait until a relay for it registers one. Idle
+    sessions get an SMB2 ECHO every keepalive_interval seconds and are logged
+    off once no job used them for idle_timeout seconds or the ECHO fails. At
+    most max_sessions are kept, the least recently used one is dropped to make
+    room for a new one.
+    """
+
+    def __init__(self, max_sessions: int = 64, idle_timeout: float = 900.0,
+                 keepalive_interval: float = 60.0, workers: int = 4):
+        self.logger = logging.getLogger(__name__)
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.sessions: Dict[SessionKey, RelayedSession] = {}
+        self.pending: Dict[SessionKey, deque] = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='relay-jobs')
+        self.stopping = threading.Event()
+        self.thread = None
+        self.counters = {'registered': 0, 'evicted': 0, 'expired': 0, 'dead': 0, 'jobs': 0}
+
+    @staticmethod
+    def make_key(user: str, domain: str, target: str) -> SessionKey:
+        """Case-insensitive key of a session"""
+        return user.lower(), domain.lower(), target.lower()
+
+    def add(self, user: str, domain: str, target: str, connection: SMBConnection) -> RelayedSession:
+        """Register an authenticated connection and start the jobs waiting for it"""
+        key = self.make_key(user, domain, target)
+        session = RelayedSession(key, connection)
+        retired = []
+        with self.lock:
+            previous = self.sessions.pop(key, None)
+            if previous:
+                retired.append(previous)
+            while len(self.sessions) >= self.max_sessions:
+                oldest = min(self.sessions.values(), key=lambda s: s.last_used)
+                del self.sessions[oldest.key]
+                self.counters['evicted'] += 1
+                retired.append(oldest)
+            self.sessions[key] = session
+            self.counters['registered'] += 1
+            waiting = self.pending.pop(key, deque())
+        for old in retired:
+            self.logger.info(f"[*] Dropping session {old.key[1]}\\{old.key[0]}@{old.key[2]} to make room")
+            self.executor.submit(self._close, old)
+        self.logger.info(f"[+] Keeping session {domain}\\{user}@{target} "
+                         f"({len(waiting)} queued jobs)")
+        for job, future in waiting:
+            self.executor.submit(self._run_job, session, job, future)
+        return session
+
+    def get(self, user: str, domain: str, target: str) -> Optional[RelayedSession]:
+        with self.lock:
+            return self.sessions.get(self.make_key(user, domain, target))
+
+    def submit(self, user: str, domain: str, target: str,
+               job: Callable[[SMBConnection], Any]) -> Future:
+        """
+        Run job(connection) on the session of (user, domain, target).
+
+        Args:
+            user (str): Relayed user name
+            domain (str): Domain of the user
+            target (str): Target the session is authenticated to
+            job (Callable[[SMBConnection], Any]): Work to do on the session
+
+        Returns:
+            Future: Result of the job; queued until the session exists
+        """
+        key = self.make_key(user, domain, target)
+        future = Future()
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                self.pending.setdefault(key, deque()).append((job, future))
+                return future
+        self.executor.submit(self._run_job, session, job, future)
+        return future
+
+    def _run_job(self, session: RelayedSession, job: Callable, future: Future):
+        if not future.set_running_or_notify_cancel():
+            return
+        with session.lock:
+            if session.closed:
+                future.set_exception(ConnectionError(f"Session {session.key} is closed"))
+                return
+            try:
+                result = job(session.connection)
+            except Exception as e:
+                session.failed_jobs += 1
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                session.jobs += 1
+                session.last_used = session.last_activity = time.monotonic()
+        with self.lock:
+            self.counters['jobs'] += 1
+
+    def remove(self, user: str, domain: str, target: str):
+        """Log the session off"""
+        with self.lock:
+            session = self.sessions.pop(self.make_key(user, domain, target), None)
+        if session:
+            self._close(session)
+
+    def _close(self, session: RelayedSession):
+        with session.lock:
+            if session.closed:
+                return
+            session.closed = True
+            try:
+                session.connection.close()
+            except Exception as e:
+                self.logger.debug(f"Error closing session {session.key}: {e}")
+
+    def start(self):
+        """Start the keep-alive and expiry thread"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._maintain, name='session-registry', daemon=True)
+        self.thread.start()
+
+    def _maintain(self):
+        interval = max(0.05, min(self.keepalive_interval, self.idle_timeout) / 4)
+        while not self.stopping.wait(interval):
+            now = time.monotonic()
+            with self.lock:
+                sessions = list(self.sessions.values())
+            for session in sessions:
+                if now - session.last_used > self.idle_timeout:
+                    self._retire(session, 'expired')
+                elif now - session.last_activity > self.keepalive_interval:
+                    self._keepalive(session)
+
+    def _keepalive(self, session: RelayedSession):
+        # A running job keeps the session busy enough
+        if not session.lock.acquire(blocking=False):
+            return
+        try:
+            if session.closed:
+                return
+            session.connection.getSMBServer().echo()
+            session.last_activity = time.monotonic()
+            return
+        except Exception as e:
+            self.logger.info(f"[-] Session {session.key[1]}\\{session.key[0]}@{session.key[2]} "
+                             f"did not answer the keep-alive: {e}")
+        finally:
+            session.lock.release()
+        self._retire(session, 'dead')
+
+    def _retire(self, session: RelayedSession, reason: str):
+        with self.lock:
+            if self.sessions.get(session.key) is not session:
+                return
+            del self.sessions[session.key]
+            self.counters[reason] += 1
+        self.logger.info(f"[*] Session {session.key[1]}\\{session.key[0]}@{session.key[2]} {reason}")
+        self._close(session)
+
+    def stop(self):
+        """Stop the maintenance thread, cancel queued jobs and log every session off"""
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(5)
+            self.thread = None
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+            pending = [future for jobs in self.pending.values() for _, future in jobs]
+            self.pending.clear()
+        for future in pending:
+            future.cancel()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for session in sessions:
+            self._close(session)
+
+    def get_stats(self) -> Dict:
+        """Counters and the live sessions"""
+        with self.lock:
+            stats = dict(self.counters)
+            stats['active'] = len(self.sessions)
+            stats['max_sessions'] = self.max_sessions
+            stats['pending_jobs'] = sum(len(jobs) for jobs in self.pending.values())
+            stats['sessions'] = [session.stats() for session in self.sessions.values()]
+        return stats
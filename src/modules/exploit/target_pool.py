@@ -0,0 +1,210 @@
+import time
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, Tuple
+
+from src.modules.exploit.smb_relay_client import SMBRelayClient
+from src.utils.metrics import summarize_latencies
+
+class _TargetState:
+    """Idle connections and counters of one pooled target"""
+
+    def __init__(self, target: str, port: int, name: str = None):
+        self.target = target
+        self.port = port
+        self.name = name
+        self.idle = deque()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.unhealthy = 0
+        self.failures = 0
+        self.negotiate_latencies = deque(maxlen=1000)
+
+class TargetConnectionPool:
+    """
+    Per-target pool of pre-negotiated, unauthenticated SMB connections.
+
+    A maintenance thread keeps every target topped up to depth idle
+    SMBRelayClient connections on which only NEGOTIATE has been done, so a
+    relayed Type 1 costs a single SESSION_SETUP round trip. Connections idle
+    for longer than max_idle are closed, the rest are checked with an SMB2
+    ECHO every health_interval seconds. acquire() falls back to connecting on
+    the spot when the pool is empty; hits and misses are counted per target.
+    """
+
+    def __init__(self, depth: int = 4, max_idle: float = 60.0, health_interval: float = 10.0,
+                 timeout: float = 5.0,
+                 factory: Callable[..., SMBRelayClient] = SMBRelayClient):
+        self.logger = logging.getLogger(__name__)
+        self.depth = depth
+        self.max_idle = max_idle
+        self.health_interval = health_interval
+        self.timeout = timeout
+        self.factory = factory
+        self.targets: Dict[Tuple[str, int], _TargetState] = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def add_target(self, target: str, port: int = 445, name: str = None):
+        """Start keeping warm connections to target"""
+        with self.lock:
+            if (target, port) not in self.targets:
+                self.targets[(target, port)] = _TargetState(target, port, name)
+        self.wakeup.set()
+
+    def remove_target(self, target: str, port: int = 445):
+        """Stop pooling target and close its idle connections"""
+        with self.lock:
+            state = self.targets.pop((target, port), None)
+        if state:
+            self._close_all(state)
+
+    def _connect(self, state: _TargetState) -> SMBRelayClient:
+        client = self.factory(state.target, state.name, state.port, self.timeout)
+        client.init_connection()
+        state.negotiate_latencies.append(client.negotiate_s)
+        return client
+
+    def acquire(self, target: str, port: int = 445, name: str = None) -> SMBRelayClient:
+        """
+        Return a negotiated connection to target, preferring a pooled one.
+
+        The caller owns the connection and must close it; pooled connections
+        are never handed out twice.
+        """
+        stale = []
+        with self.lock:
+            state = self.targets.get((target, port))
+            client = None
+            if state:
+                now = time.perf_counter()
+                while state.idle:
+                    candidate = state.idle.popleft()
+                    if now - candidate.negotiated_at <= self.max_idle:
+                        client = candidate
+                        break
+                    state.evicted += 1
+                    stale.append(candidate)
+                if client:
+                    state.hits += 1
+                else:
+                    state.misses += 1
+        for candidate in stale:
+            candidate.close()
+        if state:
+            # Top the pool up again in the background
+            self.wakeup.set()
+        if client:
+            return client
+        if state:
+            return self._connect(state)
+        client = self.factory(target, name, port, self.timeout)
+        client.init_connection()
+        return client
+
+    def start(self):
+        """Start the maintenance thread"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._maintain, name='target-pool', daemon=True)
+        self.thread.start()
+
+    def _maintain(self):
+        last_health_check = time.perf_counter()
+        while not self.stopping.is_set():
+            self.wakeup.clear()
+            with self.lock:
+                states = list(self.targets.values())
+            check_health = time.perf_counter() - last_health_check >= self.health_interval
+            for state in states:
+                if self.stopping.is_set():
+                    break
+                self._evict(state, check_health)
+                self._top_up(state)
+            if check_health:
+                last_health_check = time.perf_counter()
+            self.wakeup.wait(min(self.health_interval, self.max_idle / 2))
+
+    def _evict(self, state: _TargetState, check_health: bool):
+        now = time.perf_counter()
+        with self.lock:
+            expired = [client for client in state.idle if now - client.negotiated_at > self.max_idle]
+            for client in expired:
+                state.idle.remove(client)
+            state.evicted += len(expired)
+            # Health checks talk to the target, so they run on connections taken out of the pool
+            checked = list(state.idle) if check_health else []
+            if check_health:
+                state.idle.clear()
+        for client in expired:
+            client.close()
+        healthy = []
+        for client in checked:
+            if client.echo():
+                healthy.append(client)
+            else:
+                state.unhealthy += 1
+                client.close()
+        if healthy:
+            with self.lock:
+                state.idle.extendleft(reversed(healthy))
+
+    def _top_up(self, state: _TargetState):
+        while not self.stopping.is_set():
+            with self.lock:
+                if (state.target, state.port) not in self.targets or len(state.idle) >= self.depth:
+                    return
+            try:
+                client = self._connect(state)
+            except Exception as e:
+                state.failures += 1
+                self.logger.debug(f"[*] Could not pre-connect to {state.target}:{state.port}: {e}")
+                return
+            with self.lock:
+                if (state.target, state.port) in self.targets and not self.stopping.is_set():
+                    state.idle.append(client)
+                    continue
+            client.close()
+            return
+
+    def _close_all(self, state: _TargetState):
+        with self.lock:
+            idle = list(state.idle)
+            state.idle.clear()
+        for client in idle:
+            client.close()
+
+    def stop(self):
+        """Stop the maintenance thread and close every idle connection"""
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(self.timeout + 1)
+            self.thread = None
+        with self.lock:
+            states = list(self.targets.values())
+        for state in states:
+            self._close_all(state)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """Hit rate, idle depth and negotiate latency per target"""
+        stats = {}
+        with self.lock:
+            for (target, port), state in self.targets.items():
+                requests = state.hits + state.misses
+                stats[f"{target}:{port}"] = {
+                    'idle': len(state.idle),
+                    'hits': state.hits,
+                    'misses': state.misses,
+                    'hit_rate': round(state.hits / requests, 4) if requests else 0.0,
+                    'evicted': state.evicted,
+                    'unhealthy': state.unhealthy,
+                    'connect_failures': state.failures,
+                    'negotiate': summarize_latencies(state.negotiate_latencies),
+                }
+        return stats
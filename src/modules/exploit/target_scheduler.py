@@ -0,0 +1,301 @@
+import time
+import heapq
+import logging
+import ipaddress
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from src.utils.name_resolver import NameResolver
+
+SCHEDULES = ('round-robin', 'priority')
+
+TargetKey = Tuple[str, int]
+
+class ScopeTarget:
+    """An in-scope relay target and its scheduling state"""
+
+    __slots__ = ('host', 'port', 'name', 'priority', 'active', 'failures', 'backoff_until',
+                 'relayed', 'succeeded', 'failed', 'excluded')
+
+    def __init__(self, host: str, port: int = 445, name: str = None, priority: int = 0):
+        self.host = host
+        self.port = port
+        self.name = name or host
+        self.priority = priority
+        self.active = 0
+        # Consecutive failures drive the backoff; the counters below are totals
+        self.failures = 0
+        self.backoff_until = 0.0
+        self.relayed = 0
+        self.succeeded = 0
+        self.failed = 0
+        # Reason the target was taken out of scheduling, e.g. it requires SMB signing
+        self.excluded = None
+
+    @property
+    def key(self) -> TargetKey:
+        return self.host, self.port
+
+def parse_scope(lines: Iterable[str], default_port: int = 445) -> List[ScopeTarget]:
+    """
+    Parse scope entries, one per line: host[:port] [priority=N]
+
+    Hosts may be IP addresses, names (resolved once, here) or CIDR ranges;
+    blank lines and everything after # are ignored.
+
+    Args:
+        lines (Iterable[str]): Lines of the scope file
+        default_port (int): SMB port for entries without one
+
+    Returns:
+        List[ScopeTarget]: The targets, duplicates removed
+    """
+    targets: Dict[TargetKey, ScopeTarget] = {}
+    for number, line in enumerate(lines, 1):
+        fields = line.split('#', 1)[0].split()
+        if not fields:
+            continue
+        entry, options = fields[0], fields[1:]
+        priority = 0
+        for option in options:
+            name, _, value = option.partition('=')
+            if name != 'priority' or not value.lstrip('-').isdigit():
+                raise ValueError(f"Scope line {number}: unknown option '{option}'")
+            priority = int(value)
+        host, port = entry, default_port
+        if entry.count(':') == 1:
+            host, port_text = entry.split(':')
+            if not port_text.isdigit() or not 1 <= int(port_text) <= 65535:
+                raise ValueError(f"Scope line {number}: invalid port '{port_text}'")
+            port = int(port_text)
+        if '/' in host:
+            try:
+                network = ipaddress.ip_network(host, strict=False)
+            except ValueError as e:
+                raise ValueError(f"Scope line {number}: invalid range {host}: {e}")
+            hosts = [(str(address), None) for address in network.hosts()]
+        else:
+            try:
+                hosts = [(str(ipaddress.ip_address(host)), None)]
+            except ValueError:
+                address = NameResolver.shared().resolve_address(host)
+                if address is None:
+                    raise ValueError(f"Scope line {number}: cannot resolve {host}")
+                hosts = [(address, host)]
+        for address, name in hosts:
+            targets.setdefault((address, port), ScopeTarget(address, port, name, priority))
+    return list(targets.values())
+
+def load_scope(path: str, default_port: int = 445) -> List[ScopeTarget]:
+    """Read a scope file (see parse_scope)"""
+    with open(path) as f:
+        return parse_scope(f, default_port)
+
+class TargetScheduler:
+    """
+    Picks the relay target for each inbound authentication from a fixed scope.
+
+    Targets that can take another relay sit in ordered sets (one per
+    priority level in 'priority' mode, a single one in 'round-robin' mode);
+    taking the first entry and moving it to the end gives round-robin order
+    in O(1). A target leaves its set while it has max_per_target relays in
+    flight or is backing off after a failure (exponential, from backoff_base
+    up to backoff_max seconds) and returns when a relay ends or its backoff
+    expires from a heap. Targets where the client's user already succeeded
+    are skipped; the user of a client is learned from its last Type 3,
+    since a Type 1 does not name one. Nothing outside the scope is ever
+    returned.
+    """
+
+    def __init__(self, targets: Iterable[ScopeTarget], schedule: str = 'round-robin',
+                 max_per_target: int = 4, backoff_base: float = 5.0, backoff_max: float = 300.0,
+                 clock=time.monotonic):
+        if schedule not in SCHEDULES:
+            raise ValueError(f"Unknown schedule '{schedule}', expected one of {SCHEDULES}")
+        self.logger = logging.getLogger(__name__)
+        self.schedule = schedule
+        self.max_per_target = max_per_target
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.clock = clock
+        self.targets: Dict[TargetKey, ScopeTarget] = {}
+        self.ports_by_host: Dict[str, int] = {}
+        self.ready: Dict[int, OrderedDict] = {}
+        self.levels: List[int] = []
+        self.backoff: List[Tuple[float, int, TargetKey]] = []
+        self.backoff_seq = itertools.count()
+        self.user_successes: Dict[str, Set[TargetKey]] = {}
+        self.client_users: Dict[str, str] = {}
+        self.unavailable = 0
+        self.lock = threading.Lock()
+        self._set_targets({target.key: target for target in targets})
+
+    def _set_targets(self, targets: Dict[TargetKey, ScopeTarget]):
+        # Called with the lock held, or from __init__
+        if not targets:
+            raise ValueError("Scope does not contain any target")
+        now = self.clock()
+        self.targets = targets
+        self.ports_by_host = {}
+        for host, _ in targets:
+            self.ports_by_host[host] = self.ports_by_host.get(host, 0) + 1
+        self.ready = {}
+        for target in targets.values():
+            bucket = self.ready.setdefault(self._level(target), OrderedDict())
+            if target.backoff_until <= now and target.active < self.max_per_target and not target.excluded:
+                bucket[target.key] = None
+        self.levels = sorted(self.ready, reverse=True)
+
+    def update(self, targets: Iterable[ScopeTarget], schedule: str = None, max_per_target: int = None):
+        """
+        Replace the scope while relays are in flight.
+
+        Targets that stay in scope keep their state (relays in flight,
+        backoff, counters, users already relayed to them) and take the new
+        priority; relays in flight to removed targets finish and are released
+        as usual, but the targets are not picked again.
+        """
+        schedule = schedule or self.schedule
+        if schedule not in SCHEDULES:
+            raise ValueError(f"Unknown schedule '{schedule}', expected one of {SCHEDULES}")
+        with self.lock:
+            merged = {}
+            for target in targets:
+                kept = self.targets.get(target.key)
+                if kept is not None:
+                    kept.priority = target.priority
+                    kept.name = target.name
+                    target = kept
+                merged[target.key] = target
+            previous = self.schedule, self.max_per_target
+            self.schedule = schedule
+            self.max_per_target = max_per_target or self.max_per_target
+            try:
+                self._set_targets(merged)
+            except ValueError:
+                self.schedule, self.max_per_target = previous
+                raise
+        self.logger.info(f"[*] Scope updated: {len(merged)} target(s), {schedule}")
+
+    def _level(self, target: ScopeTarget) -> int:
+        return target.priority if self.schedule == 'priority' else 0
+
+    def in_scope(self, host: str, port: int = None) -> bool:
+        """True if host (and port, when given) is in the scope"""
+        if port is None:
+            return host in self.ports_by_host
+        return (host, port) in self.targets
+
+    def note_user(self, client_ip: str, user: str):
+        """Remember which user a client authenticates as"""
+        with self.lock:
+            self.client_users[client_ip] = user.lower()
+
+    def _expire_backoffs(self, now: float):
+        while self.backoff and self.backoff[0][0] <= now:
+            until, _, key = heapq.heappop(self.backoff)
+            target = self.targets.get(key)
+            # Stale entry, or a target removed from the scope by update()
+            if target is None or target.backoff_until != until:
+                continue
+            target.backoff_until = 0.0
+            if target.active < self.max_per_target and not target.excluded:
+                self.ready[self._level(target)][key] = None
+
+    def acquire(self, client_ip: str = None, user: str = None) -> Optional[ScopeTarget]:
+        """Pick a target for a new relay and count it as in flight, None if none is available"""
+        with self.lock:
+            self._expire_backoffs(self.clock())
+            user = (user or self.client_users.get(client_ip) or '').lower()
+            done = self.user_successes.get(user, ())
+            # Only targets this user owns and the client's own host can be skipped
+            limit = len(done) + self.ports_by_host.get(client_ip, 0) + 1
+            for level in self.levels:
+                bucket = self.ready[level]
+                chosen = None
+                for key in itertools.islice(bucket, limit):
+                    if key[0] != client_ip and key not in done:
+                        chosen = key
+                        break
+                if chosen is None:
+                    continue
+                target = self.targets[chosen]
+                target.active += 1
+                target.relayed += 1
+                if target.active >= self.max_per_target:
+                    del bucket[chosen]
+                else:
+                    bucket.move_to_end(chosen)
+                return target
+            self.unavailable += 1
+            return None
+
+    def release(self, target: ScopeTarget, outcome: Optional[bool], user: str = None):
+        """
+        End a relay started with acquire().
+
+        Args:
+            target (ScopeTarget): Target returned by acquire()
+            outcome (Optional[bool]): True if the target accepted the user, False if the
+                target failed or refused it, None if the client went away first
+            user (str): DOMAIN\\user the relay authenticated as
+        """
+        with self.lock:
+            now = self.clock()
+            target.active -= 1
+            if self.targets.get(target.key) is not target:
+                # Removed from the scope by update() while the relay was in flight
+                return
+            bucket = self.ready[self._level(target)]
+            if outcome:
+                target.succeeded += 1
+                target.failures = 0
+                if user:
+                    self.user_successes.setdefault(user.lower(), set()).add(target.key)
+            elif outcome is False:
+                target.failed += 1
+                target.failures += 1
+                delay = min(self.backoff_base * 2 ** (target.failures - 1), self.backoff_max)
+                target.backoff_until = now + delay
+                heapq.heappush(self.backoff, (target.backoff_until, next(self.backoff_seq), target.key))
+                bucket.pop(target.key, None)
+                self.logger.info(f"[*] Backing off {target.host}:{target.port} for {delay:.0f}s "
+                                 f"after {target.failures} failure(s)")
+            if (target.backoff_until <= now and target.active < self.max_per_target
+                    and not target.excluded and target.key not in bucket):
+                bucket[target.key] = None
+
+    def exclude(self, host: str, port: int, reason: str):
+        """Stop scheduling a target for good"""
+        with self.lock:
+            target = self.targets.get((host, port))
+            if target is None or target.excluded:
+                return
+            target.excluded = reason
+            self.ready[self._level(target)].pop(target.key, None)
+        self.logger.info(f"[*] Not relaying to {host}:{port} any more: {reason}")
+
+    def get_stats(self) -> Dict:
+        """Per-target counters and scheduling state"""
+        with self.lock:
+            now = self.clock()
+            return {
+                'schedule': self.schedule,
+                'targets': len(self.targets),
+                'ready': sum(len(bucket) for bucket in self.ready.values()),
+                'unavailable': self.unavailable,
+                'per_target': {
+                    f"{target.host}:{target.port}": {
+                        'priority': target.priority,
+                        'active': target.active,
+                        'relayed': target.relayed,
+                        'succeeded': target.succeeded,
+                        'failed': target.failed,
+                        'backoff_s': round(max(0.0, target.backoff_until - now), 1),
+                        'excluded': target.excluded,
+                    }
+                    for target in self.targets.values()
+                },
+            }
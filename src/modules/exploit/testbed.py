@@ -0,0 +1,119 @@
+import time
+import asyncio
+import logging
+from typing import Dict
+
+from src.modules.exploit.ntlmrelayserver import NTLMRelayServer
+from src.utils.event_loop import EventLoopThread
+from src.utils.event_sink import EventSink
+from src.utils.metrics import peak_rss_mb, summarize_latencies
+from src.utils.smb2 import STATUS_ACCESS_DENIED
+from src.utils.smb2_client import SMB2StubClient
+from src.utils.smb2_server import SMB2StubServer
+
+class RelayTestBed:
+    """
+    Offline SMB2 relay test bed.
+
+    An SMB2StubServer plays the target and an in-process NTLMRelayServer
+    relays to it, both on loopback; relays SMB2StubClient authentications
+    with known credentials are driven through the relay, concurrency at a
+    time, and reported with the relay's per-leg histograms. The relay
+    denies every client, so whether a relay succeeded is read from the stub
+    target, which validated the relayed NTLMv2 response. The target listens
+    on another loopback address than the relay because the relay refuses
+    clients that are also the target.
+    """
+
+    def __init__(self, relays: int = 100, concurrency: int = 10, user: str = 'alice',
+                 password: str = 'Passw0rd!', domain: str = 'LAB', bad_password_every: int = 0,
+                 relay_host: str = '127.0.0.1', target_host: str = '127.0.0.2', pool_depth: int = 2,
+                 max_concurrency: int = 256, timeout: float = 10.0):
+        self.logger = logging.getLogger(__name__)
+        self.relays = relays
+        self.concurrency = concurrency
+        self.user = user
+        self.password = password
+        self.domain = domain
+        # Every Nth client sends a wrong password, which the target must reject (0: none)
+        self.bad_password_every = bad_password_every
+        self.relay_host = relay_host
+        self.target_host = target_host
+        self.pool_depth = pool_depth
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+
+    def _bad_password(self, index: int) -> bool:
+        return bool(self.bad_password_every) and index % self.bad_password_every == self.bad_password_every - 1
+
+    async def _drive(self, port: int) -> Dict:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        latencies = []
+        errors = []
+
+        async def one_relay(index):
+            async with semaphore:
+                password = 'not-' + self.password if self._bad_password(index) else self.password
+                client = SMB2StubClient(self.relay_host, port, self.user, password, self.domain,
+                                        timeout=self.timeout)
+                try:
+                    result = await client.authenticate()
+                except Exception as e:
+                    errors.append(str(e) or type(e).__name__)
+                    return
+                if result['status'] != STATUS_ACCESS_DENIED:
+                    errors.append(f"unexpected status {result['status']:#x}")
+                    return
+                latencies.append(result['total_s'])
+
+        started = time.perf_counter()
+        await asyncio.gather(*[one_relay(i) for i in range(self.relays)])
+        return {'elapsed_s': time.perf_counter() - started, 'latencies': latencies, 'errors': errors}
+
+    def run(self) -> Dict:
+        """Run the relays and return the report"""
+        bad = sum(1 for index in range(self.relays) if self._bad_password(index))
+        target = SMB2StubServer(self.target_host, 0, {self.user: self.password}, domain_name=self.domain)
+        target_loop = EventLoopThread('stub-target')
+        target_loop.start()
+        # Session records are only counted; the sink exercises the same hand-off as the real store
+        sink = EventSink(lambda session: None, name='testbed-sessions')
+        relay = None
+        try:
+            target_loop.run(target.start())
+            relay = NTLMRelayServer(self.relay_host, 0, target_port=target.port, pool_depth=self.pool_depth,
+                                    max_concurrency=self.max_concurrency, event_sink=sink)
+            relay.target = self.target_host
+            relay.target_computer_name = self.target_host
+            relay.start()
+            results = asyncio.run(self._drive(relay.listen_port))
+            relay_timings = relay.get_relay_timings()
+            phases = relay.get_phase_stats()
+        finally:
+            if relay:
+                relay.stop()
+            sink.stop()
+            target_loop.run(target.stop())
+            target_loop.stop()
+
+        expected = self.relays - bad
+        elapsed = results['elapsed_s']
+        return {
+            'relays': self.relays,
+            'concurrency': self.concurrency,
+            'succeeded': target.accepted,
+            'rejected': target.rejected,
+            'expected_successes': expected,
+            'expected_rejections': bad,
+            'success_rate': round(target.accepted / expected, 4) if expected else 0.0,
+            'errors': len(results['errors']),
+            'first_errors': results['errors'][:5],
+            'elapsed_s': round(elapsed, 3),
+            'relays_per_s': round(len(results['latencies']) / elapsed, 1) if elapsed else 0.0,
+            'latency': summarize_latencies(results['latencies']),
+            'connect_to_auth': relay_timings.get('inprocess', {}),
+            'phases': phases,
+            'sessions': sink.get_stats(),
+            'target_connections': target.connections,
+            'peak_rss_mb': peak_rss_mb(),
+        }
@@ -0,0 +1,327 @@
+import sys
+import time
+import signal
+import logging
+import functools
+import threading
+import multiprocessing
+from collections import namedtuple
+from multiprocessing.connection import wait
+from typing import Callable, Dict, List, Optional
+
+from src.modules.pipeline.records import END_OF_RECORDS, RecordStore, RecordWriter
+from src.utils.metrics import process_usage
+
+# A pipeline process: start(options, store) starts the subsystem with store in place of its
+# MongoDBHandler and returns the callable that stops it; block_timeout is the store's backpressure
+Subsystem = namedtuple('Subsystem', ['name', 'start', 'options', 'block_timeout'])
+
+STORAGE = 'storage'
+
+def start_responder(options: Dict, store: RecordStore) -> Callable[[], None]:
+    """Poisoners and capture servers of ResponderCapture"""
+    from src.modules.capture.responder import ResponderCapture
+    responder = ResponderCapture(store=store, **options)
+    responder.start_poisoning()
+    return responder.stop_poisoning
+
+def start_relay(options: Dict, store: RecordStore) -> Callable[[], None]:
+    """Relay with the keyword arguments of Relay plus 'target'"""
+    from src.modules.exploit.relay import Relay
+    options = dict(options)
+    target = options.pop('target', None)
+    relay = Relay(store=store, **options)
+    if target:
+        relay.set_target(target)
+    relay.start_relay()
+    return relay.stop_relay
+
+def start_sniffer(options: Dict, store: RecordStore) -> Callable[[], None]:
+    """PacketSniffer on options['interface']"""
+    from src.utils.packet_sniffer import PacketSniffer
+    sniffer = PacketSniffer(options['interface'], store=store)
+    sniffer.start()
+    return functools.partial(sniffer.stop, timeout=2.0)
+
+def open_mongodb(options: Dict):
+    """Storage backend of the daemon: (write(collection, documents), close)"""
+    from src.utils.mongo_handler import MongoDBHandler
+    handler = MongoDBHandler(**options)
+    return handler.store_raw, handler.disconnect
+
+def _configure_process(log_level: int, log_file: Optional[str]):
+    # Ctrl+C reaches the whole process group; the daemon decides the shutdown order
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    logging.basicConfig(level=log_level, handlers=handlers,
+                        format='%(asctime)s - %(levelname)s - %(processName)s - %(name)s - %(message)s')
+
+def _report(conn, kind: str, payload=None):
+    try:
+        conn.send((kind, payload))
+    except (OSError, EOFError):
+        pass  # The daemon is gone
+
+def _subsystem_main(subsystem: Subsystem, records, conn, log_level: int, log_file: Optional[str],
+                    metrics_interval: float):
+    """Entry point of a responder, relay or sniffer process"""
+    _configure_process(log_level, log_file)
+    # terminate() still stops the subsystem and flushes its records
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    store = RecordStore(records, subsystem.block_timeout)
+    try:
+        stop = subsystem.start(subsystem.options, store)
+    except Exception as e:
+        logging.getLogger(__name__).error(f"[-] {subsystem.name} failed to start: {e}", exc_info=True)
+        _report(conn, 'error', f"{type(e).__name__}: {e}")
+        return
+    _report(conn, 'ready')
+    try:
+        # The daemon asks a process to stop with a message on its pipe; EOF means the daemon is gone
+        while not conn.poll(metrics_interval):
+            _report(conn, 'metrics', dict(process_usage(), records=store.get_stats()))
+    finally:
+        try:
+            stop()
+        finally:
+            # Everything this process queued reaches the pipe before the storage process is told to finish
+            records.close()
+            records.join_thread()
+            _report(conn, 'metrics', dict(process_usage(), records=store.get_stats()))
+            _report(conn, 'stopped')
+
+def _storage_main(open_storage: Callable, options: Dict, records, conn, log_level: int,
+                  log_file: Optional[str], metrics_interval: float, batch_size: int):
+    """Entry point of the storage process: write records until END_OF_RECORDS"""
+    _configure_process(log_level, log_file)
+    try:
+        write, close = open_storage(options)
+    except Exception as e:
+        logging.getLogger(__name__).error(f"[-] Storage failed to start: {e}", exc_info=True)
+        _report(conn, 'error', f"{type(e).__name__}: {e}")
+        return
+    _report(conn, 'ready')
+    writer = RecordWriter(records, write, batch_size)
+    try:
+        reported = time.monotonic()
+        while writer.drain(timeout=metrics_interval):
+            if time.monotonic() - reported >= metrics_interval:
+                _report(conn, 'metrics', dict(process_usage(), storage=writer.get_stats()))
+                reported = time.monotonic()
+    finally:
+        close()
+        _report(conn, 'metrics', dict(process_usage(), storage=writer.get_stats()))
+        _report(conn, 'stopped')
+
+class _Process:
+    """A pipeline process as the daemon sees it"""
+
+    __slots__ = ('name', 'process', 'conn', 'stopping', 'metrics', 'sampled_at')
+
+    def __init__(self, name: str, process, conn):
+        self.name = name
+        self.process = process
+        self.conn = conn
+        # Set before the process is asked to stop, so its exit is not reported as a failure
+        self.stopping = False
+        self.metrics: Dict = {}
+        self.sampled_at: Optional[float] = None
+
+class PipelineDaemon:
+    """
+    Runs the pipeline subsystems and their storage as separate processes.
+
+    Each subsystem (responder, relay, sniffer) gets its own interpreter, so
+    a CPU spike in one, e.g. parsing in the relay, cannot delay the
+    poisoned answers of another; MongoDB is written by one storage process.
+    Subsystems send their captures and results as binary records (see
+    records.py) over one bounded queue, with per-subsystem backpressure.
+    A monitor thread waits on every process's status pipe and exit
+    sentinel: metrics (CPU time and percentage, RSS, record counters)
+    arrive every metrics_interval seconds, and a process that exits without
+    being asked to is reported to on_failure at once. Processes are
+    spawned, not forked, so each imports only its own stack. start_process()
+    and stop_process() are meant for a Supervisor, storage first on start
+    and last on stop (names() is that order), so it writes everything the
+    subsystems queued before they stopped.
+    """
+
+    def __init__(self, subsystems: List[Subsystem], storage=(open_mongodb, {}), queue_size: int = 10000,
+                 batch_size: int = 500, metrics_interval: float = 10.0, start_timeout: float = 60.0,
+                 stop_timeout: float = 10.0, on_failure: Callable[[str, BaseException], None] = None,
+                 log_level: int = logging.INFO, log_file: str = None):
+        self.logger = logging.getLogger(__name__)
+        self.subsystems = {subsystem.name: subsystem for subsystem in subsystems}
+        if STORAGE in self.subsystems:
+            raise ValueError(f"'{STORAGE}' is the name of the storage process")
+        self.storage = storage
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.metrics_interval = metrics_interval
+        self.start_timeout = start_timeout
+        self.stop_timeout = stop_timeout
+        self.on_failure = on_failure
+        self.log_level = log_level
+        self.log_file = log_file
+        self.context = multiprocessing.get_context('spawn')
+        self.records = None
+        self.processes: Dict[str, _Process] = {}
+        self.lock = threading.Lock()
+        self.monitor_thread: Optional[threading.Thread] = None
+        self.wakeup_read = self.wakeup_write = None
+
+    def names(self) -> List[str]:
+        """Process names in start order"""
+        return [STORAGE] + list(self.subsystems)
+
+    def open(self):
+        """Create the record queue and start the monitor thread"""
+        self.records = self.context.Queue(self.queue_size)
+        self.wakeup_read, self.wakeup_write = self.context.Pipe(duplex=False)
+        self.monitor_thread = threading.Thread(target=self._monitor, name='pipeline-monitor', daemon=True)
+        self.monitor_thread.start()
+
+    def start_process(self, name: str):
+        """Spawn one process and wait until it is ready"""
+        # Duplex: status messages come up, the stop request goes down. Not an Event, whose set() would
+        # wait forever for a process that died in wait()
+        conn, child_conn = self.context.Pipe()
+        if name == STORAGE:
+            open_storage, options = self.storage
+            target, args = _storage_main, (open_storage, options, self.records, child_conn, self.log_level,
+                                           self.log_file, self.metrics_interval, self.batch_size)
+        else:
+            target, args = _subsystem_main, (self.subsystems[name], self.records, child_conn, self.log_level,
+                                             self.log_file, self.metrics_interval)
+        process = self.context.Process(target=target, args=args, name=f"pipeline-{name}", daemon=True)
+        started = time.perf_counter()
+        process.start()
+        child_conn.close()
+        try:
+            if not conn.poll(self.start_timeout):
+                raise TimeoutError(f"{name} process not ready within {self.start_timeout}s")
+            kind, detail = conn.recv()
+        except EOFError:
+            process.join(self.stop_timeout)
+            raise RuntimeError(f"{name} process exited with code {process.exitcode} while starting")
+        except Exception:
+            process.terminate()
+            process.join(self.stop_timeout)
+            raise
+        if kind != 'ready':
+            process.join(self.stop_timeout)
+            raise RuntimeError(f"{name} process failed to start: {detail}")
+        with self.lock:
+            self.processes[name] = _Process(name, process, conn)
+        self.wakeup_write.send(True)
+        self.logger.info(f"[+] {name} process {process.pid} ready in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def stop_process(self, name: str):
+        """Stop one process: subsystems flush their records, storage writes what is queued"""
+        with self.lock:
+            entry = self.processes.get(name)
+        if entry is None:
+            return
+        entry.stopping = True
+        if name == STORAGE:
+            try:
+                self.records.put(END_OF_RECORDS, timeout=self.stop_timeout)
+            except Exception as e:
+                self.logger.warning(f"Could not ask storage to finish: {e}")
+        else:
+            _report(entry.conn, 'stop')
+        entry.process.join(self.stop_timeout)
+        if entry.process.is_alive():
+            self.logger.warning(f"[-] {name} process did not stop within {self.stop_timeout}s, terminating it")
+            entry.process.terminate()
+            entry.process.join(self.stop_timeout)
+        # Let the monitor read the final metrics before the summary
+        self._drain(entry)
+        metrics = entry.metrics
+        summary = f"cpu {metrics.get('cpu_user_s', 0) + metrics.get('cpu_system_s', 0):.2f} s, " \
+                  f"peak RSS {metrics.get('peak_rss_mb')} MiB"
+        if 'records' in metrics:
+            summary += f", {metrics['records']['sent']} records sent, {metrics['records']['dropped']} dropped"
+        if 'storage' in metrics:
+            summary += f", {metrics['storage']['written']} records written, {metrics['storage']['failed']} failed"
+        self.logger.info(f"[*] {name} process stopped ({summary})")
+
+    def _drain(self, entry: _Process):
+        with self.lock:
+            try:
+                while entry.conn.poll():
+                    self._on_message(entry, *entry.conn.recv())
+            except (EOFError, OSError):
+                pass
+
+    def _monitor(self):
+        while True:
+            with self.lock:
+                conns = {entry.conn: entry for entry in self.processes.values() if not entry.conn.closed}
+                sentinels = {entry.process.sentinel: entry for entry in self.processes.values()
+                             if entry.process.exitcode is None}
+            for ready in wait([self.wakeup_read, *conns, *sentinels]):
+                if ready is self.wakeup_read:
+                    if self.wakeup_read.recv() is None:
+                        return
+                elif ready in conns:
+                    with self.lock:
+                        try:
+                            # stop_process() may have read the message in the meantime
+                            if ready.poll():
+                                self._on_message(conns[ready], *ready.recv())
+                        except (EOFError, OSError):
+                            ready.close()
+                else:
+                    self._on_exit(sentinels[ready])
+
+    def _on_message(self, entry: _Process, kind: str, payload):
+        # Called with the lock held
+        if kind != 'metrics':
+            return
+        now = time.monotonic()
+        cpu = payload['cpu_user_s'] + payload['cpu_system_s']
+        if entry.sampled_at is not None:
+            previous = entry.metrics['cpu_user_s'] + entry.metrics['cpu_system_s']
+            payload['cpu_percent'] = round((cpu - previous) / max(now - entry.sampled_at, 1e-6) * 100, 1)
+        entry.metrics = payload
+        entry.sampled_at = now
+        self.logger.debug(f"{entry.name} process: {payload}")
+
+    def _on_exit(self, entry: _Process):
+        # The sentinel is ready once the child closed its descriptors, slightly before it can be reaped
+        entry.process.join(self.stop_timeout)
+        if entry.stopping:
+            return
+        error = RuntimeError(f"process {entry.process.pid} exited with code {entry.process.exitcode}")
+        self.logger.error(f"[-] {entry.name} {error}")
+        if self.on_failure:
+            self.on_failure(entry.name, error)
+
+    def get_stats(self) -> Dict:
+        """Per-process pid, state and latest metrics, and the records waiting for storage"""
+        with self.lock:
+            processes = {name: dict(entry.metrics, pid=entry.process.pid, alive=entry.process.is_alive())
+                         for name, entry in self.processes.items()}
+        try:
+            queued = self.records.qsize() if self.records else 0
+        except NotImplementedError:  # macOS
+            queued = None
+        return {'processes': processes, 'queued': queued}
+
+    def close(self):
+        """Stop the monitor and close the record queue; stop the processes first"""
+        if self.monitor_thread:
+            self.wakeup_write.send(None)
+            self.monitor_thread.join(self.stop_timeout)
+            self.monitor_thread = None
+        for name in reversed(self.names()):
+            entry = self.processes.pop(name, None)
+            if entry and entry.process.is_alive():
+                entry.process.terminate()
+                entry.process.join(self.stop_timeout)
+        if self.records:
+            self.records.close()
+            self.records = None
@@ -0,0 +1,180 @@
+import time
+import queue
+import struct
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import bson
+from bson.objectid import ObjectId
+
+# Record layout: format version, kind, then the BSON document
+RECORD_HEADER = struct.Struct('!BB')
+RECORD_VERSION = 1
+
+# Record kinds and the collection each one is stored in
+KIND_CAPTURE = 1
+KIND_RESULT = 2
+COLLECTIONS = {KIND_CAPTURE: 'captures', KIND_RESULT: 'results'}
+
+# Put on the record queue after the last producer stopped; the storage process exits once it reads it
+END_OF_RECORDS = b''
+
+def encode_record(kind: int, document: Dict) -> bytes:
+    """Pack a document into a record: two header bytes and its BSON encoding"""
+    return RECORD_HEADER.pack(RECORD_VERSION, kind) + bson.encode(document)
+
+def decode_record(record: bytes) -> Tuple[int, Dict]:
+    """Kind and document of a record, for readers that need the fields (the storage process does not)"""
+    version, kind = RECORD_HEADER.unpack_from(record)
+    if version != RECORD_VERSION:
+        raise ValueError(f"Unsupported record version {version}")
+    return kind, bson.decode(record[RECORD_HEADER.size:])
+
+class RecordStore:
+    """
+    Stands in for MongoDBHandler in a pipeline process.
+
+    The store_* calls of the responder, relay and sniffer become binary
+    records on the queue read by the storage process instead of MongoDB
+    round trips. Ids are ObjectIds made here, so a result can reference the
+    capture it belongs to before either is written. When the queue is full
+    a call waits up to block_timeout seconds (0: not at all) and then drops
+    the record, so a slow database slows producers down without ever
+    holding one indefinitely; sent, dropped and blocked time are counted.
+    """
+
+    def __init__(self, records, block_timeout: float = 1.0):
+        self.logger = logging.getLogger(__name__)
+        self.records = records
+        self.block_timeout = block_timeout
+        self.lock = threading.Lock()
+        self.counters = {'sent': 0, 'dropped': 0, 'failed': 0, 'bytes': 0, 'blocked_s': 0.0}
+
+    def _send(self, kind: int, document: Dict) -> Optional[str]:
+        document.setdefault('_id', ObjectId())
+        try:
+            record = encode_record(kind, document)
+        except (bson.InvalidDocument, OverflowError) as e:
+            self.logger.error(f"Cannot encode {COLLECTIONS[kind]} record: {e}")
+            with self.lock:
+                self.counters['failed'] += 1
+            return None
+        started = time.perf_counter()
+        try:
+            if self.block_timeout:
+                self.records.put(record, timeout=self.block_timeout)
+            else:
+                self.records.put_nowait(record)
+            outcome = 'sent'
+        except queue.Full:
+            outcome = 'dropped'
+        with self.lock:
+            self.counters[outcome] += 1
+            self.counters['blocked_s'] += time.perf_counter() - started
+            if outcome == 'sent':
+                self.counters['bytes'] += len(record)
+        if outcome == 'dropped':
+            self.logger.warning(f"Record queue full, dropped a {COLLECTIONS[kind]} record")
+            return None
+        return str(document['_id'])
+
+    def store_capture(self, capture_data: Dict) -> Optional[str]:
+        """Queue a capture record"""
+        capture_data['timestamp'] = datetime.now()
+        return self._send(KIND_CAPTURE, capture_data)
+
+    def store_result(self, result_data: Dict) -> Optional[str]:
+        """Queue a result record"""
+        result_data['timestamp'] = datetime.now()
+        return self._send(KIND_RESULT, result_data)
+
+    def store_results(self, results: List[Dict]) -> List[str]:
+        """Queue several result records"""
+        now = datetime.now()
+        ids = []
+        for result_data in results:
+            result_data.setdefault('timestamp', now)
+            record_id = self._send(KIND_RESULT, result_data)
+            if record_id:
+                ids.append(record_id)
+        return ids
+
+    def disconnect(self):
+        """Nothing to close; the queue is flushed when the process ends"""
+
+    def get_stats(self) -> Dict:
+        """Records sent, dropped on a full queue or not encodable, bytes sent and time spent waiting"""
+        with self.lock:
+            stats = dict(self.counters)
+        stats['blocked_s'] = round(stats['blocked_s'], 3)
+        return stats
+
+class RecordWriter:
+    """
+    Storage side of the pipeline: reads records in batches and writes them.
+
+    Each batch is split by collection and handed to write(collection,
+    documents) as raw BSON, which MongoDBHandler.store_raw() inserts
+    without decoding; the record kinds are the only part looked at.
+    """
+
+    def __init__(self, records, write: Callable[[str, List[bytes]], int], batch_size: int = 500):
+        self.logger = logging.getLogger(__name__)
+        self.records = records
+        self.write = write
+        self.batch_size = batch_size
+        self.counters = {'records': 0, 'written': 0, 'failed': 0, 'batches': 0, 'bytes': 0}
+
+    def drain(self, timeout: float = None) -> bool:
+        """Write the next batch, waiting up to timeout for its first record; False after END_OF_RECORDS"""
+        try:
+            record = self.records.get(timeout=timeout)
+        except queue.Empty:
+            return True
+        batch: Dict[str, List[bytes]] = {}
+        running = True
+        count = 0
+        while True:
+            if record == END_OF_RECORDS:
+                running = False
+                break
+            self._add(batch, record)
+            count += 1
+            if count >= self.batch_size:
+                break
+            try:
+                record = self.records.get_nowait()
+            except queue.Empty:
+                break
+        self._write(batch, count)
+        return running
+
+    def _add(self, batch: Dict[str, List[bytes]], record: bytes):
+        self.counters['records'] += 1
+        self.counters['bytes'] += len(record)
+        version, kind = RECORD_HEADER.unpack_from(record)
+        collection = COLLECTIONS.get(kind) if version == RECORD_VERSION else None
+        if collection is None:
+            self.logger.error(f"Dropping record of unknown version {version} or kind {kind}")
+            self.counters['failed'] += 1
+            return
+        batch.setdefault(collection, []).append(record[RECORD_HEADER.size:])
+
+    def _write(self, batch: Dict[str, List[bytes]], count: int):
+        if not count:
+            return
+        self.counters['batches'] += 1
+        for collection, documents in batch.items():
+            try:
+                written = self.write(collection, documents)
+            except Exception as e:
+                self.logger.error(f"Failed to write {len(documents)} {collection} records: {e}")
+                written = 0
+            self.counters['written'] += written
+            self.counters['failed'] += len(documents) - written
+
+    def get_stats(self) -> Dict:
+        """Records read and written, failures, batches and bytes read"""
+        return dict(self.counters)
@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Coroutine, Optional
+
+
+class EventLoopThread:
+    """Runs an asyncio event loop in a daemon thread for the threaded parts of the tool"""
+
+    def __init__(self, name: str = 'event-loop'):
+        self.logger = logging.getLogger(__name__)
+        self.name = name
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread: Optional[threading.Thread] = None
+        self._started = threading.Event()
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        """Start the loop thread and return the running loop"""
+        if self.thread and self.thread.is_alive():
+            return self.loop
+        self.loop = asyncio.new_event_loop()
+        self._started.clear()
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+        self._started.wait()
+        return self.loop
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._started.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            try:
+                pending = asyncio.all_tasks(self.loop)
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+                self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            finally:
+                self.loop.close()
+
+    def submit(self, coro: Coroutine):
+        """Schedule a coroutine on the loop and return a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: float = None) -> Any:
+        """Run a coroutine on the loop and wait for its result"""
+        return self.submit(coro).result(timeout)
+
+    def is_running(self) -> bool:
+        return bool(self.thread and self.thread.is_alive())
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the loop, cancelling any task still running on it"""
+        if not self.is_running():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            self.logger.warning(f"Event loop thread {self.name} did not stop within {timeout}s")
+        self.thread = None
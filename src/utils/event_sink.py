@@ -0,0 +1,116 @@
+import time
+import queue
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+class EventSink:
+    """
+    Non-blocking hand-off of records to a slow consumer.
+
+    emit() only puts the record on a bounded queue, so the caller (an event
+    loop, a relay) never waits on storage; one writer thread passes the
+    records to consumer in order. When the writer falls behind by max_queued
+    records, new ones are dropped and counted instead of blocking. With a
+    batch_size the consumer gets lists of up to batch_size records instead,
+    flushed when full or flush_interval seconds after their first record.
+    """
+
+    def __init__(self, consumer: Callable[[Any], Any], max_queued: int = 10000, name: str = 'event-sink',
+                 batch_size: int = None, flush_interval: float = 1.0):
+        self.logger = logging.getLogger(__name__)
+        self.consumer = consumer
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.records: queue.Queue = queue.Queue(max_queued)
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+        self.counters = {'emitted': 0, 'written': 0, 'dropped': 0, 'failed': 0, 'batches': 0}
+
+    def start(self):
+        """Start the writer thread"""
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self._write, name=self.name, daemon=True)
+            self.thread.start()
+
+    def emit(self, record: Dict) -> bool:
+        """Queue a record for the consumer; False if it was dropped"""
+        if self.thread is None:
+            self.start()
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            with self.lock:
+                self.counters['dropped'] += 1
+            return False
+        with self.lock:
+            self.counters['emitted'] += 1
+        return True
+
+    def _write(self):
+        if self.batch_size:
+            self._write_batches()
+            return
+        while True:
+            record = self.records.get()
+            if record is None:
+                break
+            self._consume(record, 1)
+
+    def _write_batches(self):
+        stopping = False
+        while not stopping:
+            record = self.records.get()
+            if record is None:
+                break
+            batch: List = [record]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    record = self.records.get(timeout=remaining) if remaining > 0 else self.records.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    stopping = True
+                    break
+                batch.append(record)
+            self._consume(batch, len(batch))
+
+    def _consume(self, item, count: int):
+        try:
+            self.consumer(item)
+            outcome = 'written'
+        except Exception as e:
+            self.logger.error(f"Failed to write {count} {self.name} record(s): {e}")
+            outcome = 'failed'
+        with self.lock:
+            self.counters[outcome] += count
+            if self.batch_size:
+                self.counters['batches'] += 1
+
+    def stop(self, timeout: float = 5.0):
+        """Write what is queued, then stop the writer"""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is None:
+            return
+        # The stop marker waits for a free slot like any record
+        try:
+            self.records.put(None, timeout=timeout)
+        except queue.Full:
+            self.logger.warning(f"{self.name} is still {self.records.qsize()} records behind, not waiting")
+            return
+        thread.join(timeout)
+        if thread.is_alive():
+            self.logger.warning(f"{self.name} did not finish writing within {timeout}s")
+
+    def get_stats(self) -> Dict:
+        """Emitted/written/dropped/failed record counters, batches written and the current backlog"""
+        with self.lock:
+            stats = dict(self.counters)
+        stats['queued'] = self.records.qsize()
+        return stats
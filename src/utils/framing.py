@@ -0,0 +1,301 @@
+import os
+import socket
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Optional, Tuple
+
+from src.utils.smb2 import NETBIOS_HEADER_SIZE
+
+# Receive buffer size; NEGOTIATE and NTLMSSP SESSION_SETUP requests fit several times over
+DEFAULT_BUFFER_SIZE = 16 * 1024
+
+# Largest NetBIOS payload accepted (the header allows 16 MB; Kerberos tokens stay well below 1 MB)
+MAX_FRAME_SIZE = 1024 * 1024
+
+class FrameTooLarge(ConnectionError):
+    """The peer announced a NetBIOS payload larger than max_frame"""
+
+class BufferPool:
+    """Free list of equally sized receive buffers shared by the connections of a server"""
+
+    def __init__(self, size: int = DEFAULT_BUFFER_SIZE, max_free: int = 1024):
+        self.size = size
+        self.max_free = max_free
+        self.free = deque()
+        self.lock = threading.Lock()
+        self.allocated = 0
+
+    def acquire(self) -> bytearray:
+        """Take a buffer from the pool, allocating one if it is empty"""
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+            self.allocated += 1
+        return bytearray(self.size)
+
+    def release(self, buffer: bytearray):
+        """Return a buffer; grown buffers are dropped"""
+        if len(buffer) != self.size:
+            return
+        with self.lock:
+            if len(self.free) < self.max_free:
+                self.free.append(buffer)
+
+class FramedConnection(asyncio.BufferedProtocol):
+    """
+    NetBIOS session service framing on a pooled receive buffer.
+
+    The transport recv_into()s straight into a buffer taken from a BufferPool
+    and read_frame() returns each message as a memoryview of that buffer, so
+    no bytes are copied or allocated per message. TCP may split or merge
+    messages; frames are cut by the 4 byte NetBIOS header only. A frame
+    returned by read_frame() stays valid until the next read_frame() call,
+    handlers copy what they need to keep. Frames longer than the buffer grow
+    it up to max_frame, larger ones fail with FrameTooLarge. peek(),
+    read_until() and discard() read unframed protocols on the same buffer,
+    so a server can sniff the first bytes before choosing how to read.
+
+    The object is also the writer: write(), drain(), close() and
+    get_extra_info() behave like asyncio.StreamWriter. detach() hands the
+    socket over to code outside the event loop.
+    """
+
+    def __init__(self, handler: Callable[['FramedConnection'], Awaitable[None]],
+                 buffer_pool: BufferPool, max_frame: int = MAX_FRAME_SIZE):
+        self.logger = logging.getLogger(__name__)
+        self.handler = handler
+        self.buffer_pool = buffer_pool
+        self.max_frame = max_frame
+        self.transport: Optional[asyncio.Transport] = None
+        self.buffer: Optional[bytearray] = None
+        self.view: Optional[memoryview] = None
+        # Unread data is buffer[start:end]; the frame handed out last is buffer[held:start]
+        self.start = 0
+        self.end = 0
+        self.held = None
+        self.eof = False
+        self.reading_paused = False
+        self.writing_paused = False
+        self.read_waiter: Optional[asyncio.Future] = None
+        self.drain_waiter: Optional[asyncio.Future] = None
+        self.task: Optional[asyncio.Task] = None
+
+    # Protocol callbacks
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self.buffer = self.buffer_pool.acquire()
+        self.view = memoryview(self.buffer)
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        try:
+            await self.handler(self)
+        finally:
+            self.transport.close()
+            # The handler is done with its frames, the buffer can serve another connection
+            self.view.release()
+            self.buffer_pool.release(self.buffer)
+            self.view = self.buffer = None
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if self.end == len(self.buffer):
+            self._make_room()
+        return self.view[self.end:]
+
+    def buffer_updated(self, nbytes: int):
+        self.end += nbytes
+        if self.end == len(self.buffer) and not self._make_room():
+            # Full of frames the handler has not read yet
+            self.transport.pause_reading()
+            self.reading_paused = True
+        self._wake_reader()
+
+    def eof_received(self):
+        self.eof = True
+        self._wake_reader()
+
+    def connection_lost(self, exc: Optional[Exception]):
+        self.eof = True
+        self._wake_reader()
+        if self.drain_waiter and not self.drain_waiter.done():
+            self.drain_waiter.set_exception(exc or ConnectionResetError("Connection lost"))
+
+    def pause_writing(self):
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+        if self.drain_waiter and not self.drain_waiter.done():
+            self.drain_waiter.set_result(None)
+
+    def _wake_reader(self):
+        if self.read_waiter and not self.read_waiter.done():
+            self.read_waiter.set_result(None)
+
+    # Buffer management
+
+    def _pending_frame_size(self) -> Optional[int]:
+        if self.end - self.start < NETBIOS_HEADER_SIZE:
+            return None
+        buffer, start = self.buffer, self.start
+        return NETBIOS_HEADER_SIZE + (buffer[start + 1] << 16 | buffer[start + 2] << 8 | buffer[start + 3])
+
+    def _make_room(self) -> bool:
+        """Free space at the end of the buffer without moving the frame the handler holds"""
+        if self.held is not None:
+            return False
+        if self.start:
+            remaining = self.end - self.start
+            self.view[:remaining] = self.view[self.start:self.end]
+            self.start, self.end = 0, remaining
+            return self.end < len(self.buffer)
+        size = self._pending_frame_size()
+        if size is None or size <= len(self.buffer) or size > self.max_frame + NETBIOS_HEADER_SIZE:
+            return False
+        # One frame larger than the buffer: move it to a bigger one
+        grown = bytearray(max(size, 2 * len(self.buffer)))
+        grown[:self.end] = self.view[:self.end]
+        self.view.release()
+        self.buffer_pool.release(self.buffer)
+        self.buffer, self.view = grown, memoryview(grown)
+        return True
+
+    # Reader side
+
+    async def read_frame(self) -> Tuple[int, memoryview]:
+        """Read one NetBIOS session service message, returning (type, payload view)"""
+        self.held = None
+        while True:
+            size = self._pending_frame_size()
+            if size is not None:
+                if size > self.max_frame + NETBIOS_HEADER_SIZE:
+                    raise FrameTooLarge(f"NetBIOS frame of {size - NETBIOS_HEADER_SIZE} bytes")
+                if self.end - self.start >= size:
+                    self.held = self.start
+                    self.start += size
+                    return self.buffer[self.held], self.view[self.held + NETBIOS_HEADER_SIZE:self.start]
+            if size is None or self.start + size > len(self.buffer):
+                self._make_room()
+            await self._receive(size or NETBIOS_HEADER_SIZE)
+
+    async def peek(self, size: int) -> bytes:
+        """Wait for size bytes (fewer if the peer closes first) and return them without consuming them"""
+        self.held = None
+        while self.end - self.start < size and not self.eof:
+            await self._receive(size)
+        return bytes(self.view[self.start:min(self.end, self.start + size)])
+
+    async def read_until(self, separator: bytes, limit: int = DEFAULT_BUFFER_SIZE) -> memoryview:
+        """
+        Read up to and including separator, like StreamReader.readuntil().
+
+        The view stays valid until the next read; limit is capped at the
+        buffer size, longer data raises asyncio.LimitOverrunError.
+        """
+        self.held = None
+        limit = min(limit, len(self.buffer))
+        # Searched bytes, relative to start as _make_room() moves the data
+        searched = 0
+        while True:
+            index = self.buffer.find(separator, self.start + searched, self.end)
+            if index != -1:
+                self.held = self.start
+                self.start = index + len(separator)
+                return self.view[self.held:self.start]
+            if self.end - self.start >= limit:
+                raise asyncio.LimitOverrunError(f"No {separator!r} within {limit} bytes", self.end - self.start)
+            searched = max(0, self.end - self.start - len(separator) + 1)
+            if self.end == len(self.buffer):
+                self._make_room()
+            await self._receive(self.end - self.start + len(separator))
+
+    async def discard(self, size: int):
+        """Consume size bytes without reading them, e.g. an HTTP request body"""
+        self.held = None
+        while True:
+            skipped = min(size, self.end - self.start)
+            self.start += skipped
+            size -= skipped
+            if not size:
+                return
+            self._make_room()
+            await self._receive(size)
+
+    async def _receive(self, expected: int):
+        """Wait for more data; expected is reported if the peer closed instead"""
+        if self.reading_paused and self.end < len(self.buffer):
+            self.reading_paused = False
+            self.transport.resume_reading()
+        if self.eof:
+            raise asyncio.IncompleteReadError(bytes(self.view[self.start:self.end]), expected)
+        self.read_waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self.read_waiter
+        finally:
+            self.read_waiter = None
+
+    # Writer side
+
+    def write(self, data):
+        self.transport.write(data)
+
+    async def drain(self):
+        if self.transport.is_closing():
+            raise ConnectionResetError("Connection lost")
+        if not self.writing_paused:
+            return
+        self.drain_waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self.drain_waiter
+        finally:
+            self.drain_waiter = None
+
+    def close(self):
+        self.transport.close()
+
+    async def detach(self) -> Tuple[socket.socket, bytes]:
+        """
+        Take the socket away from asyncio once everything written has been sent.
+
+        Returns a blocking duplicate of the socket and the bytes received but
+        not read as frames yet; the connection is closed afterwards.
+        """
+        self.transport.set_write_buffer_limits(0)
+        await self.drain()
+        sock = self.transport.get_extra_info('socket')
+        detached = socket.socket(sock.family, sock.type, sock.proto, fileno=os.dup(sock.fileno()))
+        detached.setblocking(True)
+        unread = bytes(self.view[self.start:self.end])
+        self.start = self.end
+        self.transport.abort()
+        return detached, unread
+
+    def get_extra_info(self, name: str, default=None):
+        return self.transport.get_extra_info(name, default)
+
+async def start_framed_server(handler: Callable[[FramedConnection], Awaitable[None]],
+                              host: str = None, port: int = None, sock=None, backlog: int = 100,
+                              buffer_pool: BufferPool = None,
+                              max_frame: int = MAX_FRAME_SIZE) -> asyncio.AbstractServer:
+    """
+    Start a TCP server running handler(connection) for every FramedConnection.
+
+    Args:
+        handler: Coroutine function serving one connection
+        host (str): Address to listen on (ignored with sock)
+        port (int): Port to listen on (ignored with sock)
+        sock: Already bound listening socket
+        backlog (int): Listen backlog
+        buffer_pool (BufferPool): Receive buffers to draw from, a new pool by default
+        max_frame (int): Largest NetBIOS payload accepted
+
+    Returns:
+        asyncio.AbstractServer: The listening server
+    """
+    buffer_pool = buffer_pool or BufferPool()
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(lambda: FramedConnection(handler, buffer_pool, max_frame),
+                                    host, port, sock=sock, backlog=backlog)
@@ -0,0 +1,112 @@
+import os
+import sys
+import math
+import bisect
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Upper bounds of the latency histogram buckets, in seconds (1 ms to 30 s, then overflow)
+HISTOGRAM_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def summarize_latencies(values: Iterable[float]) -> Dict[str, float]:
+    """Summarize latencies in seconds as milliseconds (count, mean, p50, p95, p99, max)"""
+    ordered = sorted(values)
+    if not ordered:
+        return {'count': 0, 'mean_ms': 0.0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MiB, None where getrusage is unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def current_rss_mb() -> Optional[float]:
+    """Resident set size of this process in MiB from /proc (Linux), else the peak"""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+    return round(pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+
+def process_usage() -> Dict[str, Optional[float]]:
+    """CPU seconds used by this process so far and its current and peak RSS in MiB"""
+    times = os.times()
+    rss, peak = current_rss_mb(), peak_rss_mb()
+    return {
+        'cpu_user_s': round(times.user, 3),
+        'cpu_system_s': round(times.system, 3),
+        'rss_mb': rss,
+        # ru_maxrss is only updated now and then and can trail the current size
+        'peak_rss_mb': max(rss, peak) if rss is not None and peak is not None else peak,
+    }
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram.
+
+    Memory does not grow with the number of observations, so a long-running
+    process can keep one per target and phase; percentiles are the upper
+    bound of the bucket holding the rank (the maximum in the overflow bucket).
+    """
+
+    def __init__(self, bounds=HISTOGRAM_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, fraction: float) -> float:
+        """Approximate quantile in seconds"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict:
+        """Summary in milliseconds plus the non-empty buckets keyed by upper bound ('le_<ms>')"""
+        buckets = {f"le_{bound * 1000:g}ms": count for bound, count in zip(self.bounds, self.counts) if count}
+        if self.counts[-1]:
+            buckets['inf'] = self.counts[-1]
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            'p50_ms': round(self.quantile(0.50) * 1000, 3),
+            'p95_ms': round(self.quantile(0.95) * 1000, 3),
+            'p99_ms': round(self.quantile(0.99) * 1000, 3),
+            'max_ms': round(self.max * 1000, 3),
+            'buckets': buckets,
+        }
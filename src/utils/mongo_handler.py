@@ -7,6 +7,7 @@ from typing import Optional, Dict, List, Any
 from configparser import ConfigParser
 from pymongo import MongoClient, errors
 from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
 
 class MongoDBHandler:
     def __init__(self, config_path: str = None, max_retries: int = 3, retry_delay: int = 2):
@@ -123,6 +124,32 @@ class MongoDBHandler:
             self.logger.error(f"Failed to store result: {e}")
             return None
 
+    def store_results(self, results: List[Dict]) -> List[str]:
+        """Store several execution results with one insert_many round trip"""
+        if not results:
+            return []
+        try:
+            now = datetime.now()
+            for result_data in results:
+                result_data.setdefault('timestamp', now)
+            result = self.results.insert_many(results, ordered=False)
+            return [str(inserted_id) for inserted_id in result.inserted_ids]
+        except Exception as e:
+            self.logger.error(f"Failed to store {len(results)} results: {e}")
+            return []
+
+    def store_raw(self, collection: str, documents: List[bytes]) -> int:
+        """Insert already BSON-encoded documents, carrying their own _id, without decoding them"""
+        if not documents:
+            return 0
+        try:
+            result = self.db[collection].insert_many([RawBSONDocument(document) for document in documents],
+                                                     ordered=False)
+            return len(result.inserted_ids)
+        except Exception as e:
+            self.logger.error(f"Failed to store {len(documents)} {collection} records: {e}")
+            return 0
+
     def get_captures(self, query: Dict = None) -> List[Dict]:
         """Retrieve capture records with optional query"""
         try:
@@ -0,0 +1,173 @@
+import time
+import socket
+import logging
+import ipaddress
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, Dict, Optional, Tuple
+
+# Seconds an answer is kept; failed lookups are retried sooner
+POSITIVE_TTL = 300.0
+NEGATIVE_TTL = 30.0
+
+# NetBIOS node status queries are UDP round trips to the target itself
+NETBIOS_TIMEOUT = 1.0
+
+ADDRESS = 'address'
+NETBIOS_NAME = 'netbios'
+
+def is_ip_address(value: str) -> bool:
+    try:
+        ipaddress.ip_address(value)
+        return True
+    except ValueError:
+        return False
+
+def lookup_address(host: str) -> Optional[str]:
+    """IPv4 address of a host name, None if it does not resolve"""
+    try:
+        return socket.gethostbyname(host)
+    except (socket.gaierror, UnicodeError):
+        return None
+
+def lookup_netbios_name(ip: str, timeout: float = NETBIOS_TIMEOUT) -> Optional[str]:
+    """NetBIOS server name of ip from a node status query, None if it does not answer"""
+    from impacket import nmb
+    netbios = nmb.NetBIOS()
+    netbios.set_timeout(timeout)
+    try:
+        return netbios.getnetbiosname(ip) or None
+    except Exception:
+        return None
+
+class _Entry:
+    __slots__ = ('value', 'expires')
+
+    def __init__(self, value: Optional[str], expires: float):
+        self.value = value
+        self.expires = expires
+
+class NameResolver:
+    """
+    Process-wide cache of target addresses and NetBIOS names.
+
+    Lookups run on a few background threads and return futures; concurrent
+    requests for the same name share one lookup. Answers are kept for
+    positive_ttl seconds and failures (None) for negative_ttl seconds.
+    prefetch() warms both entries of a target as soon as it is configured,
+    and cached_name() never waits: it returns what is known, stale or not,
+    and refreshes missing or expired names in the background.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, positive_ttl: float = POSITIVE_TTL, negative_ttl: float = NEGATIVE_TTL,
+                 workers: int = 4, address_lookup: Callable[[str], Optional[str]] = lookup_address,
+                 name_lookup: Callable[[str], Optional[str]] = lookup_netbios_name,
+                 clock: Callable[[], float] = time.monotonic):
+        self.logger = logging.getLogger(__name__)
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.lookups = {ADDRESS: address_lookup, NETBIOS_NAME: name_lookup}
+        self.clock = clock
+        self.entries: Dict[Tuple[str, str], _Entry] = {}
+        self.inflight: Dict[Tuple[str, str], Future] = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='name-resolver')
+        self.counters = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'lookups': 0, 'failures': 0}
+
+    @classmethod
+    def shared(cls) -> 'NameResolver':
+        """Return the process-wide resolver"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def _resolve(self, kind: str, key: str) -> Future:
+        cache_key = (kind, key.lower())
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry and entry.expires > self.clock():
+                self.counters['hits' if entry.value is not None else 'negative_hits'] += 1
+                future = Future()
+                future.set_result(entry.value)
+                return future
+            self.counters['misses'] += 1
+            future = self.inflight.get(cache_key)
+            if future is None:
+                future = self.executor.submit(self._lookup, kind, key, cache_key)
+                self.inflight[cache_key] = future
+            return future
+
+    def _lookup(self, kind: str, key: str, cache_key: Tuple[str, str]) -> Optional[str]:
+        try:
+            value = self.lookups[kind](key)
+        except Exception as e:
+            self.logger.debug(f"{kind} lookup of {key} failed: {e}")
+            value = None
+        ttl = self.positive_ttl if value is not None else self.negative_ttl
+        with self.lock:
+            self.entries[cache_key] = _Entry(value, self.clock() + ttl)
+            self.inflight.pop(cache_key, None)
+            self.counters['lookups'] += 1
+            if value is None:
+                self.counters['failures'] += 1
+        return value
+
+    def address(self, host: str) -> Future:
+        """Future of the IPv4 address of host (None if it does not resolve); IP addresses resolve at once"""
+        if is_ip_address(host):
+            future = Future()
+            future.set_result(host)
+            return future
+        return self._resolve(ADDRESS, host)
+
+    def resolve_address(self, host: str, timeout: float = 5.0) -> Optional[str]:
+        """IPv4 address of host, waiting at most timeout seconds for an uncached name"""
+        try:
+            return self.address(host).result(timeout)
+        except FutureTimeout:
+            self.logger.warning(f"Resolving {host} timed out after {timeout}s")
+            return None
+
+    def netbios_name(self, ip: str) -> Future:
+        """Future of the NetBIOS name of ip, None if it does not answer"""
+        return self._resolve(NETBIOS_NAME, ip)
+
+    def cached_name(self, ip: str) -> Optional[str]:
+        """Known NetBIOS name of ip without waiting; a missing or expired name is looked up in the background"""
+        with self.lock:
+            entry = self.entries.get((NETBIOS_NAME, ip.lower()))
+        if entry is None or entry.expires <= self.clock():
+            self.netbios_name(ip)
+        return entry.value if entry else None
+
+    def prefetch(self, host: str) -> Future:
+        """Resolve host and then its NetBIOS name in the background; returns the address future"""
+        future = self.address(host)
+
+        def resolved(done: Future):
+            if done.result():
+                self.netbios_name(done.result())
+
+        future.add_done_callback(resolved)
+        return future
+
+    def invalidate(self, key: str = None):
+        """Forget the entries of one host or address, or everything"""
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+                return
+            for kind in self.lookups:
+                self.entries.pop((kind, key.lower()), None)
+
+    def get_stats(self) -> Dict:
+        """Hit/miss counters and cache size"""
+        with self.lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self.entries)
+            stats['inflight'] = len(self.inflight)
+        return stats
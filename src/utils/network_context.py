@@ -0,0 +1,287 @@
+import socket
+import struct
+import logging
+import ipaddress
+import threading
+from collections import namedtuple
+from typing import Callable, Dict, List, Optional
+
+InterfaceAddress = namedtuple('InterfaceAddress', ['name', 'address', 'prefixlen'])
+
+# rtnetlink constants (linux/netlink.h, linux/rtnetlink.h, linux/if_addr.h)
+NETLINK_ROUTE = 0
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x01
+NLM_F_DUMP = 0x300
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTMGRP_LINK = 0x01
+RTMGRP_IPV4_IFADDR = 0x10
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+
+_NLMSGHDR = struct.Struct('=IHHII')
+_IFADDRMSG = struct.Struct('=BBBBI')
+_RTATTR = struct.Struct('=HH')
+
+def _align(length: int) -> int:
+    return (length + 3) & ~3
+
+def parse_netlink_addresses(data: bytes) -> List[InterfaceAddress]:
+    """Parse RTM_NEWADDR messages from an rtnetlink buffer into IPv4 interface addresses"""
+    addresses = []
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, msg_type, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+        if length < _NLMSGHDR.size:
+            break
+        if msg_type == RTM_NEWADDR:
+            body = offset + _NLMSGHDR.size
+            family, prefixlen, _, _, index = _IFADDRMSG.unpack_from(data, body)
+            if family == socket.AF_INET:
+                attrs = {}
+                position = body + _IFADDRMSG.size
+                end = offset + length
+                while position + _RTATTR.size <= end:
+                    attr_length, attr_type = _RTATTR.unpack_from(data, position)
+                    if attr_length < _RTATTR.size:
+                        break
+                    attrs[attr_type] = data[position + _RTATTR.size:position + attr_length]
+                    position += _align(attr_length)
+                raw = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+                if raw and len(raw) == 4:
+                    if IFA_LABEL in attrs:
+                        name = attrs[IFA_LABEL].rstrip(b'\x00').decode('utf-8', 'replace')
+                    else:
+                        try:
+                            name = socket.if_indextoname(index)
+                        except OSError:
+                            name = str(index)
+                    addresses.append(InterfaceAddress(name, socket.inet_ntoa(raw), prefixlen))
+        offset += _align(length)
+    return addresses
+
+def load_netlink_addresses() -> List[InterfaceAddress]:
+    """Dump the IPv4 addresses of all interfaces over rtnetlink (Linux)"""
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    try:
+        sock.bind((0, 0))
+        request = _NLMSGHDR.pack(_NLMSGHDR.size + _IFADDRMSG.size, RTM_GETADDR,
+                                 NLM_F_REQUEST | NLM_F_DUMP, 1, 0)
+        sock.send(request + _IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0))
+        addresses = []
+        while True:
+            data = sock.recv(65536)
+            addresses.extend(parse_netlink_addresses(data))
+            done = False
+            offset = 0
+            while offset + _NLMSGHDR.size <= len(data):
+                length, msg_type, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+                if msg_type in (NLMSG_DONE, NLMSG_ERROR):
+                    done = True
+                if length < _NLMSGHDR.size:
+                    break
+                offset += _align(length)
+            if done:
+                return addresses
+    finally:
+        sock.close()
+
+def load_psutil_addresses() -> List[InterfaceAddress]:
+    """Read the IPv4 addresses of all interfaces through psutil (Windows/macOS)"""
+    import psutil
+    addresses = []
+    for name, addrs in psutil.net_if_addrs().items():
+        for addr in addrs:
+            if addr.family == socket.AF_INET:
+                prefixlen = 32
+                if addr.netmask:
+                    prefixlen = ipaddress.IPv4Network(f"0.0.0.0/{addr.netmask}").prefixlen
+                addresses.append(InterfaceAddress(name, addr.address, prefixlen))
+    return addresses
+
+def _is_ip_address(value: str) -> bool:
+    try:
+        socket.inet_aton(value)
+        return value.count('.') == 3
+    except (OSError, TypeError):
+        return False
+
+def _usable(address: str) -> bool:
+    return not address.startswith('169.254.')
+
+class NetworkContext:
+    """
+    Process-wide cache of interface addresses.
+
+    Addresses are loaded once (rtnetlink on Linux, psutil elsewhere) and
+    shared by the responder and the relay through NetworkContext.shared().
+    On Linux a watcher thread subscribed to rtnetlink address/link
+    notifications reloads the cache when addresses change; elsewhere call
+    refresh() explicitly.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, loader: Callable[[], List[InterfaceAddress]] = None):
+        self.logger = logging.getLogger(__name__)
+        if loader is None:
+            loader = load_netlink_addresses if hasattr(socket, 'AF_NETLINK') else load_psutil_addresses
+        self.loader = loader
+        self.lock = threading.Lock()
+        self.addresses: Optional[List[InterfaceAddress]] = None
+        self.version = 0
+        self.listeners = []
+        self.watch_thread = None
+        self.watch_socket = None
+
+    @classmethod
+    def shared(cls) -> 'NetworkContext':
+        """Return the process-wide context, watching for address changes where supported"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+                cls._shared.start_watching()
+            return cls._shared
+
+    def refresh(self) -> List[InterfaceAddress]:
+        """Reload the interface addresses and notify listeners"""
+        try:
+            addresses = self.loader()
+        except Exception as e:
+            self.logger.error(f"Failed to load interface addresses: {e}")
+            addresses = []
+        with self.lock:
+            changed = self.addresses is not None and addresses != self.addresses
+            self.addresses = addresses
+            self.version += 1
+        if changed:
+            self.logger.info("Interface addresses changed")
+            for listener in list(self.listeners):
+                try:
+                    listener(self)
+                except Exception as e:
+                    self.logger.error(f"Error in network change listener: {e}")
+        return addresses
+
+    def get_addresses(self) -> List[InterfaceAddress]:
+        """Return the cached interface addresses, loading them on first use"""
+        addresses = self.addresses
+        if addresses is None:
+            addresses = self.refresh()
+        return addresses
+
+    def add_listener(self, listener: Callable[['NetworkContext'], None]):
+        """Call listener(context) whenever the addresses change"""
+        self.listeners.append(listener)
+
+    def interfaces(self) -> Dict[str, List[InterfaceAddress]]:
+        """Group the cached addresses by interface name"""
+        grouped = {}
+        for entry in self.get_addresses():
+            grouped.setdefault(entry.name, []).append(entry)
+        return grouped
+
+    def interface_addresses(self, interface: str) -> List[InterfaceAddress]:
+        """
+        Addresses of an interface, matched exactly first and then case-insensitively by substring.
+        An IP address selects the interface it is assigned to.
+        """
+        interfaces = self.interfaces()
+        if _is_ip_address(interface):
+            for entries in interfaces.values():
+                if any(entry.address == interface for entry in entries):
+                    return entries
+            return []
+        if interface in interfaces:
+            return interfaces[interface]
+        wanted = interface.lower()
+        for name, entries in interfaces.items():
+            if wanted in name.lower():
+                return entries
+        return []
+
+    def primary_ip(self) -> str:
+        """First non-loopback, non-APIPA IPv4 address (a loopback address if that is all there is)"""
+        loopback = None
+        for entry in self.get_addresses():
+            if not _usable(entry.address):
+                continue
+            if entry.address.startswith('127.'):
+                loopback = loopback or entry.address
+                continue
+            return entry.address
+        return loopback or '0.0.0.0'
+
+    def resolve(self, interface: str, fallback: str = None) -> str:
+        """
+        Resolve an interface name (or IP address) to an IPv4 address.
+
+        IP addresses, including 0.0.0.0, are returned unchanged. Unknown
+        interfaces, or interfaces with only APIPA addresses, resolve to
+        fallback, or to primary_ip() when no fallback is given.
+        """
+        if _is_ip_address(interface):
+            return interface
+        for entry in self.interface_addresses(interface):
+            if _usable(entry.address):
+                self.logger.info(f"Resolved interface '{interface}' to IP: {entry.address}")
+                return entry.address
+        result = fallback if fallback is not None else self.primary_ip()
+        self.logger.warning(f"Could not find a suitable IPv4 address for interface '{interface}', using {result}")
+        return result
+
+    def networks(self, interface: str) -> List[ipaddress.IPv4Network]:
+        """Directly connected IPv4 networks of an interface"""
+        return [ipaddress.ip_network(f"{entry.address}/{entry.prefixlen}", strict=False)
+                for entry in self.interface_addresses(interface) if _usable(entry.address)]
+
+    def start_watching(self):
+        """Subscribe to rtnetlink address notifications (Linux only)"""
+        if not hasattr(socket, 'AF_NETLINK') or self.watch_thread:
+            return
+        sock = None
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+            # Port id 0: the kernel assigns one that is unique among all netlink sockets
+            sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+        except OSError as e:
+            if sock is not None:
+                sock.close()
+            self.logger.warning(f"Address change notifications unavailable: {e}")
+            return
+        self.watch_socket = sock
+        self.watch_thread = threading.Thread(target=self._watch, name='network-context', daemon=True)
+        self.watch_thread.start()
+
+    def _watch(self):
+        sock = self.watch_socket
+        while self.watch_socket is not None:
+            try:
+                sock.settimeout(None)
+                sock.recv(65536)
+                # Coalesce bursts of notifications into a single reload
+                sock.settimeout(0.1)
+                while True:
+                    sock.recv(65536)
+            except socket.timeout:
+                pass
+            except OSError:
+                break
+            if self.addresses is not None:
+                self.refresh()
+
+    def stop_watching(self):
+        """Stop the notification watcher"""
+        sock, self.watch_socket = self.watch_socket, None
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        self.watch_thread = None
@@ -0,0 +1,259 @@
+import os
+import re
+import hmac
+import time
+import struct
+from typing import Dict, Optional, Union
+
+from Crypto.Hash import MD4
+
+NTLMSSP_SIGNATURE = b'NTLMSSP\x00'
+
+NTLM_NEGOTIATE = 1
+NTLM_CHALLENGE = 2
+NTLM_AUTHENTICATE = 3
+
+# Negotiate flags (MS-NLMP 2.2.2.5)
+NTLMSSP_NEGOTIATE_UNICODE = 0x00000001
+NTLMSSP_REQUEST_TARGET = 0x00000004
+NTLMSSP_NEGOTIATE_NTLM = 0x00000200
+NTLMSSP_NEGOTIATE_ALWAYS_SIGN = 0x00008000
+NTLMSSP_TARGET_TYPE_DOMAIN = 0x00010000
+NTLMSSP_NEGOTIATE_EXTENDED_SESSIONSECURITY = 0x00080000
+NTLMSSP_NEGOTIATE_TARGET_INFO = 0x00800000
+NTLMSSP_NEGOTIATE_VERSION = 0x02000000
+NTLMSSP_NEGOTIATE_128 = 0x20000000
+NTLMSSP_NEGOTIATE_56 = 0x80000000
+
+DEFAULT_NEGOTIATE_FLAGS = (
+    NTLMSSP_NEGOTIATE_UNICODE | NTLMSSP_REQUEST_TARGET | NTLMSSP_NEGOTIATE_NTLM |
+    NTLMSSP_NEGOTIATE_ALWAYS_SIGN | NTLMSSP_NEGOTIATE_EXTENDED_SESSIONSECURITY |
+    NTLMSSP_NEGOTIATE_TARGET_INFO | NTLMSSP_NEGOTIATE_VERSION |
+    NTLMSSP_NEGOTIATE_128 | NTLMSSP_NEGOTIATE_56
+)
+
+# AV_PAIR identifiers used in the challenge target info
+MSV_AV_EOL = 0
+MSV_AV_NB_COMPUTER_NAME = 1
+MSV_AV_NB_DOMAIN_NAME = 2
+MSV_AV_DNS_COMPUTER_NAME = 3
+MSV_AV_DNS_DOMAIN_NAME = 4
+MSV_AV_TIMESTAMP = 7
+
+# Windows version advertised in our messages (10.0 build 19041, NTLM revision 15)
+NTLM_VERSION = struct.pack('<BBH3xB', 10, 0, 19041, 15)
+
+_SIGNATURE_RE = re.compile(re.escape(NTLMSSP_SIGNATURE))
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+def message_type(buf: BytesLike) -> Optional[int]:
+    """Return the NTLMSSP message type of buf, or None if buf is not an NTLMSSP message"""
+    if len(buf) < 12 or buf[:8] != NTLMSSP_SIGNATURE:
+        return None
+    return struct.unpack_from('<I', buf, 8)[0]
+
+def find_ntlmssp(buf: BytesLike) -> Optional[memoryview]:
+    """
+    Locate an NTLMSSP message inside buf without copying it.
+
+    Works for raw NTLMSSP tokens as well as tokens wrapped in SPNEGO, since the
+    NTLM message is the last element of the security blob.
+    """
+    match = _SIGNATURE_RE.search(buf)
+    if not match:
+        return None
+    return memoryview(buf)[match.start():]
+
+def _field(buf: BytesLike, offset: int) -> memoryview:
+    """Return the payload referenced by the (length, max length, offset) field at offset"""
+    length, _, data_offset = struct.unpack_from('<HHI', buf, offset)
+    return memoryview(buf)[data_offset:data_offset + length]
+
+def _av_pairs(pairs) -> bytes:
+    encoded = b''
+    for av_id, value in pairs:
+        encoded += struct.pack('<HH', av_id, len(value)) + value
+    return encoded + struct.pack('<HH', MSV_AV_EOL, 0)
+
+def filetime(timestamp: float = None) -> bytes:
+    """Encode a Unix timestamp as a little-endian Windows FILETIME"""
+    if timestamp is None:
+        timestamp = time.time()
+    return struct.pack('<Q', int((timestamp + 11644473600) * 10000000))
+
+def build_negotiate_message(flags: int = DEFAULT_NEGOTIATE_FLAGS) -> bytes:
+    """Build an NTLM Type 1 (NEGOTIATE) message"""
+    return (NTLMSSP_SIGNATURE + struct.pack('<II', NTLM_NEGOTIATE, flags) +
+            struct.pack('<HHI', 0, 0, 40) + struct.pack('<HHI', 0, 0, 40) + NTLM_VERSION)
+
+def build_challenge_message(server_challenge: bytes, computer_name: str = 'SERVER',
+                            domain_name: str = 'WORKGROUP', dns_domain_name: str = '',
+                            flags: int = DEFAULT_NEGOTIATE_FLAGS | NTLMSSP_TARGET_TYPE_DOMAIN,
+                            timestamp: float = None) -> bytes:
+    """
+    Build an NTLM Type 2 (CHALLENGE) message.
+
+    Args:
+        server_challenge (bytes): 8 byte server challenge
+        computer_name (str): NetBIOS computer name advertised in the target info
+        domain_name (str): NetBIOS domain name, also used as the target name
+        dns_domain_name (str): DNS domain name, defaults to domain_name
+        flags (int): Negotiate flags
+        timestamp (float): Unix time for MsvAvTimestamp, defaults to now
+
+    Returns:
+        bytes: Encoded CHALLENGE message
+    """
+    if len(server_challenge) != 8:
+        raise ValueError("Server challenge must be 8 bytes")
+    target_name = domain_name.encode('utf-16-le')
+    dns_domain = (dns_domain_name or domain_name).encode('utf-16-le')
+    dns_computer = computer_name.encode('utf-16-le')
+    if dns_domain_name:
+        dns_computer = f"{computer_name}.{dns_domain_name}".encode('utf-16-le')
+    target_info = _av_pairs([
+        (MSV_AV_NB_DOMAIN_NAME, target_name),
+        (MSV_AV_NB_COMPUTER_NAME, computer_name.encode('utf-16-le')),
+        (MSV_AV_DNS_DOMAIN_NAME, dns_domain),
+        (MSV_AV_DNS_COMPUTER_NAME, dns_computer),
+        (MSV_AV_TIMESTAMP, filetime(timestamp)),
+    ])
+    target_name_offset = 56
+    target_info_offset = target_name_offset + len(target_name)
+    return (
+        NTLMSSP_SIGNATURE +
+        struct.pack('<I', NTLM_CHALLENGE) +
+        struct.pack('<HHI', len(target_name), len(target_name), target_name_offset) +
+        struct.pack('<I', flags) +
+        server_challenge +
+        b'\x00' * 8 +  # Reserved
+        struct.pack('<HHI', len(target_info), len(target_info), target_info_offset) +
+        NTLM_VERSION +
+        target_name +
+        target_info
+    )
+
+def parse_challenge_message(buf: BytesLike) -> Dict:
+    """Parse an NTLM Type 2 message into its flags, server challenge and target info"""
+    if message_type(buf) != NTLM_CHALLENGE:
+        raise ValueError("Not an NTLM CHALLENGE message")
+    return {
+        'flags': struct.unpack_from('<I', buf, 20)[0],
+        'server_challenge': bytes(buf[24:32]),
+        'target_name': str(_field(buf, 12), 'utf-16-le'),
+        'target_info': bytes(_field(buf, 40)),
+    }
+
+def parse_authenticate_message(buf: BytesLike) -> Dict:
+    """
+    Parse an NTLM Type 3 (AUTHENTICATE) message.
+
+    Args:
+        buf (BytesLike): The NTLMSSP message, starting at the signature
+
+    Returns:
+        Dict: username, domain, workstation, lm_response, nt_response and flags
+    """
+    if message_type(buf) != NTLM_AUTHENTICATE:
+        raise ValueError("Not an NTLM AUTHENTICATE message")
+    flags = struct.unpack_from('<I', buf, 60)[0]
+    encoding = 'utf-16-le' if flags & NTLMSSP_NEGOTIATE_UNICODE else 'latin-1'
+    return {
+        'lm_response': bytes(_field(buf, 12)),
+        'nt_response': bytes(_field(buf, 20)),
+        'domain': str(_field(buf, 28), encoding),
+        'username': str(_field(buf, 36), encoding),
+        'workstation': str(_field(buf, 44), encoding),
+        'flags': flags,
+    }
+
+def hash_type(auth: Dict) -> str:
+    """Classify the response in a parsed AUTHENTICATE message"""
+    if len(auth['nt_response']) > 24:
+        return 'NTLMv2'
+    if len(auth['nt_response']) == 24:
+        return 'NTLMv1'
+    return 'anonymous'
+
+def format_hash(auth: Dict, server_challenge: bytes) -> Optional[str]:
+    """
+    Format a parsed AUTHENTICATE message as a crackable hash line.
+
+    NTLMv2 responses use the hashcat 5600 layout
+    (user::domain:challenge:ntproofstr:blob), NTLMv1 the 5500 layout.
+    """
+    kind = hash_type(auth)
+    if kind == 'NTLMv2':
+        nt_response = auth['nt_response']
+        return (f"{auth['username']}::{auth['domain']}:{server_challenge.hex()}:"
+                f"{nt_response[:16].hex()}:{nt_response[16:].hex()}")
+    if kind == 'NTLMv1':
+        return (f"{auth['username']}::{auth['domain']}:{auth['lm_response'].hex()}:"
+                f"{auth['nt_response'].hex()}:{server_challenge.hex()}")
+    return None
+
+def nt_hash(password: str) -> bytes:
+    """Compute the NT hash (MD4 of the UTF-16LE password)"""
+    return MD4.new(password.encode('utf-16-le')).digest()
+
+def ntowf_v2(user: str, domain: str, password: str = None, nthash: bytes = None) -> bytes:
+    """Compute the NTLMv2 response key from a password or an NT hash"""
+    if nthash is None:
+        nthash = nt_hash(password)
+    return hmac.new(nthash, (user.upper() + domain).encode('utf-16-le'), 'md5').digest()
+
+def build_authenticate_message(challenge: BytesLike, user: str, password: str = None,
+                               domain: str = '', workstation: str = 'CLIENT',
+                               nthash: bytes = None, client_challenge: bytes = None,
+                               timestamp: float = None) -> bytes:
+    """
+    Build an NTLMv2 Type 3 (AUTHENTICATE) message answering a CHALLENGE message.
+
+    Args:
+        challenge (BytesLike): The Type 2 message received from the server
+        user (str): Account name
+        password (str): Clear text password (or pass nthash)
+        domain (str): Account domain
+        workstation (str): Client workstation name
+        nthash (bytes): NT hash to use instead of password
+        client_challenge (bytes): 8 byte client nonce, random by default
+        timestamp (float): Unix time for the NTLMv2 blob, defaults to now
+
+    Returns:
+        bytes: Encoded AUTHENTICATE message
+    """
+    parsed = parse_challenge_message(challenge)
+    server_challenge = parsed['server_challenge']
+    client_challenge = client_challenge or os.urandom(8)
+    response_key = ntowf_v2(user, domain, password, nthash)
+
+    blob = (b'\x01\x01' + b'\x00' * 6 + filetime(timestamp) + client_challenge +
+            b'\x00' * 4 + parsed['target_info'] + b'\x00' * 4)
+    nt_proof = hmac.new(response_key, server_challenge + blob, 'md5').digest()
+    nt_response = nt_proof + blob
+    lm_response = hmac.new(response_key, server_challenge + client_challenge, 'md5').digest() + client_challenge
+
+    flags = parsed['flags'] & DEFAULT_NEGOTIATE_FLAGS
+    domain_bytes = domain.encode('utf-16-le')
+    user_bytes = user.encode('utf-16-le')
+    workstation_bytes = workstation.encode('utf-16-le')
+
+    offset = 88  # Fixed header, version and MIC
+    fields = b''
+    payload = b''
+    for value in (lm_response, nt_response, domain_bytes, user_bytes, workstation_bytes, b''):
+        fields += struct.pack('<HHI', len(value), len(value), offset + len(payload))
+        payload += value
+    return (NTLMSSP_SIGNATURE + struct.pack('<I', NTLM_AUTHENTICATE) + fields +
+            struct.pack('<I', flags) + NTLM_VERSION + b'\x00' * 16 + payload)
+
+def verify_ntlmv2_response(auth: Dict, server_challenge: bytes, password: str = None,
+                           nthash: bytes = None) -> bool:
+    """Check a parsed NTLMv2 AUTHENTICATE message against a known password or NT hash"""
+    if hash_type(auth) != 'NTLMv2':
+        return False
+    response_key = ntowf_v2(auth['username'], auth['domain'], password, nthash)
+    nt_response = auth['nt_response']
+    expected = hmac.new(response_key, server_challenge + nt_response[16:], 'md5').digest()
+    return hmac.compare_digest(expected, nt_response[:16])
@@ -13,19 +13,22 @@ from src.utils.hash_handler import parse_hashes
 
 
 class PacketSniffer:
-    def __init__(self, interface: str = None):
+    def __init__(self, interface: str = None, store=None):
         self.logger = logging.getLogger(__name__)
         self.interface = self._get_interface_name(interface)
         self.running = False
         self.capture_thread: Optional[threading.Thread] = None
 
-        # Initialize MongoDB only
-        try:
-            self.mongo_handler = MongoDBHandler()
-            self.logger.info("MongoDB connection established")
-        except Exception as e:
-            self.logger.error(f"Failed to connect to MongoDB: {e}")
-            raise
+        # Initialize MongoDB only, unless a store with the same methods is given (pipeline mode)
+        if store is not None:
+            self.mongo_handler = store
+        else:
+            try:
+                self.mongo_handler = MongoDBHandler()
+                self.logger.info("MongoDB connection established")
+            except Exception as e:
+                self.logger.error(f"Failed to connect to MongoDB: {e}")
+                raise
 
         self.ntlm_sessions = {}  # Track NTLM sessions
 
@@ -73,11 +76,11 @@ class PacketSniffer:
             self.logger.error(f"Failed to start capture: {e}")
             raise
 
-    def stop(self):
-        """Stop the packet capture"""
+    def stop(self, timeout: float = None):
+        """Stop the packet capture; sniff() only sees the flag on the next packet, hence the timeout"""
         self.running = False
         if self.capture_thread:
-            self.capture_thread.join()
+            self.capture_thread.join(timeout)
         if hasattr(self, 'mongo_handler') and self.mongo_handler:
             self.mongo_handler.disconnect()
         self.logger.info("Packet capture stopped")
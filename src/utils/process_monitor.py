@@ -0,0 +1,241 @@
+import os
+import sys
+import logging
+import selectors
+import threading
+from typing import Callable, Dict, IO, List, Optional
+
+# Bytes read from a pipe at once, into the buffer shared by all streams
+READ_SIZE = 65536
+# Output without a newline for this long is handed on as a line of its own
+MAX_LINE = 65536
+
+class _Stream:
+    """One pipe of a watched process and its partial last line"""
+
+    __slots__ = ('pipe', 'watch', 'pending')
+
+    def __init__(self, pipe: IO[bytes], watch: '_Watch'):
+        self.pipe = pipe
+        self.watch = watch
+        self.pending = bytearray()
+
+class _Watch:
+    """A watched process: the markers still to be matched and where to report them"""
+
+    __slots__ = ('process', 'name', 'markers', 'callback', 'open_streams')
+
+    def __init__(self, process, name: str, markers: Dict[str, str], callback: Callable[[str, str], None]):
+        self.process = process
+        self.name = name
+        self.markers = dict(markers)
+        self.callback = callback
+        self.open_streams = 0
+
+class ProcessOutputMonitor:
+    """
+    One thread reading the stdout and stderr of every watched child process.
+
+    The pipes are non-blocking and multiplexed with selectors; each read
+    goes into one buffer shared by all streams and is cut into lines, with
+    only an unfinished last line kept per stream. A line containing one of
+    a process's markers calls callback(event, line) once for that event.
+    Pipes are read until EOF whether or not markers are left, so a child
+    never blocks on a full pipe. Windows cannot select on pipes, there each
+    stream gets a blocking reader thread instead.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.thread: Optional[threading.Thread] = None
+        self.wakeup_read = self.wakeup_write = None
+        self.read_buffer = bytearray(READ_SIZE)
+        # Streams handed over by watch() until the monitor thread registers them
+        self.incoming: List[_Stream] = []
+        # Set by stop() for the current thread only, so a later watch() can start another
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.counters = {'processes': 0, 'streams': 0, 'open_streams': 0, 'lines': 0, 'events': 0, 'bytes': 0}
+
+    @classmethod
+    def shared(cls) -> 'ProcessOutputMonitor':
+        """Return the process-wide monitor"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def watch(self, process, markers: Dict[str, str], callback: Callable[[str, str], None],
+              name: str = 'process'):
+        """
+        Read the output of a process started with stdout and/or stderr=PIPE.
+
+        Args:
+            process (subprocess.Popen): Child process whose pipes are read
+            markers (Dict[str, str]): Event name -> text that signals it in an output line
+            callback (Callable[[str, str], None]): Called with the event and the line, once per event
+            name (str): Prefix of the output lines logged at debug level
+        """
+        watch = _Watch(process, name, markers, callback)
+        streams = [_Stream(pipe, watch) for pipe in (process.stdout, process.stderr) if pipe is not None]
+        watch.open_streams = len(streams)
+        with self.lock:
+            self.counters['processes'] += 1
+            self.counters['streams'] += len(streams)
+            self.counters['open_streams'] += len(streams)
+        if sys.platform == 'win32':
+            for stream in streams:
+                threading.Thread(target=self._read_blocking, args=(stream,), name=f"{name}-output",
+                                 daemon=True).start()
+            return
+        for stream in streams:
+            os.set_blocking(stream.pipe.fileno(), False)
+        with self.lock:
+            self.incoming.extend(streams)
+            self._start()
+            os.write(self.wakeup_write, b'\0')
+
+    def _start(self):
+        # Called with the lock held
+        if self.thread and self.thread.is_alive() and not self.stopped.is_set():
+            return
+        self.stopped = threading.Event()
+        selector = selectors.DefaultSelector()
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        os.set_blocking(self.wakeup_read, False)
+        selector.register(self.wakeup_read, selectors.EVENT_READ, None)
+        args = (selector, self.wakeup_read, self.wakeup_write, self.stopped)
+        self.thread = threading.Thread(target=self._run, args=args, name='process-monitor', daemon=True)
+        self.thread.start()
+
+    def _run(self, selector: selectors.BaseSelector, wakeup_read: int, wakeup_write: int,
+             stopped: threading.Event):
+        try:
+            while True:
+                for key, _ in selector.select():
+                    if key.data is not None:
+                        self._read(selector, key.data)
+                        continue
+                    try:
+                        os.read(wakeup_read, 4096)
+                    except BlockingIOError:
+                        pass
+                    if stopped.is_set():
+                        return
+                    with self.lock:
+                        incoming, self.incoming = self.incoming, []
+                    for stream in incoming:
+                        selector.register(stream.pipe, selectors.EVENT_READ, stream)
+        except Exception as e:
+            self.logger.error(f"Process output monitor failed: {e}", exc_info=True)
+        finally:
+            for key in list(selector.get_map().values()):
+                if key.data is not None:
+                    self._close(key.data)
+            selector.close()
+            with self.lock:
+                os.close(wakeup_read)
+                os.close(wakeup_write)
+                if self.wakeup_write == wakeup_write:
+                    self.wakeup_read = self.wakeup_write = None
+
+    def _read(self, selector: selectors.BaseSelector, stream: _Stream):
+        try:
+            length = os.readv(stream.pipe.fileno(), [self.read_buffer])
+        except BlockingIOError:
+            return
+        except OSError:
+            length = 0
+        if length:
+            self._feed(stream, self.read_buffer, length)
+        else:
+            selector.unregister(stream.pipe)
+            self._close(stream)
+
+    def _read_blocking(self, stream: _Stream):
+        try:
+            while True:
+                data = os.read(stream.pipe.fileno(), READ_SIZE)
+                if not data:
+                    break
+                self._feed(stream, data, len(data))
+        except OSError:
+            pass
+        finally:
+            self._close(stream)
+
+    def _feed(self, stream: _Stream, data, length: int):
+        """Cut the first length bytes of data into lines, after what stream has pending"""
+        with self.lock:
+            self.counters['bytes'] += length
+        start = 0
+        while True:
+            end = data.find(b'\n', start, length)
+            if end < 0:
+                break
+            if stream.pending:
+                stream.pending += data[start:end]
+                line = bytes(stream.pending)
+                stream.pending.clear()
+            else:
+                line = bytes(data[start:end])
+            self._line(stream.watch, line)
+            start = end + 1
+        stream.pending += data[start:length]
+        if len(stream.pending) >= MAX_LINE:
+            self._line(stream.watch, bytes(stream.pending))
+            stream.pending.clear()
+
+    def _line(self, watch: _Watch, line: bytes):
+        text = line.decode('utf-8', errors='ignore').strip()
+        if not text:
+            return
+        self.logger.debug(f"[{watch.name}] {text}")
+        # A process's stdout and stderr may be read by different threads (Windows)
+        with self.lock:
+            self.counters['lines'] += 1
+            matched = [event for event, marker in watch.markers.items() if marker in text]
+            for event in matched:
+                del watch.markers[event]
+            self.counters['events'] += len(matched)
+        for event in matched:
+            try:
+                watch.callback(event, text)
+            except Exception as e:
+                self.logger.error(f"Error handling {event} of {watch.name}: {e}", exc_info=True)
+
+    def _close(self, stream: _Stream):
+        if stream.pending:
+            self._line(stream.watch, bytes(stream.pending))
+            stream.pending.clear()
+        try:
+            stream.pipe.close()
+        except OSError:
+            pass
+        watch = stream.watch
+        with self.lock:
+            watch.open_streams -= 1
+            self.counters['open_streams'] -= 1
+            finished = watch.open_streams == 0
+        if finished:
+            # Reap the child if it already exited
+            watch.process.poll()
+            self.logger.debug(f"[*] Output of {watch.name} ended")
+
+    def get_stats(self) -> Dict:
+        """Processes and streams watched, streams still open, lines and bytes read and events matched"""
+        with self.lock:
+            return dict(self.counters)
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the monitor thread and close the pipes it was reading"""
+        with self.lock:
+            thread = self.thread
+            if thread is None or not thread.is_alive() or self.stopped.is_set():
+                return
+            self.stopped.set()
+            os.write(self.wakeup_write, b'\0')
+        thread.join(timeout)
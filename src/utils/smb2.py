@@ -0,0 +1,232 @@
+import os
+import time
+import struct
+import asyncio
+from typing import Optional, Tuple
+
+from src.utils.ntlm import filetime
+from src.utils.spnego import NEG_STATE_ACCEPT_INCOMPLETE, neg_token_init, neg_token_resp
+
+SMB1_MAGIC = b'\xffSMB'
+SMB2_MAGIC = b'\xfeSMB'
+
+# SMB2 commands
+SMB2_NEGOTIATE = 0x0000
+SMB2_SESSION_SETUP = 0x0001
+SMB2_LOGOFF = 0x0002
+SMB2_TREE_CONNECT = 0x0003
+SMB2_ECHO = 0x000d
+
+# SMB1 command used by clients that start with a multi-protocol negotiate
+SMB1_COM_NEGOTIATE = 0x72
+
+# NTSTATUS values
+STATUS_SUCCESS = 0x00000000
+STATUS_MORE_PROCESSING_REQUIRED = 0xc0000016
+STATUS_ACCESS_DENIED = 0xc0000022
+STATUS_LOGON_FAILURE = 0xc000006d
+STATUS_NOT_SUPPORTED = 0xc00000bb
+
+SMB2_FLAGS_SERVER_TO_REDIR = 0x00000001
+
+SMB2_NEGOTIATE_SIGNING_ENABLED = 0x0001
+SMB2_NEGOTIATE_SIGNING_REQUIRED = 0x0002
+
+SMB2_DIALECT_202 = 0x0202
+SMB2_DIALECT_21 = 0x0210
+SMB2_DIALECT_30 = 0x0300
+SMB2_DIALECT_302 = 0x0302
+SMB2_DIALECT_311 = 0x0311
+SMB2_DIALECT_WILDCARD = 0x02ff
+
+# Dialects we can answer without negotiate contexts, most preferred first
+SUPPORTED_DIALECTS = (SMB2_DIALECT_21, SMB2_DIALECT_202, SMB2_DIALECT_302, SMB2_DIALECT_30)
+
+SMB2_HEADER_SIZE = 64
+NETBIOS_HEADER_SIZE = 4
+
+# NetBIOS session service message types (RFC 1002)
+NETBIOS_SESSION_MESSAGE = 0x00
+NETBIOS_SESSION_REQUEST = 0x81
+NETBIOS_POSITIVE_RESPONSE = 0x82
+
+# Offsets of the patchable header fields, relative to the start of a framed message
+# (i.e. including the 4 byte NetBIOS header)
+STATUS_OFFSET = NETBIOS_HEADER_SIZE + 8
+MESSAGE_ID_OFFSET = NETBIOS_HEADER_SIZE + 24
+SESSION_ID_OFFSET = NETBIOS_HEADER_SIZE + 40
+
+_HEADER = struct.Struct('<4sHHIHHIIQIIQ16s')
+
+class SMB2Header:
+    """Fields of an SMB2 sync header parsed from a message buffer"""
+
+    __slots__ = ('status', 'command', 'credits', 'flags', 'message_id', 'tree_id', 'session_id')
+
+    def __init__(self, buf):
+        (magic, structure_size, _, self.status, self.command, self.credits, self.flags,
+         _, self.message_id, _, self.tree_id, self.session_id, _) = _HEADER.unpack_from(buf, 0)
+        if magic != SMB2_MAGIC or structure_size != SMB2_HEADER_SIZE:
+            raise ValueError("Not an SMB2 message")
+
+def build_header(command: int, message_id: int = 0, session_id: int = 0, status: int = 0,
+                 credits: int = 1, flags: int = 0, tree_id: int = 0) -> bytes:
+    """Build a 64 byte SMB2 sync header"""
+    return _HEADER.pack(SMB2_MAGIC, SMB2_HEADER_SIZE, 0, status, command, credits, flags,
+                        0, message_id, 0xfeff, tree_id, session_id, b'\x00' * 16)
+
+def netbios_frame(message: bytes) -> bytes:
+    """Prefix an SMB message with its NetBIOS session service header"""
+    return struct.pack('>I', len(message)) + message
+
+def encode_netbios_name(name: str, suffix: int = 0x20) -> bytes:
+    """First-level encode a NetBIOS name (RFC 1001 section 14.1) as a length-prefixed label"""
+    raw = name.upper().encode('ascii')[:15].ljust(15, b' ') + bytes([suffix])
+    encoded = bytes(b for byte in raw for b in (0x41 + (byte >> 4), 0x41 + (byte & 0x0f)))
+    return bytes([len(encoded)]) + encoded + b'\x00'
+
+def build_session_request(called: str = '*SMBSERVER', calling: str = 'RELAY') -> bytes:
+    """Build a NetBIOS SESSION REQUEST, needed before SMB on port 139"""
+    names = encode_netbios_name(called) + encode_netbios_name(calling, 0x00)
+    return bytes([NETBIOS_SESSION_REQUEST]) + len(names).to_bytes(3, 'big') + names
+
+def security_buffer(buf, offset_field: int, length_field: int) -> memoryview:
+    """Slice the security buffer referenced by the offset/length fields of an SMB2 body"""
+    offset, = struct.unpack_from('<H', buf, offset_field)
+    length, = struct.unpack_from('<H', buf, length_field)
+    return memoryview(buf)[offset:offset + length]
+
+def session_setup_request_token(message) -> memoryview:
+    """Return the security blob of an SMB2 SESSION_SETUP request (message starts at the SMB2 header)"""
+    return security_buffer(message, SMB2_HEADER_SIZE + 12, SMB2_HEADER_SIZE + 14)
+
+def session_setup_response_token(message) -> memoryview:
+    """Return the security blob of an SMB2 SESSION_SETUP response"""
+    return security_buffer(message, SMB2_HEADER_SIZE + 4, SMB2_HEADER_SIZE + 6)
+
+def negotiate_request_dialects(message) -> Tuple[int, ...]:
+    """Return the dialects offered by an SMB2 NEGOTIATE request"""
+    count, = struct.unpack_from('<H', message, SMB2_HEADER_SIZE + 2)
+    return struct.unpack_from(f'<{count}H', message, SMB2_HEADER_SIZE + 36)
+
+def negotiate_response_security_mode(message) -> int:
+    """Return SecurityMode from an SMB2 NEGOTIATE response"""
+    return struct.unpack_from('<H', message, SMB2_HEADER_SIZE + 2)[0]
+
+def negotiate_response_dialect(message) -> int:
+    """Return DialectRevision from an SMB2 NEGOTIATE response"""
+    return struct.unpack_from('<H', message, SMB2_HEADER_SIZE + 4)[0]
+
+def smb1_negotiate_dialects(message) -> Tuple[bytes, ...]:
+    """Return the dialect strings of an SMB1 multi-protocol NEGOTIATE request"""
+    byte_count, = struct.unpack_from('<H', message, 33)
+    raw = bytes(message[35:35 + byte_count])
+    return tuple(d[1:] for d in raw.split(b'\x00') if d.startswith(b'\x02'))
+
+def choose_dialect(offered) -> Optional[int]:
+    """Pick the dialect we answer with from the client's offer"""
+    for dialect in SUPPORTED_DIALECTS:
+        if dialect in offered:
+            return dialect
+    return None
+
+def build_negotiate_request(dialects=(SMB2_DIALECT_202, SMB2_DIALECT_21), message_id: int = 0,
+                            security_mode: int = SMB2_NEGOTIATE_SIGNING_ENABLED,
+                            client_guid: bytes = None) -> bytes:
+    """Build a framed SMB2 NEGOTIATE request"""
+    body = struct.pack('<HHHHI16sQ', 36, len(dialects), security_mode, 0, 0,
+                       client_guid or os.urandom(16), 0)
+    body += struct.pack(f'<{len(dialects)}H', *dialects)
+    return netbios_frame(build_header(SMB2_NEGOTIATE, message_id, credits=31) + body)
+
+def build_session_setup_request(token: bytes, message_id: int, session_id: int = 0,
+                                security_mode: int = SMB2_NEGOTIATE_SIGNING_ENABLED) -> bytes:
+    """Build a framed SMB2 SESSION_SETUP request carrying a security blob"""
+    body = struct.pack('<HBBIIHHQ', 25, 0, security_mode, 0, 0,
+                       SMB2_HEADER_SIZE + 24, len(token), 0)
+    return netbios_frame(build_header(SMB2_SESSION_SETUP, message_id, session_id, credits=31) +
+                         body + token)
+
+def build_negotiate_response(dialect: int, message_id: int = 0, server_guid: bytes = None,
+                             security_mode: int = SMB2_NEGOTIATE_SIGNING_ENABLED,
+                             start_time: float = None) -> bytes:
+    """Build a framed SMB2 NEGOTIATE response advertising NTLMSSP through SPNEGO"""
+    token = neg_token_init()
+    body = struct.pack('<HHHH16sIIIIQQHHI', 65, security_mode, dialect, 0,
+                       server_guid or os.urandom(16),
+                       0x00000001,  # Capabilities: DFS
+                       0x00800000, 0x00800000, 0x00800000,  # Max transact/read/write size
+                       struct.unpack('<Q', filetime())[0],
+                       struct.unpack('<Q', filetime(start_time or time.time()))[0],
+                       SMB2_HEADER_SIZE + 64, len(token), 0)
+    header = build_header(SMB2_NEGOTIATE, message_id, credits=1, flags=SMB2_FLAGS_SERVER_TO_REDIR)
+    return netbios_frame(header + body + token)
+
+def build_session_setup_response(token: bytes, status: int, message_id: int = 0,
+                                 session_id: int = 0, session_flags: int = 0) -> bytes:
+    """Build a framed SMB2 SESSION_SETUP response"""
+    body = struct.pack('<HHHH', 9, session_flags, SMB2_HEADER_SIZE + 8 if token else 0, len(token))
+    header = build_header(SMB2_SESSION_SETUP, message_id, session_id, status, credits=1,
+                          flags=SMB2_FLAGS_SERVER_TO_REDIR)
+    return netbios_frame(header + body + token)
+
+def build_empty_response(command: int, message_id: int = 0, session_id: int = 0) -> bytes:
+    """Build a framed successful response with the 4 byte body of ECHO and LOGOFF"""
+    header = build_header(command, message_id, session_id, credits=1, flags=SMB2_FLAGS_SERVER_TO_REDIR)
+    return netbios_frame(header + struct.pack('<HH', 4, 0))
+
+def build_error_response(command: int, status: int, message_id: int = 0, session_id: int = 0) -> bytes:
+    """Build a framed SMB2 ERROR response"""
+    header = build_header(command, message_id, session_id, status, credits=1, flags=SMB2_FLAGS_SERVER_TO_REDIR)
+    return netbios_frame(header + struct.pack('<HBBI', 9, 0, 0, 0) + b'\x00')
+
+class SMB2ResponseTemplates:
+    """
+    Prebuilt SMB2 server responses for one challenge layout.
+
+    The frames are built once; each connection gets its own bytearray copy in
+    which only the message ID, session ID and server challenge are patched
+    with struct.pack_into before sending.
+    """
+
+    def __init__(self, challenge_message: bytes, dialect: int = SMB2_DIALECT_21,
+                 server_guid: bytes = None):
+        self.server_guid = server_guid or os.urandom(16)
+        self.dialect = dialect
+        self.negotiate = build_negotiate_response(dialect, server_guid=self.server_guid)
+        self.wildcard_negotiate = build_negotiate_response(SMB2_DIALECT_WILDCARD,
+                                                           server_guid=self.server_guid)
+        spnego_challenge = neg_token_resp(challenge_message, NEG_STATE_ACCEPT_INCOMPLETE,
+                                          supported_mech=True)
+        self.spnego_challenge = build_session_setup_response(
+            spnego_challenge, STATUS_MORE_PROCESSING_REQUIRED)
+        self.raw_challenge = build_session_setup_response(
+            challenge_message, STATUS_MORE_PROCESSING_REQUIRED)
+        # Server challenge lives at byte 24 of the NTLM message, which ends each frame
+        self.spnego_challenge_offset = self._challenge_offset(self.spnego_challenge, challenge_message)
+        self.raw_challenge_offset = self._challenge_offset(self.raw_challenge, challenge_message)
+        self.access_denied = build_session_setup_response(b'', STATUS_ACCESS_DENIED)
+
+    @staticmethod
+    def _challenge_offset(frame: bytes, challenge_message: bytes) -> int:
+        return len(frame) - len(challenge_message) + 24
+
+    def negotiate_for(self, dialect: int) -> bytearray:
+        """Return a patchable negotiate response for dialect"""
+        frame = bytearray(self.negotiate)
+        struct.pack_into('<H', frame, NETBIOS_HEADER_SIZE + SMB2_HEADER_SIZE + 4, dialect)
+        return frame
+
+def patch_ids(frame: bytearray, message_id: int, session_id: int = None) -> bytearray:
+    """Patch the message ID (and session ID) of a framed SMB2 response in place"""
+    struct.pack_into('<Q', frame, MESSAGE_ID_OFFSET, message_id)
+    if session_id is not None:
+        struct.pack_into('<Q', frame, SESSION_ID_OFFSET, session_id)
+    return frame
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    """Read one NetBIOS session service message, returning (type, payload)"""
+    header = await reader.readexactly(NETBIOS_HEADER_SIZE)
+    length = int.from_bytes(header[1:], 'big')
+    payload = await reader.readexactly(length) if length else b''
+    return header[0], payload
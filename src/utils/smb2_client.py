@@ -0,0 +1,92 @@
+import time
+import asyncio
+from typing import Dict, Optional
+
+from src.utils.ntlm import build_authenticate_message, build_negotiate_message
+from src.utils.smb2 import (SMB2_DIALECT_202, SMB2_DIALECT_21, STATUS_MORE_PROCESSING_REQUIRED,
+                            SMB2Header, build_negotiate_request, build_session_setup_request,
+                            negotiate_response_dialect, read_frame, session_setup_response_token)
+from src.utils.spnego import neg_token_init, neg_token_resp, unwrap_ntlmssp
+
+class SMB2StubClient:
+    """
+    Minimal SMB2 client performing NEGOTIATE and an NTLMSSP SESSION_SETUP.
+
+    Used by the benchmarks and the offline test bed to authenticate against
+    our own servers with known credentials; it implements nothing past the
+    session setup.
+    """
+
+    def __init__(self, host: str, port: int, user: str, password: str = None, domain: str = '',
+                 nthash: bytes = None, workstation: str = 'STUBCLIENT',
+                 dialects=(SMB2_DIALECT_202, SMB2_DIALECT_21), timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.domain = domain
+        self.nthash = nthash
+        self.workstation = workstation
+        self.dialects = dialects
+        self.timeout = timeout
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.message_id = 0
+        self.session_id = 0
+        self.dialect = None
+
+    async def _request(self, frame: bytes):
+        self.writer.write(frame)
+        await self.writer.drain()
+        _, message = await asyncio.wait_for(read_frame(self.reader), self.timeout)
+        self.message_id += 1
+        return SMB2Header(message), message
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+
+    async def negotiate(self) -> int:
+        """Send NEGOTIATE and return the dialect chosen by the server"""
+        _, message = await self._request(build_negotiate_request(self.dialects, self.message_id))
+        self.dialect = negotiate_response_dialect(message)
+        return self.dialect
+
+    async def session_setup(self) -> int:
+        """Run the NTLMSSP exchange and return the final NTSTATUS"""
+        header, message = await self._request(build_session_setup_request(
+            neg_token_init(build_negotiate_message()), self.message_id))
+        if header.status != STATUS_MORE_PROCESSING_REQUIRED:
+            return header.status
+        self.session_id = header.session_id
+        challenge = unwrap_ntlmssp(session_setup_response_token(message))
+        authenticate = build_authenticate_message(challenge, self.user, self.password, self.domain,
+                                                  self.workstation, nthash=self.nthash)
+        header, _ = await self._request(build_session_setup_request(
+            neg_token_resp(authenticate), self.message_id, self.session_id))
+        return header.status
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+            self.writer = None
+
+    async def authenticate(self) -> Dict:
+        """Connect, negotiate and authenticate once, returning the status and timings"""
+        started = time.perf_counter()
+        try:
+            await self.connect()
+            connected = time.perf_counter()
+            await self.negotiate()
+            status = await self.session_setup()
+            return {
+                'status': status,
+                'connect_s': connected - started,
+                'total_s': time.perf_counter() - started,
+            }
+        finally:
+            await self.close()
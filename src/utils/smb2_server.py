@@ -0,0 +1,131 @@
+import os
+import asyncio
+import logging
+import itertools
+from typing import Dict, Optional
+
+from src.utils.ntlm import (NTLM_AUTHENTICATE, NTLM_NEGOTIATE, build_challenge_message, message_type,
+                            parse_authenticate_message, verify_ntlmv2_response)
+from src.utils.smb2 import (NETBIOS_POSITIVE_RESPONSE, NETBIOS_SESSION_MESSAGE, NETBIOS_SESSION_REQUEST,
+                            SMB2_ECHO, SMB2_LOGOFF, SMB2_MAGIC, SMB2_NEGOTIATE, SMB2_SESSION_SETUP,
+                            STATUS_LOGON_FAILURE, STATUS_NOT_SUPPORTED, STATUS_SUCCESS, SMB2Header,
+                            SMB2ResponseTemplates, build_empty_response, build_error_response,
+                            build_session_setup_response, choose_dialect, negotiate_request_dialects,
+                            patch_ids, session_setup_request_token)
+from src.utils.framing import BufferPool, FramedConnection, start_framed_server
+from src.utils.spnego import is_spnego, unwrap_ntlmssp
+
+class SMB2StubServer:
+    """
+    Minimal SMB2 server authenticating NTLMv2 against known credentials.
+
+    Stands in for a relay target in the offline test bed (the counterpart of
+    SMB2StubClient): NEGOTIATE, an NTLMSSP SESSION_SETUP with a fresh server
+    challenge per connection, checked with verify_ntlmv2_response, then ECHO
+    and LOGOFF. Every other command is answered with STATUS_NOT_SUPPORTED.
+    """
+
+    def __init__(self, host: str, port: int, credentials: Dict[str, str],
+                 computer_name: str = 'TARGET', domain_name: str = 'LAB',
+                 idle_timeout: float = 30.0, backlog: int = 1024):
+        self.logger = logging.getLogger(__name__)
+        self.host = host
+        self.port = port
+        # User names are case-insensitive in NTLM
+        self.credentials = {user.lower(): password for user, password in credentials.items()}
+        self.idle_timeout = idle_timeout
+        self.backlog = backlog
+        self.templates = SMB2ResponseTemplates(build_challenge_message(b'\x00' * 8, computer_name, domain_name))
+        self.session_ids = itertools.count(0x0000080000000001)
+        self.buffer_pool = BufferPool()
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.connections = 0
+        self.accepted = 0
+        self.rejected = 0
+
+    async def start(self):
+        """Start listening"""
+        self.server = await start_framed_server(self._handle_client, self.host, self.port,
+                                                backlog=self.backlog, buffer_pool=self.buffer_pool)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.logger.info(f"SMB2 stub server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        """Stop listening"""
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def get_stats(self) -> Dict:
+        return {'connections': self.connections, 'accepted': self.accepted, 'rejected': self.rejected}
+
+    def _check_authenticate(self, ntlm, server_challenge: bytes) -> bool:
+        try:
+            auth = parse_authenticate_message(ntlm)
+        except Exception as e:
+            self.logger.debug(f"Malformed NTLM Type 3: {e}")
+            return False
+        password = self.credentials.get(auth['username'].lower())
+        return password is not None and verify_ntlmv2_response(auth, server_challenge, password)
+
+    async def _handle_client(self, connection: FramedConnection):
+        client_address = connection.get_extra_info('peername')
+        self.connections += 1
+        session_id = next(self.session_ids)
+        server_challenge = None
+        try:
+            while True:
+                kind, message = await asyncio.wait_for(connection.read_frame(), self.idle_timeout)
+                if kind == NETBIOS_SESSION_REQUEST:
+                    connection.write(bytes([NETBIOS_POSITIVE_RESPONSE, 0, 0, 0]))
+                    continue
+                if kind != NETBIOS_SESSION_MESSAGE or message[:4] != SMB2_MAGIC:
+                    break
+                header = SMB2Header(message)
+
+                if header.command == SMB2_NEGOTIATE:
+                    dialect = choose_dialect(negotiate_request_dialects(message))
+                    if dialect is None:
+                        break
+                    connection.write(patch_ids(self.templates.negotiate_for(dialect), header.message_id))
+
+                elif header.command == SMB2_SESSION_SETUP:
+                    token = session_setup_request_token(message)
+                    ntlm = unwrap_ntlmssp(token)
+                    kind = message_type(ntlm) if ntlm is not None else None
+                    if kind == NTLM_NEGOTIATE:
+                        spnego = is_spnego(token)
+                        frame = bytearray(self.templates.spnego_challenge if spnego
+                                          else self.templates.raw_challenge)
+                        offset = (self.templates.spnego_challenge_offset if spnego
+                                  else self.templates.raw_challenge_offset)
+                        server_challenge = os.urandom(8)
+                        frame[offset:offset + 8] = server_challenge
+                        connection.write(patch_ids(frame, header.message_id, session_id))
+                    elif kind == NTLM_AUTHENTICATE and server_challenge:
+                        if self._check_authenticate(ntlm, server_challenge):
+                            self.accepted += 1
+                            status = STATUS_SUCCESS
+                        else:
+                            self.rejected += 1
+                            status = STATUS_LOGON_FAILURE
+                        server_challenge = None
+                        connection.write(build_session_setup_response(b'', status, header.message_id,
+                                                                      session_id))
+                    else:
+                        break
+
+                elif header.command in (SMB2_ECHO, SMB2_LOGOFF):
+                    connection.write(build_empty_response(header.command, header.message_id,
+                                                          header.session_id))
+                else:
+                    connection.write(build_error_response(header.command, STATUS_NOT_SUPPORTED,
+                                                          header.message_id, header.session_id))
+                await connection.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            self.logger.error(f"Error in SMB stub handler for {client_address[0]}: {e}")
+        finally:
+            connection.close()
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from src.utils.smb2 import (NETBIOS_HEADER_SIZE, NETBIOS_POSITIVE_RESPONSE, SMB2_DIALECT_202,
+                            SMB2_DIALECT_21, SMB2_DIALECT_30, SMB2_DIALECT_302, SMB2_MAGIC,
+                            SMB2_NEGOTIATE_SIGNING_ENABLED, SMB2_NEGOTIATE_SIGNING_REQUIRED,
+                            STATUS_SUCCESS, SMB2Header, build_negotiate_request, build_session_request,
+                            negotiate_response_dialect, negotiate_response_security_mode)
+
+# Shared by the relay and scripts/target_scanner.py
+DEFAULT_STORE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+                                  'data', 'smb_capabilities.json')
+
+# Signing policy is a domain/GPO setting and rarely changes; probe again after a day
+DEFAULT_MAX_AGE = 24 * 3600.0
+
+# 3.1.1 needs negotiate contexts; servers that speak it still answer one of these
+PROBE_DIALECTS = (SMB2_DIALECT_202, SMB2_DIALECT_21, SMB2_DIALECT_30, SMB2_DIALECT_302)
+
+SMBCapabilities = namedtuple('SMBCapabilities', ['address', 'port', 'dialect', 'signing_enabled',
+                                                 'signing_required', 'probed_at', 'error'])
+
+def _recv_frame(sock: socket.socket) -> Tuple[int, bytes]:
+    def recv_exactly(size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Connection closed by the server")
+            data += chunk
+        return data
+
+    header = recv_exactly(NETBIOS_HEADER_SIZE)
+    length = int.from_bytes(header[1:], 'big')
+    return header[0], recv_exactly(length) if length else b''
+
+def probe_smb_signing(address: str, port: int = 445, timeout: float = 3.0) -> SMBCapabilities:
+    """
+    Read the signing policy of an SMB server from its NEGOTIATE response.
+
+    One SMB2 NEGOTIATE round trip (plus the NetBIOS session request on port
+    139); no session is set up.
+
+    Args:
+        address (str): IPv4 address of the server
+        port (int): 445, or 139 for SMB over the NetBIOS session service
+        timeout (float): Connect and read timeout, in seconds
+
+    Returns:
+        SMBCapabilities: Dialect and SecurityMode flags, or error set if the probe failed
+    """
+    try:
+        with socket.create_connection((address, port), timeout) as sock:
+            if port == 139:
+                sock.sendall(build_session_request())
+                kind, _ = _recv_frame(sock)
+                if kind != NETBIOS_POSITIVE_RESPONSE:
+                    raise ConnectionError(f"NetBIOS session refused ({kind:#x})")
+            sock.sendall(build_negotiate_request(PROBE_DIALECTS))
+            _, message = _recv_frame(sock)
+        if message[:4] != SMB2_MAGIC:
+            raise ConnectionError("Server does not speak SMB2")
+        header = SMB2Header(message)
+        if header.status != STATUS_SUCCESS:
+            raise ConnectionError(f"NEGOTIATE failed with status {header.status:#x}")
+        security_mode = negotiate_response_security_mode(message)
+        return SMBCapabilities(address, port, negotiate_response_dialect(message),
+                               bool(security_mode & SMB2_NEGOTIATE_SIGNING_ENABLED),
+                               bool(security_mode & SMB2_NEGOTIATE_SIGNING_REQUIRED), time.time(), None)
+    except (OSError, ValueError) as e:
+        return SMBCapabilities(address, port, None, None, None, time.time(), str(e) or type(e).__name__)
+
+class CapabilityStore:
+    """
+    Persistent per-target SMB capabilities (dialect and signing policy).
+
+    Entries are keyed by address:port and kept in a JSON file so a scan and
+    later relay sessions share them; entries older than max_age, and failed
+    probes, are probed again on lookup. The file is written outside the
+    lock, once per lookup_many() batch, or by flush() after record(save=False).
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH, max_age: float = DEFAULT_MAX_AGE,
+                 probe: Callable[..., SMBCapabilities] = probe_smb_signing, timeout: float = 3.0):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.max_age = max_age
+        self.probe = probe
+        self.timeout = timeout
+        self.entries: Optional[Dict[str, SMBCapabilities]] = None
+        self.lock = threading.Lock()
+        # Entries recorded since the file was last written; save_lock orders the writers
+        self.dirty = False
+        self.save_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls) -> 'CapabilityStore':
+        """Return the process-wide store backed by DEFAULT_STORE_PATH"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    @staticmethod
+    def _key(address: str, port: int) -> str:
+        return f"{address}:{port}"
+
+    def _load(self) -> Dict[str, SMBCapabilities]:
+        if self.entries is None:
+            self.entries = {}
+            try:
+                with open(self.path) as f:
+                    for key, fields in json.load(f).items():
+                        self.entries[key] = SMBCapabilities(**fields)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, TypeError) as e:
+                self.logger.warning(f"Ignoring unreadable capability store {self.path}: {e}")
+        return self.entries
+
+    def load(self):
+        """Read the file now, e.g. before an event loop starts asking cached()"""
+        with self.lock:
+            self._load()
+
+    def flush(self):
+        """Write the entries recorded since the last write, if any"""
+        with self.save_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                snapshot = {key: entry._asdict() for key, entry in self.entries.items()}
+                self.dirty = False
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                temporary = f"{self.path}.{os.getpid()}.tmp"
+                with open(temporary, 'w') as f:
+                    json.dump(snapshot, f, indent=1)
+                os.replace(temporary, self.path)
+            except OSError as e:
+                self.logger.warning(f"Could not write capability store {self.path}: {e}")
+                with self.lock:
+                    self.dirty = True
+
+    def cached(self, address: str, port: int = 445) -> Optional[SMBCapabilities]:
+        """Stored capabilities that are still fresh, without probing"""
+        with self.lock:
+            entry = self._load().get(self._key(address, port))
+        if entry is None or entry.error or time.time() - entry.probed_at > self.max_age:
+            return None
+        return entry
+
+    def lookup(self, address: str, port: int = 445, refresh: bool = False, save: bool = True) -> SMBCapabilities:
+        """Stored capabilities of address:port, probing (and storing) them when missing or stale"""
+        entry = None if refresh else self.cached(address, port)
+        if entry is None:
+            entry = self.probe(address, port, self.timeout)
+            self.record(entry, save)
+        return entry
+
+    def lookup_many(self, targets: Iterable[Tuple[str, int]], workers: int = 32) -> List[SMBCapabilities]:
+        """lookup() several targets concurrently"""
+        targets = list(targets)
+        if not targets:
+            return []
+        try:
+            with ThreadPoolExecutor(max_workers=min(workers, len(targets))) as executor:
+                return list(executor.map(lambda target: self.lookup(*target, save=False), targets))
+        finally:
+            self.flush()
+
+    def signing_required(self, address: str, port: int = 445) -> Optional[bool]:
+        """True or False from the store, None if the target has not been probed successfully"""
+        entry = self.cached(address, port)
+        return entry.signing_required if entry else None
+
+    def record(self, entry: SMBCapabilities, save: bool = True):
+        """Store a probe result; with save=False only in memory until the next flush()"""
+        with self.lock:
+            self._load()[self._key(entry.address, entry.port)] = entry
+            self.dirty = True
+        if save:
+            self.flush()
@@ -0,0 +1,49 @@
+from typing import Optional
+
+from src.utils.ntlm import find_ntlmssp
+
+# DER encoded object identifiers
+SPNEGO_OID = b'\x06\x06\x2b\x06\x01\x05\x05\x02'            # 1.3.6.1.5.5.2
+NTLMSSP_OID = b'\x06\x0a\x2b\x06\x01\x04\x01\x82\x37\x02\x02\x0a'  # 1.3.6.1.4.1.311.2.2.10
+
+NEG_STATE_ACCEPT_COMPLETED = 0
+NEG_STATE_ACCEPT_INCOMPLETE = 1
+NEG_STATE_REJECT = 2
+
+def der_length(length: int) -> bytes:
+    """Encode a DER length"""
+    if length < 0x80:
+        return bytes([length])
+    encoded = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes([0x80 | len(encoded)]) + encoded
+
+def der(tag: int, content: bytes) -> bytes:
+    """Encode a DER TLV"""
+    return bytes([tag]) + der_length(len(content)) + content
+
+def neg_token_init(mech_token: bytes = None) -> bytes:
+    """Build a GSS-API wrapped SPNEGO NegTokenInit offering NTLMSSP"""
+    body = der(0xa0, der(0x30, NTLMSSP_OID))  # mechTypes
+    if mech_token is not None:
+        body += der(0xa2, der(0x04, mech_token))  # mechToken
+    return der(0x60, SPNEGO_OID + der(0xa0, der(0x30, body)))
+
+def neg_token_resp(response_token: bytes = None, neg_state: int = None,
+                   supported_mech: bool = False) -> bytes:
+    """Build a SPNEGO NegTokenResp"""
+    body = b''
+    if neg_state is not None:
+        body += der(0xa0, der(0x0a, bytes([neg_state])))
+    if supported_mech:
+        body += der(0xa1, NTLMSSP_OID)
+    if response_token is not None:
+        body += der(0xa2, der(0x04, response_token))
+    return der(0xa1, der(0x30, body))
+
+def is_spnego(buf) -> bool:
+    """True if buf starts with a NegTokenInit or NegTokenResp"""
+    return len(buf) > 0 and buf[0] in (0x60, 0xa1)
+
+def unwrap_ntlmssp(buf) -> Optional[memoryview]:
+    """Return the NTLMSSP message carried by a raw or SPNEGO wrapped security blob"""
+    return find_ntlmssp(buf)
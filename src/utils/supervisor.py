@@ -0,0 +1,187 @@
+import sys
+import time
+import signal
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Signals that stop a supervised command
+STOP_SIGNALS = tuple(getattr(signal, name) for name in ('SIGINT', 'SIGTERM') if hasattr(signal, name))
+
+class _Component:
+    """A supervised part of the command and how long it took to start and stop"""
+
+    __slots__ = ('name', 'start', 'stop', 'start_s', 'stop_s')
+
+    def __init__(self, name: str, start: Optional[Callable[[], object]], stop: Optional[Callable[[], object]]):
+        self.name = name
+        self.start = start
+        self.stop = stop
+        self.start_s: Optional[float] = None
+        self.stop_s: Optional[float] = None
+
+class Supervisor:
+    """
+    Starts the long-running parts of a command, waits, and stops them again.
+
+    Components start in the order they were added and stop in the reverse
+    order, so the listeners that bring in new work are stopped before the
+    parts that finish it and store the results. The main thread blocks on one
+    Event, set by SIGINT/SIGTERM, request_stop(), fail() or an uncaught
+    exception in any thread (threading.excepthook), so a signal or a crash
+    starts the shutdown at once. A component whose start raised is stopped
+    as well, to release what it had set up. The time to ready, the time
+    from the stop request to the last component stopped and the per-component
+    start and stop times are logged and kept in get_report().
+    """
+
+    def __init__(self, name: str = 'supervisor'):
+        self.logger = logging.getLogger(__name__)
+        self.name = name
+        self.components: List[_Component] = []
+        # Components start() was called on, in start order
+        self.started: List[_Component] = []
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.reason: Optional[str] = None
+        self.failure: Optional[Tuple[str, BaseException]] = None
+        self.ready_s: Optional[float] = None
+        self.shutdown_s: Optional[float] = None
+        self.started_at: Optional[float] = None
+        self.stop_requested_at: Optional[float] = None
+        self.previous_handlers = {}
+        self.previous_excepthook = None
+
+    def add(self, name: str, start: Callable[[], object] = None, stop: Callable[[], object] = None):
+        """
+        Add a component, started after and stopped before the ones added earlier.
+
+        Args:
+            name (str): Name used in the logs and the report
+            start (Callable): Returns once the component is ready, raises if it cannot start
+            stop (Callable): Stops the component and waits for its work to be written out
+        """
+        self.components.append(_Component(name, start, stop))
+
+    def request_stop(self, reason: str = 'stop requested'):
+        """Start the shutdown; only the first request counts"""
+        self._request(reason)
+
+    def fail(self, name: str, error: BaseException):
+        """Report that a component failed, which stops the command"""
+        if self._request(f"{name} failed: {error}", (name, error)):
+            self.logger.error(f"[-] {name} failed: {error}")
+
+    def _request(self, reason: str, failure: Tuple[str, BaseException] = None) -> bool:
+        with self.lock:
+            if self.stopping.is_set():
+                return False
+            self.reason = reason
+            self.failure = failure
+            self.stop_requested_at = time.perf_counter()
+            self.stopping.set()
+        return True
+
+    def _on_signal(self, signum, frame):
+        self.request_stop(signal.Signals(signum).name)
+
+    def _on_thread_exception(self, args):
+        # The previous hook still prints the traceback
+        self.previous_excepthook(args)
+        if args.exc_type is SystemExit:
+            return
+        name = args.thread.name if args.thread else 'thread'
+        self.fail(name, args.exc_value if args.exc_value is not None else args.exc_type())
+
+    def _install(self):
+        self.previous_excepthook = threading.excepthook
+        threading.excepthook = self._on_thread_exception
+        # Signal handlers can only be set from the main thread
+        if threading.current_thread() is threading.main_thread():
+            for signum in STOP_SIGNALS:
+                self.previous_handlers[signum] = signal.signal(signum, self._on_signal)
+
+    def _restore_signals(self):
+        # A second Ctrl+C then interrupts a shutdown that hangs
+        for signum, handler in self.previous_handlers.items():
+            signal.signal(signum, handler)
+        self.previous_handlers = {}
+
+    def start(self) -> bool:
+        """Start the components in order; False if one failed or a stop was requested meanwhile"""
+        self._install()
+        self.started_at = time.perf_counter()
+        for component in self.components:
+            if self.stopping.is_set():
+                return False
+            self.started.append(component)
+            started = time.perf_counter()
+            try:
+                if component.start:
+                    component.start()
+            except Exception as e:
+                self.fail(component.name, e)
+                return False
+            finally:
+                component.start_s = time.perf_counter() - started
+        if self.stopping.is_set():
+            return False
+        self.ready_s = time.perf_counter() - self.started_at
+        timings = ', '.join(f"{c.name} {c.start_s * 1000:.0f} ms" for c in self.components)
+        self.logger.info(f"[+] {self.name} ready in {self.ready_s * 1000:.0f} ms ({timings})")
+        return True
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until a stop is requested; False if timeout expired first"""
+        if sys.platform != 'win32':
+            return self.stopping.wait(timeout)
+        # Windows delivers Ctrl+C to the main thread only between waits
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.stopping.is_set():
+            remaining = 0.5 if deadline is None else min(0.5, deadline - time.monotonic())
+            if remaining <= 0:
+                return False
+            self.stopping.wait(remaining)
+        return True
+
+    def stop(self) -> Dict:
+        """Stop the started components in reverse order and return the report"""
+        self._request('shutdown')
+        self._restore_signals()
+        for component in reversed(self.started):
+            started = time.perf_counter()
+            try:
+                if component.stop:
+                    component.stop()
+            except Exception as e:
+                self.logger.error(f"[-] Error stopping {component.name}: {e}")
+            finally:
+                component.stop_s = time.perf_counter() - started
+        self.started = []
+        self.shutdown_s = time.perf_counter() - self.stop_requested_at
+        if self.previous_excepthook:
+            threading.excepthook = self.previous_excepthook
+            self.previous_excepthook = None
+        timings = ', '.join(f"{c.name} {c.stop_s * 1000:.0f} ms" for c in self.components if c.stop_s is not None)
+        self.logger.info(f"[*] {self.name} stopped in {self.shutdown_s * 1000:.0f} ms after {self.reason} "
+                         f"({timings})")
+        return self.get_report()
+
+    def run(self) -> int:
+        """Start, wait for a signal or a failure, stop; the exit code is 1 if a component failed"""
+        try:
+            if self.start():
+                self.wait()
+        finally:
+            self.stop()
+        return 1 if self.failure else 0
+
+    def get_report(self) -> Dict:
+        """Time to ready and to shut down, why it stopped, and start/stop times per component"""
+        return {
+            'ready_s': self.ready_s,
+            'shutdown_s': self.shutdown_s,
+            'reason': self.reason,
+            'failed': self.failure[0] if self.failure else None,
+            'components': {c.name: {'start_s': c.start_s, 'stop_s': c.stop_s} for c in self.components},
+        }
@@ -0,0 +1,171 @@
+import time
+import errno
+import socket
+import logging
+import selectors
+import threading
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional
+
+from src.utils.name_resolver import NameResolver
+
+# Ports worth relaying to, in the order they are reported
+RELAY_SERVICES = {
+    445: "SMB",
+    139: "NetBIOS-SSN",
+    80: "HTTP",
+    443: "HTTPS",
+    389: "LDAP",
+    636: "LDAPS",
+}
+
+# SMB transports in order of preference: direct TCP, then NetBIOS session service
+SMB_PORTS = (445, 139)
+
+ServiceStatus = namedtuple('ServiceStatus', ['port', 'service', 'reachable', 'connect_s', 'error'])
+
+_CONNECTING = (0, errno.EINPROGRESS, errno.EWOULDBLOCK, getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK))
+
+def probe_ports(address: str, ports: Iterable[int], timeout: float = 3.0) -> Dict[int, ServiceStatus]:
+    """
+    TCP connect to all ports of address at once.
+
+    Args:
+        address (str): IPv4 address to probe
+        ports (Iterable[int]): Ports to connect to
+        timeout (float): Deadline for the whole probe, in seconds
+
+    Returns:
+        Dict[int, ServiceStatus]: Status per port; ports still connecting at the deadline are unreachable
+    """
+    started = time.perf_counter()
+    deadline = started + timeout
+    results = {}
+    selector = selectors.DefaultSelector()
+    try:
+        for port in ports:
+            service = RELAY_SERVICES.get(port, str(port))
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            error = sock.connect_ex((address, port))
+            if error in _CONNECTING:
+                selector.register(sock, selectors.EVENT_WRITE, port)
+            else:
+                sock.close()
+                results[port] = ServiceStatus(port, service, False, None, errno.errorcode.get(error, str(error)))
+        while selector.get_map():
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            for key, _ in selector.select(remaining):
+                sock, port = key.fileobj, key.data
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                selector.unregister(sock)
+                sock.close()
+                service = RELAY_SERVICES.get(port, str(port))
+                if error:
+                    results[port] = ServiceStatus(port, service, False, None,
+                                                  errno.errorcode.get(error, str(error)))
+                else:
+                    results[port] = ServiceStatus(port, service, True, time.perf_counter() - started, None)
+    finally:
+        for key in list(selector.get_map().values()):
+            results[key.data] = ServiceStatus(key.data, RELAY_SERVICES.get(key.data, str(key.data)),
+                                              False, None, 'timed out')
+            key.fileobj.close()
+        selector.close()
+    return results
+
+class ReachabilityReport:
+    """Which relay services of a target accepted a TCP connection"""
+
+    def __init__(self, target: str, address: str, services: Dict[int, ServiceStatus]):
+        self.target = target
+        self.address = address
+        self.services = services
+        self.probed_at = time.time()
+
+    def reachable(self, port: int) -> bool:
+        status = self.services.get(port)
+        return bool(status and status.reachable)
+
+    @property
+    def accessible(self) -> List[ServiceStatus]:
+        """Reachable services in RELAY_SERVICES order"""
+        return [status for status in self.services.values() if status.reachable]
+
+    def smb_port(self) -> Optional[int]:
+        """Port to relay SMB to: 445 if it answers, else 139, else None"""
+        for port in SMB_PORTS:
+            if self.reachable(port):
+                return port
+        return None
+
+    def to_dict(self) -> Dict:
+        return {
+            'target': self.target,
+            'address': self.address,
+            'probed_at': self.probed_at,
+            'smb_port': self.smb_port(),
+            'services': {port: status._asdict() for port, status in self.services.items()},
+        }
+
+class TargetProbe:
+    """
+    Process-wide cache of target reachability reports.
+
+    A report is probed once per target and session; later calls reuse it and
+    only connect to ports it has not covered yet, so main's validation and
+    the relay's connectivity check cost one round of probes together.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, resolver: NameResolver = None):
+        self.logger = logging.getLogger(__name__)
+        self.resolver = resolver
+        self.reports: Dict[str, ReachabilityReport] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def shared(cls) -> 'TargetProbe':
+        """Return the process-wide probe cache"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def probe(self, target: str, ports: Iterable[int] = None, timeout: float = 3.0,
+              refresh: bool = False) -> Optional[ReachabilityReport]:
+        """
+        Reachability report of target, probing only what the cached report lacks.
+
+        Args:
+            target (str): Host name or IP address
+            ports (Iterable[int]): Ports to cover, RELAY_SERVICES by default
+            timeout (float): Deadline for the probe, in seconds
+            refresh (bool): Probe every port again instead of using the cache
+
+        Returns:
+            Optional[ReachabilityReport]: The report, None if target does not resolve
+        """
+        address = (self.resolver or NameResolver.shared()).resolve_address(target)
+        if address is None:
+            return None
+        ports = list(ports or RELAY_SERVICES)
+        with self.lock:
+            cached = None if refresh else self.reports.get(address)
+        known = cached.services if cached else {}
+        missing = [port for port in ports if port not in known]
+        if not missing:
+            return cached
+        results = probe_ports(address, missing, timeout)
+        # Keep the RELAY_SERVICES order for reports and logs
+        order = list(RELAY_SERVICES)
+        services = dict(sorted({**known, **results}.items(),
+                               key=lambda item: order.index(item[0]) if item[0] in order else item[0]))
+        report = ReachabilityReport(target, address, services)
+        with self.lock:
+            self.reports[address] = report
+        return report
@@ -0,0 +1,39 @@
+import threading
+import time
+
+from src.utils.event_sink import EventSink
+
+
+def test_emit_does_not_wait_for_the_consumer():
+    release = threading.Event()
+    written = []
+
+    def slow_consumer(record):
+        release.wait(5)
+        written.append(record)
+
+    sink = EventSink(slow_consumer, max_queued=2)
+    started = time.perf_counter()
+    # At most the record being written and two queued ones are kept, the rest is dropped
+    results = [sink.emit({'n': n}) for n in range(4)]
+    assert time.perf_counter() - started < 0.5
+    assert results[:2] == [True, True] and not results[-1]
+    release.set()
+    sink.stop()
+    stats = sink.get_stats()
+    assert stats['emitted'] + stats['dropped'] == 4
+    assert stats['written'] == stats['emitted'] == len(written)
+    assert [record['n'] for record in written] == sorted(record['n'] for record in written)
+
+
+def test_consumer_errors_are_counted():
+    def failing_consumer(record):
+        if record['fail']:
+            raise RuntimeError("storage down")
+
+    sink = EventSink(failing_consumer)
+    sink.emit({'fail': True})
+    sink.emit({'fail': False})
+    sink.stop()
+    stats = sink.get_stats()
+    assert stats['failed'] == 1 and stats['written'] == 1 and stats['queued'] == 0
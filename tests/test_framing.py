@@ -0,0 +1,92 @@
+import asyncio
+import os
+
+from src.utils.framing import BufferPool, FrameTooLarge, start_framed_server
+from src.utils.smb2 import netbios_frame
+
+
+def _serve(payloads, buffer_size=64, max_frame=1024):
+    """Send payloads through a framed server in awkward chunks and collect what it reads"""
+    received = []
+    errors = []
+
+    async def handler(connection):
+        try:
+            while True:
+                kind, message = await connection.read_frame()
+                received.append((kind, bytes(message)))
+        except asyncio.IncompleteReadError:
+            pass
+        except FrameTooLarge as e:
+            errors.append(e)
+
+    async def scenario():
+        pool = BufferPool(size=buffer_size)
+        server = await start_framed_server(handler, '127.0.0.1', 0, buffer_pool=pool, max_frame=max_frame)
+        port = server.sockets[0].getsockname()[1]
+        for _ in range(2):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            stream = b''.join(netbios_frame(payload) for payload in payloads)
+            # Split inside headers and merge several frames into one segment
+            for chunk in (stream[:3], stream[3:5], stream[5:]):
+                writer.write(chunk)
+                await writer.drain()
+                await asyncio.sleep(0.01)
+            writer.close()
+            await asyncio.sleep(0.05)
+        server.close()
+        await server.wait_closed()
+        return pool
+
+    pool = asyncio.run(scenario())
+    return received, errors, pool
+
+
+def test_frames_survive_split_and_merged_segments():
+    payloads = [b'\xfeSMB' + os.urandom(20), b'', b'\xfeSMB' + os.urandom(30), b'x' * 40]
+    received, errors, pool = _serve(payloads)
+    assert received == [(0, payload) for payload in payloads] * 2
+    assert not errors
+    # The second connection reused the first one's buffer
+    assert pool.allocated == 1
+
+
+def test_frames_larger_than_the_buffer_grow_it():
+    payloads = [os.urandom(500), b'small']
+    received, errors, _ = _serve(payloads)
+    assert received == [(0, payload) for payload in payloads] * 2
+
+
+def test_oversized_frames_are_refused():
+    received, errors, _ = _serve([b'ok', os.urandom(2000)])
+    assert received == [(0, b'ok')] * 2
+    assert len(errors) == 2
+
+
+def test_unframed_reads_share_the_buffer():
+    results = []
+
+    async def handler(connection):
+        results.append(await connection.peek(4))
+        head = await connection.read_until(b'\r\n\r\n')
+        results.append(bytes(head))
+        await connection.discard(100)
+        results.append(bytes(await connection.read_until(b'\r\n\r\n')))
+
+    async def scenario():
+        server = await start_framed_server(handler, '127.0.0.1', 0, buffer_pool=BufferPool(size=64))
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        stream = b'POST / HTTP/1.1\r\nContent-Length: 100\r\n\r\n' + b'b' * 100 + b'GET / HTTP/1.1\r\n\r\n'
+        # Separators and the body are split across segments and buffer refills
+        for index in range(0, len(stream), 7):
+            writer.write(stream[index:index + 7])
+            await writer.drain()
+            await asyncio.sleep(0.002)
+        await asyncio.sleep(0.05)
+        writer.close()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(scenario())
+    assert results == [b'POST', b'POST / HTTP/1.1\r\nContent-Length: 100\r\n\r\n', b'GET / HTTP/1.1\r\n\r\n']
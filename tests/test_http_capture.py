@@ -0,0 +1,121 @@
+import asyncio
+import binascii
+
+import pytest
+
+from src.modules.capture.http_server import (MAX_CONTENT_LENGTH, NTLMHTTPCaptureServer, decode_ntlm_token,
+                                             parse_request_head)
+from src.utils.ntlm import (build_authenticate_message, build_challenge_message, build_negotiate_message,
+                            parse_authenticate_message, verify_ntlmv2_response)
+from src.utils.spnego import neg_token_init, neg_token_resp, unwrap_ntlmssp
+
+CHALLENGE = b'\x11\x22\x33\x44\x55\x66\x77\x88'
+
+
+def test_ntlmv2_roundtrip():
+    challenge = build_challenge_message(CHALLENGE, 'SRV', 'LAB')
+    auth = parse_authenticate_message(build_authenticate_message(challenge, 'alice', 'Secret1', 'LAB'))
+    assert auth['username'] == 'alice'
+    assert auth['domain'] == 'LAB'
+    assert verify_ntlmv2_response(auth, CHALLENGE, 'Secret1')
+    assert not verify_ntlmv2_response(auth, CHALLENGE, 'wrong')
+
+
+def test_parse_request_head_authorization():
+    token = build_negotiate_message()
+    block = (b'GET / HTTP/1.1\r\nHost: x\r\nauthorization: NTLM ' +
+             binascii.b2a_base64(token, newline=False) + b'\r\nConnection: close\r\n\r\n')
+    head = parse_request_head(block)
+    assert head.method == b'GET'
+    assert not head.keep_alive
+    assert decode_ntlm_token(head.authorization) == token
+
+
+def test_parse_request_head_rejects_bad_content_length():
+    for value in (b'-1', b'+5', b'1_000', b'x', str(MAX_CONTENT_LENGTH + 1).encode()):
+        with pytest.raises(ValueError):
+            parse_request_head(b'POST / HTTP/1.1\r\nContent-Length: ' + value + b'\r\n\r\n')
+    assert parse_request_head(b'POST / HTTP/1.1\r\nContent-Length: 12\r\n\r\n').content_length == 12
+
+
+def test_negotiate_scheme_and_large_bodies():
+    events = []
+
+    async def scenario():
+        server = NTLMHTTPCaptureServer('127.0.0.1', 0, on_credential=events.append,
+                                       server_challenge=CHALLENGE)
+        await server.start()
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+
+        async def send(token, body=b''):
+            writer.write(b'POST / HTTP/1.1\r\nHost: x\r\nContent-Length: ' + str(len(body)).encode() +
+                         b'\r\nAuthorization: Negotiate ' + binascii.b2a_base64(token, newline=False) +
+                         b'\r\n\r\n' + body)
+            head = await reader.readuntil(b'\r\n\r\n')
+            blob = None
+            for line in head.split(b'\r\n'):
+                if line.startswith(b'WWW-Authenticate: '):
+                    scheme, _, value = line[18:].partition(b' ')
+                    assert scheme == b'Negotiate'
+                    blob = binascii.a2b_base64(value)
+            return int(head.split(b' ')[1]), blob
+
+        # SPNEGO-wrapped Type 1 with a body larger than the reader's buffer
+        status, blob = await send(neg_token_init(build_negotiate_message()), b'x' * 200000)
+        assert status == 401 and blob[0] == 0xa1
+        challenge = bytes(unwrap_ntlmssp(blob))
+        status, _ = await send(neg_token_resp(build_authenticate_message(challenge, 'alice', 'Secret1', 'LAB')))
+        assert status == 200
+        # Raw NTLMSSP under Negotiate gets a raw challenge, still in the Negotiate scheme
+        status, blob = await send(build_negotiate_message())
+        assert status == 401 and blob.startswith(b'NTLMSSP\x00')
+
+        writer.write(b'POST / HTTP/1.1\r\nContent-Length: 10000000000\r\n\r\n')
+        assert (await reader.readuntil(b'\r\n\r\n')).startswith(b'HTTP/1.1 400 ')
+        assert await reader.read() == b''
+        writer.close()
+        await server.stop()
+
+    asyncio.run(scenario())
+    assert len(events) == 1 and events[0]['username'] == 'alice'
+
+
+def test_keep_alive_handshakes_capture_credentials():
+    events = []
+
+    async def scenario():
+        server = NTLMHTTPCaptureServer('127.0.0.1', 0, on_credential=events.append,
+                                       server_challenge=CHALLENGE)
+        await server.start()
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+
+        async def send(token=None):
+            auth = b''
+            if token:
+                auth = b'Authorization: NTLM ' + binascii.b2a_base64(token, newline=False) + b'\r\n'
+            writer.write(b'GET / HTTP/1.1\r\nHost: x\r\n' + auth + b'\r\n')
+            head = await reader.readuntil(b'\r\n\r\n')
+            challenge = None
+            for line in head.split(b'\r\n'):
+                if line.startswith(b'WWW-Authenticate: NTLM '):
+                    challenge = binascii.a2b_base64(line[23:])
+            return int(head.split(b' ')[1]), challenge
+
+        for _ in range(2):  # Two full exchanges on the same connection
+            assert (await send())[0] == 401
+            status, challenge = await send(build_negotiate_message())
+            assert status == 401 and challenge
+            status, _ = await send(build_authenticate_message(challenge, 'alice', 'Secret1', 'LAB'))
+            assert status == 200
+        writer.close()
+        await asyncio.sleep(0.05)
+        await server.stop()
+        return server
+
+    server = asyncio.run(scenario())
+    assert server.connections == 1
+    assert server.handshakes == 2
+    assert len(events) == 2
+    assert events[0]['username'] == 'alice'
+    assert events[0]['hash_type'] == 'NTLMv2'
+    assert events[0]['ntlm_hash'].startswith('alice::LAB:1122334455667788:')
@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Cumulative import time allowed for src.main, in microseconds (about 25 ms when lazy imports
+# were introduced, 530 ms before)
+MAIN_BUDGET_US = 150_000
+
+# Third-party stacks only the commands that use them may load
+HEAVY_PACKAGES = {'scapy', 'impacket', 'pymongo', 'psutil', 'dns', 'pyroute2', 'passlib'}
+
+
+def import_times(module):
+    """Cumulative microseconds per module imported by `import module` in a fresh interpreter"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOT,
+                            capture_output=True, text=True, timeout=60, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_cli_startup_leaves_command_stacks_unloaded():
+    loaded = {name.split('.')[0] for name in import_times('src.main')}
+    assert not loaded & HEAVY_PACKAGES
+
+
+def test_cli_startup_stays_within_budget():
+    # The best of three runs, the first may compile bytecode
+    best = min(import_times('src.main')['src.main'] for _ in range(3))
+    assert best <= MAIN_BUDGET_US, f"importing src.main took {best / 1000:.0f} ms"
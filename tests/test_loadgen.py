@@ -0,0 +1,49 @@
+import socket
+import threading
+
+from src.modules.capture.loadgen import ResponderLoadGenerator, compare_reports
+from src.modules.capture.packets import answer_query
+
+
+def _echo_poisoner(protocol, stop):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(0.1)
+
+    def serve():
+        while not stop.is_set():
+            try:
+                data, address = sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            sock.sendto(answer_query(protocol, data, '10.0.0.5')[1], address)
+        sock.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return sock.getsockname()[1]
+
+
+def test_load_generator_measures_answers():
+    stop = threading.Event()
+    try:
+        ports = {protocol: _echo_poisoner(protocol, stop) for protocol in ('llmnr', 'nbt-ns', 'mdns')}
+        report = ResponderLoadGenerator('127.0.0.1', ports, rate=400, duration=0.5, timeout=0.5,
+                                        source_address='127.0.0.1', response_ip='10.0.0.5',
+                                        seed=1).run()
+    finally:
+        stop.set()
+    assert report['sent'] == 200
+    assert report['answered'] == 200
+    assert report['drop_rate'] == 0.0
+    assert report['latency']['count'] == 200
+    assert sum(p['sent'] for p in report['protocols'].values()) == 200
+
+
+def test_compare_reports_flags_regressions():
+    baseline = {'latency': {'p50_ms': 1.0, 'p95_ms': 2.0, 'p99_ms': 3.0},
+                'answers_per_s': 1000.0, 'drop_rate': 0.0}
+    current = {'latency': {'p50_ms': 1.1, 'p95_ms': 2.0, 'p99_ms': 6.0},
+               'answers_per_s': 800.0, 'drop_rate': 0.05}
+    assert compare_reports(baseline, baseline) == []
+    regressions = compare_reports(baseline, current)
+    assert [r.split()[0] for r in regressions] == ['p99_ms', 'answers_per_s', 'drop_rate']
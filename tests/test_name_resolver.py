@@ -0,0 +1,86 @@
+import threading
+
+from src.utils.name_resolver import NameResolver
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class SlowLookup:
+    """Counts calls and answers once released"""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = []
+        self.release = threading.Event()
+
+    def __call__(self, key):
+        self.calls.append(key)
+        self.release.wait(5)
+        return self.answers.get(key)
+
+
+def _resolver(addresses=None, names=None, **kwargs):
+    address_lookup = SlowLookup(addresses or {})
+    name_lookup = SlowLookup(names or {})
+    address_lookup.release.set()
+    name_lookup.release.set()
+    resolver = NameResolver(address_lookup=address_lookup, name_lookup=name_lookup, **kwargs)
+    return resolver, address_lookup, name_lookup
+
+
+def test_answers_and_failures_are_cached_for_their_ttl():
+    clock = FakeClock()
+    resolver, lookup, _ = _resolver({'fs01.corp.local': '10.0.0.5'}, positive_ttl=60, negative_ttl=5,
+                                    clock=clock)
+    assert resolver.resolve_address('fs01.corp.local') == '10.0.0.5'
+    assert resolver.resolve_address('FS01.corp.local') == '10.0.0.5'
+    assert resolver.resolve_address('nope.corp.local') is None
+    assert resolver.resolve_address('nope.corp.local') is None
+    assert resolver.resolve_address('10.0.0.9') == '10.0.0.9'
+    assert lookup.calls == ['fs01.corp.local', 'nope.corp.local']
+    clock.now += 10
+    resolver.resolve_address('fs01.corp.local')
+    resolver.resolve_address('nope.corp.local')
+    assert lookup.calls[2:] == ['nope.corp.local']
+    stats = resolver.get_stats()
+    assert stats['hits'] == 2 and stats['negative_hits'] == 1 and stats['lookups'] == 3
+
+
+def test_concurrent_requests_share_one_lookup():
+    resolver, lookup, _ = _resolver({'fs01': '10.0.0.5'})
+    lookup.release.clear()
+    futures = [resolver.address('fs01') for _ in range(5)]
+    assert len(set(map(id, futures))) == 1
+    lookup.release.set()
+    assert futures[0].result(5) == '10.0.0.5'
+    assert lookup.calls == ['fs01']
+
+
+def test_cached_name_never_waits():
+    clock = FakeClock()
+    resolver, _, names = _resolver(names={'10.0.0.5': 'FS01'}, positive_ttl=60, clock=clock)
+    names.release.clear()
+    assert resolver.cached_name('10.0.0.5') is None
+    names.release.set()
+    assert resolver.netbios_name('10.0.0.5').result(5) == 'FS01'
+    assert resolver.cached_name('10.0.0.5') == 'FS01'
+    # Expired names are still served while they are refreshed
+    clock.now += 120
+    names.release.clear()
+    assert resolver.cached_name('10.0.0.5') == 'FS01'
+    names.release.set()
+    assert resolver.netbios_name('10.0.0.5').result(5) == 'FS01'
+    assert names.calls == ['10.0.0.5', '10.0.0.5']
+
+
+def test_prefetch_resolves_the_address_then_the_name():
+    resolver, _, names = _resolver({'fs01': '10.0.0.5'}, {'10.0.0.5': 'FS01'})
+    assert resolver.prefetch('fs01').result(5) == '10.0.0.5'
+    assert resolver.netbios_name('10.0.0.5').result(5) == 'FS01'
+    assert names.calls == ['10.0.0.5']
@@ -0,0 +1,63 @@
+import socket
+import struct
+
+import pytest
+
+from src.utils.network_context import (IFA_LABEL, IFA_LOCAL, RTM_NEWADDR, InterfaceAddress,
+                                       NetworkContext, parse_netlink_addresses)
+
+ADDRESSES = [
+    InterfaceAddress('lo', '127.0.0.1', 8),
+    InterfaceAddress('eth0', '169.254.10.1', 16),
+    InterfaceAddress('eth0', '10.0.0.5', 24),
+    InterfaceAddress('Wi-Fi', '192.168.1.20', 24),
+]
+
+
+def _attr(attr_type, payload):
+    length = 4 + len(payload)
+    return struct.pack('=HH', length, attr_type) + payload + b'\x00' * (-length % 4)
+
+
+def test_parse_netlink_addresses():
+    body = (struct.pack('=BBBBI', socket.AF_INET, 24, 0, 0, 2) +
+            _attr(IFA_LOCAL, socket.inet_aton('10.0.0.5')) + _attr(IFA_LABEL, b'eth0\x00'))
+    message = struct.pack('=IHHII', 16 + len(body), RTM_NEWADDR, 2, 1, 0) + body
+    assert parse_netlink_addresses(message) == [InterfaceAddress('eth0', '10.0.0.5', 24)]
+
+
+def test_resolution_is_cached_and_refreshed():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return list(ADDRESSES) if len(calls) == 1 else ADDRESSES[:1]
+
+    context = NetworkContext(loader)
+    changes = []
+    context.add_listener(changes.append)
+    assert context.resolve('eth0') == '10.0.0.5'
+    assert context.resolve('wi-fi') == '192.168.1.20'
+    assert context.resolve('10.0.0.9') == '10.0.0.9'
+    assert context.resolve('missing', fallback='0.0.0.0') == '0.0.0.0'
+    assert context.primary_ip() == '10.0.0.5'
+    assert [str(n) for n in context.networks('10.0.0.5')] == ['10.0.0.0/24']
+    assert len(calls) == 1
+
+    context.refresh()
+    assert changes == [context]
+    assert context.primary_ip() == '127.0.0.1'
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_NETLINK'), reason='rtnetlink is Linux only')
+def test_watchers_get_distinct_netlink_port_ids():
+    contexts = [NetworkContext(loader=lambda: list(ADDRESSES)) for _ in range(3)]
+    try:
+        for context in contexts:
+            context.start_watching()
+        assert all(context.watch_thread for context in contexts)
+        port_ids = {context.watch_socket.getsockname()[0] for context in contexts}
+        assert len(port_ids) == 3 and 0 not in port_ids
+    finally:
+        for context in contexts:
+            context.stop_watching()
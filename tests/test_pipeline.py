@@ -0,0 +1,153 @@
+import os
+import queue
+import struct
+import threading
+import time
+
+import bson
+import pytest
+
+from src.modules.pipeline.daemon import STORAGE, PipelineDaemon, Subsystem
+from src.modules.pipeline.records import (KIND_CAPTURE, KIND_RESULT, RecordStore, RecordWriter, decode_record,
+                                          encode_record)
+
+LENGTH = struct.Struct('!I')
+
+
+# Module-level so that spawned processes can import them
+
+def start_emitter(options, store):
+    """Subsystem storing a capture per count and a result when it stops"""
+    ids = [store.store_capture({'type': 'LLMNR', 'source': '10.0.0.5', 'request_name': f'fs{i:02d}'})
+           for i in range(options['count'])]
+    return lambda: store.store_result({'status': 'stopped', 'capture_id': ids[-1]})
+
+
+def start_crasher(options, store):
+    """Subsystem whose process dies shortly after it is ready"""
+    threading.Timer(options['after'], os._exit, (3,)).start()
+    return lambda: None
+
+
+def start_broken(options, store):
+    raise ValueError('no such interface')
+
+
+def open_file_storage(options):
+    """Storage appending each raw BSON document, length-prefixed, to options['path']"""
+    output = open(options['path'], 'ab')
+
+    def write(collection, documents):
+        for document in documents:
+            name = collection.encode()
+            output.write(LENGTH.pack(len(name)) + name + LENGTH.pack(len(document)) + document)
+        return len(documents)
+
+    return write, output.close
+
+
+def read_file_storage(path):
+    documents = []
+    with open(path, 'rb') as stored:
+        data = stored.read()
+    offset = 0
+    while offset < len(data):
+        (size,) = LENGTH.unpack_from(data, offset)
+        collection = data[offset + 4:offset + 4 + size].decode()
+        offset += 4 + size
+        (size,) = LENGTH.unpack_from(data, offset)
+        documents.append((collection, bson.decode(data[offset + 4:offset + 4 + size])))
+        offset += 4 + size
+    return documents
+
+
+def test_records_reach_storage_as_raw_bson():
+    records = queue.Queue()
+    store = RecordStore(records)
+    capture_id = store.store_capture({'type': 'SMB', 'username': 'alice', 'ntlm_hash': 'alice::LAB:1122'})
+    store.store_results([{'action': 'list_shares', 'capture_id': capture_id, 'result': ['C$', 'IPC$']}])
+    kind, document = decode_record(records.queue[0])
+    assert kind == KIND_CAPTURE and str(document['_id']) == capture_id and document['username'] == 'alice'
+
+    written = []
+    writer = RecordWriter(records, lambda collection, documents: written.extend(
+        (collection, bson.decode(document)) for document in documents) or len(documents))
+    assert writer.drain(timeout=0)
+    assert [(collection, document.get('username') or document['action']) for collection, document in written] == [
+        ('captures', 'alice'), ('results', 'list_shares')]
+    assert written[1][1]['result'] == ['C$', 'IPC$'] and str(written[1][1]['capture_id']) == capture_id
+    assert writer.get_stats()['written'] == 2 and store.get_stats()['sent'] == 2
+    with pytest.raises(ValueError):
+        decode_record(b'\x09' + encode_record(KIND_RESULT, {})[1:])
+
+
+def test_full_queue_blocks_up_to_the_timeout_then_drops():
+    records = queue.Queue(1)
+    waiting = RecordStore(records, block_timeout=0.05)
+    assert waiting.store_result({'status': 'ok'})
+    assert waiting.store_result({'status': 'ok'}) is None
+    stats = waiting.get_stats()
+    assert (stats['sent'], stats['dropped']) == (1, 1) and stats['blocked_s'] >= 0.05
+    # The responder's store never waits
+    never = RecordStore(records, block_timeout=0)
+    started = time.perf_counter()
+    assert never.store_capture({'type': 'LLMNR'}) is None
+    assert time.perf_counter() - started < 0.05
+
+
+@pytest.fixture
+def daemon_factory():
+    daemons = []
+
+    def create(subsystems, path, **kwargs):
+        daemon = PipelineDaemon(subsystems, storage=(open_file_storage, {'path': str(path)}), metrics_interval=0.1,
+                                stop_timeout=5.0, **kwargs)
+        daemon.open()
+        daemons.append(daemon)
+        return daemon
+
+    yield create
+    for daemon in daemons:
+        daemon.close()
+
+
+def test_subsystems_run_in_their_own_processes(daemon_factory, tmp_path):
+    path = tmp_path / 'records.bin'
+    daemon = daemon_factory([Subsystem('emitter', start_emitter, {'count': 50}, 1.0)], path)
+    assert daemon.names() == [STORAGE, 'emitter']
+    for name in daemon.names():
+        daemon.start_process(name)
+    time.sleep(0.5)
+    stats = daemon.get_stats()['processes']
+    assert {stats[name]['pid'] for name in daemon.names()}.isdisjoint({os.getpid()})
+    assert stats['emitter']['records']['sent'] == 50 and stats['emitter']['rss_mb']
+    assert 'cpu_percent' in stats['emitter']
+    for name in reversed(daemon.names()):
+        daemon.stop_process(name)
+    assert daemon.get_stats()['processes'][STORAGE]['storage']['written'] == 51
+
+    documents = read_file_storage(path)
+    assert [collection for collection, _ in documents] == ['captures'] * 50 + ['results']
+    assert documents[-1][1]['capture_id'] == str(documents[-2][1]['_id'])
+
+
+def test_process_exit_is_reported_at_once(daemon_factory, tmp_path):
+    failures = []
+    failed = threading.Event()
+    daemon = daemon_factory([Subsystem('relay', start_crasher, {'after': 0.2}, 1.0)], tmp_path / 'records.bin',
+                            on_failure=lambda name, error: (failures.append((name, str(error))), failed.set()))
+    daemon.start_process(STORAGE)
+    daemon.start_process('relay')
+    assert failed.wait(5)
+    assert failures[0][0] == 'relay' and 'exited with code 3' in failures[0][1]
+    daemon.stop_process('relay')
+    daemon.stop_process(STORAGE)
+    assert len(failures) == 1
+
+
+def test_failed_start_is_raised(daemon_factory, tmp_path):
+    daemon = daemon_factory([Subsystem('sniffer', start_broken, {}, 0.0)], tmp_path / 'records.bin')
+    daemon.start_process(STORAGE)
+    with pytest.raises(RuntimeError, match='no such interface'):
+        daemon.start_process('sniffer')
+    daemon.stop_process(STORAGE)
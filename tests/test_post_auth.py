@@ -0,0 +1,133 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from src.modules.exploit import post_auth
+from src.modules.exploit.ntlmrelayserver import NTLMRelayServer
+from src.modules.exploit.post_auth import PostAuthPipeline, register_action
+from src.utils.event_loop import EventLoopThread
+from src.utils.event_sink import EventSink
+from src.utils.smb2_client import SMB2StubClient
+from src.utils.smb2_server import SMB2StubServer
+
+TARGET = '127.0.0.2'
+
+
+class FakeConnection:
+    """Stands in for an SMBConnection: a socket the watchdog can shut down"""
+
+    def __init__(self):
+        self.sock, self.peer = socket.socketpair()
+        self.closed = False
+
+    def getSMBServer(self):
+        return self
+
+    def get_socket(self):
+        return self.sock
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+        self.peer.close()
+
+
+def join_workers():
+    # Idle pool workers only exit after stop(); keep them from leaking into later thread counts
+    for thread in threading.enumerate():
+        if thread.name.startswith('post-auth'):
+            thread.join(5)
+
+
+@pytest.fixture
+def actions(monkeypatch):
+    monkeypatch.setattr(post_auth, 'POST_AUTH_ACTIONS', dict(post_auth.POST_AUTH_ACTIONS))
+
+    @register_action('greet')
+    def greet(connection, output):
+        output.write("hello\n")
+        return 42
+
+    @register_action('broken')
+    def broken(connection, output):
+        raise RuntimeError("access denied")
+
+    @register_action('hang', timeout=0.2)
+    def hang(connection, output):
+        # Blocks like an impacket call waiting for an answer that never comes
+        if not connection.get_socket().recv(1):
+            raise ConnectionError("connection closed")
+
+    @register_action('nap')
+    def nap(connection, output):
+        time.sleep(0.5)
+
+    yield
+    join_workers()
+
+
+def test_actions_capture_output_and_time_out(actions):
+    batches = []
+    sink = EventSink(batches.append, batch_size=10, flush_interval=5.0)
+    pipeline = PostAuthPipeline(['greet', 'broken', 'hang', 'greet'], sink=sink)
+    connection = FakeConnection()
+    started = time.perf_counter()
+    results = pipeline.submit(connection, '10.0.0.5:445', 'LAB\\alice').result(5)
+    assert time.perf_counter() - started < 2
+    assert [r['status'] for r in results] == ['ok', 'error', 'timeout', 'skipped']
+    assert results[0]['output'] == "hello\n" and results[0]['result'] == 42
+    assert results[1]['error'] == 'access denied'
+    assert connection.closed
+    pipeline.stop()
+    sink.stop()
+    # Stopping flushed the four results as one batch
+    assert [len(batch) for batch in batches] == [4]
+    assert pipeline.get_stats()['pending'] == 0
+
+
+def test_stop_closes_sessions_still_queued(actions):
+    pipeline = PostAuthPipeline(['nap'], workers=1)
+    running, queued = FakeConnection(), FakeConnection()
+    pipeline.submit(running, '10.0.0.5:445', 'LAB\\alice')
+    waiting = pipeline.submit(queued, '10.0.0.6:445', 'LAB\\bob')
+    pipeline.stop()
+    assert waiting.cancelled()
+    assert queued.closed and running.closed
+    assert pipeline.get_stats()['pending'] == 0
+
+
+def test_unknown_actions_are_rejected():
+    with pytest.raises(ValueError):
+        PostAuthPipeline(['no_such_action'])
+
+
+def test_slow_actions_do_not_delay_the_next_relay(actions):
+    target_loop = EventLoopThread('stub-target')
+    target_loop.start()
+    target = SMB2StubServer(TARGET, 0, {'alice': 'Secret1'})
+    target_loop.run(target.start())
+    relay = NTLMRelayServer('127.0.0.1', 0, target_port=target.port, pool_depth=0,
+                            post_auth_actions=['nap'], post_auth_workers=2)
+    relay.target = TARGET
+    relay.target_computer_name = TARGET
+    relay.start()
+    try:
+        timings = []
+        for _ in range(2):
+            started = time.perf_counter()
+            asyncio.run(SMB2StubClient('127.0.0.1', relay.listen_port, 'alice', 'Secret1', 'LAB').authenticate())
+            timings.append(time.perf_counter() - started)
+        # Both relays were answered while the first action was still sleeping
+        assert sum(timings) < 0.5
+        assert target.accepted == 2
+        deadline = time.time() + 5
+        while relay.get_post_auth_stats()['ok'] < 2 and time.time() < deadline:
+            time.sleep(0.02)
+        assert relay.get_post_auth_stats()['ok'] == 2
+    finally:
+        relay.stop()
+        target_loop.run(target.stop())
+        target_loop.stop()
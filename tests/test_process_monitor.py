@@ -0,0 +1,78 @@
+import subprocess
+import sys
+import threading
+import time
+
+from src.modules.exploit.ntlmrelayserver import IMPACKET_MARKERS
+from src.utils.process_monitor import ProcessOutputMonitor
+
+# Prints a marker line in two writes, floods stderr and prints the marker again
+CHILD = r"""
+import sys, time
+sys.stdout.write("[*] Servers started\n[*] Authenticating against smb://10.0.0.5 as LAB/alice SUCC")
+sys.stdout.flush()
+time.sleep(0.1)
+sys.stdout.write("EED\n")
+sys.stdout.flush()
+sys.stderr.write("x" * 70000 + "\n" + "noise\n" * 50000)
+sys.stdout.write("[*] Started interactive SMB client shell via TCP on 127.0.0.1:11000\nSUCCEED\n")
+"""
+
+
+def spawn(code):
+    return subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_one_thread_reads_every_child():
+    monitor = ProcessOutputMonitor()
+    events = []
+    threads = threading.active_count()
+    processes = [spawn(CHILD) for _ in range(4)]
+    try:
+        for index, process in enumerate(processes):
+            monitor.watch(process, IMPACKET_MARKERS, lambda event, line, index=index: events.append((index, event)),
+                          name=f"child{index}")
+        assert threading.active_count() == threads + 1
+        # Children only exit if their stderr flood was drained
+        assert wait_for(lambda: all(process.poll() is not None for process in processes))
+        assert wait_for(lambda: monitor.get_stats()['open_streams'] == 0)
+        # Each event fires once per process, a marker split across writes included
+        assert sorted(events) == sorted((index, event) for index in range(4) for event in IMPACKET_MARKERS)
+        stats = monitor.get_stats()
+        assert stats['processes'] == 4 and stats['streams'] == 8
+        # Four stdout lines; on stderr the 70000-byte line is handed on in two pieces
+        assert stats['lines'] == 4 * (4 + 2 + 50000)
+    finally:
+        monitor.stop()
+        for process in processes:
+            process.kill()
+            process.wait()
+    assert threading.active_count() == threads
+
+
+def test_callback_errors_do_not_stop_the_monitor():
+    monitor = ProcessOutputMonitor()
+    events = []
+
+    def callback(event, line):
+        events.append(event)
+        raise RuntimeError("boom")
+
+    try:
+        first = spawn("print('SUCCEED')")
+        monitor.watch(first, IMPACKET_MARKERS, callback)
+        assert wait_for(lambda: events == ['authenticated'])
+        second = spawn("print('SUCCEED')")
+        monitor.watch(second, IMPACKET_MARKERS, callback)
+        assert wait_for(lambda: events == ['authenticated'] * 2)
+        first.wait()
+        second.wait()
+    finally:
+        monitor.stop()
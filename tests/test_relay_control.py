@@ -0,0 +1,123 @@
+import asyncio
+import os
+import socket
+
+import pytest
+
+from src.modules.exploit.ntlmrelayserver import NTLMRelayServer
+from src.modules.exploit.relay_control import RelayControlServer, send_command
+from src.utils.event_loop import EventLoopThread
+from src.utils.ntlm import build_authenticate_message, build_negotiate_message
+from src.utils.smb2 import (STATUS_ACCESS_DENIED, STATUS_MORE_PROCESSING_REQUIRED, build_session_setup_request,
+                            session_setup_response_token)
+from src.utils.smb2_client import SMB2StubClient
+from src.utils.smb2_server import SMB2StubServer
+from src.utils.spnego import neg_token_init, neg_token_resp, unwrap_ntlmssp
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs UNIX domain sockets')
+
+OLD_TARGET = '127.0.0.2'
+NEW_TARGET = '127.0.0.3'
+USERS = {'alice': 'Secret1'}
+
+
+@pytest.fixture
+def relay(tmp_path):
+    target_loop = EventLoopThread('stub-target')
+    target_loop.start()
+    old = SMB2StubServer(OLD_TARGET, 0, USERS)
+    target_loop.run(old.start())
+    # Both targets share a port number so that only the address changes
+    new = SMB2StubServer(NEW_TARGET, old.port, USERS)
+    target_loop.run(new.start())
+    relay = NTLMRelayServer('127.0.0.1', 0, target_port=old.port, pool_depth=0, post_auth_actions=[])
+    relay.target = OLD_TARGET
+    relay.target_computer_name = OLD_TARGET
+    relay.start()
+    control = RelayControlServer(relay, str(tmp_path / 'relay.sock'))
+    control.start()
+    try:
+        yield relay, control, old, new
+    finally:
+        control.stop()
+        relay.stop()
+        target_loop.run(old.stop())
+        target_loop.run(new.stop())
+        target_loop.stop()
+
+
+def relay_once(port):
+    return asyncio.run(SMB2StubClient('127.0.0.1', port, 'alice', 'Secret1', 'LAB').authenticate())['status']
+
+
+def test_target_swap_leaves_open_relays_on_their_target(relay):
+    relay, control, old, new = relay
+
+    async def relay_across_swap():
+        client = SMB2StubClient('127.0.0.1', relay.listen_port, 'alice', 'Secret1', 'LAB')
+        await client.connect()
+        try:
+            await client.negotiate()
+            header, message = await client._request(build_session_setup_request(
+                neg_token_init(build_negotiate_message()), client.message_id))
+            assert header.status == STATUS_MORE_PROCESSING_REQUIRED
+            # The relay now holds a session on the old target
+            loop = asyncio.get_running_loop()
+            answer = await loop.run_in_executor(None, lambda: send_command(control.path, 'reconfigure',
+                                                                           target=NEW_TARGET))
+            assert answer['ok'] and answer['config']['target'] == NEW_TARGET
+            challenge = unwrap_ntlmssp(session_setup_response_token(message))
+            authenticate = build_authenticate_message(challenge, 'alice', 'Secret1', 'LAB')
+            header, _ = await client._request(build_session_setup_request(
+                neg_token_resp(authenticate), client.message_id, header.session_id))
+            return header.status
+        finally:
+            await client.close()
+
+    assert asyncio.run(relay_across_swap()) == STATUS_ACCESS_DENIED
+    assert (old.accepted, new.accepted) == (1, 0)
+    assert relay_once(relay.listen_port) == STATUS_ACCESS_DENIED
+    assert (old.accepted, new.accepted) == (1, 1)
+    assert relay.generation == 1
+
+
+def test_scope_and_options_are_swapped_together(relay, tmp_path):
+    relay, control, old, new = relay
+    scope = tmp_path / 'scope.txt'
+    scope.write_text(f'{NEW_TARGET}:{new.port}\n')
+    answer = send_command(control.path, 'reconfigure', scope_file=str(scope), schedule='priority',
+                          client_timeout=7.5)
+    assert answer['ok']
+    config = answer['config']
+    assert config['scope'] == [f'{NEW_TARGET}:{new.port}']
+    assert (config['schedule'], config['client_timeout']) == ('priority', 7.5)
+    assert relay_once(relay.listen_port) == STATUS_ACCESS_DENIED
+    assert (old.accepted, new.accepted) == (0, 1)
+    status = send_command(control.path, 'status')
+    assert status['ok'] and status['stats']['scheduler']['per_target'][f'{NEW_TARGET}:{new.port}']['succeeded'] == 1
+
+
+def test_rejected_requests_change_nothing(relay, tmp_path):
+    relay, control, old, new = relay
+    before = send_command(control.path, 'status')['config']
+    for options in ({'listen_port': 80}, {'schedule': 'random'}, {'post_auth_actions': ['no_such_action']},
+                    {'scope_file': str(tmp_path / 'missing.txt')}, {}):
+        answer = send_command(control.path, 'reconfigure', **options)
+        assert not answer['ok'] and answer['error']
+    assert not send_command(control.path, 'reboot')['ok']
+    assert send_command(control.path, 'status')['config'] == before
+    assert oct(os.stat(control.path).st_mode & 0o777) == '0o600'
+
+
+def test_socket_is_private_without_touching_the_umask(tmp_path, monkeypatch):
+    def umask(mask):
+        raise AssertionError("the umask is process-wide")
+
+    monkeypatch.setattr(os, 'umask', umask)
+    control = RelayControlServer(None, str(tmp_path / 'relay.sock'))
+    control.start()
+    try:
+        assert oct(os.stat(control.path).st_mode & 0o777) == '0o600'
+    finally:
+        control.stop()
+    assert not os.path.exists(control.path)
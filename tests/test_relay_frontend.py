@@ -0,0 +1,112 @@
+import asyncio
+import base64
+import socket
+
+import pytest
+
+from src.modules.exploit.ntlmrelayserver import (PROTOCOL_HTTP, PROTOCOL_SMB, NTLMRelayServer,
+                                                 sniff_protocol)
+from src.utils.event_loop import EventLoopThread
+from src.utils.event_sink import EventSink
+from src.utils.ntlm import build_authenticate_message, build_negotiate_message
+from src.utils.smb2 import STATUS_ACCESS_DENIED
+from src.utils.smb2_client import SMB2StubClient
+from src.utils.smb2_server import SMB2StubServer
+from src.utils.spnego import neg_token_init, unwrap_ntlmssp
+
+TARGET = '127.0.0.2'
+
+
+@pytest.fixture
+def relay():
+    target_loop = EventLoopThread('stub-target')
+    target_loop.start()
+    target = SMB2StubServer(TARGET, 0, {'alice': 'Secret1', 'bob': 'Secret2'})
+    target_loop.run(target.start())
+    sessions = []
+    sink = EventSink(sessions.append)
+    relay = NTLMRelayServer('127.0.0.1', 0, target_port=target.port, pool_depth=0, post_auth_actions=[],
+                            event_sink=sink, extra_ports=[0])
+    relay.target = TARGET
+    relay.target_computer_name = TARGET
+    relay.start()
+    try:
+        yield relay, target, sessions
+    finally:
+        relay.stop()
+        sink.stop()
+        target_loop.run(target.stop())
+        target_loop.stop()
+
+
+def http_request(sock, authorization=None):
+    """Send one GET and return (status code, WWW-Authenticate value)"""
+    head = b'GET /share HTTP/1.1\r\nHost: fileserver\r\n'
+    if authorization:
+        head += b'Authorization: ' + authorization + b'\r\n'
+    sock.sendall(head + b'\r\n')
+    response = b''
+    while b'\r\n\r\n' not in response:
+        data = sock.recv(4096)
+        if not data:
+            break
+        response += data
+    lines = response.split(b'\r\n')
+    headers = dict(line.split(b': ', 1) for line in lines[1:] if b': ' in line)
+    return int(lines[0].split()[1]), headers.get(b'WWW-Authenticate')
+
+
+def http_relay(port, user, password, scheme=b'NTLM', wrap=lambda token: token):
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+        status, authenticate = http_request(sock)
+        assert (status, authenticate) == (401, b'NTLM')
+        negotiate = wrap(build_negotiate_message())
+        status, authenticate = http_request(sock, scheme + b' ' + base64.b64encode(negotiate))
+        assert status == 401 and authenticate.startswith(scheme + b' ')
+        challenge = bytes(unwrap_ntlmssp(base64.b64decode(authenticate.split(b' ', 1)[1])))
+        answer = build_authenticate_message(challenge, user, password, 'LAB')
+        status, _ = http_request(sock, scheme + b' ' + base64.b64encode(answer))
+        return status
+
+
+def test_first_bytes_pick_the_protocol():
+    assert sniff_protocol(b'\x00\x00\x00\x54') == PROTOCOL_SMB
+    assert sniff_protocol(b'\x81\x00\x00\x44') == PROTOCOL_SMB
+    assert sniff_protocol(b'GET ') == PROTOCOL_HTTP
+    assert sniff_protocol(b'PROPFIND') == PROTOCOL_HTTP
+    assert sniff_protocol(b'\x16\x03\x01\x02') is None
+    assert sniff_protocol(b'') is None
+
+
+def test_http_and_smb_clients_relay_through_any_listener(relay):
+    relay, target, sessions = relay
+    primary, extra = relay.listen_ports
+    assert primary == relay.listen_port and extra != primary
+
+    # Both listeners take both protocols
+    assert http_relay(extra, 'alice', 'Secret1') == 403
+    assert http_relay(primary, 'bob', 'wrong') == 403
+    assert http_relay(primary, 'bob', 'Secret2', b'Negotiate', neg_token_init) == 403
+    for port in (primary, extra):
+        result = asyncio.run(SMB2StubClient('127.0.0.1', port, 'alice', 'Secret1', 'LAB').authenticate())
+        assert result['status'] == STATUS_ACCESS_DENIED
+
+    assert (target.accepted, target.rejected) == (4, 1)
+    relay.event_sink.stop()
+    assert [(s['protocol'], s['username'], s['outcome']) for s in sessions] == [
+        ('HTTP', 'alice', 'SUCCEED'), ('HTTP', 'bob', '0xc000006d'), ('HTTP', 'bob', 'SUCCEED'),
+        ('SMB', 'alice', 'SUCCEED'), ('SMB', 'alice', 'SUCCEED')]
+    # One set of per-target histograms for every listener
+    assert relay.get_phase_stats()[f"{TARGET}:{target.port}"]['legs']['auth_status']['count'] == 5
+
+
+def test_unknown_protocols_are_closed(relay):
+    relay, _, _ = relay
+    with socket.create_connection(('127.0.0.1', relay.listen_port), timeout=5) as sock:
+        sock.sendall(b'\x16\x03\x01\x02\x00')
+        assert sock.recv(16) == b''
+
+
+def test_extra_listeners_need_the_inprocess_mode():
+    with pytest.raises(ValueError):
+        NTLMRelayServer('127.0.0.1', 0, relay_mode='subprocess', extra_ports=[8080])
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+from src.modules.exploit.ntlmrelayserver import NTLMRelayServer
+from src.modules.exploit.relay_phases import PhaseHistograms, RelayPhaseTimer
+from src.utils.event_loop import EventLoopThread
+from src.utils.event_sink import EventSink
+from src.utils.metrics import LatencyHistogram
+from src.utils.ntlm import build_negotiate_message
+from src.utils.smb2 import build_session_setup_request
+from src.utils.smb2_client import SMB2StubClient
+from src.utils.smb2_server import SMB2StubServer
+from src.utils.spnego import neg_token_init
+
+TARGET = '127.0.0.2'
+
+
+def test_latency_histogram_buckets_and_quantiles():
+    histogram = LatencyHistogram()
+    for seconds in [0.0005] * 90 + [0.03] * 9 + [45.0]:
+        histogram.observe(seconds)
+    stats = histogram.to_dict()
+    assert stats['count'] == 100
+    assert stats['buckets'] == {'le_1ms': 90, 'le_50ms': 9, 'inf': 1}
+    assert stats['p50_ms'] == 1.0
+    assert stats['p95_ms'] == 50.0
+    assert stats['p99_ms'] == 50.0
+    assert stats['max_ms'] == 45000.0
+
+
+def test_phase_histograms_count_legs_and_stalls():
+    histograms = PhaseHistograms()
+    timer = RelayPhaseTimer(time.perf_counter() - 0.01)
+    for phase in ('negotiate', 'type1_relayed', 'type2_returned'):
+        timer.mark(phase)
+    histograms.record('10.0.0.5:445', timer, completed=False)
+    stats = histograms.get_stats()['10.0.0.5:445']
+    assert list(stats['legs']) == ['negotiate', 'type1_relayed', 'type2_returned']
+    assert stats['legs']['negotiate']['p50_ms'] >= 10.0
+    assert stats['stalled_after'] == {'type2_returned': 1}
+    assert list(timer.offsets()) == ['accept', 'negotiate', 'type1_relayed', 'type2_returned']
+
+
+def test_relay_records_phases_per_target():
+    target_loop = EventLoopThread('stub-target')
+    target_loop.start()
+    target = SMB2StubServer(TARGET, 0, {'alice': 'Secret1'})
+    target_loop.run(target.start())
+    sessions = []
+    sink = EventSink(sessions.append)
+    relay = NTLMRelayServer('127.0.0.1', 0, target_port=target.port, pool_depth=0, event_sink=sink)
+    relay.target = TARGET
+    relay.target_computer_name = TARGET
+    relay.start()
+
+    async def abandon_after_challenge():
+        # A client that gives up before sending its Type 3
+        client = SMB2StubClient('127.0.0.1', relay.listen_port, 'alice', 'Secret1')
+        await client.connect()
+        await client.negotiate()
+        await client._request(build_session_setup_request(neg_token_init(build_negotiate_message()),
+                                                          client.message_id))
+        await client.close()
+
+    try:
+        asyncio.run(SMB2StubClient('127.0.0.1', relay.listen_port, 'alice', 'Secret1', 'LAB').authenticate())
+        asyncio.run(abandon_after_challenge())
+        deadline = time.time() + 5
+        while (len(relay.relay_timings) < 2 or 'post_auth' not in relay.relay_timings[0]['phases']) \
+                and time.time() < deadline:
+            time.sleep(0.02)
+        succeeded, abandoned = relay.relay_timings
+        assert succeeded['outcome'] == 'SUCCEED'
+        assert list(succeeded['phases']) == ['accept', 'negotiate', 'type1_relayed', 'type2_returned',
+                                             'type3_relayed', 'auth_status', 'post_auth']
+        assert abandoned['outcome'] == 'INCOMPLETE' and abandoned['connect_to_auth_s'] is None
+        stats = relay.get_phase_stats(f"{TARGET}:{target.port}")[f"{TARGET}:{target.port}"]
+        assert stats['legs']['auth_status']['count'] == 1
+        assert stats['legs']['type2_returned']['count'] == 2
+        assert stats['legs']['post_auth']['count'] == 1
+        assert stats['stalled_after'] == {'type2_returned': 1}
+        assert relay.get_relay_timings()['inprocess']['count'] == 1
+        sink.stop()
+        # Only the relay that got as far as a Type 3 has a session record
+        session, = sessions
+        assert session['type'] == 'relay_session' and session['outcome'] == 'SUCCEED'
+        assert (session['client'], session['target']) == ('127.0.0.1', f"{TARGET}:{target.port}")
+        assert session['ntlm_hash'].startswith(f"alice::LAB:{session['server_challenge']}:")
+        assert 'post_auth' in session['phases']
+    finally:
+        relay.stop()
+        target_loop.run(target.stop())
+        target_loop.stop()
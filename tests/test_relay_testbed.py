@@ -0,0 +1,32 @@
+import asyncio
+
+from src.modules.exploit.testbed import RelayTestBed
+from src.utils.smb2 import STATUS_LOGON_FAILURE, STATUS_SUCCESS
+from src.utils.smb2_client import SMB2StubClient
+from src.utils.smb2_server import SMB2StubServer
+
+
+def test_stub_server_validates_ntlmv2():
+    async def run():
+        server = SMB2StubServer('127.0.0.1', 0, {'Alice': 'Secret1'})
+        await server.start()
+        try:
+            results = [await SMB2StubClient('127.0.0.1', server.port, user, password, 'LAB').authenticate()
+                       for user, password in (('alice', 'Secret1'), ('alice', 'wrong'), ('bob', 'Secret1'))]
+        finally:
+            await server.stop()
+        return server, [result['status'] for result in results]
+
+    server, statuses = asyncio.run(run())
+    assert statuses == [STATUS_SUCCESS, STATUS_LOGON_FAILURE, STATUS_LOGON_FAILURE]
+    assert server.get_stats() == {'connections': 3, 'accepted': 1, 'rejected': 2}
+
+
+def test_testbed_relays_concurrent_authentications():
+    report = RelayTestBed(relays=40, concurrency=8, bad_password_every=4, pool_depth=1).run()
+    assert report['errors'] == 0
+    assert report['succeeded'] == 30 and report['rejected'] == 10
+    assert report['success_rate'] == 1.0
+    assert report['latency']['count'] == 40
+    assert report['connect_to_auth']['count'] == 40
+    assert report['peak_rss_mb'] > 0
@@ -0,0 +1,155 @@
+import socket
+import struct
+import time
+
+from src.modules.capture.packets import QUERY_BUILDERS, answer_query
+from src.modules.capture.responder import ResponderCapture
+from src.modules.capture.workers import (IP_PKTINFO, ResponderWorkerPool, _is_shared_destination,
+                                         interface_broadcasts, owns_datagram)
+from src.utils.network_context import InterfaceAddress, NetworkContext
+
+
+def _free_udp_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_answer_query_llmnr():
+    query = QUERY_BUILDERS['llmnr']('fileserver', transaction_id=0x1234)
+    query_name, response = answer_query('llmnr', query, '10.0.0.5')
+    assert query_name == 'fileserver'
+    assert response[:2] == b'\x12\x34'
+    assert response.endswith(socket.inet_aton('10.0.0.5'))
+
+
+def test_answer_query_ignores_responses():
+    response = b'\x00\x01\x80\x00' + b'\x00' * 20
+    assert answer_query('llmnr', response, '10.0.0.5') is None
+
+
+def test_owns_datagram_shards_exactly_once():
+    data = QUERY_BUILDERS['mdns']('printer', transaction_id=7)
+    owners = [i for i in range(4) if owns_datagram(i, 4, ('192.168.1.20', 5353), data)]
+    assert len(owners) == 1
+
+
+def test_shared_destination_includes_subnet_broadcasts():
+    network = NetworkContext(loader=lambda: [InterfaceAddress('lo', '10.1.2.5', 25),
+                                             InterfaceAddress('lo', '10.9.9.9', 32)])
+    broadcasts = interface_broadcasts(network)
+    index = socket.if_nametoindex('lo')
+
+    def pktinfo(dst, ifindex=index):
+        return [(socket.IPPROTO_IP, IP_PKTINFO,
+                 struct.pack('I4s4s', ifindex, socket.inet_aton('10.1.2.5'), socket.inet_aton(dst)))]
+
+    assert _is_shared_destination(pktinfo('10.1.2.127'), broadcasts)
+    assert _is_shared_destination(pktinfo('255.255.255.255'), broadcasts)
+    assert _is_shared_destination(pktinfo('224.0.0.252'), broadcasts)
+    assert not _is_shared_destination(pktinfo('10.1.2.5'), broadcasts)
+    # .255 is a host on a /25 ending in .127, and a /32 has no broadcast address
+    assert not _is_shared_destination(pktinfo('10.1.2.255'), broadcasts)
+    assert not _is_shared_destination(pktinfo('10.9.9.9'), broadcasts)
+    # A subnet broadcast only counts on the interface it belongs to
+    assert not _is_shared_destination(pktinfo('10.1.2.127', ifindex=index + 1000), broadcasts)
+
+
+def test_worker_pool_answers_over_loopback():
+    ports = {'llmnr': _free_udp_port(), 'nbt-ns': _free_udp_port(), 'mdns': _free_udp_port()}
+    events = []
+    pool = ResponderWorkerPool('10.0.0.5', ports, workers=2, bind_address='127.0.0.1',
+                               event_handler=lambda *event: events.append(event))
+    pool.start()
+    try:
+        answers = 0
+        for i, protocol in enumerate(['llmnr', 'nbt-ns', 'mdns'] * 4):
+            client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            client.settimeout(2)
+            client.sendto(QUERY_BUILDERS[protocol](f'host{i}', transaction_id=i),
+                          ('127.0.0.1', ports[protocol]))
+            response, _ = client.recvfrom(2048)
+            client.close()
+            assert response.endswith(socket.inet_aton('10.0.0.5'))
+            answers += 1
+
+        deadline = time.time() + 2
+        while len(events) < answers and time.time() < deadline:
+            time.sleep(0.05)
+        assert answers == 12
+        assert len(events) == 12
+        assert {event[0] for event in events} == {'LLMNR', 'NBT-NS', 'MDNS'}
+    finally:
+        pool.stop()
+
+
+def test_worker_pool_update_changes_the_answer():
+    ports = {'llmnr': _free_udp_port(), 'nbt-ns': _free_udp_port(), 'mdns': _free_udp_port()}
+    pool = ResponderWorkerPool('10.0.0.5', ports, workers=2, bind_address='127.0.0.1')
+    pool.start()
+
+    def answer(i):
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.settimeout(2)
+        client.sendto(QUERY_BUILDERS['llmnr'](f'host{i}', transaction_id=i), ('127.0.0.1', ports['llmnr']))
+        response, _ = client.recvfrom(2048)
+        client.close()
+        return response[-4:]
+
+    try:
+        assert answer(0) == socket.inet_aton('10.0.0.5')
+        pool.update('10.0.0.9', {})
+        # Each worker applies the update before its next datagram; the kernel spreads clients over both
+        deadline = time.time() + 2
+        while time.time() < deadline:
+            answers = {answer(i) for i in range(1, 9)}
+            if answers == {socket.inet_aton('10.0.0.9')}:
+                break
+            time.sleep(0.05)
+        assert answers == {socket.inet_aton('10.0.0.9')}
+        assert pool.response_ip == '10.0.0.9'
+    finally:
+        pool.stop()
+
+
+class _NullStore:
+    def store_capture(self, capture_data):
+        return 'capture'
+
+    def store_result(self, result_data):
+        return 'result'
+
+
+def test_responder_follows_address_changes(monkeypatch):
+    addresses = [InterfaceAddress('lo', '127.0.0.1', 8)]
+    network = NetworkContext(loader=lambda: list(addresses))
+    monkeypatch.setattr(NetworkContext, '_shared', network)
+    ports = {'llmnr': _free_udp_port(), 'nbt-ns': _free_udp_port(), 'mdns': _free_udp_port()}
+    responder = ResponderCapture('lo', poisoning_ports=ports, auth_ports={'http': 0, 'smb': 0}, workers=2,
+                                 store=_NullStore())
+    responder.start_poisoning()
+    try:
+        http_server = responder.async_servers[0]
+        port = http_server.port
+        addresses[:] = [InterfaceAddress('lo', '127.0.0.2', 8)]
+        network.refresh()
+
+        assert responder.get_response_ip() == '127.0.0.2'
+        assert {server.host for server in responder.async_servers} == {'127.0.0.2'}
+        # Same port, new address
+        socket.create_connection(('127.0.0.2', port), timeout=2).close()
+        deadline = time.time() + 2
+        while True:
+            client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            client.settimeout(2)
+            client.sendto(QUERY_BUILDERS['llmnr']('fs', transaction_id=1), ('127.0.0.1', ports['llmnr']))
+            response, _ = client.recvfrom(2048)
+            client.close()
+            if response.endswith(socket.inet_aton('127.0.0.2')) or time.time() > deadline:
+                break
+            time.sleep(0.05)
+        assert response.endswith(socket.inet_aton('127.0.0.2'))
+    finally:
+        responder.stop_poisoning()
@@ -0,0 +1,69 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from src.modules.exploit import session_proxy
+from src.modules.exploit.session_proxy import SPLICE_SUPPORTED, SessionProxy
+
+
+def _tcp_pair():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    near = socket.create_connection(listener.getsockname())
+    far, _ = listener.accept()
+    listener.close()
+    return near, far
+
+
+@pytest.mark.parametrize('use_splice', [False] + ([True] if SPLICE_SUPPORTED else []))
+def test_proxy_copies_both_ways_and_counts_bytes(use_splice):
+    client_app, client_side = _tcp_pair()
+    target_side, target_app = _tcp_pair()
+    proxy = SessionProxy(use_splice=use_splice)
+    proxy.proxy(client_side, target_side, ('10.0.0.7', 50000), ('10.0.0.9', 445), 'LAB\\alice',
+                to_client=b'hello', to_target=b'unread')
+    payload = bytes(range(256)) * 4096
+
+    received = bytearray()
+
+    def drain():
+        while len(received) < len(b'unread') + len(payload):
+            received.extend(target_app.recv(65536))
+
+    reader = threading.Thread(target=drain)
+    reader.start()
+    client_app.sendall(payload)
+    reader.join(5)
+    assert bytes(received) == b'unread' + payload
+    assert client_app.recv(5) == b'hello'
+    target_app.sendall(b'reply')
+    assert client_app.recv(5) == b'reply'
+
+    # Both ends finishing closes the session and folds its counters into the totals
+    client_app.close()
+    target_app.close()
+    deadline = time.time() + 5
+    while proxy.get_stats()['active'] and time.time() < deadline:
+        time.sleep(0.05)
+    stats = proxy.get_stats()
+    assert stats['closed'] == 1
+    assert stats['bytes_to_target'] == len(b'unread') + len(payload)
+    assert stats['bytes_to_client'] == len(b'hello') + len(b'reply')
+
+
+def test_idle_sessions_are_closed(monkeypatch):
+    monkeypatch.setattr(session_proxy, 'POLL_INTERVAL', 0.05)
+    client_app, client_side = _tcp_pair()
+    target_side, target_app = _tcp_pair()
+    proxy = SessionProxy(idle_timeout=0.2, use_splice=False)
+    session = proxy.proxy(client_side, target_side, ('10.0.0.7', 50000), ('10.0.0.9', 445))
+    assert session.closed.wait(5)
+    assert session.closed_reason == 'idle'
+    # The peers see the connection go away
+    assert client_app.recv(1) == b''
+    assert target_app.recv(1) == b''
+    client_app.close()
+    target_app.close()
@@ -0,0 +1,82 @@
+import time
+
+from src.modules.exploit.session_registry import SessionRegistry
+
+
+class FakeConnection:
+    """Stand-in for an authenticated SMBConnection"""
+
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.echoes = 0
+        self.closed = False
+
+    def getSMBServer(self):
+        return self
+
+    def echo(self):
+        self.echoes += 1
+        if not self.alive:
+            raise ConnectionResetError("gone")
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_jobs_wait_for_the_session_and_reuse_it():
+    registry = SessionRegistry()
+    try:
+        early = registry.submit('Alice', 'LAB', '10.0.0.9', lambda conn: conn)
+        assert registry.get_stats()['pending_jobs'] == 1
+        connection = FakeConnection()
+        registry.add('alice', 'lab', '10.0.0.9', connection)
+        assert early.result(5) is connection
+        # Later jobs run on the same session without another relay
+        assert registry.submit('ALICE', 'Lab', '10.0.0.9', lambda conn: conn).result(5) is connection
+        stats = registry.get_stats()
+        assert stats['registered'] == 1 and stats['jobs'] == 2
+        assert stats['sessions'][0]['jobs'] == 2
+    finally:
+        registry.stop()
+    assert connection.closed
+
+
+def test_cap_evicts_the_least_recently_used_session():
+    registry = SessionRegistry(max_sessions=2)
+    try:
+        connections = [FakeConnection() for _ in range(3)]
+        registry.add('a', 'LAB', '10.0.0.9', connections[0])
+        registry.add('b', 'LAB', '10.0.0.9', connections[1])
+        registry.submit('a', 'LAB', '10.0.0.9', lambda conn: None).result(5)
+        registry.add('c', 'LAB', '10.0.0.9', connections[2])
+        assert registry.get('b', 'LAB', '10.0.0.9') is None
+        assert registry.get('a', 'LAB', '10.0.0.9') is not None
+        assert _wait_for(lambda: connections[1].closed)
+        assert registry.get_stats()['evicted'] == 1
+    finally:
+        registry.stop()
+
+
+def test_keepalive_and_idle_expiry():
+    registry = SessionRegistry(idle_timeout=0.6, keepalive_interval=0.1)
+    registry.start()
+    try:
+        healthy, dead = FakeConnection(), FakeConnection(alive=False)
+        registry.add('alice', 'LAB', '10.0.0.9', healthy)
+        registry.add('bob', 'LAB', '10.0.0.9', dead)
+        assert _wait_for(lambda: registry.get_stats()['dead'] == 1)
+        assert dead.closed
+        assert _wait_for(lambda: healthy.echoes >= 2)
+        # Keep-alives do not count as use: the idle session is still logged off
+        assert _wait_for(lambda: registry.get_stats()['expired'] == 1)
+        assert healthy.closed
+    finally:
+        registry.stop()
@@ -0,0 +1,127 @@
+import os
+import socket
+import threading
+import time
+
+from src.utils.smb2 import (NETBIOS_POSITIVE_RESPONSE, NETBIOS_SESSION_REQUEST, SMB2_DIALECT_21,
+                            SMB2_NEGOTIATE_SIGNING_ENABLED, SMB2_NEGOTIATE_SIGNING_REQUIRED,
+                            build_negotiate_response)
+from src.utils.smb_capabilities import CapabilityStore, SMBCapabilities, probe_smb_signing
+
+
+def _negotiate_server(security_mode, netbios=False):
+    """Answer every connection's first message with a NEGOTIATE response"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(8)
+    connections = []
+
+    def serve():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            connections.append(conn)
+            with conn:
+                request = conn.recv(4096)
+                if netbios:
+                    assert request[0] == NETBIOS_SESSION_REQUEST
+                    conn.sendall(bytes([NETBIOS_POSITIVE_RESPONSE, 0, 0, 0]))
+                    conn.recv(4096)
+                conn.sendall(build_negotiate_response(SMB2_DIALECT_21, security_mode=security_mode))
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener, listener.getsockname()[1], connections
+
+
+def test_probe_reads_security_mode_from_one_negotiate():
+    listener, port, _ = _negotiate_server(SMB2_NEGOTIATE_SIGNING_ENABLED | SMB2_NEGOTIATE_SIGNING_REQUIRED)
+    try:
+        result = probe_smb_signing('127.0.0.1', port, timeout=2)
+    finally:
+        listener.close()
+    assert result.error is None
+    assert result.dialect == SMB2_DIALECT_21
+    assert result.signing_enabled and result.signing_required
+
+
+def test_probe_speaks_netbios_session_service_on_139(monkeypatch):
+    listener, port, _ = _negotiate_server(SMB2_NEGOTIATE_SIGNING_ENABLED, netbios=True)
+    real_connect = socket.create_connection
+    monkeypatch.setattr(socket, 'create_connection',
+                        lambda address, timeout: real_connect((address[0], port), timeout))
+    try:
+        result = probe_smb_signing('127.0.0.1', 139, timeout=2)
+    finally:
+        listener.close()
+    assert result.error is None and result.port == 139
+    assert result.signing_enabled and not result.signing_required
+
+
+def test_probe_reports_unreachable_servers():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    result = probe_smb_signing('127.0.0.1', port, timeout=1)
+    assert result.error and result.signing_required is None
+
+
+def test_store_persists_results_and_reprobes_stale_ones(tmp_path):
+    path = str(tmp_path / 'capabilities.json')
+    listener, port, connections = _negotiate_server(SMB2_NEGOTIATE_SIGNING_ENABLED)
+    try:
+        store = CapabilityStore(path, max_age=3600)
+        assert store.signing_required('127.0.0.1', port) is None
+        assert store.lookup('127.0.0.1', port).signing_required is False
+        store.lookup('127.0.0.1', port)
+        # A new process reads the file instead of probing
+        reloaded = CapabilityStore(path, max_age=3600)
+        assert reloaded.signing_required('127.0.0.1', port) is False
+        reloaded.lookup('127.0.0.1', port)
+        assert len(connections) == 1
+        stale = SMBCapabilities('127.0.0.1', port, SMB2_DIALECT_21, True, True, time.time() - 7200, None)
+        reloaded.record(stale)
+        assert reloaded.signing_required('127.0.0.1', port) is None
+        assert reloaded.lookup('127.0.0.1', port).signing_required is False
+        assert len(connections) == 2
+    finally:
+        listener.close()
+
+
+def test_lookup_many_probes_concurrently(tmp_path):
+    calls = []
+
+    def slow_probe(address, port, timeout):
+        calls.append(address)
+        time.sleep(0.2)
+        return SMBCapabilities(address, port, SMB2_DIALECT_21, True, address.endswith('.1'), time.time(), None)
+
+    store = CapabilityStore(str(tmp_path / 'capabilities.json'), probe=slow_probe)
+    started = time.perf_counter()
+    results = store.lookup_many([(f'10.0.0.{i}', 445) for i in range(1, 11)])
+    assert time.perf_counter() - started < 1.0
+    assert [r.signing_required for r in results] == [True] + [False] * 9
+    assert len(calls) == 10
+
+
+def test_lookup_many_writes_the_store_once(tmp_path, monkeypatch):
+    path = str(tmp_path / 'capabilities.json')
+    writes = []
+    replace = os.replace
+    monkeypatch.setattr(os, 'replace', lambda *args: (writes.append(args), replace(*args)))
+
+    def probe(address, port, timeout):
+        return SMBCapabilities(address, port, SMB2_DIALECT_21, True, False, time.time(), None)
+
+    store = CapabilityStore(path, probe=probe)
+    store.lookup_many([(f'10.0.1.{i}', 445) for i in range(1, 51)])
+    assert len(writes) == 1
+    store.flush()  # Nothing new to write
+    assert len(writes) == 1
+    store.record(SMBCapabilities('10.0.2.1', 445, SMB2_DIALECT_21, True, True, time.time(), None), save=False)
+    assert len(writes) == 1
+    store.flush()
+    reloaded = CapabilityStore(path)
+    assert reloaded.signing_required('10.0.2.1') is True and reloaded.signing_required('10.0.1.50') is False
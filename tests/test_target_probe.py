@@ -0,0 +1,80 @@
+import socket
+import time
+
+from src.utils.target_probe import ReachabilityReport, ServiceStatus, TargetProbe, probe_ports
+
+
+def _listener(backlog=8):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(backlog)
+    return sock, sock.getsockname()[1]
+
+
+def _closed_port():
+    sock, port = _listener()
+    sock.close()
+    return port
+
+
+def _stalled_port():
+    """A port whose accept queue is full, so new connections hang in SYN_SENT"""
+    sock, port = _listener(0)
+    held = []
+    for _ in range(2):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.settimeout(0.2)
+        try:
+            client.connect(('127.0.0.1', port))
+        except socket.timeout:
+            pass
+        held.append(client)
+    return [sock] + held, port
+
+
+def test_ports_are_probed_concurrently_within_one_deadline():
+    open_sock, open_port = _listener()
+    closed_port = _closed_port()
+    stalled = []
+    stalled_ports = []
+    for _ in range(3):
+        sockets, port = _stalled_port()
+        stalled += sockets
+        stalled_ports.append(port)
+    try:
+        started = time.perf_counter()
+        results = probe_ports('127.0.0.1', [open_port, closed_port] + stalled_ports, timeout=0.5)
+        elapsed = time.perf_counter() - started
+    finally:
+        for sock in [open_sock] + stalled:
+            sock.close()
+    # Three hanging ports cost one deadline, not three
+    assert elapsed < 1.0
+    assert results[open_port].reachable and results[open_port].connect_s < 0.5
+    assert results[closed_port].error == 'ECONNREFUSED'
+    assert all(results[port].error == 'timed out' for port in stalled_ports)
+
+
+def test_reports_are_cached_and_extended():
+    open_sock, open_port = _listener()
+    closed_port = _closed_port()
+    probe = TargetProbe()
+    report = probe.probe('127.0.0.1', [open_port, closed_port], timeout=1)
+    assert [status.port for status in report.accessible] == [open_port]
+    open_sock.close()
+    # Known ports come from the cache, new ones are added to the report
+    report = probe.probe('127.0.0.1', [open_port, 445], timeout=1)
+    assert report.reachable(open_port)
+    assert set(report.services) == {open_port, closed_port, 445}
+    assert not probe.probe('127.0.0.1', [open_port], refresh=True).reachable(open_port)
+
+
+def test_smb_port_prefers_445_and_falls_back_to_139():
+    statuses = {port: ServiceStatus(port, service, reachable, None, None)
+                for port, service, reachable in ((445, 'SMB', False), (139, 'NetBIOS-SSN', True))}
+    report = ReachabilityReport('fs01', '10.0.0.5', statuses)
+    assert report.smb_port() == 139
+    statuses[445] = statuses[445]._replace(reachable=True)
+    assert report.smb_port() == 445
+    assert report.to_dict()['smb_port'] == 445
+    assert ReachabilityReport('fs01', '10.0.0.5', {}).smb_port() is None
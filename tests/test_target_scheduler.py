@@ -0,0 +1,113 @@
+import pytest
+
+from src.modules.exploit.target_scheduler import ScopeTarget, TargetScheduler, parse_scope
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def _scheduler(entries, **kwargs):
+    return TargetScheduler(parse_scope(entries), **kwargs)
+
+
+def test_scope_file_entries_are_expanded():
+    targets = parse_scope(['# lab hosts', '', '10.0.0.5', '10.0.0.6:4445 priority=7  # backup',
+                           '10.0.1.0/30', '10.0.0.5'])
+    assert [(t.host, t.port, t.priority) for t in targets] == [
+        ('10.0.0.5', 445, 0), ('10.0.0.6', 4445, 7), ('10.0.1.1', 445, 0), ('10.0.1.2', 445, 0)]
+    with pytest.raises(ValueError):
+        parse_scope(['10.0.0.5 weight=3'])
+
+
+@pytest.mark.parametrize('entry', ['10.0.0.5:abc', '10.0.0.5:0', '10.0.0.5:65536', '10.0.0.5:-1', '10.0.1.0/33',
+                                   '10.0.1.300/24'])
+def test_bad_scope_entries_name_their_line(entry):
+    with pytest.raises(ValueError, match='^Scope line 2: '):
+        parse_scope(['10.0.0.5', entry])
+
+
+def test_round_robin_rotates_and_stays_in_scope():
+    scheduler = _scheduler(['10.0.0.1', '10.0.0.2', '10.0.0.3'], max_per_target=10)
+    picks = [scheduler.acquire('10.0.9.9').host for _ in range(6)]
+    assert picks == ['10.0.0.1', '10.0.0.2', '10.0.0.3'] * 2
+    assert scheduler.in_scope('10.0.0.2') and not scheduler.in_scope('10.0.0.4')
+    assert not scheduler.in_scope('10.0.0.2', 139)
+
+
+def test_priority_prefers_higher_levels_and_skips_the_client():
+    scheduler = _scheduler(['10.0.0.1 priority=1', '10.0.0.2 priority=5', '10.0.0.3 priority=5'],
+                           schedule='priority', max_per_target=10)
+    assert [scheduler.acquire('10.0.0.2').host for _ in range(2)] == ['10.0.0.3', '10.0.0.3']
+    assert [scheduler.acquire('10.0.9.9').host for _ in range(2)] == ['10.0.0.2', '10.0.0.3']
+
+
+def test_targets_owned_by_the_user_are_skipped():
+    scheduler = _scheduler(['10.0.0.1', '10.0.0.2'])
+    first = scheduler.acquire('10.0.9.9')
+    scheduler.note_user('10.0.9.9', 'CORP\\Alice')
+    scheduler.release(first, True, 'CORP\\Alice')
+    # The same client is sent elsewhere, another user still gets the owned target
+    assert [scheduler.acquire('10.0.9.9').host for _ in range(2)] == ['10.0.0.2', '10.0.0.2']
+    assert scheduler.acquire('10.0.8.8', user='corp\\bob').host == '10.0.0.1'
+
+
+def test_concurrency_cap_and_backoff():
+    clock = FakeClock()
+    scheduler = _scheduler(['10.0.0.1', '10.0.0.2'], max_per_target=1, backoff_base=5, clock=clock)
+    a, b = scheduler.acquire(), scheduler.acquire()
+    assert {a.host, b.host} == {'10.0.0.1', '10.0.0.2'}
+    # Both targets are at their limit
+    assert scheduler.acquire() is None
+    scheduler.release(a, None)
+    scheduler.release(b, False)
+    assert scheduler.acquire().host == a.host
+    scheduler.release(a, None)
+    stats = scheduler.get_stats()['per_target'][f"{b.host}:445"]
+    assert stats['failed'] == 1 and stats['backoff_s'] == 5
+    clock.now += 5
+    assert {scheduler.acquire().host for _ in range(2)} == {'10.0.0.1', '10.0.0.2'}
+    assert scheduler.get_stats()['unavailable'] == 1
+
+
+def test_backoff_grows_with_consecutive_failures():
+    clock = FakeClock()
+    scheduler = TargetScheduler([ScopeTarget('10.0.0.1')], backoff_base=2, backoff_max=5, clock=clock)
+    for expected in (2, 4, 5):
+        target = scheduler.acquire()
+        scheduler.release(target, False)
+        assert target.backoff_until - clock.now == expected
+        assert scheduler.acquire() is None
+        clock.now = target.backoff_until
+    target = scheduler.acquire()
+    scheduler.release(target, True, 'CORP\\alice')
+    assert target.failures == 0 and target.backoff_until == 0
+
+
+def test_excluded_targets_are_never_picked_again():
+    scheduler = _scheduler(['10.0.0.1', '10.0.0.2'], max_per_target=10)
+    first = scheduler.acquire()
+    scheduler.exclude(first.host, first.port, 'requires SMB signing')
+    scheduler.release(first, True, 'CORP\\alice')
+    assert {scheduler.acquire().host for _ in range(3)} == {'10.0.0.2'}
+    assert scheduler.get_stats()['per_target']['10.0.0.1:445']['excluded'] == 'requires SMB signing'
+
+
+def test_update_keeps_state_of_targets_that_stay():
+    clock = FakeClock()
+    scheduler = _scheduler(['10.0.0.1', '10.0.0.2'], max_per_target=1, backoff_base=5, clock=clock)
+    a, b = scheduler.acquire(), scheduler.acquire()
+    scheduler.release(a, False)
+    scheduler.update(parse_scope([f'{a.host} priority=3', '10.0.0.3']), schedule='priority', max_per_target=2)
+    # The relay to the removed target ends without touching the new scope
+    scheduler.release(b, True, 'CORP\\alice')
+    stats = scheduler.get_stats()['per_target']
+    assert set(stats) == {f'{a.host}:445', '10.0.0.3:445'}
+    assert stats[f'{a.host}:445']['failed'] == 1 and stats[f'{a.host}:445']['backoff_s'] == 5
+    assert [scheduler.acquire().host for _ in range(2)] == ['10.0.0.3', '10.0.0.3']
+    clock.now += 5
+    assert scheduler.acquire().host == a.host